@@ -2,10 +2,12 @@
 import json
 import logging
 import re
+from collections import defaultdict
+from copy import deepcopy
 from datetime import datetime, timedelta
 
 import pytz
-from sqlalchemy import select, update, delete, desc, func, case, text
+from sqlalchemy import select, insert, update, delete, desc, func, case, text
 
 from dtable_events.activities.models import Activities
 from dtable_events.app.config import TIME_ZONE
@@ -55,17 +57,61 @@ class TableActivityDetail(object):
         return self.__dict__[key]
 
 
-def save_or_update_or_delete(session, event):
+IGNORED_COLUMN_TYPES = ['creator', 'ctime', 'last-modifier', 'mtime']
+
+# activities of the same row by the same user in this period are merged
+MERGE_ACTIVITIES_PERIOD = timedelta(minutes=5)
+
+
+def filter_row_event(event):
     # ignore a few column data: creator, ctime, last-modifier, mtime
+    # the event may be shared with other consumers of the channel, do not modify it in place
+    event = dict(event)
+    event['row_data'] = [cell_data for cell_data in event['row_data']
+                         if cell_data.get('column_type', '') not in IGNORED_COLUMN_TYPES]
+    return event
+
+
+def merge_modify_row_detail(detail, activity_op_type, event):
+    """Merge cells of a `modify_row` event into the detail of an existing activity"""
+    cells_data = event['row_data']
+    if activity_op_type == 'insert_row':
+        # Update cells values.
+        for cell_data in cells_data:
+            for i in detail['row_data']:
+                if i['column_key'] == cell_data['column_key']:
+                    i['value'] = cell_data['value']
+                    if i['column_type'] != cell_data['column_type']:
+                        i['column_type'] = cell_data['column_type']
+                        i['column_data'] = cell_data['column_data']
+                    break
+            else:
+                cell_data = {k: v for k, v in cell_data.items() if k != 'old_value'}
+                detail['row_data'].append(cell_data)
+    else:
+        # Update cells values and keep old_values unchanged.
+        for cell_data in cells_data:
+            for i in detail['row_data']:
+                if i['column_key'] == cell_data['column_key']:
+                    i['value'] = cell_data['value']
+                    if i['column_type'] != cell_data['column_type']:
+                        i['column_type'] = cell_data['column_type']
+                        i['column_data'] = cell_data['column_data']
+                        i['old_value'] = cell_data['old_value']
+                    break
+            else:
+                detail['row_data'].append(cell_data)
+    detail['row_name'] = event['row_name']
+    detail['row_name_option'] = event.get('row_name_option', '')
+
 
+def save_or_update_or_delete(session, event):
     if event['op_type'] in ROWS_OPERATION_TYPES:
-        for cell_data in event['row_data']:
-            if cell_data.get('column_type', '') in ['creator', 'ctime', 'last-modifier', 'mtime']:
-                event['row_data'].remove(cell_data)
+        event = filter_row_event(event)
 
         if event['op_type'] == 'modify_row':
             op_time = datetime.utcfromtimestamp(event['op_time'])
-            _timestamp = op_time - timedelta(minutes=5)
+            _timestamp = op_time - MERGE_ACTIVITIES_PERIOD
             # If a row was edited many times by same user in 5 minutes, just update record.
             stmt = select(Activities).where(
                 Activities.row_id == event['row_id'],
@@ -76,39 +122,7 @@ def save_or_update_or_delete(session, event):
             if row:
                 detail = json.loads(row.detail)
                 if detail['table_id'] == event['table_id']:
-                    if row.op_type == 'insert_row':
-                        cells_data = event['row_data']
-                        # Update cells values.
-                        for cell_data in cells_data:
-                            for i in detail['row_data']:
-                                if i['column_key'] == cell_data['column_key']:
-                                    i['value'] = cell_data['value']
-                                    if i['column_type'] != cell_data['column_type']:
-                                        i['column_type'] = cell_data['column_type']
-                                        i['column_data'] = cell_data['column_data']
-                                    break
-                            else:
-                                del cell_data['old_value']
-                                detail['row_data'].append(cell_data)
-                        detail['row_name'] = event['row_name']
-                        detail['row_name_option'] = event.get('row_name_option', '')
-                    else:
-                        cells_data = event['row_data']
-                        # Update cells values and keep old_values unchanged.
-                        for cell_data in cells_data:
-                            for i in detail['row_data']:
-                                if i['column_key'] == cell_data['column_key']:
-                                    i['value'] = cell_data['value']
-                                    if i['column_type'] != cell_data['column_type']:
-                                        i['column_type'] = cell_data['column_type']
-                                        i['column_data'] = cell_data['column_data']
-                                        i['old_value'] = cell_data['old_value']
-                                    break
-                            else:
-                                detail['row_data'].append(cell_data)
-                        detail['row_name'] = event['row_name']
-                        detail['row_name_option'] = event.get('row_name_option', '')
-
+                    merge_modify_row_detail(detail, row.op_type, event)
                     detail = json.dumps(detail)
                     update_activity_timestamp(session, row.id, op_time, detail)
                 else:
@@ -117,7 +131,7 @@ def save_or_update_or_delete(session, event):
                 save_user_activities(session, event)
         elif event['op_type'] == 'delete_row':
             op_time = datetime.utcfromtimestamp(event['op_time'])
-            _timestamp = op_time - timedelta(minutes=5)
+            _timestamp = op_time - MERGE_ACTIVITIES_PERIOD
             # If a row was inserted by same user in 5 minutes, just delete this record.
             stmt = select(Activities).where(
                 Activities.row_id == event['row_id'],
@@ -398,6 +412,134 @@ def save_user_activities_by_link(session, event, row1, row2):
         session.add(activity2)
     session.commit()
 
+def _get_recent_activity(activities, since):
+    for activity in reversed(activities):
+        if activity['op_time'] > since:
+            return activity
+    return None
+
+
+def _gen_activity(event, op_time):
+    detail_dict = {
+        'table_id': event['table_id'],
+        'table_name': event['table_name'],
+        'row_name': event['row_name'],
+        'row_name_option': event.get('row_name_option', ''),
+        # copy cells, later events in the batch may be merged into them
+        'row_data': deepcopy(event['row_data'])
+    }
+    if len(json.dumps(detail_dict)) > DETAIL_LIMIT:
+        return None
+    return {
+        'id': None,
+        'dtable_uuid': event['dtable_uuid'],
+        'row_id': event['row_id'],
+        'row_count': event.get('row_count', 1),
+        'op_user': event['op_user'],
+        'op_type': event['op_type'],
+        'op_time': op_time,
+        'detail': detail_dict,
+        'op_app': event.get('op_app'),
+        'changed': False
+    }
+
+
+def save_activities_batch(session, events):
+    """Save a batch of row events.
+
+    Activities are merged with the same rules as `save_or_update_or_delete`, but
+    the recent activities of all rows are loaded with one query, and new, merged
+    and deleted activities are written with one statement each.
+    """
+    events = [filter_row_event(event) for event in events if event['op_type'] in ROWS_OPERATION_TYPES]
+    if not events:
+        return
+
+    # (row_id, op_user) -> activities of the row ordered by id
+    recent_activities = defaultdict(list)
+    merge_events = [event for event in events if event['op_type'] in ('modify_row', 'delete_row')]
+    if merge_events:
+        keys = {(event['row_id'], event['op_user']) for event in merge_events}
+        since = min(datetime.utcfromtimestamp(event['op_time']) for event in merge_events) - MERGE_ACTIVITIES_PERIOD
+        stmt = select(
+            Activities.id, Activities.row_id, Activities.op_user, Activities.op_type, Activities.op_time, Activities.detail
+        ).where(
+            Activities.row_id.in_({row_id for row_id, _ in keys}),
+            Activities.op_time > since
+        ).order_by(Activities.id)
+        for row in session.execute(stmt):
+            if (row.row_id, row.op_user) not in keys:
+                continue
+            recent_activities[(row.row_id, row.op_user)].append({
+                'id': row.id,
+                'op_type': row.op_type,
+                'op_time': row.op_time,
+                'detail': row.detail,
+                'changed': False
+            })
+
+    new_activities, deleted_ids = [], []
+    for event in events:
+        op_time = datetime.utcfromtimestamp(event['op_time'])
+        activities = recent_activities[(event['row_id'], event['op_user'])]
+        if event['op_type'] == 'modify_row':
+            # If a row was edited many times by same user in 5 minutes, just update record.
+            activity = _get_recent_activity(activities, op_time - MERGE_ACTIVITIES_PERIOD)
+            if activity:
+                detail = activity['detail']
+                if isinstance(detail, str):
+                    detail = activity['detail'] = json.loads(detail)
+                if detail['table_id'] == event['table_id']:
+                    merged_detail = deepcopy(detail)
+                    merge_modify_row_detail(merged_detail, activity['op_type'], event)
+                    if len(json.dumps(merged_detail)) <= DETAIL_LIMIT:
+                        activity['detail'] = merged_detail
+                        activity['op_time'] = op_time
+                        activity['changed'] = True
+                    continue
+        elif event['op_type'] == 'delete_row':
+            # If a row was inserted by same user in 5 minutes, just delete this record.
+            activity = _get_recent_activity(activities, op_time - MERGE_ACTIVITIES_PERIOD)
+            if activity and activity['op_type'] == 'insert_row':
+                activities.remove(activity)
+                if activity['id']:
+                    deleted_ids.append(activity['id'])
+                else:
+                    new_activities.remove(activity)
+                continue
+        activity = _gen_activity(event, op_time)
+        if activity:
+            new_activities.append(activity)
+            activities.append(activity)
+
+    changed_activities = [activity for activities in recent_activities.values() for activity in activities
+                          if activity['id'] and activity['changed']]
+
+    if new_activities:
+        session.execute(insert(Activities), [{
+            'dtable_uuid': activity['dtable_uuid'],
+            'row_id': activity['row_id'],
+            'row_count': activity['row_count'],
+            'op_user': activity['op_user'],
+            'op_type': activity['op_type'],
+            'op_time': activity['op_time'],
+            'detail': json.dumps(activity['detail']),
+            'op_app': activity['op_app']
+        } for activity in new_activities])
+    if changed_activities:
+        stmt = update(Activities).where(
+            Activities.id.in_([activity['id'] for activity in changed_activities])
+        ).values({
+            'op_time': case({activity['id']: activity['op_time'] for activity in changed_activities}, value=Activities.id),
+            'detail': case({activity['id']: json.dumps(activity['detail']) for activity in changed_activities}, value=Activities.id)
+        }).execution_options(synchronize_session=False)
+        session.execute(stmt)
+    if deleted_ids:
+        stmt = delete(Activities).where(Activities.id.in_(deleted_ids)).execution_options(synchronize_session=False)
+        session.execute(stmt)
+    session.commit()
+
+
 def cache_dtable_update_info(app, event):
     cache = app.dtable_update_cache
     dtable_uuid = event.get('dtable_uuid')
@@ -1,17 +1,23 @@
 # -*- coding: utf-8 -*-
 import logging
 import time
-import json
-from threading import Thread, Event
+from threading import Thread, Lock
 from json.decoder import JSONDecodeError
-from dtable_events.app.event_redis import RedisClient
-from dtable_events.activities.db import save_or_update_or_delete, cache_dtable_update_info
+
+from sqlalchemy import event as sa_event
+
+from dtable_events.app.config import ACTIVITIES_BATCH_SIZE, ACTIVITIES_BATCH_FLUSH_INTERVAL
+from dtable_events.app.event_redis import pubsub_dispatcher
+from dtable_events.activities.db import save_or_update_or_delete, save_activities_batch, cache_dtable_update_info, \
+    ROWS_OPERATION_TYPES
 from dtable_events.db import init_db_session_class
+from dtable_events.utils.utils_metric import publish_metric, ACTIVITIES_EVENTS_RATE_METRIC_HELP, \
+    ACTIVITIES_DB_ROUND_TRIPS_METRIC_HELP
 
 logger = logging.getLogger(__name__)
 
 
-class MessageHandler(Thread):
+class MessageHandler(object):
     SUPPORT_OPERATION_TYPES = [
         'insert_row',
         'insert_rows',
@@ -27,48 +33,117 @@ class MessageHandler(Thread):
     ]
 
     def __init__(self, app):
-        Thread.__init__(self)
-        self._finished = Event()
         self._db_session_class = init_db_session_class()
-        self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=5,
-                                         health_check_interval=30, retry_on_timeout=True)
         self.app = app
         self._pubsub_channel_name = 'table-events'
-        self._pubsub_no_message_timeout = 5 * 60
 
-    def run(self):
-        logger.info('Starting handle table activities...')
-        subscriber = self._redis_client.get_subscriber(self._pubsub_channel_name)
-        last_pubsub_message_time = time.time()
-        while not self._finished.is_set():
+        # batch mode, events are saved when batch size reached or flush interval passed
+        self._batch_size = ACTIVITIES_BATCH_SIZE
+        self._flush_interval = ACTIVITIES_BATCH_FLUSH_INTERVAL / 1000
+        self._batch = []
+        self._batch_lock = Lock()
+        self._flush_lock = Lock()
+
+        # metrics
+        self._metrics_interval = 30
+        self._events_count = 0
+        self._db_round_trips = 0
+        sa_event.listen(self._db_session_class.kw['bind'], 'after_cursor_execute', self._count_db_round_trip)
+
+    def _count_db_round_trip(self, *args):
+        self._db_round_trips += 1
+
+    def _save_rows_events(self, session, events):
+        try:
+            save_activities_batch(session, events)
+        except Exception as e:
+            logger.warning('Save activities batch failed, save them one by one: %s', e)
+            session.rollback()
+            for event in events:
+                self._save_event(session, event)
+
+    def _save_event(self, session, event):
+        try:
+            save_or_update_or_delete(session, event)
+        except JSONDecodeError as err:
+            logger.warning('Json decode error on handling activity messages: %s' % err)
+        except Exception as e:
+            logger.exception(e)
+            logger.error('Handle activities message failed: %s' % e)
+            session.rollback()
+
+    def _save_events(self, events):
+        session = self._db_session_class()
+        try:
+            # keep events order, link events are not batched
+            rows_events = []
+            for event in events:
+                if event['op_type'] in ROWS_OPERATION_TYPES:
+                    rows_events.append(event)
+                    continue
+                if rows_events:
+                    self._save_rows_events(session, rows_events)
+                    rows_events = []
+                self._save_event(session, event)
+            if rows_events:
+                self._save_rows_events(session, rows_events)
+        finally:
+            session.close()
+        self._events_count += len(events)
+
+    def save_events(self, events):
+        with self._flush_lock:
+            self._save_events(events)
+
+    def flush(self):
+        # batches are taken and saved under the flush lock, saved in the order they were taken
+        with self._flush_lock:
+            with self._batch_lock:
+                events, self._batch = self._batch, []
+            if events:
+                self._save_events(events)
+
+    def handle_event(self, event):
+        if event.get('op_type') not in self.SUPPORT_OPERATION_TYPES:
+            return
+        try:
+            cache_dtable_update_info(self.app, event)
+        except Exception as e:
+            logger.error('Cache dtable update info failed: %s' % e)
+        if self._batch_size <= 1:
+            self.save_events([event])
+            return
+        with self._batch_lock:
+            self._batch.append(event)
+            if len(self._batch) < self._batch_size:
+                return
+        self.flush()
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception('Flush activities error: %s', e)
+
+    def publish_metrics(self):
+        last_events_count, last_db_round_trips = 0, 0
+        while True:
+            time.sleep(self._metrics_interval)
+            events_count, db_round_trips = self._events_count, self._db_round_trips
+            events = events_count - last_events_count
+            round_trips = db_round_trips - last_db_round_trips
+            last_events_count, last_db_round_trips = events_count, db_round_trips
             try:
-                message = subscriber.get_message()
-                if message is not None:
-                    if message.get('type') != 'message':
-                        continue
-                    last_pubsub_message_time = time.time()
-                    event = json.loads(message['data'])
-                    if event['op_type'] not in self.SUPPORT_OPERATION_TYPES:
-                        continue
-                    session = self._db_session_class()
-                    try:
-                        save_or_update_or_delete(session, event)
-                        cache_dtable_update_info(self.app, event)
-                    except JSONDecodeError as err:
-                        logger.warning('Json decode error on handling activity messages: %s' % err)
-                    except Exception as e:
-                        logger.exception(e)
-                        logger.error('Handle activities message failed: %s' % e)
-                    finally:
-                        session.close()
-                else:
-                    if (time.time() - last_pubsub_message_time) >= self._pubsub_no_message_timeout:
-                        subscriber = self._redis_client.refresh_subscriber(
-                            subscriber, self._pubsub_channel_name, 'no message timeout')
-                        last_pubsub_message_time = time.time()
-                        continue
-                    time.sleep(0.5)
+                publish_metric(round(events / self._metrics_interval, 2), 'activities_events_per_second', ACTIVITIES_EVENTS_RATE_METRIC_HELP)
+                publish_metric(round(round_trips / events, 2) if events else 0, 'activities_db_round_trips_per_event', ACTIVITIES_DB_ROUND_TRIPS_METRIC_HELP)
             except Exception as e:
-                logger.error('redis pubsub receive error: %s', e)
-                subscriber = self._redis_client.refresh_subscriber(subscriber, self._pubsub_channel_name, str(e))
-                last_pubsub_message_time = time.time()
+                logger.warning('Publish activities metrics error: %s', e)
+
+    def start(self):
+        logger.info('Starting handle table activities...')
+        if self._batch_size > 1:
+            Thread(target=self.flush_periodically, daemon=True).start()
+        Thread(target=self.publish_metrics, daemon=True).start()
+        pubsub_dispatcher.register(self._pubsub_channel_name, self.handle_event, name='activities')
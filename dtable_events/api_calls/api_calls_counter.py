@@ -1,17 +1,16 @@
 # -*- coding: utf-8 -*-
 import logging
-import time
 import json
 from collections import defaultdict
 from datetime import datetime
-from threading import Thread, Event
+from threading import Thread
 
 from apscheduler.schedulers.blocking import BlockingScheduler
 from dateutil import parser, relativedelta
 from sqlalchemy import text
 
 from dtable_events.app.config import INNER_DTABLE_WEB_SERVICE_URL
-from dtable_events.app.event_redis import RedisClient
+from dtable_events.app.event_redis import RedisClient, pubsub_dispatcher
 from dtable_events.db import init_db_session_class
 from dtable_events.utils import uuid_str_to_32_chars
 from dtable_events.utils.dtable_web_api import DTableWebAPI
@@ -21,13 +20,11 @@ logger = logging.getLogger(__name__)
 
 class APICallsCounter(object):
     def __init__(self):
-        self._finished = Event()
         self._db_session_class = init_db_session_class()
         self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=5,
                                          health_check_interval=30, retry_on_timeout=True)
         self.keep_months = 3  # including this month
         self._pubsub_channel_name = 'stats_api_calls'
-        self._pubsub_no_message_timeout = 5 * 60
 
     def count_api_gateway(self, info, db_session):
         try:
@@ -127,37 +124,14 @@ class APICallsCounter(object):
         except Exception as e:
             logger.exception('stats api_gateway api calls info: %s error: %s', info, e)
 
-    def count(self):
-        logger.info('Starting count api calls...')
-        subscriber = self._redis_client.get_subscriber(self._pubsub_channel_name)
-        last_pubsub_message_time = time.time()
-
-        while not self._finished.is_set():
-            try:
-                message = subscriber.get_message()
-                if message is not None:
-                    if message.get('type') != 'message':
-                        continue
-                    last_pubsub_message_time = time.time()
-                    msg = json.loads(message['data'])
-                    session = self._db_session_class()
-                    try:
-                        self.count_api_calls(msg, session)
-                    except Exception as e:
-                        logger.exception('count api calls msg: %s error: %s', msg, e)
-                    finally:
-                        session.close()
-                else:
-                    if (time.time() - last_pubsub_message_time) >= self._pubsub_no_message_timeout:
-                        subscriber = self._redis_client.refresh_subscriber(
-                            subscriber, self._pubsub_channel_name, 'no message timeout')
-                        last_pubsub_message_time = time.time()
-                        continue
-                    time.sleep(0.5)
-            except Exception as e:
-                logger.error('redis pubsub receive error: %s', e)
-                subscriber = self._redis_client.refresh_subscriber(subscriber, self._pubsub_channel_name, str(e))
-                last_pubsub_message_time = time.time()
+    def handle_message(self, msg):
+        session = self._db_session_class()
+        try:
+            self.count_api_calls(msg, session)
+        except Exception as e:
+            logger.exception('count api calls msg: %s error: %s', msg, e)
+        finally:
+            session.close()
 
     def clean(self):
         logger.info('Starting schedule clean api calls...')
@@ -206,6 +180,7 @@ class APICallsCounter(object):
         sched.start()
 
     def start(self):
-        Thread(target=self.count, daemon=True).start()
+        logger.info('Starting count api calls...')
+        pubsub_dispatcher.register(self._pubsub_channel_name, self.handle_message, name='api_calls_counter')
         Thread(target=self.clean, daemon=True).start()
         Thread(target=self.reset, daemon=True).start()
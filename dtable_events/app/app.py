@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 import time
+from threading import Thread
 
 from dtable_events.activities.handlers import MessageHandler
+from dtable_events.app.event_redis import pubsub_dispatcher
+from dtable_events.utils import DTABLE_OWNER_CHANGED_CHANNEL, handle_dtable_owner_changed_message
+from dtable_events.utils.lru_cache import publish_caches_metrics
+from dtable_events.utils.http_session import publish_http_metrics
+from dtable_events.utils.utils_metadata_cache import subscribe_metadata_changes, publish_metadata_cache_metrics
 from dtable_events.app.stats_sender import StatsSender
 from dtable_events.statistics.counter import UserActivityCounter
 from dtable_events.dtable_io.dtable_io_server import DTableIOServer
@@ -52,7 +58,7 @@ class App(object):
             self._playwright_manager = get_playwright_manager()
 
         if self._enable_background_tasks:
-            # redis client subscriber
+            # redis pubsub handlers
             self._message_handler = MessageHandler(self)
             self._notification_rule_handler = NotificationRuleHandler()
             self._user_activity_counter = UserActivityCounter()
@@ -84,14 +90,16 @@ class App(object):
             self.ai_stats_worker = AIStatsWorker()
 
     def serve_forever(self):
-
+        Thread(target=publish_caches_metrics, daemon=True).start()
+        Thread(target=publish_http_metrics, daemon=True).start()
+        Thread(target=publish_metadata_cache_metrics, daemon=True).start()
 
         if self._enable_foreground_tasks:
             self._playwright_manager.start()                 # always True
             self._dtable_io_server.start()                   # always True
 
         if self._enable_background_tasks:
-            # redis client subscriber
+            # redis pubsub handlers
             self._metric_manager.start()                     # always True, ready to collect metrics
             self._message_handler.start()                    # always True
             self._notification_rule_handler.start()          # always True
@@ -123,6 +131,13 @@ class App(object):
             self.ai_stats_worker.start()                     # default True
             # automations pipeline
             self._automations_pipeline.start()               # always True
+            # invalidate cached dtable owner info when a base is transferred or deleted
+            pubsub_dispatcher.register(DTABLE_OWNER_CHANGED_CHANNEL, handle_dtable_owner_changed_message,
+                                       name='dtable_owner_cache')
+            # invalidate cached metadata when schema of a base changes
+            subscribe_metadata_changes()
+            # one redis subscription for all the handlers registered above
+            pubsub_dispatcher.start()
 
         while True:
             time.sleep(60)
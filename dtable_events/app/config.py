@@ -108,9 +108,31 @@ AI_PRICES = get_llm_prices(LLM_MODELS + [OCR_SERVICE_CONFIG])
 
 # IO server
 ARCHIVE_VIEW_EXPORT_ROW_LIMIT = configs.get('ARCHIVE_VIEW_EXPORT_ROW_LIMIT', default=250000)
+BIG_DATA_EXPORT_QUEUE_DEPTH = configs.get('BIG_DATA_EXPORT_QUEUE_DEPTH', default=2)  # pages buffered between export stages
 APP_TABLE_EXPORT_EXCEL_ROW_LIMIT = configs.get('APP_TABLE_EXPORT_EXCEL_ROW_LIMIT', default=10000)
 BIG_DATA_ROW_IMPORT_LIMIT = configs.get('BIG_DATA_ROW_IMPORT_LIMIT', default=500000)
 BIG_DATA_ROW_UPDATE_LIMIT = configs.get('BIG_DATA_ROW_UPDATE_LIMIT', default=500000)
+ASSET_DOWNLOAD_WORKERS = configs.get('ASSET_DOWNLOAD_WORKERS', default=8)  # concurrent file downloads of an export
+ASSET_DOWNLOAD_RETRIES = configs.get('ASSET_DOWNLOAD_RETRIES', default=3)
+
+# activities
+ACTIVITIES_BATCH_SIZE = configs.get('ACTIVITIES_BATCH_SIZE', default=100)
+ACTIVITIES_BATCH_FLUSH_INTERVAL = configs.get('ACTIVITIES_BATCH_FLUSH_INTERVAL', default=500)  # ms
+
+# notification rules
+NOTIFICATION_RULES_BATCH_SIZE = configs.get('NOTIFICATION_RULES_BATCH_SIZE', default=1000)
+NOTIFICATION_RULES_BATCH_FLUSH_INTERVAL = configs.get('NOTIFICATION_RULES_BATCH_FLUSH_INTERVAL', default=1000)  # ms
+
+# webhook
+WEBHOOK_WORKERS = configs.get('WEBHOOK_WORKERS', default=10)
+WEBHOOK_CONCURRENCY_PER_WEBHOOK = configs.get('WEBHOOK_CONCURRENCY_PER_WEBHOOK', default=2)
+WEBHOOK_QUEUE_SIZE = configs.get('WEBHOOK_QUEUE_SIZE', default=10000)
+WEBHOOK_QUEUE_FULL_POLICY = configs.get('WEBHOOK_QUEUE_FULL_POLICY', default='drop')  # drop / spill
+WEBHOOK_REQUEST_TIMEOUT = configs.get('WEBHOOK_REQUEST_TIMEOUT', default=30)
+WEBHOOK_RETRY_TIMES = configs.get('WEBHOOK_RETRY_TIMES', default=2)
+WEBHOOK_RETRY_BACKOFF = configs.get('WEBHOOK_RETRY_BACKOFF', default=2)  # seconds, doubled for each retry
+# seconds, webhooks created, edited or deleted in dtable-web are picked up at most this late
+WEBHOOK_INDEX_REFRESH_INTERVAL = configs.get('WEBHOOK_INDEX_REFRESH_INTERVAL', default=10)
 
 # notices feature
 ENABLE_WEIXIN = configs.get('ENABLE_WEIXIN', default=False)
@@ -144,6 +166,12 @@ IO_SERVER_HOST = configs.get('IO_SERVER_HOST', default='127.0.0.1')
 IO_SERVER_PORT = configs.get('IO_SERVER_PORT', default=6000)
 IO_SERVER_WORKERS = configs.get('IO_SERVER_WORKERS', default=3)
 IO_SERVER_TASK_TIMEOUT = configs.get('IO_SERVER_TASK_TIMEOUT', default=3600)
+IO_TASK_BACKEND = configs.get('IO_TASK_BACKEND', default='memory')  # memory / redis
+IO_TASK_QUEUE_SIZE = configs.get('IO_TASK_QUEUE_SIZE', default=10)
+IO_TASK_RESULT_TIMEOUT = configs.get('IO_TASK_RESULT_TIMEOUT', default=3600)
+# processes for cpu bound io tasks, 0 to run them in threads
+IO_CPU_TASK_WORKERS = configs.get('IO_CPU_TASK_WORKERS', default=2)
+IO_CPU_TASK_MAX_TASKS_PER_CHILD = configs.get('IO_CPU_TASK_MAX_TASKS_PER_CHILD', default=20)
 
 # instant notices sender
 INSTANT_SENDER_INTERVAL = configs.get('INSTANT_SENDER_INTERVAL', default=60)
@@ -164,6 +192,11 @@ LDAP_SYNC_INTERVAL = configs.get('LDAP_SYNC_INTERVAL', default=60*60)
 
 # common dataset syncer
 COMMON_DATASET_SYNCER_ENABLED = configs.get('COMMON_DATASET_SYNCER_ENABLED', default=True)
+COMMON_DATASET_INCREMENTAL_SYNC_ENABLED = configs.get('COMMON_DATASET_INCREMENTAL_SYNC_ENABLED', default=True)
+COMMON_DATASET_FULL_SYNC_INTERVAL = configs.get('COMMON_DATASET_FULL_SYNC_INTERVAL', default=24 * 60 * 60)  # seconds
+COMMON_DATASET_ROW_HASH_ENABLED = configs.get('COMMON_DATASET_ROW_HASH_ENABLED', default=True)
+COMMON_DATASET_SYNC_CONCURRENCY = configs.get('COMMON_DATASET_SYNC_CONCURRENCY', default=5)
+COMMON_DATASET_SYNC_PER_DST_CONCURRENCY = configs.get('COMMON_DATASET_SYNC_PER_DST_CONCURRENCY', default=1)
 
 # clean db
 CLEAN_DB_ENABLED = configs.get('CLEAN_DB_ENABLED', default=True)
@@ -180,6 +213,9 @@ CLEAN_DB_KEEP_USER_ACTIVITY_STATISTICS_DAYS = configs.get('CLEAN_DB_KEEP_USER_AC
 CLEAN_DB_KEEP_DTABLE_APP_PAGES_OPERATION_LOG_DAYS = configs.get('CLEAN_DB_KEEP_DTABLE_APP_PAGES_OPERATION_LOG_DAYS', default=14)
 CLEAN_DB_KEEP_EMAIL_SENDING_LOG_DAYS = configs.get('CLEAN_DB_KEEP_EMAIL_SENDING_LOG_DAYS', default=30)
 CLEAN_DB_KEEP_SYSADMIN_EXTRA_USERLOGINLOG_DAYS = configs.get('CLEAN_DB_KEEP_SYSADMIN_EXTRA_USERLOGINLOG_DAYS', default=30)
+CLEAN_DB_BATCH_SIZE = configs.get('CLEAN_DB_BATCH_SIZE', default=5000)
+CLEAN_DB_MAX_ROWS_PER_SECOND = configs.get('CLEAN_DB_MAX_ROWS_PER_SECOND', default=20000)  # per table, 0 means no limit
+CLEAN_DB_CONCURRENCY = configs.get('CLEAN_DB_CONCURRENCY', default=3)
 
 # email syncer
 EMAIL_SYNCER_ENABLED = configs.get('EMAIL_SYNCER_ENABLED', default=True)
@@ -195,6 +231,10 @@ AI_STATS_ENABLED = configs.get('AI_STATS_ENABLED', default=True)
 AUTOMATION_WORKERS = configs.get('AUTOMATION_WORKERS', default=5)
 AUTOMATION_RATE_LIMIT_WINDOW_SECS = configs.get('AUTOMATION_RATE_LIMIT_WINDOW_SECS', default=300)
 AUTOMATION_RATE_LIMIT_PERCENT = configs.get('AUTOMATION_RATE_LIMIT_PERCENT', default=0.25)
+# local / redis / redis_approximate
+AUTOMATION_RATE_LIMIT_BACKEND = configs.get('AUTOMATION_RATE_LIMIT_BACKEND', default='local')
+AUTOMATION_RATE_LIMIT_SYNC_INTERVAL = configs.get('AUTOMATION_RATE_LIMIT_SYNC_INTERVAL', default=5)
+AUTOMATION_RESULTS_BATCH_SIZE = configs.get('AUTOMATION_RESULTS_BATCH_SIZE', default=100)
 
 # playwright
 CONVERT_PDF_BROWSERS = configs.get('CONVERT_PDF_BROWSERS', default=2)
@@ -209,6 +249,26 @@ VIRUS_SCAN_SCAN_INTERVAL = configs.get('VIRUS_SCAN_SCAN_INTERVAL', default=60)
 VIRUS_SCAN_SCAN_SIZE_LIMIT = configs.get('VIRUS_SCAN_SCAN_SIZE_LIMIT', default=20)
 VIRUS_SCAN_SCAN_SKIP_EXT = configs.get('VIRUS_SCAN_SCAN_SKIP_EXT')
 VIRUS_SCAN_THREADS = configs.get('VIRUS_SCAN_THREADS', default=4)
+# clamd socket, path of unix socket or host:port, files are streamed to clamd instead of running scan command
+VIRUS_SCAN_CLAMD_ADDRESS = configs.get('VIRUS_SCAN_CLAMD_ADDRESS')
+VIRUS_SCAN_CLAMD_TIMEOUT = configs.get('VIRUS_SCAN_CLAMD_TIMEOUT', default=60)
+VIRUS_SCAN_DB_BATCH_SIZE = configs.get('VIRUS_SCAN_DB_BATCH_SIZE', default=100)  # repos of scan results saved together
+VIRUS_SCAN_SEAFDIR_CACHE_SIZE = configs.get('VIRUS_SCAN_SEAFDIR_CACHE_SIZE', default=10000)  # dirs loaded by commit differ
+VIRUS_SCAN_CHECKPOINT_INTERVAL = configs.get('VIRUS_SCAN_CHECKPOINT_INTERVAL', default=60)  # seconds, 0 to disable
+
+# base metadata cache, ttl in seconds
+# a longer ttl, e.g. 3600, only if dtable-server publishes schema changes in `table-events` channel
+METADATA_CACHE_SIZE = configs.get('METADATA_CACHE_SIZE', default=500)
+METADATA_CACHE_TTL = configs.get('METADATA_CACHE_TTL', default=60)
+
+# sqls generated from filters and statistics, cleared when the date changes, 0 to disable
+SQL_GENERATOR_CACHE_SIZE = configs.get('SQL_GENERATOR_CACHE_SIZE', default=2000)
+
+# http sessions of inner services
+# connections kept alive per upstream, enough for workers requesting the same upstream concurrently
+HTTP_POOL_MAXSIZE = configs.get('HTTP_POOL_MAXSIZE', default=max(10, AUTOMATION_WORKERS + COMMON_DATASET_SYNC_CONCURRENCY + EMAIL_SYNCER_MAX_WORKERS))
+HTTP_RETRY_TOTAL = configs.get('HTTP_RETRY_TOTAL', default=3)  # retries of connect errors and 429/503
+HTTP_RETRY_BACKOFF_FACTOR = configs.get('HTTP_RETRY_BACKOFF_FACTOR', default=0.5)
 
 def get_config(config_file):
     config = configparser.ConfigParser()
@@ -4,6 +4,10 @@ import json
 import logging
 import os
 import time
+from collections import defaultdict
+from queue import Queue, Full, Empty
+from threading import Thread, Lock
+
 import redis
 
 from dtable_events.app.config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
@@ -82,7 +86,10 @@ class RedisClient(object):
     def get(self, key):
         return self._redis.get(key)
 
-    def set(self, key, value, timeout=None):
+    def set(self, key, value, timeout=None, nx=False):
+        if nx:
+            # only set if not exists, return True if set
+            return bool(self._redis.set(key, value, ex=timeout, nx=True))
         if not timeout:
             return self._redis.set(key, value)
         else:
@@ -102,12 +109,27 @@ class RedisClient(object):
     def lpush(self, key, value):
         return self._redis.lpush(key, value)
 
-    def rpop(self, key):
-        return self._redis.rpop(key)
+    def rpop(self, key, count=None):
+        return self._redis.rpop(key, count)
+
+    def brpop(self, key, timeout=0):
+        return self._redis.brpop(key, timeout=timeout)
 
     def llen(self, key):
         return self._redis.llen(key)
 
+    def exists(self, *keys):
+        return self._redis.exists(*keys)
+
+    def zadd(self, key, mapping, **kwargs):
+        return self._redis.zadd(key, mapping, **kwargs)
+
+    def register_script(self, script):
+        return self._redis.register_script(script)
+
+    def pipeline(self, transaction=True):
+        return self._redis.pipeline(transaction=transaction)
+
 
 class RedisCache(object):
     def __init__(self):
@@ -141,3 +163,173 @@ class RedisCache(object):
         return self._redis_client.publish(channel_name, message)
 
 redis_cache = RedisCache()
+
+
+class PubSubHandler(object):
+    """
+    A consumer registered on PubSubDispatcher.
+
+    Every handler owns a bounded queue and its own worker threads, so a slow
+    consumer only delays (and at worst drops) its own messages.
+    """
+
+    def __init__(self, name, channel, callback, queue_size=10000, workers=1):
+        self.name = name
+        self.channel = channel
+        self.callback = callback
+        self.workers = workers
+        self.queue = Queue(maxsize=queue_size)
+
+        self.received_count = 0
+        self.processed_count = 0
+        self.dropped_count = 0
+        self.max_lag = 0
+        self.last_active_time = time.time()
+
+    def put(self, data):
+        self.received_count += 1
+        try:
+            self.queue.put_nowait((time.time(), data))
+        except Full:
+            self.dropped_count += 1
+            if self.dropped_count % 1000 == 1:
+                logger.warning('pubsub handler %s queue is full, %s messages dropped so far',
+                               self.name, self.dropped_count)
+            return False
+        return True
+
+    def pop_max_lag(self):
+        max_lag, self.max_lag = self.max_lag, 0
+        return max_lag
+
+    def run(self):
+        while True:
+            self.last_active_time = time.time()
+            try:
+                received_at, data = self.queue.get(timeout=1)
+            except Empty:
+                continue
+            lag = time.time() - received_at
+            if lag > self.max_lag:
+                self.max_lag = lag
+            try:
+                self.callback(data)
+            except Exception as e:
+                logger.exception('pubsub handler %s handle message error: %s', self.name, e)
+            finally:
+                self.processed_count += 1
+
+    def start(self):
+        for i in range(self.workers):
+            Thread(target=self.run, name='pubsub-%s-%s' % (self.name, i), daemon=True).start()
+
+
+class PubSubDispatcher(object):
+    """
+    Hold one blocking redis subscription for all channels, decode every
+    message once and fan it out to the handlers registered on its channel.
+
+    The decoded message is shared by all handlers of a channel, handlers must
+    not modify it in place.
+    """
+
+    def __init__(self, queue_size=10000, metrics_interval=30):
+        self.queue_size = queue_size
+        self.metrics_interval = metrics_interval
+        self._handlers = defaultdict(list)
+        self._handlers_lock = Lock()
+        self._redis_client = None
+        self._started = False
+        self._get_message_timeout = 1
+        self._pubsub_no_message_timeout = 5 * 60
+        self.last_poll_time = time.time()
+
+    def register(self, channel, callback, name=None, queue_size=None, workers=1):
+        handler = PubSubHandler(name or channel, channel, callback,
+                                queue_size=queue_size or self.queue_size, workers=workers)
+        with self._handlers_lock:
+            self._handlers[channel].append(handler)
+            started = self._started
+        if started:
+            # the channel is subscribed by the listening thread
+            handler.start()
+        logger.info('pubsub handler %s registered on channel %s', handler.name, channel)
+        return handler
+
+    def get_handlers(self):
+        with self._handlers_lock:
+            return [handler for handlers in self._handlers.values() for handler in handlers]
+
+    def _get_channels(self):
+        with self._handlers_lock:
+            return sorted(self._handlers.keys())
+
+    def dispatch(self, channel, data):
+        with self._handlers_lock:
+            handlers = list(self._handlers.get(channel, []))
+        if not handlers:
+            return
+        try:
+            data = json.loads(data)
+        except Exception as e:
+            logger.warning('pubsub channel %s message invalid: %s', channel, e)
+            return
+        for handler in handlers:
+            handler.put(data)
+
+    def listen(self):
+        channels = self._get_channels()
+        subscriber = self._redis_client.get_subscriber(channels)
+        last_pubsub_message_time = time.time()
+        while True:
+            try:
+                current_channels = self._get_channels()
+                if current_channels != channels:
+                    subscriber.subscribe(*[c for c in current_channels if c not in channels])
+                    channels = current_channels
+                message = subscriber.get_message(timeout=self._get_message_timeout)
+                self.last_poll_time = time.time()
+                if message is None:
+                    if (time.time() - last_pubsub_message_time) >= self._pubsub_no_message_timeout:
+                        subscriber = self._redis_client.refresh_subscriber(
+                            subscriber, channels, 'no message timeout')
+                        last_pubsub_message_time = time.time()
+                    continue
+                if message.get('type') != 'message':
+                    continue
+                last_pubsub_message_time = time.time()
+                self.dispatch(message['channel'], message['data'])
+            except Exception as e:
+                logger.error('redis pubsub receive error: %s', e)
+                subscriber = self._redis_client.refresh_subscriber(subscriber, channels, str(e))
+                last_pubsub_message_time = time.time()
+
+    def publish_metrics(self):
+        # imported here, utils_metric depends on this module
+        from dtable_events.utils.utils_metric import publish_metric, PUBSUB_QUEUE_SIZE_METRIC_HELP, \
+            PUBSUB_DROPPED_COUNT_METRIC_HELP, PUBSUB_LAG_METRIC_HELP
+        while True:
+            time.sleep(self.metrics_interval)
+            for handler in self.get_handlers():
+                try:
+                    publish_metric(handler.queue.qsize(), f'pubsub_{handler.name}_queue_size', PUBSUB_QUEUE_SIZE_METRIC_HELP)
+                    publish_metric(handler.dropped_count, f'pubsub_{handler.name}_dropped_count', PUBSUB_DROPPED_COUNT_METRIC_HELP)
+                    publish_metric(round(handler.pop_max_lag(), 3), f'pubsub_{handler.name}_lag', PUBSUB_LAG_METRIC_HELP)
+                except Exception as e:
+                    logger.warning('publish pubsub handler %s metrics error: %s', handler.name, e)
+
+    def start(self):
+        with self._handlers_lock:
+            if self._started or not self._handlers:
+                return
+            self._started = True
+        logger.info('Starting pubsub dispatcher...')
+        self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=5,
+                                         health_check_interval=30, retry_on_timeout=True)
+        for handler in self.get_handlers():
+            handler.start()
+        Thread(target=self.listen, name='pubsub-dispatcher', daemon=True).start()
+        Thread(target=self.publish_metrics, daemon=True).start()
+
+
+pubsub_dispatcher = PubSubDispatcher()
@@ -1,19 +1,24 @@
 import json
+import logging
 import os
 import time
 from copy import deepcopy
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta, date
-from threading import Thread, Lock
+from threading import Thread
 
+import redis
 from apscheduler.schedulers.blocking import BlockingScheduler
 from sqlalchemy import text
 
 from dtable_events.app.config import INNER_DTABLE_WEB_SERVICE_URL, AUTOMATION_RATE_LIMIT_PERCENT, \
-    AUTOMATION_RATE_LIMIT_WINDOW_SECS, AUTOMATION_WORKERS
-from dtable_events.app.event_redis import RedisClient
+    AUTOMATION_RATE_LIMIT_WINDOW_SECS, AUTOMATION_WORKERS, AUTOMATION_RATE_LIMIT_BACKEND, \
+    AUTOMATION_RATE_LIMIT_SYNC_INTERVAL, AUTOMATION_RESULTS_BATCH_SIZE
+from dtable_events.app.event_redis import RedisClient, pubsub_dispatcher
 from dtable_events.app.log import auto_rule_logger
 from dtable_events.automations.automations_stats_manager import AutomationsStatsManager
+from dtable_events.automations.rate_limiter import get_rate_limiter
+from dtable_events.automations.rules_cache import AutomationRulesCache
 from dtable_events.ccnet.organization import get_org_admins
 from dtable_events.db import init_db_session_class
 from dtable_events.utils import get_dtable_owner_org_id
@@ -24,72 +29,35 @@ from dtable_events.utils.utils_metric import AUTOMATION_QUEUE_10_METRIC_HELP, AU
 from dtable_events.automations.entities import AutomationResult, AutomationTask, QUEUE_AUTOMATION_TASKS_10, QUEUE_AUTOMATION_TASKS_20, QUEUE_AUTOMATION_TASKS_30
 
 
-class RateLimiter:
-
-    def __init__(self, window_secs = 60 * 5, percent=0.25):
-        self.window_secs = window_secs
-        self.percent = percent
-        self.window_start = time.time()
-        self.counters = {}
-        self.counters_lock = Lock()
-
-    def get_key(self, owner, org_id):
-        if org_id and org_id != -1:
-            return org_id
-        else:
-            return owner
-
-    def is_allowed(self, owner, org_id, workers):
-        limit_key = self.get_key(owner, org_id)
-        if isinstance(limit_key, str) and '@seafile_group' in limit_key:
-            return True
-        with self.counters_lock:
-            if time.time() - self.window_start > self.window_secs:
-                return True
-            total_time = self.counters.get(limit_key, 0)
-            auto_rule_logger.debug(f"owner {owner} org_id {org_id} usage percent {self.get_percent(owner, org_id, workers)}")
-            if total_time / (self.window_secs * workers) > self.percent:
-                return False
-            return True
-
-    def record_time(self, owner, org_id, run_time):
-        with self.counters_lock:
-            now_time = time.time()
-            if now_time - self.window_start > self.window_secs:
-                self.counters.clear()
-                self.window_start = now_time
-            limit_key = self.get_key(owner, org_id)
-            self.counters[limit_key] = self.counters.get(limit_key, 0) + run_time
-
-    def get_percent(self, owner, org_id, workers):
-        limit_key = self.get_key(owner, org_id)
-        return self.counters.get(limit_key, 0) / (self.window_secs * workers)
-
-
 class AutomationsPipeline(object):
 
     def __init__(self):
         self.workers = 5
         self._db_session_class = init_db_session_class()
 
-        # Keep pubsub reconnects isolated from regular Redis commands.
         self._command_redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=10,
                                                  health_check_interval=30, retry_on_timeout=True)
-        self._subscriber_redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=10,
-                                                    health_check_interval=30, retry_on_timeout=True)
         self.per_update_channel = 'automation-rule-triggered'
-        self._pubsub_no_message_timeout = 5 * 60
+        self._pubsub_handler = None
 
         self.results_queue_key = 'automation_results'
+        self.results_batch_size = AUTOMATION_RESULTS_BATCH_SIZE
+        self._rpop_count_supported = True
+
+        self.rate_limiter = get_rate_limiter(
+            AUTOMATION_RATE_LIMIT_BACKEND,
+            window_secs=AUTOMATION_RATE_LIMIT_WINDOW_SECS,
+            percent=AUTOMATION_RATE_LIMIT_PERCENT,
+            sync_interval=AUTOMATION_RATE_LIMIT_SYNC_INTERVAL
+        )
 
-        self.rate_limiter = RateLimiter()
+        self.rules_cache = AutomationRulesCache()
 
         self.automations_stats_manager = AutomationsStatsManager()
 
         # metrics
         self.realtime_trigger_count = 0
         self.scheduled_trigger_count = 0
-        self.realtime_automation_heartbeat = time.time()
         ## metric_times record the lastest publish times of metrics
         self.metric_times = {}
 
@@ -116,9 +84,11 @@ class AutomationsPipeline(object):
     def parse_config(self):
         self.workers = AUTOMATION_WORKERS
 
-        self.rate_limiter.window_secs = AUTOMATION_RATE_LIMIT_WINDOW_SECS
-
-        self.rate_limiter.percent = AUTOMATION_RATE_LIMIT_PERCENT
+    def get_realtime_automation_heartbeat(self):
+        # both the dispatcher listening thread and the automations handler must be alive
+        if not self._pubsub_handler:
+            return pubsub_dispatcher.last_poll_time
+        return min(pubsub_dispatcher.last_poll_time, self._pubsub_handler.last_active_time)
 
     def publish_metrics(self):
         while True:
@@ -127,21 +97,16 @@ class AutomationsPipeline(object):
             publish_metric(self._command_redis_client.llen(QUEUE_AUTOMATION_TASKS_10), f'{QUEUE_AUTOMATION_TASKS_10}_size', AUTOMATION_QUEUE_10_METRIC_HELP)
             publish_metric(self._command_redis_client.llen(QUEUE_AUTOMATION_TASKS_20), f'{QUEUE_AUTOMATION_TASKS_20}_size', AUTOMATION_QUEUE_20_METRIC_HELP)
             publish_metric(self._command_redis_client.llen(QUEUE_AUTOMATION_TASKS_30), f'{QUEUE_AUTOMATION_TASKS_30}_size', AUTOMATION_QUEUE_30_METRIC_HELP)
-            publish_metric(self.realtime_automation_heartbeat, 'realtime_automation_heartbeat', REALTIME_AUTOMATION_RULES_HEARTBEAT_HELP)
+            publish_metric(self.get_realtime_automation_heartbeat(), 'realtime_automation_heartbeat', REALTIME_AUTOMATION_RULES_HEARTBEAT_HELP)
+            self.rate_limiter.publish_metrics()
             time.sleep(10)
 
     def get_automation_task(self, db_session, event_data):
-        sql = "SELECT `trigger`, `actions`, `run_condition`, `dtable_uuid` FROM dtable_automation_rules WHERE id=:rule_id AND is_valid=1 AND is_pause=0"
-        rule = db_session.execute(text(sql), {'rule_id': event_data['automation_rule_id']}).fetchone()
+        rule = self.rules_cache.get_rule(db_session, event_data['automation_rule_id'])
         if not rule:
             return None
         owner_info = get_dtable_owner_org_id(rule.dtable_uuid, db_session)
-        return AutomationTask(
-            rule_id=event_data['automation_rule_id'],
-            run_condition=rule.run_condition,
-            trigger=json.loads(rule.trigger),
-            actions=json.loads(rule.actions),
-            dtable_uuid=rule.dtable_uuid,
+        return rule.gen_task(
             org_id=owner_info['org_id'],
             owner=owner_info['owner'],
             data=event_data,
@@ -161,105 +126,85 @@ class AutomationsPipeline(object):
         )
         self._command_redis_client.lpush(queue_key, json.dumps(automation_task.to_dict()))
 
+    def handle_event(self, event):
+        auto_rule_logger.info(
+            "Received automation event: rule_id=%s dtable_uuid=%s op_type=%s table_id=%s row_id=%s updated_column_keys=%s",
+            event.get('automation_rule_id'),
+            event.get('dtable_uuid'),
+            event.get('op_type'),
+            event.get('table_id'),
+            event.get('row_id'),
+            event.get('updated_column_keys'),
+        )
+
+        db_session = self._db_session_class()
+        try:
+            dtable_uuid = event.get('dtable_uuid')
+            owner_info = get_dtable_owner_org_id(dtable_uuid, db_session)
+            event.update(owner_info)
+            automation_task = self.get_automation_task(db_session, event)
+            if not automation_task:
+                return
+            if not automation_task.can_do_actions():
+                auto_rule_logger.info(
+                    "Skip automation event: trigger conditions not met rule_id=%s owner=%s org_id=%s",
+                    automation_task.rule_id,
+                    owner_info['owner'],
+                    owner_info['org_id'],
+                )
+                return
+            if not self.rate_limiter.is_allowed(owner_info['owner'], owner_info['org_id'], self.workers):
+                auto_rule_logger.info(
+                    "Skip automation event: rate limited owner=%s org_id=%s rule_id=%s",
+                    owner_info['owner'],
+                    owner_info['org_id'],
+                    automation_task.rule_id,
+                )
+                automation_task.append_warning({'type': 'exceed_system_resource_limit'})
+                automation_result = AutomationResult(
+                    rule_id=automation_task.rule_id,
+                    rule_name=automation_task.rule_name,
+                    dtable_uuid=automation_task.dtable_uuid,
+                    run_condition=automation_task.run_condition,
+                    org_id=automation_task.org_id,
+                    owner=automation_task.owner,
+                    with_test=automation_task.with_test,
+                    success=False,
+                    is_exceed_system_resource_limit=True,
+                    trigger_time=datetime.utcnow(),
+                    trigger_date=date.today().replace(day=1),
+                    warnings=automation_task.warnings
+                )
+                self.add_exceed_system_resource_limit_entity(automation_task.owner, automation_task.org_id)
+                self._command_redis_client.lpush(self.results_queue_key, json.dumps(automation_result.to_dict()))
+                return
+            if self.automations_stats_manager.is_exceed(db_session, owner_info['owner'], owner_info['org_id']):
+                auto_rule_logger.info(
+                    "Skip automation event: trigger quota exceeded owner=%s org_id=%s rule_id=%s",
+                    owner_info['owner'],
+                    owner_info['org_id'],
+                    automation_task.rule_id,
+                )
+                return
+            self.put_task(automation_task)
+            self.realtime_trigger_count += 1
+        except Exception as e:
+            auto_rule_logger.exception(e)
+        finally:
+            db_session.close()
+
     def receive(self):
         auto_rule_logger.info(
-            "Start consuming automation events from Redis: window_secs=%s limit_percent=%s",
+            "Start consuming automation events from Redis: window_secs=%s limit_percent=%s limit_backend=%s",
             self.rate_limiter.window_secs,
             self.rate_limiter.percent,
+            AUTOMATION_RATE_LIMIT_BACKEND,
         )
-        subscriber = self._subscriber_redis_client.get_subscriber(self.per_update_channel)
-        last_pubsub_message_time = time.time()
-        while True:
-            try:
-                message = subscriber.get_message()
-                self.realtime_automation_heartbeat = time.time()
-                if message is not None:
-                    if message.get('type') != 'message':
-                        continue
-                    last_pubsub_message_time = time.time()
-                    event = json.loads(message['data'])
-                    auto_rule_logger.info(
-                        "Received automation event: rule_id=%s dtable_uuid=%s op_type=%s table_id=%s row_id=%s updated_column_keys=%s",
-                        event.get('automation_rule_id'),
-                        event.get('dtable_uuid'),
-                        event.get('op_type'),
-                        event.get('table_id'),
-                        event.get('row_id'),
-                        event.get('updated_column_keys'),
-                    )
-
-                    db_session = self._db_session_class()
-                    try:
-                        dtable_uuid = event.get('dtable_uuid')
-                        owner_info = get_dtable_owner_org_id(dtable_uuid, db_session)
-                        event.update(owner_info)
-                        automation_task = self.get_automation_task(db_session, event)
-                        if not automation_task:
-                            continue
-                        if not automation_task.can_do_actions():
-                            auto_rule_logger.info(
-                                "Skip automation event: trigger conditions not met rule_id=%s owner=%s org_id=%s",
-                                automation_task.rule_id,
-                                owner_info['owner'],
-                                owner_info['org_id'],
-                            )
-                            continue
-                        if not self.rate_limiter.is_allowed(owner_info['owner'], owner_info['org_id'], self.workers):
-                            auto_rule_logger.info(
-                                "Skip automation event: rate limited owner=%s org_id=%s rule_id=%s",
-                                owner_info['owner'],
-                                owner_info['org_id'],
-                                automation_task.rule_id,
-                            )
-                            automation_task.append_warning({'type': 'exceed_system_resource_limit'})
-                            automation_result = AutomationResult(
-                                rule_id=automation_task.rule_id,
-                                rule_name=automation_task.rule_name,
-                                dtable_uuid=automation_task.dtable_uuid,
-                                run_condition=automation_task.run_condition,
-                                org_id=automation_task.org_id,
-                                owner=automation_task.owner,
-                                with_test=automation_task.with_test,
-                                success=False,
-                                is_exceed_system_resource_limit=True,
-                                trigger_time=datetime.utcnow(),
-                                trigger_date=date.today().replace(day=1),
-                                warnings=automation_task.warnings
-                            )
-                            self.add_exceed_system_resource_limit_entity(automation_task.owner, automation_task.org_id)
-                            self._command_redis_client.lpush(self.results_queue_key, json.dumps(automation_result.to_dict()))
-                            continue
-                        if self.automations_stats_manager.is_exceed(db_session, owner_info['owner'], owner_info['org_id']):
-                            auto_rule_logger.info(
-                                "Skip automation event: trigger quota exceeded owner=%s org_id=%s rule_id=%s",
-                                owner_info['owner'],
-                                owner_info['org_id'],
-                                automation_task.rule_id,
-                            )
-                            continue
-                        self.put_task(automation_task)
-                        self.realtime_trigger_count += 1
-                    except Exception as e:
-                        auto_rule_logger.exception(e)
-                    finally:
-                        db_session.close()
-                else:
-                    if time.time() - last_pubsub_message_time >= self._pubsub_no_message_timeout:
-                        auto_rule_logger.info('no automation message for %ss', self._pubsub_no_message_timeout)
-                        subscriber = self._subscriber_redis_client.refresh_subscriber(
-                            subscriber, self.per_update_channel, 'no message timeout')
-                        last_pubsub_message_time = time.time()
-                        continue
-                    time.sleep(0.5)
-            except Exception as e:
-                auto_rule_logger.error('Redis pubsub receive failed: %s', e)
-                subscriber = self._subscriber_redis_client.refresh_subscriber(
-                    subscriber, self.per_update_channel, str(e))
-                last_pubsub_message_time = time.time()
+        self._pubsub_handler = pubsub_dispatcher.register(self.per_update_channel, self.handle_event, name='automations')
 
     def scan_rules(self):
         sql = '''
-            SELECT `dar`.`id`, `run_condition`, `trigger`, `actions`, `dtable_uuid`, w.`owner`, w.`org_id` FROM dtable_automation_rules dar
+            SELECT `dar`.`id`, `dtable_uuid`, w.`owner`, w.`org_id` FROM dtable_automation_rules dar
             JOIN dtables d ON dar.dtable_uuid=d.uuid
             JOIN workspaces w ON d.workspace_id=w.id
             WHERE ((run_condition='per_day' AND (last_trigger_time<:per_day_check_time OR last_trigger_time IS NULL))
@@ -277,7 +222,9 @@ class AutomationsPipeline(object):
                 'per_day_check_time': per_day_check_time,
                 'per_week_check_time': per_week_check_time,
                 'per_month_check_time': per_month_check_time
-            })
+            }).fetchall()
+            # trigger and actions of rules are parsed once and cached
+            parsed_rules = self.rules_cache.get_rules(db_session, [rule.id for rule in rules])
         except Exception as e:
             auto_rule_logger.exception('Failed to query scheduled automation rules: %s', e)
             db_session.close()
@@ -288,12 +235,10 @@ class AutomationsPipeline(object):
 
         try:
             for rule in rules:
-                automation_task = AutomationTask(
-                    rule_id=rule.id,
-                    run_condition=rule.run_condition,
-                    trigger=json.loads(rule.trigger),
-                    actions=json.loads(rule.actions),
-                    dtable_uuid=rule.dtable_uuid,
+                parsed_rule = parsed_rules.get(rule.id)
+                if not parsed_rule:
+                    continue
+                automation_task = parsed_rule.gen_task(
                     org_id=rule.org_id,
                     owner=rule.owner,
                     data=None,
@@ -345,67 +290,107 @@ class AutomationsPipeline(object):
             task_id, rule_id)
         return False
 
+    def pop_results(self):
+        """pop at most results_batch_size results, wait at most 1s for a result if the queue is empty"""
+        results = None
+        if self._rpop_count_supported:
+            try:
+                results = self._command_redis_client.rpop(self.results_queue_key, self.results_batch_size)
+            except redis.ResponseError as e:
+                # RPOP with count is supported since redis 6.2
+                auto_rule_logger.warning('RPOP with count not supported, pop results by pipeline: %s', e)
+                self._rpop_count_supported = False
+        if not self._rpop_count_supported:
+            pipeline = self._command_redis_client.pipeline(transaction=False)
+            for _ in range(self.results_batch_size):
+                pipeline.rpop(self.results_queue_key)
+            results = [result for result in pipeline.execute() if result]
+        if results:
+            return results
+        item = self._command_redis_client.brpop(self.results_queue_key, timeout=1)
+        return [item[1]] if item else []
+
+    def load_result(self, result_info_str):
+        try:
+            result_info = json.loads(result_info_str)
+            result_info['trigger_time'] = datetime.fromisoformat(result_info['trigger_time'])
+            result_info['trigger_date'] = datetime.fromisoformat(result_info['trigger_date'])
+            result = AutomationResult(**result_info)
+        except Exception as e:
+            auto_rule_logger.exception(f'failed to load result {result_info_str}')
+            return None
+        result_data = result.data if isinstance(result.data, dict) else {}
+        auto_rule_logger.info(
+            "Received automation result: rule_id=%s rule_name=%s run_condition=%s dtable_uuid=%s op_type=%s table_id=%s row_id=%s updated_column_keys=%s success=%s run_time=%s test=%s",
+            result.rule_id,
+            result.rule_name,
+            result.run_condition,
+            result.dtable_uuid,
+            result_data.get('op_type'),
+            result_data.get('table_id'),
+            result_data.get('row_id'),
+            result_data.get('updated_column_keys'),
+            result.success,
+            result.run_time,
+            result.with_test
+        )
+        return result
+
+    def update_stats(self, results):
+        db_session = self._db_session_class()
+        try:
+            self.automations_stats_manager.update_stats_batch(db_session, results)
+        except Exception as e:
+            auto_rule_logger.exception('Failed to update stats of %s automation results, update one by one: %s', len(results), e)
+            db_session.rollback()
+            for result in results:
+                try:
+                    self.automations_stats_manager.update_stats(db_session, result)
+                except Exception as e:
+                    auto_rule_logger.exception(e)
+                    db_session.rollback()
+        finally:
+            try:
+                db_session.close()
+            except Exception:
+                auto_rule_logger.exception('Failed to close automation stats database session')
+        for result in results:
+            if not result.is_valid:
+                self.rules_cache.invalidate(result.rule_id)
+
     def stats(self):
         auto_rule_logger.info("Start stats thread")
         while True:
             try:
-                result_info_str = self._command_redis_client.rpop(self.results_queue_key)
+                result_info_strs = self.pop_results()
             except Exception:
                 auto_rule_logger.exception('Failed to pop automation result from Redis')
                 time.sleep(1)
                 continue
-            if not result_info_str:
-                time.sleep(0.2)
-                continue
-            try:
-                result_info = json.loads(result_info_str)
-                result_info['trigger_time'] = datetime.fromisoformat(result_info['trigger_time'])
-                result_info['trigger_date'] = datetime.fromisoformat(result_info['trigger_date'])
-                result = AutomationResult(**result_info)
-            except Exception as e:
-                auto_rule_logger.exception(f'failed to load result {result_info_str}')
-                continue
-            result_data = result.data if isinstance(result.data, dict) else {}
-            auto_rule_logger.info(
-                "Received automation result: rule_id=%s rule_name=%s run_condition=%s dtable_uuid=%s op_type=%s table_id=%s row_id=%s updated_column_keys=%s success=%s run_time=%s test=%s",
-                result.rule_id,
-                result.rule_name,
-                result.run_condition,
-                result.dtable_uuid,
-                result_data.get('op_type'),
-                result_data.get('table_id'),
-                result_data.get('row_id'),
-                result_data.get('updated_column_keys'),
-                result.success,
-                result.run_time,
-                result.with_test
-            )
-            if result.with_test:
-                self.mark_test_task_done(result.task_id, result.rule_id)
-                continue
-            if result.run_condition == 'per_update' and not result.is_exceed_system_resource_limit:
-                owner = result.owner
-                org_id = result.org_id
-                run_time = result.run_time
-                self.rate_limiter.record_time(owner, org_id, run_time)
-                auto_rule_logger.debug(
-                    'Automation usage percent owner=%s org_id=%s percent=%s',
-                    owner,
-                    org_id,
-                    self.rate_limiter.get_percent(owner, org_id, self.workers),
-                )
-            db_session = None
-            try:
-                db_session = self._db_session_class()
-                self.automations_stats_manager.update_stats(db_session, result)
-            except Exception as e:
-                auto_rule_logger.exception(e)
-            finally:
-                if db_session:
-                    try:
-                        db_session.close()
-                    except Exception:
-                        auto_rule_logger.exception('Failed to close automation stats database session')
+            results = []
+            for result_info_str in result_info_strs:
+                result = self.load_result(result_info_str)
+                if not result:
+                    continue
+                if result.with_test:
+                    self.mark_test_task_done(result.task_id, result.rule_id)
+                    continue
+                if result.run_condition == 'per_update' and not result.is_exceed_system_resource_limit:
+                    owner = result.owner
+                    org_id = result.org_id
+                    run_time = result.run_time
+                    self.rate_limiter.record_time(owner, org_id, run_time)
+                    # getting percent queries the rate limiter backend, e.g. redis, only for debugging
+                    if auto_rule_logger.isEnabledFor(logging.DEBUG):
+                        auto_rule_logger.debug(
+                            'Automation usage percent owner=%s org_id=%s percent=%s',
+                            owner,
+                            org_id,
+                            self.rate_limiter.get_percent(owner, org_id, self.workers),
+                        )
+                results.append(result)
+            if results:
+                self.update_stats(results)
 
     def send_exceed_system_resource_limit_notifications(self):
         sched = BlockingScheduler()
@@ -442,6 +427,8 @@ class AutomationsPipeline(object):
             rule = db_session.execute(text(sql), {'automation_rule_id': automation_rule_id}).fetchone()
             if not rule:
                 return
+            # rule is usually just edited when test run
+            self.rules_cache.invalidate(int(automation_rule_id))
             owner_info = get_dtable_owner_org_id(rule.dtable_uuid, db_session)
             automation_task = AutomationTask(
                 rule_id=automation_rule_id,
@@ -471,7 +458,8 @@ class AutomationsPipeline(object):
 
     def start(self):
         auto_rule_logger.info("Start automations pipeline")
-        Thread(target=self.receive, daemon=True).start() # add normal action to redis queue
+        self.rate_limiter.start()
+        self.receive() # add normal action to redis queue
         Thread(target=self.scheduled_scan, daemon=True).start() # add cron action to redis queue
         Thread(target=self.stats, daemon=True).start() # update status
         Thread(target=self.publish_metrics, daemon=True).start() # update metrics
@@ -10,6 +10,7 @@ from dtable_events.utils import get_dtable_admins
 
 from dtable_events.app.config import SEATABLE_MYSQL_DB_CCNET_DB_NAME, INNER_DTABLE_WEB_SERVICE_URL, ORG_MEMBER_QUOTA_DEFAULT
 from dtable_events.app.event_redis import redis_cache
+from dtable_events.app.log import auto_rule_logger
 from dtable_events.automations.entities import AutomationResult
 from dtable_events.utils.dtable_web_api import DTableWebAPI
 
@@ -189,22 +190,129 @@ class AutomationsStatsManager:
         db_session.commit()
 
         # send reach warning
+        self.check_reach_warning(db_session, owner, org_id)
+
+        # send invalid warning
+        if auto_rule_result.is_valid == False:
+            self.send_invalid_notification(db_session, auto_rule_result)
+
+    def check_reach_warning(self, db_session, owner, org_id):
         if org_id == -1 and owner and '@seafile_group' not in owner:
             self.check_user_reach_warning(db_session, owner)
         elif org_id != -1:
             self.check_org_reach_warning(db_session, org_id)
 
-        # send invalid warning
-        if auto_rule_result.is_valid == False:
-            admins = get_dtable_admins(auto_rule_result.dtable_uuid, db_session)
-            invalid_type = auto_rule_result.invalid_type or ''
-            send_notification(auto_rule_result.dtable_uuid, [{
-                'to_user': user,
-                'msg_type': 'auto_rule_invalid',
-                'detail': {
-                    'author': 'Automation Rule',
-                    'rule_id': auto_rule_result.rule_id,
-                    'rule_name': auto_rule_result.rule_name,
-                    'invalid_type': invalid_type
-                }
-            } for user in admins])
+    def send_invalid_notification(self, db_session, auto_rule_result: AutomationResult):
+        admins = get_dtable_admins(auto_rule_result.dtable_uuid, db_session)
+        invalid_type = auto_rule_result.invalid_type or ''
+        send_notification(auto_rule_result.dtable_uuid, [{
+            'to_user': user,
+            'msg_type': 'auto_rule_invalid',
+            'detail': {
+                'author': 'Automation Rule',
+                'rule_id': auto_rule_result.rule_id,
+                'rule_name': auto_rule_result.rule_name,
+                'invalid_type': invalid_type
+            }
+        } for user in admins])
+
+    def update_stats_batch(self, db_session, auto_rule_results):
+        """
+        update stats of a batch of results with one statement per table and one commit,
+        results of the same rule / owner / org are aggregated in memory
+        """
+        insert_rule_log = '''
+            INSERT INTO auto_rules_task_log (trigger_time, success, rule_id, run_condition, dtable_uuid, org_id, owner, warnings) VALUES
+            (:trigger_time, :success, :rule_id, :run_condition, :dtable_uuid, :org_id, :owner, :warnings)
+        '''
+        statistic_sql_user = '''
+            INSERT INTO user_auto_rules_statistics (username, trigger_date, trigger_count, update_at) VALUES
+            (:username, :trigger_date, :trigger_count, :trigger_time)
+            ON DUPLICATE KEY UPDATE
+            trigger_count=trigger_count+VALUES(trigger_count),
+            update_at=VALUES(update_at)
+        '''
+        statistic_sql_org = '''
+            INSERT INTO org_auto_rules_statistics (org_id, trigger_date, trigger_count, update_at) VALUES
+            (:org_id, :trigger_date, :trigger_count, :trigger_time)
+            ON DUPLICATE KEY UPDATE
+            trigger_count=trigger_count+VALUES(trigger_count),
+            update_at=VALUES(update_at)
+        '''
+
+        rule_logs = []
+        rules_map = {}  # rule_id -> {trigger_time, is_valid, trigger_count}
+        users_map, orgs_map = {}, {}  # (username / org_id, trigger_date) -> {trigger_count, trigger_time}
+        for result in auto_rule_results:
+            rule_logs.append({
+                'trigger_time': result.trigger_time,
+                'success': 1 if result.success else 0,
+                'rule_id': result.rule_id,
+                'run_condition': result.run_condition,
+                'dtable_uuid': result.dtable_uuid,
+                'org_id': result.org_id,
+                'owner': result.owner,
+                'warnings': json.dumps(result.warnings) if result.warnings else None
+            })
+            if result.is_exceed_system_resource_limit:
+                continue
+            # the same as updating one by one, the last result decides is_valid
+            rule = rules_map.setdefault(result.rule_id, {'trigger_count': 0, 'trigger_time': result.trigger_time})
+            rule['trigger_count'] += 1
+            rule['trigger_time'] = result.trigger_time
+            rule['is_valid'] = result.is_valid
+            if not result.org_id:
+                continue
+            if result.org_id == -1:
+                if '@seafile_group' in result.owner:
+                    continue
+                stats = users_map.setdefault((result.owner, result.trigger_date), {'trigger_count': 0})
+            else:
+                stats = orgs_map.setdefault((result.org_id, result.trigger_date), {'trigger_count': 0})
+            stats['trigger_count'] += 1
+            stats['trigger_time'] = result.trigger_time
+
+        if rules_map:
+            params, time_cases, valid_cases, count_cases = {}, [], [], []
+            for index, (rule_id, rule) in enumerate(rules_map.items()):
+                params[f'rule_id_{index}'] = rule_id
+                params[f'trigger_time_{index}'] = rule['trigger_time']
+                params[f'is_valid_{index}'] = rule['is_valid']
+                params[f'trigger_count_{index}'] = rule['trigger_count']
+                time_cases.append(f'WHEN :rule_id_{index} THEN :trigger_time_{index}')
+                valid_cases.append(f'WHEN :rule_id_{index} THEN :is_valid_{index}')
+                count_cases.append(f'WHEN :rule_id_{index} THEN :trigger_count_{index}')
+            update_rules_sql = f'''
+                UPDATE dtable_automation_rules SET
+                last_trigger_time=CASE id {' '.join(time_cases)} END,
+                is_valid=CASE id {' '.join(valid_cases)} END,
+                trigger_count=trigger_count+CASE id {' '.join(count_cases)} END
+                WHERE id IN ({', '.join(f':rule_id_{index}' for index in range(len(rules_map)))})
+            '''
+            db_session.execute(text(update_rules_sql), params)
+        if rule_logs:
+            db_session.execute(text(insert_rule_log), rule_logs)
+        if users_map:
+            db_session.execute(text(statistic_sql_user), [
+                {'username': username, 'trigger_date': trigger_date, **stats}
+                for (username, trigger_date), stats in users_map.items()
+            ])
+        if orgs_map:
+            db_session.execute(text(statistic_sql_org), [
+                {'org_id': org_id, 'trigger_date': trigger_date, **stats}
+                for (org_id, trigger_date), stats in orgs_map.items()
+            ])
+        db_session.commit()
+
+        # stats are committed, failures of warnings should not make stats updated again
+        try:
+            # send reach warning once for each owner / org
+            for owner, org_id in {(result.owner, result.org_id) for result in auto_rule_results}:
+                self.check_reach_warning(db_session, owner, org_id)
+
+            # send invalid warning
+            for result in auto_rule_results:
+                if result.is_valid == False:
+                    self.send_invalid_notification(db_session, result)
+        except Exception as e:
+            auto_rule_logger.exception('Failed to send automation warnings: %s', e)
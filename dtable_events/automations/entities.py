@@ -22,9 +22,71 @@ QUEUE_AUTOMATION_TASKS_30 = 'automation_tasks_30'
 QUEUE_AUTOMATION_TASKS_DEFAULT = QUEUE_AUTOMATION_TASKS_20
 
 
+SUPPORTED_TRIGGER_CONDITIONS = (CONDITION_FILTERS_SATISFY, CONDITION_PERIODICALLY, CONDITION_ROWS_ADDED, CONDITION_PERIODICALLY_BY_CONDITION)
+ROWS_ADDED_OP_TYPES = frozenset(['insert_row', 'append_rows', 'insert_rows'])
+ROWS_MODIFIED_OP_TYPES = frozenset(['modify_row', 'modify_rows', 'add_link', 'update_links', 'update_rows_links', 'remove_link', 'move_group_rows'])
+
+HIGH_PRIORITY_ACTION_TYPES = [
+    'calculate_accumulated_value',
+    'calculate_delta',
+    'calculate_rank',
+    'calculate_percentage',
+    'lookup_and_copy',
+    'extract_user_name',
+    'convert_page_to_pdf',
+    'convert_document_to_pdf_and_send',
+    'run_ai'
+]
+
+
+class AutomationRule:
+    """
+    The parsed rule, everything that does not depend on the triggering event is computed once
+    and shared by all tasks generated from the rule.
+    """
+
+    def __init__(self, rule_id, run_condition, trigger, actions, dtable_uuid):
+        self.rule_id = rule_id
+        self.run_condition = run_condition
+        self.trigger = trigger
+        self.actions = actions
+        self.dtable_uuid = dtable_uuid
+        self.rule_name = trigger['rule_name']
+
+        condition = trigger.get('condition')
+        self.is_supported_condition = condition in SUPPORTED_TRIGGER_CONDITIONS
+        # op_types the event must have, None means any op_type
+        self.trigger_op_types = None
+        if condition == CONDITION_ROWS_ADDED:
+            self.trigger_op_types = ROWS_ADDED_OP_TYPES
+        elif condition in [CONDITION_FILTERS_SATISFY, CONDITION_ROWS_MODIFIED]:
+            self.trigger_op_types = ROWS_MODIFIED_OP_TYPES
+
+        self.priority_queue = QUEUE_AUTOMATION_TASKS_DEFAULT
+        for action in actions:
+            if action['type'] in HIGH_PRIORITY_ACTION_TYPES:
+                self.priority_queue = QUEUE_AUTOMATION_TASKS_10
+                break
+
+    def gen_task(self, org_id, owner, data, with_test, task_id=None):
+        return AutomationTask(
+            rule_id=self.rule_id,
+            run_condition=self.run_condition,
+            trigger=self.trigger,
+            actions=self.actions,
+            dtable_uuid=self.dtable_uuid,
+            org_id=org_id,
+            owner=owner,
+            data=data,
+            with_test=with_test,
+            task_id=task_id,
+            rule=self
+        )
+
+
 class AutomationTask:
 
-    def __init__(self, rule_id, run_condition, trigger, actions, dtable_uuid, org_id, owner, data, with_test, task_id=None):
+    def __init__(self, rule_id, run_condition, trigger, actions, dtable_uuid, org_id, owner, data, with_test, task_id=None, rule=None):
         self.rule_id = rule_id
         self.run_condition = run_condition
         self.trigger = trigger
@@ -37,23 +99,20 @@ class AutomationTask:
         self.with_test = with_test
         self.task_id = task_id
         self.warnings = []
+        self.rule = rule or AutomationRule(rule_id, run_condition, trigger, actions, dtable_uuid)
 
     def to_dict(self):
-        return {key: value for key, value in self.__dict__.items() if key not in ['trigger', 'actions']}
+        return {key: value for key, value in self.__dict__.items() if key not in ['trigger', 'actions', 'rule']}
 
     def append_warning(self, warning):
         self.warnings.append(warning)
 
     def can_do_actions(self):
-        if self.trigger.get('condition') not in (CONDITION_FILTERS_SATISFY, CONDITION_PERIODICALLY, CONDITION_ROWS_ADDED, CONDITION_PERIODICALLY_BY_CONDITION):
+        if not self.rule.is_supported_condition:
             return False
 
-        if self.trigger.get('condition') == CONDITION_ROWS_ADDED:
-            if self.data.get('op_type') not in ['insert_row', 'append_rows', 'insert_rows']:
-                return False
-
-        if self.trigger.get('condition') in [CONDITION_FILTERS_SATISFY, CONDITION_ROWS_MODIFIED]:
-            if self.data.get('op_type') not in ['modify_row', 'modify_rows', 'add_link', 'update_links', 'update_rows_links', 'remove_link', 'move_group_rows']:
+        if self.rule.trigger_op_types is not None:
+            if self.data.get('op_type') not in self.rule.trigger_op_types:
                 return False
 
         if self.run_condition == PER_UPDATE:
@@ -85,20 +144,7 @@ class AutomationTask:
     def get_priority_queue(self):
         if self.with_test:
             return QUEUE_AUTOMATION_TASKS_30
-        for action in self.actions:
-            if action['type'] in [
-                'calculate_accumulated_value',
-                'calculate_delta',
-                'calculate_rank',
-                'calculate_percentage',
-                'lookup_and_copy',
-                'extract_user_name',
-                'convert_page_to_pdf',
-                'convert_document_to_pdf_and_send',
-                'run_ai'
-            ]:
-                return QUEUE_AUTOMATION_TASKS_10
-        return QUEUE_AUTOMATION_TASKS_DEFAULT
+        return self.rule.priority_queue
 
 
 @dataclass
@@ -21,6 +21,7 @@ from dtable_events.utils.dtable_server_api import DTableServerAPI, NotFoundExcep
 from dtable_events.utils.dtable_web_api import DTableWebAPI
 from dtable_events.utils.dtable_db_api import DTableDBAPI
 from dtable_events.utils.sql_generator import filter2sql
+from dtable_events.utils.utils_metadata_cache import get_metadata
 from dtable_events.utils.email_sender import EmailSender
 
 
@@ -153,7 +154,7 @@ class BaseContext:
         if self._dtable_metadata:
             return self._dtable_metadata
         try:
-            self._dtable_metadata = self.dtable_server_api.get_metadata()
+            self._dtable_metadata = get_metadata(self.dtable_uuid)
         except NotFoundException:
             raise MetadataInvalid('dtable: %s metadata not found' % self.dtable_uuid)
         if not self._dtable_metadata:
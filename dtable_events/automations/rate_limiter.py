@@ -0,0 +1,294 @@
+import time
+from abc import ABC, abstractmethod
+from threading import Lock, Thread
+
+from dtable_events.app.event_redis import RedisClient
+from dtable_events.app.log import auto_rule_logger
+from dtable_events.utils.utils_metric import publish_metric, AUTOMATION_RATE_LIMIT_MAX_USAGE_METRIC_HELP, \
+    AUTOMATION_RATE_LIMIT_LIMITED_COUNT_METRIC_HELP, AUTOMATION_RATE_LIMIT_OVER_LIMIT_COUNT_METRIC_HELP
+
+RATE_LIMIT_BACKEND_LOCAL = 'local'
+RATE_LIMIT_BACKEND_REDIS = 'redis'
+RATE_LIMIT_BACKEND_REDIS_APPROXIMATE = 'redis_approximate'
+
+RATE_LIMIT_KEY_PREFIX = 'automation_rate_limit'
+
+# KEYS[1]: limit key
+# ARGV[1]: current bucket index, ARGV[2]: run time, ARGV[3]: buckets count, ARGV[4]: key expire (ms)
+# add run time to current bucket, drop buckets out of the window and return the total in the window
+RECORD_TIME_SCRIPT = '''
+local current = tonumber(ARGV[1])
+local buckets = tonumber(ARGV[3])
+if tonumber(ARGV[2]) > 0 then
+    redis.call('HINCRBYFLOAT', KEYS[1], ARGV[1], ARGV[2])
+end
+local total = 0
+local items = redis.call('HGETALL', KEYS[1])
+for i = 1, #items, 2 do
+    if tonumber(items[i]) <= current - buckets then
+        redis.call('HDEL', KEYS[1], items[i])
+    else
+        total = total + tonumber(items[i + 1])
+    end
+end
+if total > 0 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[4])
+end
+return tostring(total)
+'''
+
+# KEYS[1]: limit key
+# ARGV[1]: current bucket index, ARGV[2]: buckets count
+USAGE_SCRIPT = '''
+local current = tonumber(ARGV[1])
+local buckets = tonumber(ARGV[2])
+local total = 0
+local items = redis.call('HGETALL', KEYS[1])
+for i = 1, #items, 2 do
+    if tonumber(items[i]) > current - buckets then
+        total = total + tonumber(items[i + 1])
+    end
+end
+return tostring(total)
+'''
+
+
+class RateLimiter(ABC):
+    """
+    Limit the run time of automations per org (or owner if not in org) in a sliding window.
+
+    The window is split into `buckets` buckets, run time is recorded into the bucket of now and
+    buckets older than the window are dropped, so the window slides with the bucket's granularity.
+    Subclasses implement `get_usage` and `_record` to store buckets.
+    """
+
+    def __init__(self, window_secs=60 * 5, percent=0.25, buckets=10):
+        self.window_secs = window_secs
+        self.percent = percent
+        self.buckets = buckets
+
+        # metrics
+        self.limited_count = 0
+        self._recent_percents = {}  # limit_key -> percent, latest percents since last metrics publish
+        self._recent_percents_lock = Lock()
+
+    @property
+    def bucket_secs(self):
+        return self.window_secs / self.buckets
+
+    def get_bucket_index(self, now=None):
+        if now is None:
+            now = time.time()
+        return int(now // self.bucket_secs)
+
+    def get_key(self, owner, org_id):
+        if org_id and org_id != -1:
+            return org_id
+        else:
+            return owner
+
+    def is_exempt(self, limit_key):
+        return isinstance(limit_key, str) and '@seafile_group' in limit_key
+
+    @abstractmethod
+    def get_usage(self, limit_key):
+        """return run time (seconds) of limit_key in current window"""
+
+    @abstractmethod
+    def _record(self, limit_key, run_time): ...
+
+    def _get_percent(self, limit_key, workers):
+        percent = self.get_usage(limit_key) / (self.window_secs * workers)
+        with self._recent_percents_lock:
+            self._recent_percents[limit_key] = percent
+        return percent
+
+    def is_allowed(self, owner, org_id, workers):
+        limit_key = self.get_key(owner, org_id)
+        if self.is_exempt(limit_key):
+            return True
+        try:
+            percent = self._get_percent(limit_key, workers)
+        except Exception as e:
+            # not to block automations when limiter backend is unavailable
+            auto_rule_logger.warning('Failed to get automation usage of %s: %s', limit_key, e)
+            return True
+        auto_rule_logger.debug('owner %s org_id %s usage percent %s', owner, org_id, percent)
+        if percent > self.percent:
+            self.limited_count += 1
+            return False
+        return True
+
+    def record_time(self, owner, org_id, run_time):
+        limit_key = self.get_key(owner, org_id)
+        if self.is_exempt(limit_key):
+            return
+        try:
+            self._record(limit_key, run_time)
+        except Exception as e:
+            auto_rule_logger.warning('Failed to record automation run time of %s: %s', limit_key, e)
+
+    def get_percent(self, owner, org_id, workers):
+        limit_key = self.get_key(owner, org_id)
+        try:
+            return self._get_percent(limit_key, workers)
+        except Exception as e:
+            auto_rule_logger.warning('Failed to get automation usage of %s: %s', limit_key, e)
+            return 0
+
+    def start(self):
+        pass
+
+    def publish_metrics(self):
+        with self._recent_percents_lock:
+            percents, self._recent_percents = self._recent_percents, {}
+        max_percent = max(percents.values()) if percents else 0
+        over_limit_count = len([percent for percent in percents.values() if percent > self.percent])
+        publish_metric(round(max_percent, 4), 'automation_rate_limit_max_usage_percent', AUTOMATION_RATE_LIMIT_MAX_USAGE_METRIC_HELP)
+        publish_metric(over_limit_count, 'automation_rate_limit_over_limit_count', AUTOMATION_RATE_LIMIT_OVER_LIMIT_COUNT_METRIC_HELP)
+        publish_metric(self.limited_count, 'automation_rate_limit_limited_count', AUTOMATION_RATE_LIMIT_LIMITED_COUNT_METRIC_HELP)
+
+
+class LocalRateLimiter(RateLimiter):
+    """in-process sliding window, not shared between nodes"""
+
+    def __init__(self, window_secs=60 * 5, percent=0.25, buckets=10):
+        super().__init__(window_secs=window_secs, percent=percent, buckets=buckets)
+        self.counters = {}  # limit_key -> {bucket_index: run_time}
+        self.counters_lock = Lock()
+        self._last_prune_index = None
+
+    def _prune(self, current):
+        for limit_key in list(self.counters):
+            counter = self.counters[limit_key]
+            for index in [index for index in counter if index <= current - self.buckets]:
+                del counter[index]
+            if not counter:
+                del self.counters[limit_key]
+
+    def get_usage(self, limit_key):
+        current = self.get_bucket_index()
+        with self.counters_lock:
+            counter = self.counters.get(limit_key) or {}
+            return sum(run_time for index, run_time in counter.items() if index > current - self.buckets)
+
+    def _record(self, limit_key, run_time):
+        current = self.get_bucket_index()
+        with self.counters_lock:
+            counter = self.counters.setdefault(limit_key, {})
+            counter[current] = counter.get(current, 0) + run_time
+            # prune once per bucket
+            if current != self._last_prune_index:
+                self._prune(current)
+                self._last_prune_index = current
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Sliding window stored in redis hashes, shared by all dtable-events nodes.
+
+    Each limit key is a hash of bucket index -> run time, updated atomically by lua scripts.
+    Bucket index is computed by nodes' clock, so nodes are supposed to be time synchronized.
+    """
+
+    def __init__(self, window_secs=60 * 5, percent=0.25, buckets=10, redis_client=None):
+        super().__init__(window_secs=window_secs, percent=percent, buckets=buckets)
+        self._redis_client = redis_client or RedisClient(socket_connect_timeout=5, socket_timeout=5,
+                                                         health_check_interval=30, retry_on_timeout=True)
+        self._record_script = self._redis_client.register_script(RECORD_TIME_SCRIPT)
+        self._usage_script = self._redis_client.register_script(USAGE_SCRIPT)
+
+    def get_redis_key(self, limit_key):
+        return f'{RATE_LIMIT_KEY_PREFIX}:{limit_key}'
+
+    @property
+    def expire_ms(self):
+        return int((self.window_secs + self.bucket_secs) * 1000)
+
+    def get_usage(self, limit_key):
+        usage = self._usage_script(keys=[self.get_redis_key(limit_key)],
+                                   args=[self.get_bucket_index(), self.buckets])
+        return float(usage)
+
+    def _record(self, limit_key, run_time):
+        self._record_script(keys=[self.get_redis_key(limit_key)],
+                            args=[self.get_bucket_index(), run_time, self.buckets, self.expire_ms])
+
+
+class ApproximateRedisRateLimiter(RedisRateLimiter):
+    """
+    Redis sliding window without a redis round trip per event.
+
+    Run times are accumulated locally and usages are checked against a local copy, a background
+    thread flushes accumulated run times to redis and reloads usages of active keys every `sync_interval`
+    seconds, so limits of all nodes are reconciled with the delay of `sync_interval`.
+    """
+
+    def __init__(self, window_secs=60 * 5, percent=0.25, buckets=10, redis_client=None, sync_interval=5):
+        super().__init__(window_secs=window_secs, percent=percent, buckets=buckets, redis_client=redis_client)
+        self.sync_interval = sync_interval
+        self._lock = Lock()
+        self._pending = {}  # limit_key -> run time not flushed to redis
+        self._usages = {}  # limit_key -> (usage in redis, last access time)
+
+    def get_usage(self, limit_key):
+        with self._lock:
+            usage, _ = self._usages.get(limit_key, (0, None))
+            self._usages[limit_key] = (usage, time.time())
+            return usage + self._pending.get(limit_key, 0)
+
+    def _record(self, limit_key, run_time):
+        with self._lock:
+            self._pending[limit_key] = self._pending.get(limit_key, 0) + run_time
+
+    def sync(self):
+        now = time.time()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            # keys not accessed in a window are not used any more
+            limit_keys = set(pending) | {limit_key for limit_key, (_, accessed_at) in self._usages.items()
+                                         if accessed_at and now - accessed_at < self.window_secs}
+        if not limit_keys:
+            with self._lock:
+                self._usages = {}
+            return
+        limit_keys = list(limit_keys)
+        current = self.get_bucket_index(now)
+        try:
+            pipeline = self._redis_client.pipeline()
+            for limit_key in limit_keys:
+                self._record_script(keys=[self.get_redis_key(limit_key)],
+                                    args=[current, pending.get(limit_key, 0), self.buckets, self.expire_ms],
+                                    client=pipeline)
+            usages = pipeline.execute()
+        except Exception as e:
+            auto_rule_logger.warning('Failed to sync automation rate limit usages: %s', e)
+            # keep run times to flush next time
+            with self._lock:
+                for limit_key, run_time in pending.items():
+                    self._pending[limit_key] = self._pending.get(limit_key, 0) + run_time
+            return
+        with self._lock:
+            self._usages = {limit_key: (float(usage), self._usages.get(limit_key, (0, now))[1])
+                            for limit_key, usage in zip(limit_keys, usages)}
+
+    def sync_periodically(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                auto_rule_logger.exception('Failed to sync automation rate limit: %s', e)
+
+    def start(self):
+        Thread(target=self.sync_periodically, daemon=True, name='automation-rate-limit-sync').start()
+
+
+def get_rate_limiter(backend, window_secs=60 * 5, percent=0.25, sync_interval=5):
+    if backend == RATE_LIMIT_BACKEND_REDIS:
+        return RedisRateLimiter(window_secs=window_secs, percent=percent)
+    if backend == RATE_LIMIT_BACKEND_REDIS_APPROXIMATE:
+        return ApproximateRedisRateLimiter(window_secs=window_secs, percent=percent, sync_interval=sync_interval)
+    if backend != RATE_LIMIT_BACKEND_LOCAL:
+        auto_rule_logger.warning('Unknown automation rate limit backend %s, use %s', backend, RATE_LIMIT_BACKEND_LOCAL)
+    return LocalRateLimiter(window_secs=window_secs, percent=percent)
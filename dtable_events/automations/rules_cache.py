@@ -0,0 +1,66 @@
+import json
+
+from sqlalchemy import text
+
+from dtable_events.app.log import auto_rule_logger
+from dtable_events.automations.entities import AutomationRule
+from dtable_events.utils.lru_cache import LRUCache
+
+
+class AutomationRulesCache:
+    """
+    Cache parsed rules (AutomationRule) keyed by rule_id, with run_condition, trigger and actions they are parsed from.
+
+    Rules are checked against the database whenever they are got: rules not valid or paused are not returned, rules
+    edited are parsed again, so only parsing is saved and changes take effect at once.
+    """
+
+    def __init__(self, maxsize=10000, timeout=60 * 60):
+        self._cache = LRUCache('automation_rules', maxsize=maxsize, ttl=timeout)
+
+    def _load_rules(self, db_session, rule_ids):
+        sql = '''
+            SELECT `id`, `run_condition`, `trigger`, `actions`, `dtable_uuid` FROM dtable_automation_rules
+            WHERE id IN :rule_ids AND is_valid=1 AND is_pause=0
+        '''
+        rules = {}
+        for row in db_session.execute(text(sql), {'rule_ids': list(rule_ids)}):
+            source = (row.run_condition, row.trigger, row.actions, row.dtable_uuid)
+            cached = self._cache.get(row.id)
+            if cached and cached[0] == source:
+                rules[row.id] = cached[1]
+                continue
+            try:
+                rule = AutomationRule(
+                    rule_id=row.id,
+                    run_condition=row.run_condition,
+                    trigger=json.loads(row.trigger),
+                    actions=json.loads(row.actions),
+                    dtable_uuid=row.dtable_uuid
+                )
+            except Exception as e:
+                auto_rule_logger.warning('Failed to parse automation rule %s: %s', row.id, e)
+                continue
+            self._cache.set(row.id, (source, rule))
+            rules[row.id] = rule
+        for rule_id in rule_ids:
+            if rule_id not in rules:
+                self._cache.delete(rule_id)
+        return rules
+
+    def get_rule(self, db_session, rule_id):
+        """return AutomationRule or None if the rule is not valid or paused"""
+        rule_id = int(rule_id)
+        return self._load_rules(db_session, [rule_id]).get(rule_id)
+
+    def get_rules(self, db_session, rule_ids):
+        """return a dict of rule_id -> AutomationRule, rules not valid or paused are not included"""
+        rules = {}
+        rule_ids = list(set(int(rule_id) for rule_id in rule_ids))
+        step = 1000
+        for i in range(0, len(rule_ids), step):
+            rules.update(self._load_rules(db_session, rule_ids[i: i+step]))
+        return rules
+
+    def invalidate(self, rule_id):
+        self._cache.delete(rule_id)
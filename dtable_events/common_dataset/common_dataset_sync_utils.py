@@ -1,15 +1,23 @@
 # -*- coding: utf-8 -*-
 import logging
 import re
+import time
 import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from copy import deepcopy
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from threading import BoundedSemaphore, Lock
 
 from sqlalchemy import text
 from dateutil import parser
 
-from dtable_events.app.config import INNER_DTABLE_DB_URL, INNER_DTABLE_SERVER_URL
+from dtable_events.app.config import INNER_DTABLE_DB_URL, INNER_DTABLE_SERVER_URL, COMMON_DATASET_INCREMENTAL_SYNC_ENABLED, \
+    COMMON_DATASET_FULL_SYNC_INTERVAL, COMMON_DATASET_ROW_HASH_ENABLED, COMMON_DATASET_SYNC_CONCURRENCY, \
+    COMMON_DATASET_SYNC_PER_DST_CONCURRENCY
 from dtable_events.app.log import setup_logger
+from dtable_events.common_dataset.sync_watermark import get_sync_fingerprint, is_incremental_syncable, load_sync_watermark, \
+    save_sync_watermark, delete_sync_watermark, get_row_hash, load_sync_row_hashes, save_sync_row_hashes, delete_sync_row_hashes
 from dtable_events.utils import uuid_str_to_36_chars, uuid_str_to_32_chars
 from dtable_events.utils.constants import ColumnTypes
 from dtable_events.utils.dtable_server_api import BaseExceedsException, DTableServerAPI
@@ -22,6 +30,7 @@ SRC_ROWS_LIMIT = 50000
 INSERT_UPDATE_ROWS_LIMIT = 1000
 DELETE_ROWS_LIMIT = 10000
 INVALID_WARNING_ROWS = 10
+WATERMARK_MTIME_OVERLAP = 60
 
 
 DATA_NEED_KEY_VALUES = {
@@ -841,17 +850,15 @@ def delete_dst_rows(dst_dtable_uuid, dst_table_name, to_be_deleted_row_ids, dst_
             cds_logger.error('sync dataset delete rows dst dtable: %s dst table: %s error: %s', dst_dtable_uuid, dst_table_name, e)
 
 
-def get_dataset_data(dataset_id, src_dtable_uuid, src_table, src_view_id, server_only=True):
+def gen_src_view_sql_clauses(src_dtable_uuid, src_table, src_view_id):
     """
-    :return: dataset_data -> dict or None, error_body -> dict or None
+    :return: src_view, src_columns, filter_clause, sort_clause, error_body -> dict or None
     """
-    src_dtable_db_api = DTableDBAPI('dtable-events', src_dtable_uuid, INNER_DTABLE_DB_URL)
-    # fetch all src view rows id
     try:
         src_view = [view for view in src_table['views'] if view['_id'] == src_view_id][0]
     except IndexError:
         cds_logger.warning("src view %s not found" % src_view_id)
-        return None, {
+        return None, None, None, None, {
             'dst_table_id': None,
             'error_msg': 'view %s not found' % src_view_id,
             'task_status_code': 404
@@ -870,7 +877,7 @@ def get_dataset_data(dataset_id, src_dtable_uuid, src_table, src_view_id, server
         sort_clause = sql_generator._sort2sql()
     except ColumnFilterInvalidError as e:
         cds_logger.warning('src dtable: %s src table: %s src view: %s filter_conditions: %s to sql ColumnFilterInvalidError: %s', src_dtable_uuid, src_table['name'], src_view['_id'], filter_conditions, e)
-        return None, {
+        return None, None, None, None, {
             'dst_table_id': None,
             'error_msg': 'generate src view sql error: %s' % e,
             'error_type': 'wrong_filter_in_filters',
@@ -878,7 +885,7 @@ def get_dataset_data(dataset_id, src_dtable_uuid, src_table, src_view_id, server
         }
     except SQLGeneratorOptionInvalidError as e:
         cds_logger.warning('src dtable: %s src table: %s src view: %s filter_conditions: %s to sql option invalid error: %s', src_dtable_uuid, src_table['name'], src_view['_id'], filter_conditions, e)
-        return None, {
+        return None, None, None, None, {
             'dst_table_id': None,
             'error_msg': 'generate src view sql error: %s' % e,
             'error_type': 'wrong_filter_in_filters',
@@ -886,43 +893,159 @@ def get_dataset_data(dataset_id, src_dtable_uuid, src_table, src_view_id, server
         }
     except Exception as e:
         cds_logger.exception('src dtable: %s src table: %s src view: %s filter_conditions: %s to sql error: %s', src_dtable_uuid, src_table['name'], src_view['_id'], filter_conditions, e)
-        return None, {
+        return None, None, None, None, {
             'dst_table_id': None,
             'error_msg': 'generate src view sql error: %s' % e,
             'task_status_code': 500
         }
+    return src_view, src_columns, filter_clause or '', sort_clause or '', None
+
+
+def get_dataset_data(dataset_id, src_dtable_uuid, src_table, src_view_id, server_only=True, only_id=False):
+    """
+    :param only_id: only fetch rows id
+    :return: dataset_data -> dict or None, error_body -> dict or None
+    """
+    src_view, src_columns, filter_clause, sort_clause, error = gen_src_view_sql_clauses(src_dtable_uuid, src_table, src_view_id)
+    if error:
+        return None, error
+    src_dtable_db_api = DTableDBAPI('dtable-events', src_dtable_uuid, INNER_DTABLE_DB_URL)
     rows_id_list, rows_dict = list(), dict()
-    src_columns_str = ', '.join(map(lambda col: f"`{col['name']}`", src_columns))
-    sql_template = f"SELECT `_id`, {src_columns_str} FROM `{src_table['name']}` {filter_clause or ''} {sort_clause or ''}"
-    start, step = 0, 10000
-    while True:
-        sql = f"{sql_template} LIMIT {start}, {step}"
-        cds_logger.debug('fetch src dtable: %s table: %s view: %s sql: %s', src_dtable_uuid, src_table['name'], src_view['_id'], sql[:200])
-        try:
-            rows, _ = src_dtable_db_api.query(sql, convert=False, server_only=server_only)
-        except Exception as e:
-            cds_logger.error('fetch src dtable: %s table: %s view: %s sql: %s error: %s', src_dtable_uuid, src_table['name'], src_view['_id'], sql[:200], e)
-            return None, {
-                'dst_table_id': None,
-                'error_msg': 'fetch src rows id error: %s' % e,
-                'task_status_code': 500
-            }
-        for row in rows:
-            if row['_id'] in rows_dict:
-                continue
-            rows_dict[row['_id']] = row
-            rows_id_list.append(row['_id'])
-            if len(rows_id_list) >= SRC_ROWS_LIMIT:
-                break
-        cds_logger.info('dataset_id: %s src_dtable_uuid: %s src_table_id: %s src_view_id: %s fetched rows: %s', dataset_id, src_dtable_uuid, src_table['_id'], src_view_id, len(rows_id_list))
-        if len(rows) < step or len(rows_id_list) >= SRC_ROWS_LIMIT:
-            break
-        start += step
+    if only_id:
+        src_column_names = ['_id']
+    else:
+        src_column_names = ['_id', '_mtime'] + [col['name'] for col in src_columns]
+    cds_logger.debug('fetch src dtable: %s table: %s view: %s filter: %s sort: %s', src_dtable_uuid, src_table['name'], src_view['_id'], filter_clause[:200], sort_clause)
+    try:
+        for rows, _ in src_dtable_db_api.iter_pages(src_table['name'], src_column_names, filter_clause=filter_clause,
+                                                     sort_clause=sort_clause, page_size=10000, limit=SRC_ROWS_LIMIT,
+                                                     convert=False, server_only=server_only):
+            for row in rows:
+                if row['_id'] in rows_dict:
+                    continue
+                rows_dict[row['_id']] = row
+                rows_id_list.append(row['_id'])
+            cds_logger.info('dataset_id: %s src_dtable_uuid: %s src_table_id: %s src_view_id: %s fetched rows: %s', dataset_id, src_dtable_uuid, src_table['_id'], src_view_id, len(rows_id_list))
+    except Exception as e:
+        cds_logger.error('fetch src dtable: %s table: %s view: %s filter: %s sort: %s error: %s', src_dtable_uuid, src_table['name'], src_view['_id'], filter_clause[:200], sort_clause, e)
+        return None, {
+            'dst_table_id': None,
+            'error_msg': 'fetch src rows id error: %s' % e,
+            'task_status_code': 500
+        }
     cds_logger.info('dataset_id: %s src_dtable_uuid: %s src_table_id: %s src_view_id: %s fetched rows: %s totally', dataset_id, src_dtable_uuid, src_table['_id'], src_view_id, len(rows_id_list))
-    dataset_data = {'rows_id_list': rows_id_list, 'rows_dict': rows_dict}
+    dataset_data = {'rows_id_list': rows_id_list, 'rows_dict': rows_dict, 'max_mtime': get_max_mtime(rows_dict.values())}
     return dataset_data, None
 
 
+def get_max_mtime(rows, max_mtime=None):
+    # `_mtime`s from dtable-db are in the same iso format, comparable as strings
+    mtimes = [row['_mtime'] for row in rows if row.get('_mtime')]
+    if max_mtime:
+        mtimes.append(max_mtime)
+    return max(mtimes) if mtimes else None
+
+
+def get_dataset_incremental_data(dataset_id, src_dtable_uuid, src_table, src_view_id, src_rows_id_list, watermark, server_only=True):
+    """
+    fetch src view rows modified since the watermark and rows come into the view since last sync, e.g. by a filter of time
+
+    :param src_rows_id_list: current rows id of src view
+    :return: dataset_data -> dict or None, error_body -> dict or None
+    """
+    src_view, src_columns, filter_clause, _, error = gen_src_view_sql_clauses(src_dtable_uuid, src_table, src_view_id)
+    if error:
+        return None, error
+    src_dtable_db_api = DTableDBAPI('dtable-events', src_dtable_uuid, INNER_DTABLE_DB_URL)
+    src_column_names = ['_id', '_mtime'] + [col['name'] for col in src_columns]
+    src_rows_id_set = set(src_rows_id_list)
+    synced_rows_ids = watermark['rows_ids']
+    rows_dict = dict()
+    try:
+        if watermark['mtime']:
+            # rows being modified when last sync may be committed with a little earlier `_mtime`
+            since = (parser.isoparse(watermark['mtime']) - timedelta(seconds=WATERMARK_MTIME_OVERLAP)).isoformat()
+            condition = filter_clause[len('WHERE '):] if filter_clause else ''
+            if condition:
+                modified_filter_clause = f"WHERE ({condition}) AND _mtime >= '{since}'"
+            else:
+                modified_filter_clause = f"WHERE _mtime >= '{since}'"
+            for rows, _ in src_dtable_db_api.iter_pages(src_table['name'], src_column_names, filter_clause=modified_filter_clause,
+                                                         page_size=10000, limit=SRC_ROWS_LIMIT, convert=False, server_only=server_only):
+                rows_dict.update({row['_id']: row for row in rows if row['_id'] in src_rows_id_set})
+
+        come_in_rows_id_list = [row_id for row_id in src_rows_id_list if row_id not in synced_rows_ids and row_id not in rows_dict]
+        step = INSERT_UPDATE_ROWS_LIMIT
+        for i in range(0, len(come_in_rows_id_list), step):
+            rows_id_str = ', '.join(["'%s'" % row_id for row_id in come_in_rows_id_list[i: i+step]])
+            for rows, _ in src_dtable_db_api.iter_pages(src_table['name'], src_column_names, filter_clause=f"WHERE _id IN ({rows_id_str})",
+                                                         page_size=step, convert=False, server_only=server_only, seek=True):
+                rows_dict.update({row['_id']: row for row in rows})
+    except Exception as e:
+        cds_logger.error('fetch src dtable: %s table: %s view: %s modified rows error: %s', src_dtable_uuid, src_table['name'], src_view['_id'], e)
+        return None, {
+            'dst_table_id': None,
+            'error_msg': 'fetch src modified rows error: %s' % e,
+            'task_status_code': 500
+        }
+    cds_logger.info('dataset_id: %s src_dtable_uuid: %s src_table_id: %s src_view_id: %s fetched modified rows: %s since: %s', dataset_id, src_dtable_uuid, src_table['_id'], src_view_id, len(rows_dict), watermark['mtime'])
+    dataset_data = {
+        'rows_id_list': src_rows_id_list,
+        'rows_dict': rows_dict,
+        'max_mtime': get_max_mtime(rows_dict.values(), watermark['mtime']),
+        'synced_rows_ids': synced_rows_ids,
+        'full_synced_at': watermark['full_synced_at']
+    }
+    return dataset_data, None
+
+
+def is_sync_watermark_usable(watermark, src_table, src_view_id, dst_dtable_uuid, dst_table_id, dst_table_name):
+    """whether a sync can be incremental from the watermark, otherwise a full sync is needed"""
+    if not watermark:
+        return False
+    src_view = next((view for view in src_table['views'] if view['_id'] == src_view_id), None)
+    if not src_view or not is_incremental_syncable(src_table, src_view):
+        return False
+    if watermark['fingerprint'] != get_sync_fingerprint(src_table, src_view, dst_table_id):
+        cds_logger.info('dst_dtable_uuid: %s dst_table_id: %s src view or columns changed, need full sync', dst_dtable_uuid, dst_table_id)
+        return False
+    if time.time() - watermark['full_synced_at'] > COMMON_DATASET_FULL_SYNC_INTERVAL:
+        return False
+    # dst rows may be changed by others
+    dst_dtable_db_api = DTableDBAPI('dtable-events', dst_dtable_uuid, INNER_DTABLE_DB_URL)
+    try:
+        result, _ = dst_dtable_db_api.query(f"SELECT COUNT(*) AS total_count FROM `{dst_table_name}`", server_only=True)
+    except Exception as e:
+        cds_logger.warning('dst_dtable_uuid: %s dst_table_id: %s count rows error: %s', dst_dtable_uuid, dst_table_id, e)
+        return False
+    if result[0].get('total_count') != len(watermark['rows_ids']):
+        cds_logger.info('dst_dtable_uuid: %s dst_table_id: %s rows changed since last sync, need full sync', dst_dtable_uuid, dst_table_id)
+        return False
+    return True
+
+
+def load_trusted_row_hashes(dataset_sync_id, dst_dtable_db_api, dst_table_name):
+    """
+    load row hashes of last sync, without rows modified in dst table since then, which need to be compared again
+
+    :return: row_hashes -> dict {row_id: hash}
+    """
+    row_hashes_record = load_sync_row_hashes(dataset_sync_id)
+    if not row_hashes_record:
+        return {}
+    row_hashes = row_hashes_record['hashes']
+    filter_clause = f"WHERE _mtime > '{row_hashes_record['synced_at']}'"
+    try:
+        for rows, _ in dst_dtable_db_api.iter_pages(dst_table_name, ['_id'], filter_clause=filter_clause, page_size=10000,
+                                                     convert=False, server_only=True, seek=True):
+            for row in rows:
+                row_hashes.pop(row['_id'], None)
+    except Exception as e:
+        cds_logger.warning('fetch dst table: %s modified rows error: %s', dst_table_name, e)
+        return {}
+    return row_hashes
+
+
 def _import_sync_CDS(context):
     """
     fetch src/dst rows id, find need append/update/delete rows
@@ -949,6 +1072,11 @@ def _import_sync_CDS(context):
 
     is_sync = bool(dst_table_id)
 
+    dataset_sync_id = context.get('dataset_sync_id')
+    use_row_hashes = COMMON_DATASET_ROW_HASH_ENABLED and bool(dataset_sync_id)
+    # dst rows modified after this time are not trusted by row hashes next sync
+    synced_at = datetime.now(timezone.utc).isoformat()
+
     # create dst table or update dst table columns
     # fetch all src view rows id, S
     # fetch all dst table rows id, D
@@ -981,28 +1109,27 @@ def _import_sync_CDS(context):
 
     # fetch all dst table rows id
     dst_rows_id_set = set()
-    start, step = 0, 10000
-    while is_sync and True:
-        sql = f"SELECT `_id` FROM `{dst_table_name}` LIMIT {start}, {step}"
-        cds_logger.debug('fetch dst rows-id sql: %s', sql[:200])
+    if is_sync and dataset_data.get('synced_rows_ids') is not None:
+        # incremental sync, dst rows are the rows synced last time
+        dst_rows_id_set = set(dataset_data['synced_rows_ids'])
+    elif is_sync:
         try:
-            rows, _ = dst_dtable_db_api.query(sql, convert=False, server_only=True)
+            for rows, _ in dst_dtable_db_api.iter_pages(dst_table_name, ['_id'], page_size=10000, convert=False, server_only=True,
+                                                        seek=True):
+                dst_rows_id_set |= {row['_id'] for row in rows}
         except Exception as e:
-            cds_logger.error('fetch dst rows id sql: %s error: %s', sql[:200], e)
+            cds_logger.error('fetch dst dtable: %s table: %s rows id error: %s', dst_dtable_uuid, dst_table_name, e)
             return {
                 'dst_table_id': None,
                 'error_msg': 'fetch dst rows id error: %s' % e,
                 'task_status_code': 500
             }
-        dst_rows_id_set |= {row['_id'] for row in rows}
-        if len(rows) < step:
-            break
-        start += step
 
     # calc to-be-appended-rows-id, to-be-updated-rows-id, to-be-deleted-rows-id
+    # rows_dict is all src rows for a full sync, or only modified rows for an incremental sync
     to_be_appended_rows_id_set = dataset_data['rows_dict'].keys() - dst_rows_id_set
     to_be_updated_rows_id_set = dataset_data['rows_dict'].keys() & dst_rows_id_set
-    to_be_deleted_rows_id_set = dst_rows_id_set - dataset_data['rows_dict'].keys()
+    to_be_deleted_rows_id_set = dst_rows_id_set - set(dataset_data['rows_id_list'])
     cds_logger.debug('to_be_appended_rows_id_set: %s, to_be_updated_rows_id_set: %s, to_be_deleted_rows_id_set: %s', len(to_be_appended_rows_id_set), len(to_be_updated_rows_id_set), len(to_be_deleted_rows_id_set))
     stats_info['to_be_appended_rows_count'] = len(to_be_appended_rows_id_set)
     stats_info['to_be_updated_rows_count'] = len(to_be_updated_rows_id_set)
@@ -1016,8 +1143,23 @@ def _import_sync_CDS(context):
 
     rows_invalid_infos = []
 
+    # skip rows whose synced cells are the same as last sync
+    final_columns_dict = {col['key']: col for col in final_columns}
+    row_hashes, new_row_hashes = {}, {}
+    if use_row_hashes and is_sync:
+        row_hashes = load_trusted_row_hashes(dataset_sync_id, dst_dtable_db_api, dst_table_name)
+    if use_row_hashes:
+        to_be_updated_rows_id_list = []
+        for row_id in to_be_updated_rows_id_set:
+            synced_row, _ = generate_single_row(dataset_data['rows_dict'][row_id], src_columns, final_columns_dict)
+            new_row_hashes[row_id] = get_row_hash(synced_row)
+            if row_hashes.get(row_id) != new_row_hashes[row_id]:
+                to_be_updated_rows_id_list.append(row_id)
+        cds_logger.debug('skip %s unchanged rows by row hashes', len(to_be_updated_rows_id_set) - len(to_be_updated_rows_id_list))
+    else:
+        to_be_updated_rows_id_list = list(to_be_updated_rows_id_set)
+
     # fetch src to-be-updated-rows and dst to-be-updated-rows, update to dst table, step by step
-    to_be_updated_rows_id_list = list(to_be_updated_rows_id_set)
     step = 10000
     for i in range(0, len(to_be_updated_rows_id_list), step):
         cds_logger.debug('to_be_updated_rows_id_list i: %s step: %s', i, step)
@@ -1060,6 +1202,9 @@ def _import_sync_CDS(context):
         src_rows = [dataset_data['rows_dict'][row_id] for row_id in step_to_be_appended_rows_id_list]
         src_rows = sorted(src_rows, key=lambda row: step_row_sort_dict[row['_id']])
         _, to_be_appended_rows = generate_synced_rows(src_rows, src_columns, final_columns, rows_invalid_infos)
+        if use_row_hashes:
+            new_row_hashes.update({row['_id']: get_row_hash({key: value for key, value in row.items() if key != '_id'})
+                                   for row in to_be_appended_rows})
         error_resp = append_dst_rows(dst_dtable_uuid, dst_table_name, to_be_appended_rows, dst_dtable_server_api, stats_info)
         if error_resp:
             return error_resp
@@ -1074,12 +1219,20 @@ def _import_sync_CDS(context):
                 logs.append(f"\t\t{invalid_cell_info}")
         cds_logger.warning('\n'.join(logs))
         
+    synced_rows_ids = (dst_rows_id_set - to_be_deleted_rows_id_set) | to_be_appended_rows_id_set
+    if use_row_hashes:
+        # rows not in an incremental sync keep their hashes
+        row_hashes = {row_id: row_hash for row_id, row_hash in row_hashes.items() if row_id in synced_rows_ids}
+        row_hashes.update(new_row_hashes)
+        save_sync_row_hashes(dataset_sync_id, synced_at, row_hashes)
+
     sync_row_count = stats_info['appended_rows_count'] + stats_info['updated_rows_count'] + stats_info['deleted_rows_count']
     return {
         'dst_table_id': dst_table_id,
         'error_msg': '',
         'task_status_code': 200,
-        'sync_row_count': sync_row_count
+        'sync_row_count': sync_row_count,
+        'synced_rows_ids': synced_rows_ids
     }
 
 
@@ -1120,10 +1273,14 @@ def import_sync_CDS(context):
     except Exception as e:
         stats_info['is_success'] = False
         stats_info['error'] = traceback.format_exc()
+        if context.get('dataset_sync_id'):
+            delete_sync_watermark(context['dataset_sync_id'])
+            delete_sync_row_hashes(context['dataset_sync_id'])
         raise e
     else:
         stats_info['dst_table_id'] = result.get('dst_table_id')
         stats_info['is_success'] = True
+        update_sync_watermark(context, result)
     finally:
         finished_at = datetime.now()
         stats_info['finished_at'] = finished_at.isoformat()
@@ -1145,6 +1302,29 @@ def import_sync_CDS(context):
     return result
 
 
+def update_sync_watermark(context, result):
+    dataset_sync_id = context.get('dataset_sync_id')
+    if not dataset_sync_id:
+        return
+    synced_rows_ids = result.pop('synced_rows_ids', None)
+    if result.get('error_msg'):
+        delete_sync_watermark(dataset_sync_id)
+        delete_sync_row_hashes(dataset_sync_id)
+        return
+    if not COMMON_DATASET_INCREMENTAL_SYNC_ENABLED:
+        delete_sync_watermark(dataset_sync_id)
+        return
+    dataset_data = context.get('dataset_data')
+    src_table = context.get('src_table')
+    src_view = next((view for view in src_table['views'] if view['_id'] == context.get('src_view_id')), None)
+    if not src_view or synced_rows_ids is None:
+        delete_sync_watermark(dataset_sync_id)
+        return
+    fingerprint = get_sync_fingerprint(src_table, src_view, result.get('dst_table_id'))
+    save_sync_watermark(dataset_sync_id, fingerprint, dataset_data.get('max_mtime'), synced_rows_ids,
+                        full_synced_at=dataset_data.get('full_synced_at'))
+
+
 def set_common_dataset_invalid(dataset_id, db_session):
     sql = "UPDATE dtable_common_dataset SET is_valid=0 WHERE id=:dataset_id"
     try:
@@ -1206,81 +1386,113 @@ def gen_src_assets(src_dtable_uuid, src_table_id, src_view_id, dataset_sync_ids,
     }
 
 
-def gen_dst_assets(dst_dtable_uuid, dst_table_id, dataset_sync_id, db_session):
+def gen_dst_assets(dst_dtable_uuid, dst_table_id, dataset_sync_id):
     """
-    :return: assets -> dict
+    :return: assets -> dict or None, error_type -> str or None
     """
     dst_dtable_server_api = DTableServerAPI('dtable-events', dst_dtable_uuid, INNER_DTABLE_SERVER_URL)
     try:
         dst_dtable_metadata = dst_dtable_server_api.get_metadata()
     except Exception as e:
         cds_logger.error('request src dst dtable: %s metadata error: %s', dst_dtable_uuid, e)
-        return None
+        return None, 'request_metadata_error'
     dst_table = None
     for table in dst_dtable_metadata.get('tables', []):
         if table['_id'] == dst_table_id:
             dst_table = table
             break
     if not dst_table:
-        set_common_dataset_syncs_invalid([dataset_sync_id], db_session)
         cds_logger.warning('sync: %s destination table not found.', dataset_sync_id)
-        return None
+        return None, 'dst_table_not_found'
     return {
         'dst_table_name': dst_table['name'],
         'dst_columns': dst_table['columns']
-    }
+    }, None
 
 
-def batch_sync_common_dataset(app, dataset_id, dataset_syncs, db_session, is_force_sync=False, operator='dtable-events'):
+class DatasetSource:
     """
-    batch sync CDS content to all syncs
-
-    :params dataset_syncs: a list of object with properties `sync_id`, `dst_dtable_uuid`, `dst_table_id`, `src_version`
+    src rows of a dataset, fetched once and shared by syncs to all dsts running in threads
     """
-    # fetch src assets
-    src_dtable_uuid = uuid_str_to_36_chars(dataset_syncs[0].src_dtable_uuid)
-    src_table_id = dataset_syncs[0].src_table_id
-    src_view_id = dataset_syncs[0].src_view_id
-    sync_ids = [dataset_sync.sync_id for dataset_sync in dataset_syncs]
-    src_assets = gen_src_assets(src_dtable_uuid, src_table_id, src_view_id, sync_ids, db_session)
-    if not src_assets:
-        cds_logger.info('sync dataset_id: %s break!', dataset_id)
-        return 0, 0
-    src_table = src_assets.get('src_table')
 
-    dataset_data = None
-    rows_count = 0
-    sync_count = 0
-    for dataset_sync in dataset_syncs:
-        dst_dtable_uuid = uuid_str_to_36_chars(dataset_sync.dst_dtable_uuid)
-        dst_table_id = dataset_sync.dst_table_id
-        dataset_sync_id = dataset_sync.sync_id
-        last_src_version = dataset_sync.src_version
+    def __init__(self, dataset_id, src_dtable_uuid, src_table, src_view_id):
+        self.dataset_id = dataset_id
+        self.src_dtable_uuid = src_dtable_uuid
+        self.src_table = src_table
+        self.src_view_id = src_view_id
+        self._lock = Lock()
+        self._dataset_data = None
+        self._error = None
+        self._rows_id_list = None
+        self._rows_id_list_fetched = False
+
+    def is_dataset_data_fetched(self):
+        return self._dataset_data is not None
+
+    def get_dataset_data(self):
+        """
+        :return: dataset_data -> dict or None, error_body -> dict or None
+        """
+        with self._lock:
+            if self._dataset_data is None and self._error is None:
+                try:
+                    self._dataset_data, self._error = get_dataset_data(self.dataset_id, self.src_dtable_uuid, self.src_table, self.src_view_id)
+                except Exception as e:
+                    cds_logger.exception('request dtable: %s table: %s view: %s data error: %s', self.src_dtable_uuid, self.src_table['_id'], self.src_view_id, e)
+                    self._error = {'error_msg': 'fetch src rows error: %s' % e, 'task_status_code': 500}
+            return self._dataset_data, self._error
+
+    def get_rows_id_list(self):
+        """
+        :return: rows id of src view -> list or None
+        """
+        with self._lock:
+            if not self._rows_id_list_fetched:
+                ids_data, _ = get_dataset_data(self.dataset_id, self.src_dtable_uuid, self.src_table, self.src_view_id, only_id=True)
+                self._rows_id_list = ids_data['rows_id_list'] if ids_data else None
+                self._rows_id_list_fetched = True
+            return self._rows_id_list
 
-        dst_assets = gen_dst_assets(dst_dtable_uuid, dst_table_id, dataset_sync_id, db_session)
 
+def sync_dataset_to_dst(app, dataset_sync, src_assets, dataset_source, dst_semaphore, is_force_sync, operator):
+    """
+    sync dataset to one dst, run in threads, db updates are left to the caller
+
+    :return: result -> dict with `status`, one of `success`, `skipped`, `invalid`, `src_error` and `failed`
+    """
+    dataset_id = dataset_source.dataset_id
+    src_dtable_uuid = dataset_source.src_dtable_uuid
+    src_table = dataset_source.src_table
+    src_view_id = dataset_source.src_view_id
+    dst_dtable_uuid = uuid_str_to_36_chars(dataset_sync.dst_dtable_uuid)
+    dst_table_id = dataset_sync.dst_table_id
+    dataset_sync_id = dataset_sync.sync_id
+
+    if not is_force_sync and src_assets.get('src_version') == dataset_sync.src_version:
+        cds_logger.info('sync dataset_id: %s sync_id: %s break, src last version not changed!', dataset_id, dataset_sync_id)
+        return {'status': 'skipped'}
+
+    with dst_semaphore:
+        dst_assets, error_type = gen_dst_assets(dst_dtable_uuid, dst_table_id, dataset_sync_id)
         if not dst_assets:
             cds_logger.info('sync dataset_id: %s sync_id: %s break!', dataset_id, dataset_sync_id)
-            continue
-
-        if not is_force_sync and src_assets.get('src_version') == last_src_version:
-            cds_logger.info('sync dataset_id: %s sync_id: %s break, src last version not changed!', dataset_id, dataset_sync_id)
-            continue
-
-        src_table = src_assets.get('src_table')
+            return {'status': 'invalid' if error_type == 'dst_table_not_found' else 'skipped'}
         dst_table_name = dst_assets.get('dst_table_name')
 
-        if not dataset_data:
-            try:
-                dataset_data, error = get_dataset_data(dataset_id, src_dtable_uuid, src_table, src_view_id)
-            except Exception as e:
-                cds_logger.exception('request dtable: %s table: %s view: %s data error: %s', src_dtable_uuid, src_table_id, src_view_id, e)
+        sync_dataset_data = None
+        if COMMON_DATASET_INCREMENTAL_SYNC_ENABLED and not is_force_sync and not dataset_source.is_dataset_data_fetched():
+            watermark = load_sync_watermark(dataset_sync_id)
+            if is_sync_watermark_usable(watermark, src_table, src_view_id, dst_dtable_uuid, dst_table_id, dst_table_name):
+                # rows id of src view are needed to find deleted rows and rows come into the view
+                src_rows_id_list = dataset_source.get_rows_id_list()
+                if src_rows_id_list is not None:
+                    sync_dataset_data, _ = get_dataset_incremental_data(dataset_id, src_dtable_uuid, src_table, src_view_id,
+                                                                        src_rows_id_list, watermark)
+
+        if not sync_dataset_data:
+            sync_dataset_data, error = dataset_source.get_dataset_data()
             if error:
-                if error.get('task_status_code') == 400 and error.get('error_type') == 'wrong_filter_in_filters':
-                    set_common_dataset_syncs_invalid(sync_ids, db_session)
-                cds_logger.error('request dtable: %s table: %s view: %s data error: %s', src_dtable_uuid, src_table_id, src_view_id, error)
-                cds_logger.info('sync dataset_id: %s break!', dataset_id)
-                return 0, 0
+                return {'status': 'src_error', 'error': error}
 
         try:
             result = import_sync_CDS({
@@ -1295,43 +1507,92 @@ def batch_sync_common_dataset(app, dataset_id, dataset_syncs, db_session, is_for
                 'dst_columns': dst_assets.get('dst_columns'),
                 'operator': operator or 'dtable-events',
                 'lang': 'en',  # TODO: lang
-                'dataset_data': dataset_data,
+                'dataset_data': sync_dataset_data,
                 'org_id': src_assets.get('org_id'),
-                'db_session': db_session,
                 'app': app
             })
-            row_nums = result.get('sync_row_count', 0)
-            rows_count += row_nums
-            sync_count += 1
         except Exception as e:
-            cds_logger.error('sync common dataset src-uuid: %s src-table: %s src-view: %s dst-uuid: %s dst-table: %s error: %s', 
+            cds_logger.error('sync common dataset src-uuid: %s src-table: %s src-view: %s dst-uuid: %s dst-table: %s error: %s',
                         src_dtable_uuid, src_table['name'], src_view_id, dst_dtable_uuid, dst_table_name, e)
-            continue
-        else:
-            if result.get('error_msg'):
-                if result.get('error_type') in (
-                    'generate_synced_columns_error',
-                    'base_exceeds_limit',
-                    'exceed_columns_limit',
-                    'exceed_rows_limit'
-                ):
-                    cds_logger.warning('src_dtable_uuid: %s src_table_id: %s src_view_id: %s dst_dtable_uuid: %s dst_table_id: %s client error: %s',
-                                    src_dtable_uuid, src_table_id, src_view_id, dst_dtable_uuid, dst_table_id, result)
-                    set_common_dataset_syncs_invalid([dataset_sync_id], db_session)
-                else:
-                    cds_logger.error('src_dtable_uuid: %s src_table_id: %s src_view_id: %s dst_dtable_uuid: %s dst_table_id: %s error: %s',
-                                src_dtable_uuid, src_table_id, src_view_id, dst_dtable_uuid, dst_table_id, result)
+            return {'status': 'failed'}
+
+    if result.get('error_msg'):
+        if result.get('error_type') in (
+            'generate_synced_columns_error',
+            'base_exceeds_limit',
+            'exceed_columns_limit',
+            'exceed_rows_limit'
+        ):
+            cds_logger.warning('src_dtable_uuid: %s src_table_id: %s src_view_id: %s dst_dtable_uuid: %s dst_table_id: %s client error: %s',
+                            src_dtable_uuid, src_table['_id'], src_view_id, dst_dtable_uuid, dst_table_id, result)
+            return {'status': 'invalid'}
+        cds_logger.error('src_dtable_uuid: %s src_table_id: %s src_view_id: %s dst_dtable_uuid: %s dst_table_id: %s error: %s',
+                    src_dtable_uuid, src_table['_id'], src_view_id, dst_dtable_uuid, dst_table_id, result)
+        return {'status': 'failed'}
+    return {'status': 'success', 'rows_count': result.get('sync_row_count', 0)}
+
+
+def batch_sync_common_dataset(app, dataset_id, dataset_syncs, db_session, is_force_sync=False, operator='dtable-events'):
+    """
+    batch sync CDS content to all syncs, syncs lagging most start first, syncs to the same dst base are limited by
+    COMMON_DATASET_SYNC_PER_DST_CONCURRENCY
+
+    :params dataset_syncs: a list of object with properties `sync_id`, `dst_dtable_uuid`, `dst_table_id`, `src_version`
+        and optional `last_sync_time`
+    """
+    # fetch src assets
+    src_dtable_uuid = uuid_str_to_36_chars(dataset_syncs[0].src_dtable_uuid)
+    src_table_id = dataset_syncs[0].src_table_id
+    src_view_id = dataset_syncs[0].src_view_id
+    sync_ids = [dataset_sync.sync_id for dataset_sync in dataset_syncs]
+    src_assets = gen_src_assets(src_dtable_uuid, src_table_id, src_view_id, sync_ids, db_session)
+    if not src_assets:
+        cds_logger.info('sync dataset_id: %s break!', dataset_id)
+        return 0, 0
+    src_table = src_assets.get('src_table')
+    dataset_source = DatasetSource(dataset_id, src_dtable_uuid, src_table, src_view_id)
+
+    dataset_syncs = sorted(dataset_syncs, key=lambda dataset_sync: getattr(dataset_sync, 'last_sync_time', None) or datetime.min)
+    dst_semaphores = defaultdict(lambda: BoundedSemaphore(COMMON_DATASET_SYNC_PER_DST_CONCURRENCY))
+
+    rows_count = 0
+    sync_count = 0
+    src_errors = []
+    with ThreadPoolExecutor(max_workers=COMMON_DATASET_SYNC_CONCURRENCY) as executor:
+        future_sync_dict = {}
+        for dataset_sync in dataset_syncs:
+            dst_semaphore = dst_semaphores[dataset_sync.dst_dtable_uuid]
+            future = executor.submit(sync_dataset_to_dst, app, dataset_sync, src_assets, dataset_source, dst_semaphore, is_force_sync, operator)
+            future_sync_dict[future] = dataset_sync
+        for future in as_completed(future_sync_dict):
+            dataset_sync_id = future_sync_dict[future].sync_id
+            try:
+                result = future.result()
+            except Exception as e:
+                cds_logger.exception('sync dataset_id: %s sync_id: %s error: %s', dataset_id, dataset_sync_id, e)
                 continue
-        sql = '''
-            UPDATE dtable_common_dataset_sync SET last_sync_time=:last_sync_time, src_version=:src_version
-            WHERE id=:id
-        '''
-
-        db_session.execute(text(sql), {
-            'last_sync_time': datetime.now(),
-            'src_version': src_assets.get('src_version'),
-            'id': dataset_sync_id
-        })
-        db_session.commit()
+            if result['status'] == 'invalid':
+                set_common_dataset_syncs_invalid([dataset_sync_id], db_session)
+            elif result['status'] == 'src_error':
+                src_errors.append(result['error'])
+            elif result['status'] == 'success':
+                rows_count += result['rows_count']
+                sync_count += 1
+                sql = '''
+                    UPDATE dtable_common_dataset_sync SET last_sync_time=:last_sync_time, src_version=:src_version
+                    WHERE id=:id
+                '''
+                db_session.execute(text(sql), {
+                    'last_sync_time': datetime.now(),
+                    'src_version': src_assets.get('src_version'),
+                    'id': dataset_sync_id
+                })
+                db_session.commit()
+
+    if src_errors:
+        error = src_errors[0]
+        if error.get('task_status_code') == 400 and error.get('error_type') == 'wrong_filter_in_filters':
+            set_common_dataset_syncs_invalid(sync_ids, db_session)
+        cds_logger.error('request dtable: %s table: %s view: %s data error: %s', src_dtable_uuid, src_table_id, src_view_id, error)
 
     return rows_count, sync_count
@@ -37,7 +37,8 @@ class CommonDatasetSyncer(object):
 def list_pending_common_dataset_syncs(db_session):
     sql = '''
             SELECT dcds.dst_dtable_uuid, dcds.dst_table_id, dcd.table_id AS src_table_id, dcd.view_id AS src_view_id,
-                dcd.dtable_uuid AS src_dtable_uuid, dcds.id AS sync_id, dcds.src_version, dcd.id AS dataset_id
+                dcd.dtable_uuid AS src_dtable_uuid, dcds.id AS sync_id, dcds.src_version, dcd.id AS dataset_id,
+                dcds.last_sync_time
             FROM dtable_common_dataset dcd
             INNER JOIN dtable_common_dataset_sync dcds ON dcds.dataset_id=dcd.id
             INNER JOIN dtables d_src ON dcd.dtable_uuid=d_src.uuid AND d_src.deleted=0
@@ -65,7 +66,9 @@ def check_common_dataset(app, session_class):
         dataset_count = 0
         sync_count = 0
         total_row_count= 0
-        for dataset_id, dataset_syncs in cds_dst_dict.items():
+        # datasets with syncs lagging most first
+        datasets = sorted(cds_dst_dict.items(), key=lambda item: min(dataset_sync.last_sync_time or datetime.min for dataset_sync in item[1]))
+        for dataset_id, dataset_syncs in datasets:
             dataset_count += 1
             cds_logger.info('start to sync no.%s, dataset_id: %s, syncs count: %s', dataset_count, dataset_id, len(dataset_syncs))
             try:
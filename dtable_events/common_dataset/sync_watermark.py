@@ -0,0 +1,144 @@
+"""
+Watermarks of common dataset syncs, stored in redis, used by incremental syncs.
+
+A watermark records the max `_mtime` of src view rows seen by the last successful sync, the row ids
+synced to the dst table, compressed, and a fingerprint of src view / columns settings, a change of which
+requires a full sync.
+
+Row hashes record a hash of the synced cells of each dst row, rows with an unchanged hash are not
+fetched from dst and compared again.
+"""
+import base64
+import hashlib
+import json
+import logging
+import time
+import zlib
+
+from dtable_events.app.event_redis import redis_cache
+from dtable_events.utils.constants import ColumnTypes
+
+# set up in common_dataset_sync_utils
+cds_logger = logging.getLogger('dtable_events_cds')
+
+WATERMARK_KEY_PREFIX = 'common_dataset_sync_watermark'
+WATERMARK_TIMEOUT = 7 * 24 * 60 * 60
+ROW_HASHES_KEY_PREFIX = 'common_dataset_sync_row_hashes'
+
+# values of these columns change without `_mtime` of the row changed
+NOT_INCREMENTAL_COLUMN_TYPES = (
+    ColumnTypes.FORMULA,
+    ColumnTypes.LINK_FORMULA,
+    ColumnTypes.LINK,
+)
+
+
+def get_sync_fingerprint(src_table, src_view, dst_table_id):
+    settings = {
+        'columns': [(col.get('key'), col.get('name'), col.get('type'), col.get('data')) for col in src_table.get('columns', [])],
+        'filters': src_view.get('filters'),
+        'filter_conjunction': src_view.get('filter_conjunction'),
+        'sorts': src_view.get('sorts'),
+        'hidden_columns': src_view.get('hidden_columns'),
+        'dst_table_id': dst_table_id,
+    }
+    return hashlib.md5(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def is_incremental_syncable(src_table, src_view):
+    hidden_column_keys = src_view.get('hidden_columns') or []
+    return not any(col['type'] in NOT_INCREMENTAL_COLUMN_TYPES
+                   for col in src_table.get('columns', []) if col['key'] not in hidden_column_keys)
+
+
+def encode_rows_ids(rows_ids):
+    return base64.b64encode(zlib.compress('\n'.join(sorted(rows_ids)).encode())).decode()
+
+
+def decode_rows_ids(encoded_rows_ids):
+    rows_ids_str = zlib.decompress(base64.b64decode(encoded_rows_ids)).decode()
+    return set(rows_ids_str.split('\n')) if rows_ids_str else set()
+
+
+def get_watermark_key(dataset_sync_id):
+    return f'{WATERMARK_KEY_PREFIX}:{dataset_sync_id}'
+
+
+def load_sync_watermark(dataset_sync_id):
+    """
+    :return: dict with `fingerprint`, `mtime`, `rows_ids` (set) and `full_synced_at`, or None
+    """
+    try:
+        watermark = redis_cache.get(get_watermark_key(dataset_sync_id))
+        if not watermark:
+            return None
+        watermark = json.loads(watermark)
+        watermark['rows_ids'] = decode_rows_ids(watermark['rows_ids'])
+        return watermark
+    except Exception as e:
+        cds_logger.warning('load common dataset sync: %s watermark error: %s', dataset_sync_id, e)
+        return None
+
+
+def save_sync_watermark(dataset_sync_id, fingerprint, mtime, rows_ids, full_synced_at=None):
+    watermark = {
+        'fingerprint': fingerprint,
+        'mtime': mtime,
+        'rows_ids': encode_rows_ids(rows_ids),
+        'full_synced_at': full_synced_at or time.time(),
+    }
+    try:
+        redis_cache.set(get_watermark_key(dataset_sync_id), json.dumps(watermark), timeout=WATERMARK_TIMEOUT)
+    except Exception as e:
+        cds_logger.warning('save common dataset sync: %s watermark error: %s', dataset_sync_id, e)
+
+
+def delete_sync_watermark(dataset_sync_id):
+    try:
+        redis_cache.delete(get_watermark_key(dataset_sync_id))
+    except Exception as e:
+        cds_logger.warning('delete common dataset sync: %s watermark error: %s', dataset_sync_id, e)
+
+
+def get_row_hash(synced_row):
+    """
+    :param synced_row: {col_key1: converted_value1,...} generated by `generate_single_row`
+    """
+    return hashlib.md5(json.dumps(synced_row, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def get_row_hashes_key(dataset_sync_id):
+    return f'{ROW_HASHES_KEY_PREFIX}:{dataset_sync_id}'
+
+
+def load_sync_row_hashes(dataset_sync_id):
+    """
+    :return: dict with `synced_at`, an iso time before the last sync started, and `hashes` {row_id: hash}, or None
+    """
+    try:
+        row_hashes = redis_cache.get(get_row_hashes_key(dataset_sync_id))
+        if not row_hashes:
+            return None
+        return json.loads(zlib.decompress(base64.b64decode(row_hashes)).decode())
+    except Exception as e:
+        cds_logger.warning('load common dataset sync: %s row hashes error: %s', dataset_sync_id, e)
+        return None
+
+
+def save_sync_row_hashes(dataset_sync_id, synced_at, hashes):
+    row_hashes = {
+        'synced_at': synced_at,
+        'hashes': hashes,
+    }
+    try:
+        row_hashes = base64.b64encode(zlib.compress(json.dumps(row_hashes).encode())).decode()
+        redis_cache.set(get_row_hashes_key(dataset_sync_id), row_hashes, timeout=WATERMARK_TIMEOUT)
+    except Exception as e:
+        cds_logger.warning('save common dataset sync: %s row hashes error: %s', dataset_sync_id, e)
+
+
+def delete_sync_row_hashes(dataset_sync_id):
+    try:
+        redis_cache.delete(get_row_hashes_key(dataset_sync_id))
+    except Exception as e:
+        cds_logger.warning('delete common dataset sync: %s row hashes error: %s', dataset_sync_id, e)
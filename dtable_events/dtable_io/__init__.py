@@ -17,9 +17,10 @@ from seaserv import seafile_api
 from dtable_events.app.config import DTABLE_WEB_SERVICE_URL, INNER_DTABLE_SERVER_URL, INNER_DTABLE_DB_URL
 from dtable_events.dtable_io.big_data import import_excel_to_db, update_excel_to_db, export_big_data_to_excel, \
     export_app_table_page_to_excel
+from dtable_events.dtable_io.export_zip import ExportZipWriter, write_asset_dir_to_zip
 from dtable_events.dtable_io.utils import import_archive_from_src_dtable, post_big_data_screen_app_zip_file, \
     post_dtable_json, post_asset_files, \
-    download_files_to_path, create_forms_from_src_dtable, copy_src_forms_to_json, prepare_asset_file_folder, \
+    download_files_to_path, create_forms_from_src_dtable, copy_src_forms_to_json, \
     prepare_dtable_json_from_memory, update_page_design_static_image, \
     copy_src_auto_rules_to_json, create_auto_rules_from_src_dtable, sync_app_users_to_table, \
     copy_src_workflows_to_json, create_workflows_from_src_dtable, copy_src_external_app_to_json,\
@@ -61,9 +62,8 @@ def add_task_id_to_log(log_msg, task_id=None):
 
 def get_dtable_export_content(username, repo_id, workspace_id, dtable_uuid, asset_dir_id, ignore_archive_backup, task_id):
     """
-    1. prepare file content at /tmp/dtable-io/<dtable_id>/dtable_asset/...
-    2. make zip file
-    3. return zip file's content
+    1. write content.json, asset files, forms... to zip file /tmp/dtable-io/<dtable_id>/zip_file.zip as they are produced
+    2. return zip file's content
     """
     task_result = {
         'warnings': []
@@ -72,7 +72,7 @@ def get_dtable_export_content(username, repo_id, workspace_id, dtable_uuid, asse
     dtable_io_logger.info(add_task_id_to_log(f'Start prepare /tmp/dtable-io/{dtable_uuid}/zip_file.zip for export DTable.', task_id))
 
     tmp_file_path = os.path.join('/tmp/dtable-io', dtable_uuid,
-                                 'dtable_asset/')  # used to store asset files and json from file_server
+                                 'dtable_asset/')  # used to store asset files being downloaded
     tmp_zip_path = os.path.join('/tmp/dtable-io', dtable_uuid, 'zip_file') + '.zip'  # zip path of zipped xxx.dtable
 
     db_session = init_db_session_class()()
@@ -80,86 +80,87 @@ def get_dtable_export_content(username, repo_id, workspace_id, dtable_uuid, asse
     dtable_io_logger.info(add_task_id_to_log('Clear tmp dirs and files before prepare.', task_id))
     clear_tmp_files_and_dirs(tmp_file_path, tmp_zip_path)
     os.makedirs(tmp_file_path, exist_ok=True)
-    # import here to avoid circular dependency
 
-    # 1. create 'content.json' from 'xxx.dtable'
-    dtable_io_logger.info(add_task_id_to_log('Create content.json file.', task_id))
-    try:
-        prepare_dtable_json_from_memory(workspace_id, dtable_uuid, username, tmp_file_path)
-    except Exception as e:
-        error_msg = 'prepare dtable json failed. ERROR: {}'.format(e)
-        dtable_io_logger.exception(add_task_id_to_log(error_msg, task_id))
-        db_session.close()
-        raise Exception(error_msg)
+    """
+    /tmp/dtable-io/<dtable_uuid>/zip_file.zip
+                                    |- asset/
+                                    |- content.json
+                                    |- forms.json...
 
-    # 2. get asset file folder, asset could be empty
-    if asset_dir_id:
-        dtable_io_logger.info(add_task_id_to_log('Create asset dir.', task_id))
+    files are added to zip directly, images, pdfs... are stored and others are deflated
+    """
+    zip_writer = ExportZipWriter(tmp_zip_path)
+    try:
+        # 1. create 'content.json' from 'xxx.dtable'
+        dtable_io_logger.info(add_task_id_to_log('Create content.json file.', task_id))
         try:
-            prepare_asset_file_folder(username, repo_id, dtable_uuid, asset_dir_id, tmp_file_path, task_id)
+            prepare_dtable_json_from_memory(workspace_id, dtable_uuid, username, zip_writer)
         except Exception as e:
-            error_msg = 'dtable: {} create asset folder failed. ERROR: {}'.format(dtable_uuid, e)
+            error_msg = 'prepare dtable json failed. ERROR: {}'.format(e)
             dtable_io_logger.exception(add_task_id_to_log(error_msg, task_id))
-            task_result['warnings'].append({'error': error_msg})
+            raise Exception(error_msg)
 
-    # 3. copy forms
-    try:
-        copy_src_forms_to_json(dtable_uuid, tmp_file_path, db_session)
-    except Exception as e:
-        error_msg = 'copy forms failed. ERROR: {}'.format(e)
-        dtable_io_logger.exception(add_task_id_to_log(error_msg, task_id))
-
-    # 4. copy automation rules
-    try:
-        copy_src_auto_rules_to_json(dtable_uuid, tmp_file_path, db_session)
-    except Exception as e:
-        error_msg = 'copy automation rules failed. ERROR: {}'.format(e)
-        dtable_io_logger.exception(add_task_id_to_log(error_msg, task_id))
-
-    # 5. copy workflows
-    try:
-        copy_src_workflows_to_json(dtable_uuid, tmp_file_path, db_session)
-    except Exception as e:
-        error_msg = 'copy workflows failed. ERROR: {}'.format(e)
-        dtable_io_logger.exception(add_task_id_to_log(error_msg, task_id))
+        # 2. add asset files, asset could be empty
+        if asset_dir_id:
+            dtable_io_logger.info(add_task_id_to_log('Add asset files.', task_id))
+            try:
+                failed_files = write_asset_dir_to_zip(zip_writer, username, repo_id, asset_dir_id, tmp_file_path, task_id)
+            except Exception as e:
+                error_msg = 'dtable: {} add asset files failed. ERROR: {}'.format(dtable_uuid, e)
+                dtable_io_logger.exception(add_task_id_to_log(error_msg, task_id))
+                raise Exception(error_msg)
+            if failed_files:
+                error_msg = 'dtable: {} download {} asset files failed, e.g. {}'.format(dtable_uuid, len(failed_files), failed_files[0])
+                task_result['warnings'].append({'error': error_msg})
+
+        # 3. copy forms
+        try:
+            copy_src_forms_to_json(dtable_uuid, zip_writer, db_session)
+        except Exception as e:
+            error_msg = 'copy forms failed. ERROR: {}'.format(e)
+            dtable_io_logger.exception(add_task_id_to_log(error_msg, task_id))
 
-    # 5. copy external app
-    try:
-        copy_src_external_app_to_json(dtable_uuid, tmp_file_path, db_session)
-    except Exception as e:
-        error_msg = 'copy external apps failed. ERROR: {}'.format(e)
-        dtable_io_logger.exception(add_task_id_to_log(error_msg, task_id))
+        # 4. copy automation rules
+        try:
+            copy_src_auto_rules_to_json(dtable_uuid, zip_writer, db_session)
+        except Exception as e:
+            error_msg = 'copy automation rules failed. ERROR: {}'.format(e)
+            dtable_io_logger.exception(add_task_id_to_log(error_msg, task_id))
 
-    # 6. archive backup
-    if not ignore_archive_backup:
-        dtable_io_logger.info(add_task_id_to_log('Export archive backup', task_id))
+        # 5. copy workflows
         try:
-            copy_src_archive_backup(dtable_uuid, tmp_file_path, task_id)
+            copy_src_workflows_to_json(dtable_uuid, zip_writer, db_session)
         except Exception as e:
-            error_msg = 'export archive backup failed. ERROR: {}'.format(e)
-            dtable_io_logger.error(add_task_id_to_log(error_msg, task_id))
-            clear_tmp_files_and_dirs(tmp_file_path, tmp_zip_path)
-            if db_session:
-                db_session.close()
+            error_msg = 'copy workflows failed. ERROR: {}'.format(e)
+            dtable_io_logger.exception(add_task_id_to_log(error_msg, task_id))
 
-    """
-    /tmp/dtable-io/<dtable_uuid>/dtable_asset/
-                                    |- asset/
-                                    |- content.json
+        # 5. copy external app
+        try:
+            copy_src_external_app_to_json(dtable_uuid, zip_writer, db_session)
+        except Exception as e:
+            error_msg = 'copy external apps failed. ERROR: {}'.format(e)
+            dtable_io_logger.exception(add_task_id_to_log(error_msg, task_id))
 
-    we zip /tmp/dtable-io/<dtable_uuid>/dtable_asset/ to /tmp/dtable-io/<dtable_id>/zip_file.zip and download it
-    notice than make_archive will auto add .zip suffix to /tmp/dtable-io/<dtable_id>/zip_file
-    """
-    dtable_io_logger.info(add_task_id_to_log('Make zip file for download...', task_id))
-    try:
-        shutil.make_archive('/tmp/dtable-io/' + dtable_uuid + '/zip_file', "zip", root_dir=tmp_file_path)
-    except Exception as e:
-        error_msg = 'make zip failed. ERROR: {}'.format(e)
-        dtable_io_logger.error(add_task_id_to_log(error_msg, task_id))
+        # 6. archive backup
+        if not ignore_archive_backup:
+            dtable_io_logger.info(add_task_id_to_log('Export archive backup', task_id))
+            try:
+                copy_src_archive_backup(dtable_uuid, zip_writer, task_id)
+            except Exception as e:
+                error_msg = 'export archive backup failed. ERROR: {}'.format(e)
+                dtable_io_logger.error(add_task_id_to_log(error_msg, task_id))
+                raise Exception(error_msg)
+
+        dtable_io_logger.info(add_task_id_to_log('Close zip file for download...', task_id))
+        zip_writer.close()
+    except Exception:
+        zip_writer.close()
         db_session.close()
-        raise Exception(error_msg)
-
-    db_session.close()
+        clear_tmp_files_and_dirs(tmp_file_path, tmp_zip_path)
+        raise
+    finally:
+        # asset files are all in zip
+        clear_tmp_dir(tmp_file_path)
 
     dtable_io_logger.info(add_task_id_to_log('Create /tmp/dtable-io/{}/zip_file.zip success!'.format(dtable_uuid), task_id))
     # we remove '/tmp/dtable-io/<dtable_uuid>' in dtable web api
@@ -505,7 +506,7 @@ def get_dtable_export_asset_files(username, repo_id, dtable_uuid, files, task_id
     db_session = init_db_session_class()()
     try:
         # 1. download files to tmp_file_path
-        download_files_to_path(username, repo_id, dtable_uuid, files, tmp_file_path, db_session, files_map)
+        download_files_to_path(username, repo_id, dtable_uuid, files, tmp_file_path, db_session, files_map, task_id=task_id)
         # 2. zip those files to tmp_zip_path
         shutil.make_archive(tmp_zip_path.split('.')[0], 'zip', root_dir=tmp_file_path)
     except Exception as e:
@@ -796,7 +797,7 @@ def get_dtable_transfer_asset_files(username, repo_id, dtable_uuid, files, task_
     db_session = init_db_session_class()()
     try:
         # download files to local
-        local_file_list = download_files_to_path(username, repo_id, dtable_uuid, files, tmp_file_path, db_session, files_map)
+        local_file_list = download_files_to_path(username, repo_id, dtable_uuid, files, tmp_file_path, db_session, files_map, task_id=task_id)
     except Exception as e:
         dtable_io_logger.error('export asset files from dtable failed. ERROR: {}'.format(e))
         if os.path.exists(tmp_file_path):
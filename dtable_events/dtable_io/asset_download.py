@@ -0,0 +1,216 @@
+"""
+Concurrent download of asset files from file server, used in export.
+
+Files are streamed to disk by a pool of workers sharing a pooled http session, files with the same
+seafile `obj_id`, i.e. the same content, are downloaded once and hard linked.
+"""
+import os
+import shutil
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from urllib.parse import quote as urlquote
+
+from seaserv import seafile_api
+
+from dtable_events.app.config import INNER_FILE_SERVER_ROOT, ASSET_DOWNLOAD_WORKERS, ASSET_DOWNLOAD_RETRIES
+from dtable_events.dtable_io.task_manager import task_manager
+from dtable_events.utils import http_session
+
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = (10, 60)  # connect, read
+RETRY_BACKOFF = 1  # seconds, doubled for each retry
+PROGRESS_INTERVAL = 2  # seconds
+
+
+def walk_dir(repo_id, dir_id, path, task_id=None, path_join=os.path.join):
+    """
+    walk dir and its sub dirs, dirs failed to list are logged and skipped
+
+    :return: generator of (dirent, path of dirent)
+    """
+    from dtable_events.dtable_io import dtable_io_logger, add_task_id_to_log
+
+    dirs = [(dir_id, path)]
+    while dirs:
+        dir_id, dir_path = dirs.pop()
+        try:
+            entries = seafile_api.list_dir_by_dir_id(repo_id, dir_id)
+        except Exception as e:
+            dtable_io_logger.error(add_task_id_to_log(f'Failed to list dir {dir_id}: {e}', task_id))
+            continue
+        for entry in entries:
+            entry_path = path_join(dir_path, entry.obj_name)
+            if stat.S_ISDIR(entry.mode):
+                dirs.append((entry.obj_id, entry_path))
+            yield entry, entry_path
+
+
+class AssetDownloader(object):
+    """
+    Usage:
+        downloader = AssetDownloader(username, repo_id, task_id)
+        downloader.add_file(obj_id, file_name, path)
+        ...
+        downloader.wait()
+
+    Files already existing are skipped, failed files are recorded in `failed_paths`. Progress is saved
+    to the io task and returned by `query-status` while the task is running.
+    """
+
+    def __init__(self, username, repo_id, task_id=None, workers=ASSET_DOWNLOAD_WORKERS, retries=ASSET_DOWNLOAD_RETRIES,
+                 on_downloaded=None):
+        """
+        :param on_downloaded: function(obj_id, path) called in workers after a file downloaded
+        """
+        self.username = username
+        self.repo_id = repo_id
+        self.task_id = task_id
+        self.retries = retries
+        self.on_downloaded = on_downloaded
+
+        self._executor = ThreadPoolExecutor(max(workers, 1), thread_name_prefix='asset-download')
+        # limit files queued, the walker blocks until workers catch up
+        self._pending = BoundedSemaphore(max(workers, 1) * 4)
+        self._lock = Lock()
+        self._obj_paths = {}  # obj_id -> path of the first file, downloaded
+        self._duplicates = []  # (obj_id, path), linked to the first file after downloads
+        self._paths = set()
+        self._last_progress_time = 0
+
+        self.start_time = time.time()
+        self.files_total = 0
+        self.files_downloaded = 0
+        self.files_linked = 0
+        self.files_skipped = 0
+        self.files_failed = 0
+        self.bytes_downloaded = 0
+        self.failed_paths = []
+
+    def add_file(self, obj_id, file_name, path):
+        with self._lock:
+            if path in self._paths:
+                return
+            self._paths.add(path)
+            self.files_total += 1
+            if os.path.exists(path):
+                self.files_skipped += 1
+                self._obj_paths.setdefault(obj_id, path)
+                return
+            if obj_id in self._obj_paths:
+                self._duplicates.append((obj_id, path))
+                return
+            self._obj_paths[obj_id] = path
+        self._pending.acquire()
+        future = self._executor.submit(self._download_file, obj_id, file_name, path)
+        future.add_done_callback(lambda f: self._pending.release())
+
+    def add_dir(self, dir_id, path):
+        """
+        walk dir and its sub dirs, add all files to download
+        """
+        os.makedirs(path, exist_ok=True)
+        for entry, entry_path in walk_dir(self.repo_id, dir_id, path, task_id=self.task_id):
+            if stat.S_ISDIR(entry.mode):
+                os.makedirs(entry_path, exist_ok=True)
+            else:
+                self.add_file(entry.obj_id, entry.obj_name, entry_path)
+                self.save_progress()
+
+    def _download_file(self, obj_id, file_name, path):
+        from dtable_events.dtable_io import dtable_io_logger, add_task_id_to_log
+
+        temp_path = path + '.part'
+        error = None
+        for i in range(self.retries + 1):
+            if i > 0:
+                time.sleep(RETRY_BACKOFF * 2 ** (i - 1))
+            try:
+                token = seafile_api.get_fileserver_access_token(self.repo_id, obj_id, 'download', self.username,
+                                                                use_onetime=False)
+                url = '%s/files/%s/%s' % (INNER_FILE_SERVER_ROOT, token, urlquote(file_name))
+                size = 0
+                with http_session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as resp:
+                    resp.raise_for_status()
+                    with open(temp_path, 'wb') as f:
+                        for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                            if chunk:
+                                f.write(chunk)
+                                size += len(chunk)
+                os.replace(temp_path, path)
+            except Exception as e:
+                error = e
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                continue
+            with self._lock:
+                self.files_downloaded += 1
+                self.bytes_downloaded += size
+            if self.on_downloaded:
+                self.on_downloaded(obj_id, path)
+            self.save_progress()
+            return
+        with self._lock:
+            self.files_failed += 1
+            self.failed_paths.append(path)
+            # duplicates of the failed file are linked to nothing
+            if self._obj_paths.get(obj_id) == path:
+                self._obj_paths.pop(obj_id)
+        dtable_io_logger.warning(add_task_id_to_log(f'Failed to download {path}, skipping: {error}', self.task_id))
+
+    def _link_duplicates(self):
+        for obj_id, path in self._duplicates:
+            src_path = self._obj_paths.get(obj_id)
+            if not src_path:
+                self.files_failed += 1
+                self.failed_paths.append(path)
+                continue
+            try:
+                os.link(src_path, path)
+            except OSError:
+                # e.g. file system not supporting hard links
+                shutil.copyfile(src_path, path)
+            self.files_linked += 1
+        self._duplicates = []
+
+    def wait(self):
+        from dtable_events.dtable_io import dtable_io_logger, add_task_id_to_log
+
+        self._executor.shutdown(wait=True)
+        self._link_duplicates()
+        self.save_progress(force=True)
+        progress = self.get_progress()
+        dtable_io_logger.info(add_task_id_to_log(
+            f"Downloaded {progress['files_downloaded']} files ({progress['bytes_downloaded']} bytes, "
+            f"{progress['bytes_per_second']} bytes/s), linked {progress['files_linked']} files, "
+            f"skip {progress['files_skipped']} files, failed {progress['files_failed']} files", self.task_id))
+
+    def get_progress(self):
+        elapsed = max(time.time() - self.start_time, 0.001)
+        return {
+            'files_total': self.files_total,
+            'files_done': self.files_downloaded + self.files_linked + self.files_skipped + self.files_failed,
+            'files_downloaded': self.files_downloaded,
+            'files_linked': self.files_linked,
+            'files_skipped': self.files_skipped,
+            'files_failed': self.files_failed,
+            'bytes_downloaded': self.bytes_downloaded,
+            'bytes_per_second': int(self.bytes_downloaded / elapsed),
+            'files_per_second': round(self.files_downloaded / elapsed, 2),
+        }
+
+    def save_progress(self, force=False):
+        from dtable_events.dtable_io import dtable_io_logger, add_task_id_to_log
+
+        if not self.task_id:
+            return
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_progress_time < PROGRESS_INTERVAL:
+                return
+            self._last_progress_time = now
+        try:
+            task_manager.set_task_progress(self.task_id, self.get_progress())
+        except Exception as e:
+            dtable_io_logger.warning(add_task_id_to_log(f'Failed to save progress: {e}', self.task_id))
@@ -1,19 +1,22 @@
 import openpyxl
 import os
+import queue
 import shutil
+import threading
 import uuid
 from copy import deepcopy
 
-from dtable_events.dtable_io.excel import parse_row, write_xls_with_type, TEMP_EXPORT_VIEW_DIR, IMAGE_TMP_DIR
+from dtable_events.dtable_io.excel import parse_row, write_xls_with_type, write_xls_head, convert_rows_to_cells, \
+    TEMP_EXPORT_VIEW_DIR, IMAGE_TMP_DIR
 from dtable_events.dtable_io.utils import get_related_nicknames_from_dtable, get_metadata_from_dtable_server, \
     escape_sheet_name
 from dtable_events.utils import get_location_tree_json, gen_random_option, format_date_in_query
 from dtable_events.utils.constants import ColumnTypes
 from dtable_events.app.config import INNER_DTABLE_DB_URL, BIG_DATA_ROW_IMPORT_LIMIT, BIG_DATA_ROW_UPDATE_LIMIT, \
-    ARCHIVE_VIEW_EXPORT_ROW_LIMIT, APP_TABLE_EXPORT_EXCEL_ROW_LIMIT, INNER_DTABLE_SERVER_URL
+    ARCHIVE_VIEW_EXPORT_ROW_LIMIT, APP_TABLE_EXPORT_EXCEL_ROW_LIMIT, INNER_DTABLE_SERVER_URL, BIG_DATA_EXPORT_QUEUE_DEPTH
 from dtable_events.utils.dtable_db_api import DTableDBAPI, convert_db_rows
 from dtable_events.utils.dtable_server_api import DTableServerAPI
-from dtable_events.utils.sql_generator import filter2sql, BaseSQLGenerator
+from dtable_events.utils.sql_generator import BaseSQLGenerator
 
 AUTO_GENERATED_COLUMNS = [
     ColumnTypes.AUTO_NUMBER,
@@ -32,6 +35,9 @@ COLUMN_MATCH_ERROR_CODE = 3
 ROW_INSERT_ERROR_CODE = 4
 INTERNAL_ERROR_CODE = 5
 
+EXPORT_PAGE_SIZE = 10000
+_PIPELINE_END = object()
+
 
 def _parse_excel_row(excel_row_data, column_name_type_map, name_to_email, location_tree, excel_select_column_options):
     parsed_row_data = {}
@@ -439,6 +445,80 @@ def update_excel_to_db(
     return
 
 
+def _put_until_stopped(q, item, stop_event):
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get_until_stopped(q, stop_event):
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=1)
+        except queue.Empty:
+            continue
+    return _PIPELINE_END
+
+
+def run_export_pipeline(pages, convert_page, write_page, queue_depth=BIG_DATA_EXPORT_QUEUE_DEPTH):
+    """
+    Fetch pages, convert pages and write converted pages as a pipeline: `pages` (an iterator, e.g. querying
+    dtable-db page by page) is consumed in a fetching thread and `convert_page` runs in a converting thread,
+    so waiting for the next page overlaps converting and writing the current ones. `write_page` runs in the
+    calling thread. At most `queue_depth` pages wait between two stages, which bounds the memory.
+    An exception raised by any stage stops the pipeline and is raised.
+    """
+    pages_queue = queue.Queue(queue_depth)
+    converted_queue = queue.Queue(queue_depth)
+    stop_event = threading.Event()
+    errors = []
+
+    def fetch():
+        try:
+            for page in pages:
+                if not _put_until_stopped(pages_queue, page, stop_event):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            _put_until_stopped(pages_queue, _PIPELINE_END, stop_event)
+
+    def convert():
+        try:
+            while True:
+                page = _get_until_stopped(pages_queue, stop_event)
+                if page is _PIPELINE_END:
+                    return
+                if not _put_until_stopped(converted_queue, convert_page(page), stop_event):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            _put_until_stopped(converted_queue, _PIPELINE_END, stop_event)
+
+    threads = [threading.Thread(target=fetch, daemon=True), threading.Thread(target=convert, daemon=True)]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            converted_page = _get_until_stopped(converted_queue, stop_event)
+            if converted_page is _PIPELINE_END:
+                break
+            write_page(converted_page)
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+
 def export_big_data_to_excel(dtable_uuid, table_id, view_id, username, name, task_id, tasks_status_map, repo_id, is_support_image=False):
     from dtable_events.dtable_io import dtable_io_logger
 
@@ -526,8 +606,6 @@ def export_big_data_to_excel(dtable_uuid, table_id, view_id, username, name, tas
         tasks_status_map[task_id]['err_msg'] = 'get big data rows count failed'
         return
 
-    column_name_to_column = {col.get('name'): col for col in cols}
-
     # exported row number should less than ARCHIVE_VIEW_EXPORT_ROW_LIMIT
     if total_row_count > int(ARCHIVE_VIEW_EXPORT_ROW_LIMIT):
         total_row_count = int(ARCHIVE_VIEW_EXPORT_ROW_LIMIT)
@@ -540,39 +618,46 @@ def export_big_data_to_excel(dtable_uuid, table_id, view_id, username, name, tas
     filter_conditions['filter_conjunction'] = target_view.get('filter_conjunction')
 
     query_column_names = ['_id'] + [col['name'] for col in cols_without_hidden]
-    query_column_names_str = ', '.join(map(lambda column_name: f"`{column_name}`", query_column_names))
 
-    offset = 10000
-    start = 0
-    while True:
+    def fetch_pages():
+        sql_generator = BaseSQLGenerator(table_name, cols, filter_conditions=filter_conditions)
+        start = 0
         # exported row number should less than ARCHIVE_VIEW_EXPORT_ROW_LIMIT
-        if (start + offset) > total_row_count:
-            offset = total_row_count - start
-
-        filter_conditions['start'] = start
-        filter_conditions['limit'] = offset
-        sql = filter2sql(table_name, cols, filter_conditions, by_group=False)
-
-        sql = sql.replace('*', query_column_names_str, 1)
-
-        response_rows, db_metadata = dtable_db_api.query(sql, convert=True, server_only=False)
-
-        row_num = start
+        for response_rows, _ in dtable_db_api.iter_pages(table_name, query_column_names,
+                                                         filter_clause=sql_generator._filter2sql(),
+                                                         sort_clause=sql_generator._sort2sql(),
+                                                         page_size=EXPORT_PAGE_SIZE, limit=total_row_count,
+                                                         convert=True, server_only=False):
+            yield start, response_rows
+            start += len(response_rows)
+
+    def convert_page(page):
+        start, response_rows = page
         try:
-            write_xls_with_type(response_rows, email2nickname, ws, row_num, dtable_uuid, repo_id, image_param, cols_without_hidden, column_name_to_column, row_height=row_height, header_height=header_height)
+            return start + len(response_rows), convert_rows_to_cells(
+                response_rows, email2nickname, ws, start, dtable_uuid, repo_id, image_param, cols_without_hidden,
+                row_height=row_height)
         except Exception as e:
             dtable_io_logger.exception(e)
             dtable_io_logger.error('head_list = {}\n{}'.format(cols_without_hidden, e))
             tasks_status_map[task_id]['status'] = 'terminated'
             tasks_status_map[task_id]['err_msg'] = 'write xls error'
-            return
+            raise
 
-        start += offset
-        tasks_status_map[task_id]['handled_row_count'] = start
+    def write_page(converted_page):
+        handled_row_count, row_list = converted_page
+        for row_cells in row_list:
+            ws.append(row_cells)
+        tasks_status_map[task_id]['handled_row_count'] = handled_row_count
         tasks_status_map[task_id]['status'] = 'running'
 
-        if start >= total_row_count or len(response_rows) < offset:
-            break
+    write_xls_head(ws, cols_without_hidden, header_height=header_height)
+    try:
+        run_export_pipeline(fetch_pages(), convert_page, write_page)
+    except Exception:
+        if tasks_status_map[task_id]['status'] == 'terminated':
+            return
+        raise
 
     wb.save(target_path)
     tasks_status_map[task_id]['status'] = 'success'
@@ -657,27 +742,15 @@ def export_app_table_page_to_excel(dtable_uuid, repo_id, table_id, username, app
     tasks_status_map[task_id]['total_row_count'] = total_row_count
 
     query_column_names = ['_id'] + [col['name'] for col in cols_without_hidden]
-    query_column_names_str = ', '.join(map(lambda column_name: f"`{column_name}`", query_column_names))
 
-    limit = 10000
+    # exported row number should less than APP_TABLE_EXPORT_EXCEL_ROW_LIMIT
+    pages = dtable_db_api.iter_pages(table_name, query_column_names, filter_clause=sql_gen._groupfilter2sql(),
+                                     sort_clause=sql_gen._sort2sql(by_group=True), page_size=EXPORT_PAGE_SIZE,
+                                     limit=total_row_count, convert=True, server_only=False)
     start = 0
     while True:
-        # exported row number should less than APP_TABLE_EXPORT_EXCEL_ROW_LIMIT
-        if (start + limit) > total_row_count:
-            limit = total_row_count - start
-
-
-        filter_condition_groups.update({
-            'limit': limit,
-            'start': start
-        })
-
         try:
-            sql = filter2sql(table_name, cols, filter_condition_groups, by_group=True)
-
-            sql = sql.replace('*', query_column_names_str, 1)
-
-            response_rows, _ = dtable_db_api.query(sql, convert=True, server_only=False)
+            response_rows, _ = next(pages, (None, None))
         except ConnectionError as e:
             dtable_io_logger.exception(e)
             tasks_status_map[task_id]['status'] = 'terminated'
@@ -688,6 +761,8 @@ def export_app_table_page_to_excel(dtable_uuid, repo_id, table_id, username, app
             tasks_status_map[task_id]['status'] = 'terminated'
             tasks_status_map[task_id]['err_msg'] = str(e)
             return
+        if response_rows is None:
+            break
 
         row_num = start
         try:
@@ -699,12 +774,13 @@ def export_app_table_page_to_excel(dtable_uuid, repo_id, table_id, username, app
             tasks_status_map[task_id]['err_msg'] = 'write xls error'
             return
 
-        start += limit
+        start += len(response_rows)
         tasks_status_map[task_id]['handled_row_count'] = start
         tasks_status_map[task_id]['status'] = 'running'
 
-        if start >= total_row_count or len(response_rows) < limit:
-            break
+    if start == 0:
+        # no rows, only head
+        write_xls_head(ws, cols_without_hidden)
 
     wb.save(target_path)
     tasks_status_map[task_id]['status'] = 'success'
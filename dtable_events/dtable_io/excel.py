@@ -2078,9 +2078,7 @@ def write_xls_with_type(data_list, email2nickname, ws, row_num, dtable_uuid, rep
     """ write listed data into excel
     """
     from dtable_events.dtable_io import dtable_io_logger
-    from openpyxl.cell import WriteOnlyCell
-    from openpyxl.utils import get_column_letter
-    from dtable_events.dtable_io.utils import width_transfer, height_transfer
+    from dtable_events.dtable_io.utils import height_transfer
 
     export_ctx = {
         'email2nickname': email2nickname,
@@ -2095,66 +2093,93 @@ def write_xls_with_type(data_list, email2nickname, ws, row_num, dtable_uuid, rep
         'header_height': header_height,
     }
 
-    ws.row_dimensions[1].height = height_transfer(header_height) # set header height
     if row_num == 0:
-        # write table head
-        column_error_log_exists = False
-        head_cell_list = []
-        col_num = 0
-        for col in cols_without_hidden:
-            try:
-                c = WriteOnlyCell(ws, value=col.get('name'))
-                col_pos = get_column_letter(col_num + 1)
-                col_width = col.get('width', 200)
-                col_width_xls = width_transfer(col_width)
-                ws.column_dimensions[col_pos].width = col_width_xls
-
-            except Exception as e:
-                if not column_error_log_exists:
-                    dtable_io_logger.error('Error column in exporting excel: {}'.format(e))
-                    column_error_log_exists = True
-                c = WriteOnlyCell(ws, value='illegal character in excel')
-            head_cell_list.append(c)
-            col_num += 1
-        ws.append(head_cell_list)
+        write_xls_head(ws, cols_without_hidden, header_height=header_height)
+    else:
+        ws.row_dimensions[1].height = height_transfer(header_height) # set header height
 
     # write table data
-    row_error_log_exists = False
-    unknown_user_set = set()
-    unknown_cell_list = []
-
     if is_group_view:
+        unknown_user_set = set()
+        unknown_cell_list = []
         row_list = []
         # for insert image
         row_num_info = {'row_num': row_num + 1}
         sub_level = 0
         handle_grouped_view_rows(data_list, row_num_info, ws, email2nickname, unknown_user_set, unknown_cell_list, dtable_uuid,
                          repo_id, image_param, cols_without_hidden, column_name_to_column, summary_col_info, row_list, sub_level, row_height)
-    else:
-        row_list = []
-        for row in data_list:
-            row_num += 1  # for big data view
+        if unknown_cell_list:
             try:
-                params = (row, row_num, ws, export_ctx['email2nickname'], unknown_user_set, unknown_cell_list,
-                          export_ctx['dtable_uuid'], export_ctx['repo_id'], export_ctx['image_param'],
-                          export_ctx['cols_without_hidden'], export_ctx['row_height'])
-                row_cells = handle_row(*params)
-                ws.row_dimensions[row_num + 1].height = height_transfer(row_height)
+                add_nickname_to_cell(unknown_user_set, unknown_cell_list)
             except Exception as e:
-                if not row_error_log_exists:
-                    dtable_io_logger.exception(e)
-                    dtable_io_logger.error('Error row in exporting excel: {}'.format(e))
-                    row_error_log_exists = True
-                continue
-            row_list.append(row_cells)
+                dtable_io_logger.exception('add nickname to cell error: {}'.format(e))
+    else:
+        row_list = convert_rows_to_cells(data_list, email2nickname, ws, row_num, export_ctx['dtable_uuid'],
+                                         export_ctx['repo_id'], export_ctx['image_param'],
+                                         export_ctx['cols_without_hidden'], row_height=export_ctx['row_height'])
+    for row in row_list:
+        ws.append(row)
+
+
+def write_xls_head(ws, cols_without_hidden, header_height='default'):
+    from dtable_events.dtable_io import dtable_io_logger
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+    from dtable_events.dtable_io.utils import width_transfer, height_transfer
+
+    ws.row_dimensions[1].height = height_transfer(header_height) # set header height
+    column_error_log_exists = False
+    head_cell_list = []
+    col_num = 0
+    for col in cols_without_hidden:
+        try:
+            c = WriteOnlyCell(ws, value=col.get('name'))
+            col_pos = get_column_letter(col_num + 1)
+            col_width = col.get('width', 200)
+            col_width_xls = width_transfer(col_width)
+            ws.column_dimensions[col_pos].width = col_width_xls
+
+        except Exception as e:
+            if not column_error_log_exists:
+                dtable_io_logger.error('Error column in exporting excel: {}'.format(e))
+                column_error_log_exists = True
+            c = WriteOnlyCell(ws, value='illegal character in excel')
+        head_cell_list.append(c)
+        col_num += 1
+    ws.append(head_cell_list)
+
+
+def convert_rows_to_cells(data_list, email2nickname, ws, row_num, dtable_uuid, repo_id, image_param, cols_without_hidden, row_height='default'):
+    """ convert rows (not grouped) to lists of excel cells, rows start after `row_num`
+    """
+    from dtable_events.dtable_io import dtable_io_logger
+    from dtable_events.dtable_io.utils import height_transfer
 
+    row_error_log_exists = False
+    unknown_user_set = set()
+    unknown_cell_list = []
+    row_list = []
+    for row in data_list:
+        row_num += 1  # for big data view
+        try:
+            row_cells = handle_row(row, row_num, ws, email2nickname, unknown_user_set, unknown_cell_list,
+                                   dtable_uuid, repo_id, image_param, cols_without_hidden, row_height)
+            ws.row_dimensions[row_num + 1].height = height_transfer(row_height)
+        except Exception as e:
+            if not row_error_log_exists:
+                dtable_io_logger.exception(e)
+                dtable_io_logger.error('Error row in exporting excel: {}'.format(e))
+                row_error_log_exists = True
+            continue
+        row_list.append(row_cells)
+
+    # cells of users not in email2nickname are filled before written
     if unknown_cell_list:
         try:
             add_nickname_to_cell(unknown_user_set, unknown_cell_list)
         except Exception as e:
             dtable_io_logger.exception('add nickname to cell error: {}'.format(e))
-    for row in row_list:
-        ws.append(row)
+    return row_list
 
 
 def handle_grouped_view_rows(view_rows, row_num_info, ws, email2nickname, unknown_user_set, unknown_cell_list, dtable_uuid,
@@ -0,0 +1,118 @@
+"""
+Zip archive of base export written in place, files are added to the archive as they are produced, without
+staging the whole base in a directory first.
+
+Already compressed files, images, videos, pdfs, office files..., are stored, others are deflated.
+"""
+import os
+import posixpath
+import stat
+import time
+from threading import Lock
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+
+from dtable_events.dtable_io.asset_download import AssetDownloader, walk_dir
+
+COMPRESSED_EXTENSIONS = {
+    # images
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif', '.avif', '.jp2',
+    # videos / audios
+    '.mp4', '.m4v', '.mov', '.avi', '.mkv', '.webm', '.wmv', '.flv', '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.flac', '.wma',
+    # archives
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst', '.dtable',
+    # documents
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub', '.sdoc',
+}
+
+
+def get_compress_type(name):
+    return ZIP_STORED if os.path.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS else ZIP_DEFLATED
+
+
+class ExportZipWriter(object):
+    """
+    Thread safe, entries are written one after another.
+    """
+
+    def __init__(self, zip_path):
+        self._zip = ZipFile(zip_path, 'w', ZIP_DEFLATED, allowZip64=True)
+        self._lock = Lock()
+
+    def _gen_zip_info(self, name, compress_type=None):
+        zip_info = ZipInfo(name, date_time=time.localtime()[:6])
+        zip_info.compress_type = get_compress_type(name) if compress_type is None else compress_type
+        zip_info.external_attr = 0o644 << 16
+        return zip_info
+
+    def write_bytes(self, name, content, compress_type=None):
+        with self._lock:
+            self._zip.writestr(self._gen_zip_info(name, compress_type), content)
+
+    def write_file(self, name, file_path, compress_type=None):
+        with self._lock:
+            self._zip.write(file_path, name, compress_type=get_compress_type(name) if compress_type is None else compress_type)
+
+    def write_stream(self, name, chunks, compress_type=None):
+        """
+        :param chunks: iterable of bytes, size unknown, an error when iterating leaves a broken entry, the archive should be dropped
+        """
+        with self._lock:
+            with self._zip.open(self._gen_zip_info(name, compress_type), 'w', force_zip64=True) as f:
+                for chunk in chunks:
+                    if chunk:
+                        f.write(chunk)
+
+    def write_dir(self, name):
+        zip_info = ZipInfo(name.rstrip('/') + '/', date_time=time.localtime()[:6])
+        zip_info.external_attr = ((0o40755 << 16) | 0x10)
+        with self._lock:
+            self._zip.writestr(zip_info, b'')
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def write_asset_dir_to_zip(zip_writer, username, repo_id, asset_dir_id, tmp_dir, task_id=None):
+    """
+    add asset dir to `asset/` of the archive, files are downloaded concurrently to `tmp_dir` and
+    removed once added, files of the same content are downloaded once
+
+    :return: names in archive of files failed to download
+    """
+    os.makedirs(tmp_dir, exist_ok=True)
+    obj_names = {}  # obj_id -> (file_name, [name in archive])
+    zip_writer.write_dir('asset')
+    for entry, name in walk_dir(repo_id, asset_dir_id, 'asset', task_id=task_id, path_join=posixpath.join):
+        if stat.S_ISDIR(entry.mode):
+            zip_writer.write_dir(name)
+        else:
+            obj_names.setdefault(entry.obj_id, (entry.obj_name, []))[1].append(name)
+
+    errors = []
+
+    def add_downloaded_file(obj_id, path):
+        try:
+            for name in obj_names[obj_id][1]:
+                zip_writer.write_file(name, path)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            os.remove(path)
+
+    downloader = AssetDownloader(username, repo_id, task_id=task_id, on_downloaded=add_downloaded_file)
+    try:
+        for obj_id, (file_name, _) in obj_names.items():
+            if errors:
+                break
+            downloader.add_file(obj_id, file_name, os.path.join(tmp_dir, obj_id))
+    finally:
+        downloader.wait()
+    if errors:
+        raise errors[0]
+    return [name for path in downloader.failed_paths for name in obj_names[os.path.basename(path)][1]]
@@ -20,7 +20,8 @@ def force_sync_common_dataset(context: dict):
     session_class = init_db_session_class()
     sql = '''
         SELECT dcds.dst_dtable_uuid, dcds.dst_table_id, dcd.table_id AS src_table_id, dcd.view_id AS src_view_id,
-                dcd.dtable_uuid AS src_dtable_uuid, dcds.id AS sync_id, dcds.src_version, dcd.id AS dataset_id
+                dcd.dtable_uuid AS src_dtable_uuid, dcds.id AS sync_id, dcds.src_version, dcd.id AS dataset_id,
+                dcds.last_sync_time
         FROM dtable_common_dataset dcd
         INNER JOIN dtable_common_dataset_sync dcds ON dcds.dataset_id=dcd.id
         INNER JOIN dtables d_src ON dcd.dtable_uuid=d_src.uuid AND d_src.deleted=0
@@ -30,12 +31,10 @@ def force_sync_common_dataset(context: dict):
     results = []
     with session_class() as db_session:
         for sync_item in db_session.execute(text(sql), {'dataset_id': dataset_id, 'dst_dtable_uuids': dst_dtable_uuids}):
-            with task_manager.dataset_sync_ids_lock:
-                if task_manager.is_syncing(sync_item.sync_id):
-                    continue
-                results.append(sync_item)
-                task_manager.add_dataset_sync(sync_item.sync_id)
-        # sync one by one
+            if not task_manager.add_dataset_sync(sync_item.sync_id):
+                continue
+            results.append(sync_item)
+        # sync to dsts in parallel
         try:
             batch_sync_common_dataset(context.get('app'), dataset_id, results, db_session, is_force_sync=True, operator=context.get('operator'))
         except Exception as e:
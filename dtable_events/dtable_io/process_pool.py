@@ -0,0 +1,152 @@
+import importlib
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from threading import Lock
+
+from dtable_events.app.config import IO_CPU_TASK_WORKERS, IO_CPU_TASK_MAX_TASKS_PER_CHILD
+
+logger = logging.getLogger(__name__)
+
+# tasks of pure python computing, e.g. parsing / writing excel, run in processes to not hold the GIL of io server
+CPU_BOUND_TASKS = {
+    'dtable_events.dtable_io:parse_excel_csv',
+    'dtable_events.dtable_io:import_excel_csv',
+    'dtable_events.dtable_io:import_excel_csv_add_table',
+    'dtable_events.dtable_io:append_excel_csv_append_parsed_file',
+    'dtable_events.dtable_io:update_excel_csv_update_parsed_file',
+    'dtable_events.dtable_io:import_excel_csv_to_dtable',
+    'dtable_events.dtable_io:import_excel_csv_to_table',
+    'dtable_events.dtable_io:update_table_via_excel_csv',
+    'dtable_events.dtable_io:append_excel_csv_to_table',
+    'dtable_events.dtable_io:convert_view_to_excel',
+    'dtable_events.dtable_io:convert_table_to_excel',
+    'dtable_events.dtable_io.import_airtable:import_airtable',
+    'dtable_events.dtable_io:import_big_excel',
+    'dtable_events.dtable_io:update_big_excel',
+    'dtable_events.dtable_io:convert_big_data_view_to_excel',
+    'dtable_events.dtable_io:convert_app_table_page_to_excel',
+}
+
+# interval (in seconds) of reporting status of a task from the child process
+STATUS_REPORT_INTERVAL = 1
+
+
+def get_func_path(func):
+    return f'{func.__module__}:{func.__qualname__}'
+
+
+def is_cpu_bound_task(func_path):
+    return func_path in CPU_BOUND_TASKS
+
+
+def _report_status(task_id, tasks_status_map, status_queue, stop_event):
+    while not stop_event.wait(STATUS_REPORT_INTERVAL):
+        if task_id not in tasks_status_map:
+            continue
+        try:
+            status_queue.put((task_id, deepcopy(tasks_status_map[task_id])))
+        except RuntimeError:
+            # status changed by the task while copying, report next time
+            continue
+
+
+def _run_task(func_path, args, task_id=None, status_arg_index=None, status_queue=None):
+    """
+    run in the child process, status written to the local tasks_status_map is reported to the parent,
+    return (result, final status) if the task has status
+    """
+    module_name, func_name = func_path.split(':', 1)
+    func = getattr(importlib.import_module(module_name), func_name)
+    if status_arg_index is None:
+        return func(*args)
+
+    tasks_status_map = {}
+    args = list(args)
+    args[status_arg_index] = tasks_status_map
+    stop_event = threading.Event()
+    reporter = threading.Thread(target=_report_status, args=(task_id, tasks_status_map, status_queue, stop_event), daemon=True)
+    reporter.start()
+    try:
+        result = func(*args)
+    finally:
+        stop_event.set()
+        reporter.join()
+    # final status is returned with the result, not to be overwritten by reports
+    return result, tasks_status_map.get(task_id)
+
+
+class CPUTaskPool(object):
+    """
+    A process pool for cpu bound io tasks, processes are spawned lazily and recycled after
+    `max_tasks_per_child` tasks to release memory. `run` blocks the calling task thread until the task is done.
+    """
+
+    def __init__(self, max_workers=IO_CPU_TASK_WORKERS, max_tasks_per_child=IO_CPU_TASK_MAX_TASKS_PER_CHILD):
+        self.max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self._executor = None
+        self._manager = None
+        self._status_queue = None
+        self._status_maps = {}  # task_id -> tasks_status_map of the task manager
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        return self.max_workers > 0
+
+    def _init(self):
+        with self._lock:
+            if self._executor:
+                return
+            # not fork, the io server process has many threads
+            mp_context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=mp_context,
+                                                 max_tasks_per_child=self.max_tasks_per_child)
+            self._manager = mp_context.Manager()
+            self._status_queue = self._manager.Queue()
+            threading.Thread(target=self._receive_status, name='CPUTaskPool Status', daemon=True).start()
+
+    def _receive_status(self):
+        while True:
+            try:
+                task_id, status = self._status_queue.get()
+                with self._lock:
+                    tasks_status_map = self._status_maps.get(task_id)
+                    if tasks_status_map is not None:
+                        tasks_status_map[task_id] = status
+            except Exception as e:
+                logger.error('receive cpu task status error: %s', e)
+                time.sleep(1)
+
+    def run(self, func_path, args, task_id=None, tasks_status_map=None):
+        """
+        run func in a child process and return its result, if `tasks_status_map` is in args,
+        status of `task_id` set by func in the child process is synced to it
+        """
+        self._init()
+        status_arg_index = None
+        if tasks_status_map is not None:
+            status_arg_index = next(i for i, arg in enumerate(args) if arg is tasks_status_map)
+            args = list(args)
+            args[status_arg_index] = None
+            with self._lock:
+                self._status_maps[task_id] = tasks_status_map
+        future = self._executor.submit(_run_task, func_path, args, task_id, status_arg_index,
+                                       self._status_queue if status_arg_index is not None else None)
+        if status_arg_index is None:
+            return future.result()
+        try:
+            result, status = future.result()
+        finally:
+            with self._lock:
+                self._status_maps.pop(task_id, None)
+        if status is not None:
+            tasks_status_map[task_id] = status
+        return result
+
+
+cpu_task_pool = CPUTaskPool()
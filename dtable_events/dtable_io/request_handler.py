@@ -45,9 +45,9 @@ def add_export_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -78,9 +78,9 @@ def add_import_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -115,9 +115,9 @@ def add_big_data_screen_export_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -141,9 +141,9 @@ def add_big_data_screen_import_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -168,9 +168,9 @@ def add_big_data_screen_app_export_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -196,9 +196,9 @@ def add_big_data_screen_app_import_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -224,9 +224,9 @@ def add_parse_excel_csv_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -253,9 +253,9 @@ def add_import_excel_csv_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -288,9 +288,9 @@ def add_import_excel_csv_add_table_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -322,9 +322,9 @@ def add_append_excel_csv_append_parsed_file_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -349,9 +349,9 @@ def add_append_excel_csv_upload_file_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -394,6 +394,14 @@ def query_status():
     return_result = {'is_finished': is_finished}
     if isinstance(task_result, dict):
         return_result.update(task_result)
+    elif not is_finished:
+        try:
+            progress = task_manager.get_task_progress(task_id)
+        except Exception as e:
+            dtable_io_logger.warning('query task %s progress error: %s', task_id, e)
+            progress = None
+        if progress:
+            return_result['progress'] = progress
 
     return make_response((return_result, 200))
 
@@ -466,9 +474,9 @@ def convert_page_design_to_pdf():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -493,9 +501,9 @@ def convert_document_to_pdf():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -519,9 +527,9 @@ def dtable_asset_files():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -556,9 +564,9 @@ def transfer_dtable_asset_files():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -737,7 +745,7 @@ def add_run_auto_rule_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         return make_response(('dtable io server busy.', 400))
 
     data = request.form
@@ -761,9 +769,9 @@ def add_update_excel_upload_excel_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -788,9 +796,9 @@ def add_update_excel_csv_update_parsed_file_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -821,9 +829,9 @@ def add_update_csv_upload_csv_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -849,9 +857,9 @@ def add_import_excel_csv_to_dtable_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -877,9 +885,9 @@ def add_import_excel_to_table_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -904,9 +912,9 @@ def add_update_table_via_excel_csv_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -938,9 +946,9 @@ def add_append_excel_csv_to_table_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -966,9 +974,9 @@ def import_table_from_base():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -991,9 +999,9 @@ def import_common_dataset():
     is_valid, error = check_auth_token(request)
     if not is_valid:
         return make_response((error, 403))
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
     try:
@@ -1015,9 +1023,9 @@ def sync_common_data():
     is_valid, error = check_auth_token(request)
     if not is_valid:
         return make_response((error, 403))
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
     try:
@@ -1041,9 +1049,9 @@ def force_sync_common_data():
     is_valid, error = check_auth_token(request)
     if not is_valid:
         return make_response((error, 403))
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
     try:
@@ -1068,9 +1076,9 @@ def convert_view_to_excel():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -1105,9 +1113,9 @@ def convert_table_to_excel():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -1133,7 +1141,7 @@ def add_app_users_sync_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         return make_response(('dtable io server busy.', 400))
 
     data = request.form
@@ -1274,9 +1282,9 @@ def add_export_page_design_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -1301,9 +1309,9 @@ def add_import_page_design_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -1447,9 +1455,9 @@ def add_export_document_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -1476,9 +1484,9 @@ def add_import_document_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -1536,9 +1544,9 @@ def add_import_airtable_task():
     if not is_valid:
         return make_response((error, 403))
 
-    if task_manager.tasks_queue.full():
+    if task_manager.is_queue_full():
         dtable_io_logger.warning('dtable io server busy, queue size: %d, current tasks: %s, threads is_alive: %s'
-                                 % (task_manager.tasks_queue.qsize(), task_manager.current_task_info,
+                                 % (task_manager.queue_size(), task_manager.current_task_info,
                                     task_manager.threads_is_alive()))
         return make_response(('dtable io server busy.', 400))
 
@@ -0,0 +1,252 @@
+import json
+import logging
+import queue
+import threading
+import time
+from threading import Lock
+
+from dtable_events.app.event_redis import RedisClient
+
+logger = logging.getLogger(__name__)
+
+TASK_BACKEND_MEMORY = 'memory'
+TASK_BACKEND_REDIS = 'redis'
+
+# KEYS[1]: queue, KEYS[2]: processing
+# ARGV[1]: lease deadline
+CLAIM_TASK_SCRIPT = '''
+local task_id = redis.call('RPOP', KEYS[1])
+if not task_id then
+    return false
+end
+redis.call('ZADD', KEYS[2], ARGV[1], task_id)
+return task_id
+'''
+
+# KEYS[1]: queue, KEYS[2]: processing, KEYS[3]: attempts
+# ARGV[1]: now, ARGV[2]: max attempts
+# requeue tasks whose lease expired, return tasks failed too many times
+REQUEUE_TASKS_SCRIPT = '''
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+local failed = {}
+for _, task_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], task_id)
+    local attempts = redis.call('HINCRBY', KEYS[3], task_id, 1)
+    if attempts >= tonumber(ARGV[2]) then
+        table.insert(failed, task_id)
+    else
+        redis.call('RPUSH', KEYS[1], task_id)
+    end
+end
+return failed
+'''
+
+
+class MemoryTaskBackend(object):
+    """tasks and results in process memory, results not queried are removed after `result_timeout`"""
+
+    def __init__(self, maxsize=10, result_timeout=60 * 60):
+        self.tasks_queue = queue.Queue(maxsize)
+        self.tasks_map = {}
+        self.task_results_map = {}  # task_id -> (expire_at, result)
+        self.result_timeout = result_timeout
+        self._results_lock = Lock()
+        self._marks = {}  # name -> expire_at
+        self._marks_lock = Lock()
+
+    def full(self):
+        return self.tasks_queue.full()
+
+    def qsize(self):
+        return self.tasks_queue.qsize()
+
+    def put(self, task_id, task):
+        self.tasks_map[task_id] = task
+        self.tasks_queue.put(task_id)
+
+    def claim(self, timeout=2):
+        try:
+            task_id = self.tasks_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None, None
+        task = self.tasks_map.get(task_id)
+        if not task:
+            # canceled
+            return None, None
+        return task_id, task
+
+    def ack(self, task_id, result):
+        self.tasks_map.pop(task_id, None)
+        now = time.time()
+        with self._results_lock:
+            for expired_task_id in [key for key, (expire_at, _) in self.task_results_map.items() if expire_at < now]:
+                self.task_results_map.pop(expired_task_id, None)
+            self.task_results_map[task_id] = (now + self.result_timeout, result)
+
+    def exists(self, task_id):
+        return task_id in (self.tasks_map.keys() | self.task_results_map.keys())
+
+    def pop_result(self, task_id):
+        with self._results_lock:
+            _, result = self.task_results_map.pop(task_id, (None, None))
+        return result
+
+    def cancel(self, task_id):
+        self.tasks_map.pop(task_id, None)
+
+    def acquire_mark(self, name, timeout):
+        """
+        mark `name` in flight until released or expired after `timeout` seconds, return False if marked already
+        """
+        now = time.time()
+        with self._marks_lock:
+            expire_at = self._marks.get(name)
+            if expire_at and expire_at > now:
+                return False
+            self._marks[name] = now + timeout
+            return True
+
+    def release_mark(self, name):
+        with self._marks_lock:
+            self._marks.pop(name, None)
+
+    def start(self):
+        pass
+
+
+class RedisTaskBackend(object):
+    """
+    Tasks, queue and results in redis, shared by all io servers.
+
+    A claimed task is leased to the worker until `visibility_timeout`, leases of running tasks are renewed
+    periodically, so tasks of a crashed server are requeued when their leases expire, and failed after
+    `max_attempts`. Results are kept for `result_timeout` seconds.
+    Tasks must be json serializable.
+    """
+
+    def __init__(self, maxsize=10, result_timeout=60 * 60, visibility_timeout=5 * 60, max_attempts=3,
+                 key_prefix='dtable_io_tasks'):
+        self.maxsize = maxsize
+        self.result_timeout = result_timeout
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.task_timeout = 7 * 24 * 60 * 60
+
+        self.queue_key = f'{key_prefix}:queue'
+        self.processing_key = f'{key_prefix}:processing'
+        self.attempts_key = f'{key_prefix}:attempts'
+        self.task_key_prefix = f'{key_prefix}:task:'
+        self.result_key_prefix = f'{key_prefix}:result:'
+        self.mark_key_prefix = f'{key_prefix}:mark:'
+
+        self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=10,
+                                         health_check_interval=30, retry_on_timeout=True)
+        self._claim_script = self._redis_client.register_script(CLAIM_TASK_SCRIPT)
+        self._requeue_script = self._redis_client.register_script(REQUEUE_TASKS_SCRIPT)
+
+        self._running_task_ids = set()
+        self._running_lock = Lock()
+
+    def full(self):
+        return self.qsize() >= self.maxsize
+
+    def qsize(self):
+        return self._redis_client.llen(self.queue_key)
+
+    def put(self, task_id, task):
+        pipeline = self._redis_client.pipeline()
+        pipeline.set(self.task_key_prefix + task_id, json.dumps(task), ex=self.task_timeout)
+        pipeline.lpush(self.queue_key, task_id)
+        pipeline.execute()
+
+    def claim(self, timeout=2):
+        task_id = self._claim_script(keys=[self.queue_key, self.processing_key],
+                                     args=[time.time() + self.visibility_timeout])
+        if not task_id:
+            time.sleep(min(timeout, 0.5))
+            return None, None
+        task_str = self._redis_client.get(self.task_key_prefix + task_id)
+        if not task_str:
+            # canceled
+            self._clean(task_id)
+            return None, None
+        with self._running_lock:
+            self._running_task_ids.add(task_id)
+        return task_id, json.loads(task_str)
+
+    def _clean(self, task_id, pipeline=None):
+        execute = pipeline is None
+        pipeline = pipeline or self._redis_client.pipeline()
+        pipeline.zrem(self.processing_key, task_id)
+        pipeline.hdel(self.attempts_key, task_id)
+        pipeline.delete(self.task_key_prefix + task_id)
+        if execute:
+            pipeline.execute()
+
+    def ack(self, task_id, result):
+        with self._running_lock:
+            self._running_task_ids.discard(task_id)
+        pipeline = self._redis_client.pipeline()
+        pipeline.set(self.result_key_prefix + task_id, json.dumps(result, default=str), ex=self.result_timeout)
+        self._clean(task_id, pipeline=pipeline)
+        pipeline.execute()
+
+    def exists(self, task_id):
+        return self._redis_client.exists(self.task_key_prefix + task_id, self.result_key_prefix + task_id) > 0
+
+    def pop_result(self, task_id):
+        pipeline = self._redis_client.pipeline()
+        pipeline.get(self.result_key_prefix + task_id)
+        pipeline.delete(self.result_key_prefix + task_id)
+        result_str, _ = pipeline.execute()
+        return json.loads(result_str) if result_str else None
+
+    def cancel(self, task_id):
+        pipeline = self._redis_client.pipeline()
+        pipeline.lrem(self.queue_key, 0, task_id)
+        pipeline.delete(self.task_key_prefix + task_id)
+        pipeline.execute()
+
+    def acquire_mark(self, name, timeout):
+        """
+        mark `name` in flight for all io servers, released by the server running the task, or expired after
+        `timeout` seconds if the server crashed, return False if marked already
+        """
+        return self._redis_client.set(self.mark_key_prefix + name, 1, timeout=timeout, nx=True)
+
+    def release_mark(self, name):
+        self._redis_client.delete(self.mark_key_prefix + name)
+
+    def renew_leases(self):
+        with self._running_lock:
+            task_ids = list(self._running_task_ids)
+        if task_ids:
+            deadline = time.time() + self.visibility_timeout
+            self._redis_client.zadd(self.processing_key, {task_id: deadline for task_id in task_ids}, xx=True)
+
+    def requeue_expired_tasks(self):
+        failed_task_ids = self._requeue_script(keys=[self.queue_key, self.processing_key, self.attempts_key],
+                                               args=[time.time(), self.max_attempts])
+        for task_id in failed_task_ids:
+            logger.error('io task %s failed after %s attempts', task_id, self.max_attempts)
+            self.ack(task_id, {'success': False, 'error_msg': 'task failed after too many attempts'})
+
+    def maintain(self):
+        while True:
+            time.sleep(self.visibility_timeout / 3)
+            try:
+                self.renew_leases()
+                self.requeue_expired_tasks()
+            except Exception as e:
+                logger.error('maintain io tasks error: %s', e)
+
+    def start(self):
+        threading.Thread(target=self.maintain, name='TaskManager Maintain', daemon=True).start()
+
+
+def get_task_backend(backend, maxsize=10, result_timeout=60 * 60):
+    if backend == TASK_BACKEND_REDIS:
+        return RedisTaskBackend(maxsize=maxsize, result_timeout=result_timeout)
+    if backend != TASK_BACKEND_MEMORY:
+        logger.warning('Unknown io task backend %s, use %s', backend, TASK_BACKEND_MEMORY)
+    return MemoryTaskBackend(maxsize=maxsize, result_timeout=result_timeout)
@@ -3,6 +3,7 @@ import uuid
 import queue
 import threading
 
+from dtable_events.dtable_io.process_pool import cpu_task_pool, get_func_path, is_cpu_bound_task
 from dtable_events.utils.utils_metric import publish_metric, BIG_DATA_TASK_MANAGER_METRIC_HELP
 
 class BigDataTaskManager(object):
@@ -61,7 +62,11 @@ class BigDataTaskManager(object):
                 start_time = time.time()
 
                 # run
-                task[0](*task[1])
+                func_path = get_func_path(task[0])
+                if cpu_task_pool.enabled and is_cpu_bound_task(func_path):
+                    cpu_task_pool.run(func_path, task[1], task_id=task_id, tasks_status_map=self.tasks_status_map)
+                else:
+                    task[0](*task[1])
                 self.tasks_map[task_id] = 'success'
                 publish_metric(self.tasks_queue.qsize(), metric_name='big_data_io_task_queue_size', metric_help=BIG_DATA_TASK_MANAGER_METRIC_HELP)
 
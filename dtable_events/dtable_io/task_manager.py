@@ -1,17 +1,22 @@
+import importlib
 import inspect
 import json
 import os
-import queue
 import threading
 import time
 import uuid
-from threading import Lock
 
+from dtable_events.app.config import IO_TASK_BACKEND, IO_TASK_QUEUE_SIZE, IO_TASK_RESULT_TIMEOUT
 from dtable_events.app.event_redis import redis_cache
+from dtable_events.dtable_io.process_pool import cpu_task_pool, is_cpu_bound_task
+from dtable_events.dtable_io.task_backend import MemoryTaskBackend, get_task_backend
 from dtable_events.utils.utils_metric import publish_metric, TASK_MANAGER_METRIC_HELP
 
 from seaserv import seafile_api
 
+# syncs in flight of io servers crashed are released after this
+DATASET_SYNC_MARK_TIMEOUT = 2 * 60 * 60
+
 
 def log_function_call(func):
 
@@ -41,27 +46,45 @@ def log_function_call(func):
 class TaskManager(object):
 
     def __init__(self):
-        self.tasks_map = {}
-        self.task_results_map = {}
-        self.tasks_queue = queue.Queue(10)
+        self.backend = MemoryTaskBackend()
         self.current_task_info = {}
         self.threads = []
 
-        self.dataset_sync_ids = set()
-        self.dataset_sync_ids_lock = Lock()
-
-        self.force_sync_dataset_ids = set()
-        self.force_sync_dataset_ids_lock = Lock()
-
         self.conf = {}
 
     def init(self, app, workers, io_task_timeout):
         self.app = app
         self.conf['io_task_timeout'] = io_task_timeout
         self.conf['workers'] = workers
+        self.backend = get_task_backend(IO_TASK_BACKEND, maxsize=IO_TASK_QUEUE_SIZE,
+                                        result_timeout=IO_TASK_RESULT_TIMEOUT)
 
     def is_valid_task_id(self, task_id):
-        return task_id in (self.tasks_map.keys() | self.task_results_map.keys())
+        return self.backend.exists(task_id)
+
+    def is_queue_full(self):
+        return self.backend.full()
+
+    def queue_size(self):
+        return self.backend.qsize()
+
+    def put_task(self, task_id, task, with_app=False):
+        """
+        task is a tuple of (func, args), func is saved as 'module:qualname' to make the task serializable,
+        or 'app:attr.method' for method of app. If with_app, app is set to context (the first arg) when run.
+        """
+        func, args = task
+        if not isinstance(func, str):
+            func = f'{func.__module__}:{func.__qualname__}'
+        self.backend.put(task_id, {'func': func, 'args': list(args), 'with_app': with_app})
+        publish_metric(self.queue_size(), metric_name='io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+
+    def resolve_task_func(self, func_path):
+        module_name, attrs = func_path.split(':', 1)
+        obj = self.app if module_name == 'app' else importlib.import_module(module_name)
+        for attr in attrs.split('.'):
+            obj = getattr(obj, attr)
+        return obj
 
     @log_function_call
     def add_export_task(self, username, repo_id, workspace_id, dtable_uuid, dtable_name, ignore_asset, ignore_archive_backup, is_export_folder, folder_path):
@@ -79,9 +102,7 @@ class TaskManager(object):
         else:
             task = (get_dtable_export_content_folder,
                     (username, repo_id, workspace_id, dtable_uuid, asset_dir_id, ignore_archive_backup, folder_path, task_id))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), metric_name='io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
 
         return task_id
 
@@ -100,9 +121,7 @@ class TaskManager(object):
             task = (post_dtable_import_files_folder,
                     (username, repo_id, workspace_id, dtable_uuid, folder_path, in_storage,
                     can_use_automation_rules, can_use_workflows, can_use_external_apps, can_import_archive, owner, org_id, task_id))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -112,9 +131,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (get_dtable_export_asset_files,
                 (username, repo_id, dtable_uuid, files, task_id, files_map))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -123,9 +140,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (get_dtable_export_big_data_screen,
                 (username, repo_id, dtable_uuid, page_id, task_id))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -134,9 +149,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (import_big_data_screen,
                 (username, repo_id, dtable_uuid, page_id))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -145,9 +158,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (get_dtable_export_big_data_screen_app,
                 (username, repo_id, dtable_uuid, app_uuid, app_id, task_id))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -156,9 +167,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (import_big_data_screen_app,
                 (username, repo_id, dtable_uuid, app_uuid, app_id))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -177,9 +186,7 @@ class TaskManager(object):
                  replace,
                  repo_api_token,
                  seafile_server_url))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -189,9 +196,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (parse_excel_csv,
                 (username, repo_id, file_name, file_type, parse_type, dtable_uuid))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -201,9 +206,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (import_excel_csv,
                 (username, repo_id, dtable_uuid, dtable_name, included_tables, lang))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -213,9 +216,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (import_excel_csv_add_table,
                 (username, dtable_uuid, dtable_name, included_tables, lang))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -225,9 +226,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (append_excel_csv_append_parsed_file,
                 (username, dtable_uuid, file_name, table_name))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -237,18 +236,14 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (append_excel_csv_upload_file,
                 (username, file_name, dtable_uuid, table_name, file_type))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
     def add_run_auto_rule_task(self, automation_rule_id):
         task_id = str(uuid.uuid4())
-        task = (self.app._automations_pipeline.put_test_task, (automation_rule_id, task_id))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        task = ('app:_automations_pipeline.put_test_task', (automation_rule_id, task_id))
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -259,9 +254,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (update_excel_csv_update_parsed_file,
                 (username, dtable_uuid, file_name, table_name, selected_columns, can_add_row, can_update_row))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -271,9 +264,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (update_excel_upload_excel,
                 (username, file_name, dtable_uuid, table_name))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -283,9 +274,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (update_csv_upload_csv,
                 (username, file_name, dtable_uuid, table_name))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -294,9 +283,7 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (import_excel_csv_to_dtable, (username, repo_id, dtable_name, dtable_uuid, file_type, lang))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -305,9 +292,7 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (import_excel_csv_to_table, (username, file_name, dtable_uuid, file_type, lang))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -316,9 +301,7 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (update_table_via_excel_csv, (username, file_name, dtable_uuid, table_name, selected_columns, file_type, can_add_row, can_update_row))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -327,26 +310,36 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (append_excel_csv_to_table, (username, file_name, dtable_uuid, table_name, file_type))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     def query_status(self, task_id):
-        task_result = self.task_results_map.pop(task_id, None)
+        task_result = self.backend.pop_result(task_id)
         if not task_result:
             return False, None
+        redis_cache.delete(self.get_task_progress_key(task_id))
         return True, task_result
 
+    def get_task_progress_key(self, task_id):
+        return f'dtable_io_task_progress:{task_id}'
+
+    def set_task_progress(self, task_id, progress):
+        """
+        progress of a running task, dict, saved in redis to be queried from any io server
+        """
+        redis_cache.set(self.get_task_progress_key(task_id), json.dumps(progress), timeout=IO_TASK_RESULT_TIMEOUT)
+
+    def get_task_progress(self, task_id):
+        progress = redis_cache.get(self.get_task_progress_key(task_id))
+        return json.loads(progress) if progress else None
+
     def convert_page_design_to_pdf(self, dtable_uuid, page_id, row_id, username):
         from dtable_events.dtable_io import convert_page_design_to_pdf
 
         task_id = str(uuid.uuid4())
         task = (convert_page_design_to_pdf,
                 (dtable_uuid, page_id, row_id, username))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
 
         return task_id
 
@@ -356,9 +349,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (convert_document_to_pdf,
                 (dtable_uuid, doc_uuid, row_id, username))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
 
         return task_id
 
@@ -368,9 +359,7 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (import_table_from_base, (context,))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
 
         return task_id
 
@@ -379,11 +368,8 @@ class TaskManager(object):
         from dtable_events.dtable_io.import_sync_common_dataset import import_common_dataset
 
         task_id = str(uuid.uuid4())
-        context['app'] = self.app
         task = (import_common_dataset, (context,))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task, with_app=True)
 
         return task_id
 
@@ -395,17 +381,16 @@ class TaskManager(object):
         from dtable_events.dtable_io.import_sync_common_dataset import sync_common_dataset
 
         dataset_sync_id = context.get('sync_id')
-        with self.dataset_sync_ids_lock:
-            if self.is_syncing(dataset_sync_id):
-                return None, 'syncing'
-            self.add_dataset_sync(dataset_sync_id)
+        if not self.add_dataset_sync(dataset_sync_id):
+            return None, 'syncing'
 
         task_id = str(uuid.uuid4())
-        context['app'] = self.app
         task = (sync_common_dataset, (context,))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        try:
+            self.put_task(task_id, task, with_app=True)
+        except Exception:
+            self.finish_dataset_sync(dataset_sync_id)
+            raise
 
         return task_id, None
 
@@ -417,17 +402,16 @@ class TaskManager(object):
         from dtable_events.dtable_io.import_sync_common_dataset import force_sync_common_dataset
 
         dataset_id = context.get('dataset_id')
-        with self.force_sync_dataset_ids_lock:
-            if self.is_dataset_force_syncing(dataset_id):
-                return None, 'syncing'
-            self.force_sync_dataset_ids.add(dataset_id)
+        if not self.add_dataset_force_sync(dataset_id):
+            return None, 'syncing'
 
         task_id = str(uuid.uuid4())
-        context['app'] = self.app
         task = (force_sync_common_dataset, (context,))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        try:
+            self.put_task(task_id, task, with_app=True)
+        except Exception:
+            self.finish_dataset_force_sync(dataset_id)
+            raise
 
         return task_id, None
 
@@ -437,9 +421,7 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (convert_view_to_excel, (dtable_uuid, table_id, view_id, username, id_in_org, user_department_ids_map, permission, name, repo_id, is_support_image))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
 
         return task_id
 
@@ -449,9 +431,7 @@ class TaskManager(object):
 
         task_id = str(uuid.uuid4())
         task = (convert_table_to_excel, (dtable_uuid, table_id, username, name, repo_id, is_support_image))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
 
         return task_id
 
@@ -460,9 +440,7 @@ class TaskManager(object):
         from dtable_events.dtable_io import app_user_sync
         task_id = str(uuid.uuid4())
         task = (app_user_sync, (dtable_uuid, app_name, app_id, table_name, table_id, username))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
 
         return task_id
 
@@ -471,9 +449,7 @@ class TaskManager(object):
         from dtable_events.dtable_io import export_page_design
         task_id = str(uuid.uuid4())
         task = (export_page_design, (repo_id, dtable_uuid, page_id, username))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
 
         return task_id
 
@@ -482,9 +458,7 @@ class TaskManager(object):
         from dtable_events.dtable_io import import_page_design
         task_id = str(uuid.uuid4())
         task = (import_page_design, (repo_id, workspace_id, dtable_uuid, page_id, is_dir, username))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
 
         return task_id
 
@@ -495,9 +469,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (export_document,
                 (repo_id, dtable_uuid, doc_uuid, parent_path, filename, username))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
 
         return task_id
 
@@ -508,9 +480,7 @@ class TaskManager(object):
         task_id = str(uuid.uuid4())
         task = (import_document,
                 (repo_id, dtable_uuid, doc_uuid, view_id, table_id, username))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     @log_function_call
@@ -518,9 +488,7 @@ class TaskManager(object):
         from dtable_events.dtable_io.import_airtable import import_airtable
         task_id = str(uuid.uuid4())
         task = (import_airtable, (context,))
-        self.tasks_queue.put(task_id)
-        self.tasks_map[task_id] = task
-        publish_metric(self.tasks_queue.qsize(), 'io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+        self.put_task(task_id, task)
         return task_id
 
     def threads_is_alive(self):
@@ -534,64 +502,75 @@ class TaskManager(object):
 
         while True:
             try:
-                task_id = self.tasks_queue.get(timeout=2)
-            except queue.Empty:
-                continue
+                task_id, task = self.backend.claim(timeout=2)
             except Exception as e:
                 dtable_io_logger.error(e)
+                time.sleep(2)
                 continue
-
-            task = self.tasks_map.get(task_id)
-            if type(task) != tuple or len(task) < 1:
+            if not task_id:
                 continue
-            if type(task[0]).__name__ not in ('function', 'method'):
+
+            try:
+                func = self.resolve_task_func(task['func'])
+                args = task['args']
+                if task.get('with_app'):
+                    args[0]['app'] = self.app
+            except Exception as e:
+                dtable_io_logger.error('Invalid task %s: %s error: %s', task_id, task, e)
+                self.backend.ack(task_id, {'success': False, 'error_msg': 'Invalid task'})
                 continue
-            task_info = task_id + ' ' + str(task[0])
+            task_info = task_id + ' ' + task['func']
             try:
                 self.current_task_info[task_id] = task_info
                 dtable_io_logger.info('Run task: %s' % task_info)
                 start_time = time.time()
 
                 # run
-                task_result = task[0](*task[1])
+                if cpu_task_pool.enabled and is_cpu_bound_task(task['func']):
+                    task_result = cpu_task_pool.run(task['func'], args)
+                else:
+                    task_result = func(*args)
                 if isinstance(task_result, dict):
                     task_result['success'] = True
                 else:
                     task_result = {'success': True}
-                publish_metric(self.tasks_queue.qsize(), metric_name='io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
-                self.task_results_map[task_id] = task_result
+                publish_metric(self.queue_size(), metric_name='io_task_queue_size', metric_help=TASK_MANAGER_METRIC_HELP)
+                self.backend.ack(task_id, task_result)
 
                 finish_time = time.time()
                 dtable_io_logger.info('Run task success: %s cost %ds \n' % (task_info, int(finish_time - start_time)))
                 self.current_task_info.pop(task_id, None)
             except Exception as e:
-                self.task_results_map[task_id] = {
-                    'success': False,
-                    'error_msg': str(e.args[0])
-                }
+                try:
+                    self.backend.ack(task_id, {
+                        'success': False,
+                        'error_msg': str(e.args[0]) if e.args else str(e)
+                    })
+                except Exception as ack_error:
+                    dtable_io_logger.error('Failed to save result of task %s error: %s', task_info, ack_error)
                 if str(e.args[0]) in ('Excel format error', 'Number of cells returned exceeds the limit of 1 million', 'base_exceeds_limit'):
-                    dtable_io_logger.warning('Failed to handle task %s args: %s error: %s \n' % (task_info, task[1], e))
+                    dtable_io_logger.warning('Failed to handle task %s args: %s error: %s \n' % (task_info, args, e))
                 elif str(e.args[0]).startswith('import_sync_common_dataset:'):
                     # Errors in import/sync common dataset, those have been record in real task code, so no duplicated error logs here
                     # Including source/destination table not found...
-                    dtable_io_logger.warning('Failed to handle task %s args: %s error: %s \n' % (task_info, task[1], e))
+                    dtable_io_logger.warning('Failed to handle task %s args: %s error: %s \n' % (task_info, args, e))
                 elif str(e.args[0]).startswith('import_table_from_base:'):
                     # Errors in import-table-from-base, those have been record in real task code, so no duplicated error logs here
-                    dtable_io_logger.warning('Failed to handle task %s args: %s error: %s \n' % (task_info, task[1], e))
+                    dtable_io_logger.warning('Failed to handle task %s args: %s error: %s \n' % (task_info, args, e))
                 else:
                     dtable_io_logger.exception(e)
-                    dtable_io_logger.error('Failed to handle task %s, args: %s, error: %s \n' % (task_info, task[1], e))
+                    dtable_io_logger.error('Failed to handle task %s, args: %s, error: %s \n' % (task_info, args, e))
                 self.current_task_info.pop(task_id, None)
             finally:
-                self.tasks_map.pop(task_id, None)
-                if getattr(task[0], '__name__', None) == 'sync_common_dataset':
-                    context = task[1][0]
+                if getattr(func, '__name__', None) == 'sync_common_dataset':
+                    context = args[0]
                     self.finish_dataset_sync(context.get('sync_id'))
-                if getattr(task[0], '__name__', None) == 'force_sync_common_dataset':
-                    context = task[1][0]
+                if getattr(func, '__name__', None) == 'force_sync_common_dataset':
+                    context = args[0]
                     self.finish_dataset_force_sync(context.get('dataset_id'))
 
     def run(self):
+        self.backend.start()
         thread_num = self.conf['workers']
         for i in range(thread_num):
             t_name = 'TaskManager Thread-' + str(i)
@@ -601,24 +580,22 @@ class TaskManager(object):
             t.start()
 
     def cancel_task(self, task_id):
-        self.tasks_map.pop(task_id, None)
+        self.backend.cancel(task_id)
 
-    def is_syncing(self, sync_id):
-        return sync_id in self.dataset_sync_ids
+    # syncs in flight are marked in the backend, shared by io servers with redis backend, and released by the
+    # worker running the task, which may be on another server than the one adding it
+    def add_dataset_sync(self, sync_id):
+        """return False if the sync is in flight already"""
+        return self.backend.acquire_mark(f'dataset_sync:{sync_id}', DATASET_SYNC_MARK_TIMEOUT)
 
     def finish_dataset_sync(self, sync_id):
-        with self.dataset_sync_ids_lock:
-            self.dataset_sync_ids -= {sync_id}
+        self.backend.release_mark(f'dataset_sync:{sync_id}')
 
-    def add_dataset_sync(self, db_sync_id):
-        self.dataset_sync_ids.add(db_sync_id)
-
-    def is_dataset_force_syncing(self, dataset_id):
-        return dataset_id in self.force_sync_dataset_ids
+    def add_dataset_force_sync(self, dataset_id):
+        """return False if the force sync of the dataset is in flight already"""
+        return self.backend.acquire_mark(f'dataset_force_sync:{dataset_id}', DATASET_SYNC_MARK_TIMEOUT)
 
     def finish_dataset_force_sync(self, dataset_id):
-        with self.force_sync_dataset_ids_lock:
-            self.force_sync_dataset_ids -= {dataset_id}
-
+        self.backend.release_mark(f'dataset_force_sync:{dataset_id}')
 
 task_manager = TaskManager()
@@ -8,7 +8,6 @@ import io
 import uuid
 import datetime
 import random
-import stat
 import string
 import sys
 import re
@@ -23,6 +22,8 @@ from sqlalchemy import text
 from seaserv import seafile_api, USE_GO_FILESERVER
 
 from dtable_events.app.config import INNER_DTABLE_DB_URL, INNER_DTABLE_SERVER_URL, DTABLE_WEB_SERVICE_URL, INNER_DTABLE_WEB_SERVICE_URL, INNER_FILE_SERVER_ROOT
+from dtable_events.dtable_io.asset_download import AssetDownloader
+from dtable_events.dtable_io.export_zip import ExportZipWriter
 from dtable_events.dtable_io.external_app import APP_USERS_COUMNS_TYPE_MAP, match_user_info, update_app_sync, \
     get_row_ids_for_delete, get_app_users
 from dtable_events.dtable_io.task_manager import task_manager
@@ -180,6 +181,18 @@ def log_dtable_info(dtable_uuid, content, username, op_type):
         dtable_io_logger.exception('%s username: %s dtable: %s error: %s', op_type, username, dtable_uuid, e)
 
 
+def save_export_file(path, file_name, content):
+    """
+    :param path: dir of export, or an ExportZipWriter to add the file to the archive directly
+    :param content: str or bytes
+    """
+    if isinstance(path, ExportZipWriter):
+        path.write_bytes(file_name, content)
+        return
+    with open(os.path.join(path, file_name), 'wb' if isinstance(content, bytes) else 'w') as f:
+        f.write(content)
+
+
 def prepare_dtable_json_from_memory(workspace_id, dtable_uuid, username, path):
     """
     Used in dtable file export in real-time from memory by request the api of dtable-server
@@ -197,142 +210,23 @@ def prepare_dtable_json_from_memory(workspace_id, dtable_uuid, username, path):
     log_dtable_info(dtable_uuid, dtable_content, username, 'export dtable')
     content_json = json.dumps(dtable_content).encode('utf-8')
 
-    with open(os.path.join(path, 'content.json'), 'wb') as f:
-        f.write(content_json)
+    save_export_file(path, 'content.json', content_json)
 
 def prepare_asset_files_download(username, repo_id, dtable_uuid, asset_dir_id, path, task_id):
-    from dtable_events.dtable_io import dtable_io_logger, add_task_id_to_log
-
-    export_asset_path = os.path.join(path, 'asset')
-    def download_assets_files_recursively(username, repo_id, dtable_uuid, asset_dir_id, task_id, base_path=None):
-        """
-        Recursively download asset directory.
-        1. Walk through directory entries via file server API
-        2. For each file, download individually; on error, skip
-        3. Skip files that already exist if resumeable_export is True
-        """
-        if base_path is None:
-            base_path = export_asset_path
-
-        os.makedirs(base_path, exist_ok=True)
-        try:
-            entries = seafile_api.list_dir_by_dir_id(repo_id, asset_dir_id)
-        except Exception as e:
-            dtable_io_logger.error(add_task_id_to_log(f"Failed to list dir {asset_dir_id}: {e}", task_id))
-            return
-
-        asset_path = base_path[len(export_asset_path):] or '/'
-        dtable_io_logger.info(add_task_id_to_log(f"Start to download assets in {asset_path}", task_id))
-
-        file_download_count = 0
-        file_skip_count = 0
-        file_fail_count = 0
-        for entry in entries:
-            file_name = entry.obj_name
-            obj_id = entry.obj_id
-            path = os.path.join(base_path, file_name)
-
-            if stat.S_ISDIR(entry.mode):
-                # recurse into subdir
-                download_assets_files_recursively(username, repo_id, dtable_uuid, obj_id, task_id,
-                                            base_path=path)
-            else:
-                # skip if already downloaded 
-                if os.path.exists(path):
-                    file_skip_count += 1
-                    continue
-                token = seafile_api.get_fileserver_access_token(
-                    repo_id, obj_id, 'download', username, use_onetime=False
-                )
-                #ensure file downlod intact
-                temp_path = path +  '.part  '
-                try:
-                    url = get_file_download_url(token, file_name)
-                    resp = requests.get(url, stream=True)
-                    resp.raise_for_status()
-
-                    with open(temp_path, 'wb') as f:
-                        for chunk in resp.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                    os.rename(temp_path, path)
-
-                except Exception as e:
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-                    file_fail_count += 1
-                    dtable_io_logger.warning(add_task_id_to_log(f"Failed to download {path}, skipping: {e}", task_id))    
-                else:
-                    file_download_count += 1
-        dtable_io_logger.info(add_task_id_to_log(f"Downloaded {file_download_count} files, skip {file_skip_count} files, failed {file_fail_count} files in {asset_path}", task_id))
-    dtable_io_logger.info(add_task_id_to_log(f"export dtable: {dtable_uuid} username: {username} start asset recursive download", task_id))
-    download_assets_files_recursively(username, repo_id, dtable_uuid, asset_dir_id, task_id)
-    dtable_io_logger.info(add_task_id_to_log(f"export dtable: {dtable_uuid} username: {username} asset download complete", task_id))
-
-
-def prepare_asset_file_folder(username, repo_id, dtable_uuid, asset_dir_id, path, task_id):
     """
-    used in export dtable
-    create asset folder at /tmp/dtable-io/<dtable_uuid>/dtable_asset
-    notice that create_dtable_json and this function create file at same directory
-
-    1. get asset zip from file_server
-    2. unzip it at /tmp/dtable-io/<dtable_uuid>/dtable_asset/
-
-    :param username:
-    :param repo_id:
-    :param asset_dir_id:
-    :return:
+    download asset dir to path/asset concurrently, files existing are skipped, files failed are logged and skipped
     """
     from dtable_events.dtable_io import dtable_io_logger, add_task_id_to_log
 
-    # get file server access token
-    fake_obj_id = {
-        'obj_id': asset_dir_id,
-        'dir_name': 'asset',        # after download and zip, folder root name is asset
-        'is_windows': 0,
-        'parent_dir': '/asset'
-    }
+    export_asset_path = os.path.join(path, 'asset')
+    dtable_io_logger.info(add_task_id_to_log(f"export dtable: {dtable_uuid} username: {username} start asset recursive download", task_id))
+    downloader = AssetDownloader(username, repo_id, task_id=task_id)
     try:
-        token = seafile_api.get_fileserver_access_token(
-            repo_id, json.dumps(fake_obj_id), 'download-dir', username, use_onetime=False
-    )
-    except Exception as e:
-        raise e
-
-    if not USE_GO_FILESERVER:
-        progress = {'zipped': 0, 'total': 1}
-        last_log_time = None
-        dtable_io_logger.info(add_task_id_to_log(f'export dtable: {dtable_uuid} username: {username} start to zip assets', task_id))
-        while progress['zipped'] != progress['total']:
-            time.sleep(0.5)   # sleep 0.5 second
-            try:
-                progress = json.loads(seafile_api.query_zip_progress(token))
-            except Exception as e:
-                raise e
-            else:
-                # per 10s or zip progress done, log progress
-                if not last_log_time or time.time() - last_log_time > 10 or progress['zipped'] == progress['total']:
-                    dtable_io_logger.info(add_task_id_to_log(f'progress {progress}', task_id))
-                    last_log_time = time.time()
-                failed_reason = progress.get('failed_reason')
-                if failed_reason:
-                    raise Exception(failed_reason)
-        dtable_io_logger.info(add_task_id_to_log(f'export dtable: {dtable_uuid} username: {username} zip assets done', task_id))
-
-    dtable_io_logger.info(add_task_id_to_log(f'export dtable: {dtable_uuid} username: {username} start to download asset zip', task_id))
+        downloader.add_dir(asset_dir_id, export_asset_path)
+    finally:
+        downloader.wait()
+    dtable_io_logger.info(add_task_id_to_log(f"export dtable: {dtable_uuid} username: {username} asset download complete", task_id))
 
-    asset_url = gen_dir_zip_download_url(token)
-    try:
-        resp = requests.get(asset_url)
-    except Exception as e:
-        raise e
-    dtable_io_logger.info(add_task_id_to_log(f'export dtable user: {username} dtable: {dtable_uuid} asset size: {len(resp.content) / 1024 / 1024} MB', task_id))
-    file_obj = io.BytesIO(resp.content)
-    if is_zipfile(file_obj):
-        with ZipFile(file_obj) as zp:
-            dtable_io_logger.info(add_task_id_to_log(f'export dtable user: {username} dtable: {dtable_uuid} start to extractall', task_id))
-            zp.extractall(path)
 
 def copy_src_forms_to_json(dtable_uuid, tmp_file_path, db_session):
     if not db_session:
@@ -348,9 +242,7 @@ def copy_src_forms_to_json(dtable_uuid, tmp_file_path, db_session):
         }
         src_forms_json.append(form)
     if src_forms_json:
-        # os.makedirs(os.path.join(tmp_file_path, 'forms.json'))
-        with open(os.path.join(tmp_file_path, 'forms.json'), 'w+') as fp:
-            fp.write(json.dumps(src_forms_json))
+        save_export_file(tmp_file_path, 'forms.json', json.dumps(src_forms_json))
 
 
 def copy_src_auto_rules_to_json(dtable_uuid, tmp_file_path, db_session):
@@ -369,8 +261,7 @@ def copy_src_auto_rules_to_json(dtable_uuid, tmp_file_path, db_session):
         }
         src_auto_rules_json.append(auto_rule)
     if src_auto_rules_json:
-        with open(os.path.join(tmp_file_path, 'auto_rules.json'), 'w+') as fp:
-            fp.write(json.dumps(src_auto_rules_json))
+        save_export_file(tmp_file_path, 'auto_rules.json', json.dumps(src_auto_rules_json))
 
     # copy auto-rules navigation
     sql = '''SELECT `detail` FROM `dtable_automation_rules_navigation` WHERE dtable_uuid=:dtable_uuid'''
@@ -381,8 +272,7 @@ def copy_src_auto_rules_to_json(dtable_uuid, tmp_file_path, db_session):
         except:
             pass
         else:
-            with open(os.path.join(tmp_file_path, 'auto_rules_navigation.json'), 'w') as fp:
-                fp.write(src_auto_rules_navigation.detail)
+            save_export_file(tmp_file_path, 'auto_rules_navigation.json', src_auto_rules_navigation.detail)
 
 
 def copy_src_workflows_to_json(dtable_uuid, tmp_file_path, db_session):
@@ -398,8 +288,7 @@ def copy_src_workflows_to_json(dtable_uuid, tmp_file_path, db_session):
         }
         src_workflows_json.append(workflow)
     if src_workflows_json:
-        with open(os.path.join(tmp_file_path, 'workflows.json'), 'w+') as fp:
-            fp.write(json.dumps(src_workflows_json))
+        save_export_file(tmp_file_path, 'workflows.json', json.dumps(src_workflows_json))
 
 
 def copy_src_external_app_to_json(dtable_uuid, tmp_file_path, db_session):
@@ -415,8 +304,7 @@ def copy_src_external_app_to_json(dtable_uuid, tmp_file_path, db_session):
         }
         src_external_apps_json.append(external_app)
     if src_external_apps_json:
-        with open(os.path.join(tmp_file_path, 'external_apps.json'), 'w+') as fp:
-            fp.write(json.dumps(src_external_apps_json))
+        save_export_file(tmp_file_path, 'external_apps.json', json.dumps(src_external_apps_json))
 
 
 def copy_src_archive_backup(dtable_uuid, tmp_file_path, task_id):
@@ -434,6 +322,9 @@ def copy_src_archive_backup(dtable_uuid, tmp_file_path, task_id):
     backup = dtable_db_api.get_backups()[0]
     backup_version = backup['version']
     dtable_storage_server_api = DTableStorageServerAPI()
+    if isinstance(tmp_file_path, ExportZipWriter):
+        tmp_file_path.write_stream('archive', dtable_storage_server_api.iter_backup_chunks(dtable_uuid, backup_version))
+        return
     archive_file_path = os.path.join(tmp_file_path, 'archive')
     dtable_storage_server_api.get_backup_chunked(dtable_uuid, backup_version, archive_file_path)
 
@@ -1225,7 +1116,7 @@ def import_archive_from_src_dtable(username, dtable_uuid, path):
         dtable_storage_server_api.delete_dtable_all_backups(temp_uuid)
 
 
-def download_files_to_path(username, repo_id, dtable_uuid, files, path, db_session, files_map=None):
+def download_files_to_path(username, repo_id, dtable_uuid, files, path, db_session, files_map=None, task_id=None):
     """
     download dtable's asset files to path
     """
@@ -1265,34 +1156,26 @@ def download_files_to_path(username, repo_id, dtable_uuid, files, path, db_sessi
             dtable_io_logger.error('query dtable: %s custom uuids error: %s', dtable_uuid, e)
 
     tmp_file_list = []
-    for file, obj_id in valid_file_obj_ids:
-        token = seafile_api.get_fileserver_access_token(
-            repo_id, obj_id, 'download', username,
-            use_onetime=False
-        )
-        file_name = os.path.basename(file)
-        if files_map and files_map.get(file, None):
-            file_name = files_map.get(file)
-        file_url = gen_inner_file_get_url(token, file_name)
-        content = requests.get(file_url).content
-        filename_by_path = os.path.join(path, file_name)
-        with open(filename_by_path, 'wb') as f:
-            f.write(content)
-        tmp_file_list.append(filename_by_path)
-
-    for custom_uuid, obj_id, file_name in valid_custom_file_obj_ids:
-        token = seafile_api.get_fileserver_access_token(
-            repo_id, obj_id, 'download', username,
-            use_onetime=False
-        )
-        if files_map and files_map.get(custom_uuid):
-            file_name = files_map.get(custom_uuid)
-        file_url = gen_inner_file_get_url(token, file_name)
-        content = requests.get(file_url).content
-        filename_by_path = os.path.join(path, file_name)
-        with open(filename_by_path, 'wb') as f:
-            f.write(content)
-        tmp_file_list.append(filename_by_path)
+    downloader = AssetDownloader(username, repo_id, task_id=task_id)
+    try:
+        for file, obj_id in valid_file_obj_ids:
+            file_name = os.path.basename(file)
+            if files_map and files_map.get(file, None):
+                file_name = files_map.get(file)
+            filename_by_path = os.path.join(path, file_name)
+            downloader.add_file(obj_id, file_name, filename_by_path)
+            tmp_file_list.append(filename_by_path)
+
+        for custom_uuid, obj_id, file_name in valid_custom_file_obj_ids:
+            if files_map and files_map.get(custom_uuid):
+                file_name = files_map.get(custom_uuid)
+            filename_by_path = os.path.join(path, file_name)
+            downloader.add_file(obj_id, file_name, filename_by_path)
+            tmp_file_list.append(filename_by_path)
+    finally:
+        downloader.wait()
+    if downloader.failed_paths:
+        raise Exception('download files failed: %s' % ', '.join(os.path.basename(p) for p in downloader.failed_paths[:10]))
     return tmp_file_list
 
 
@@ -1447,19 +1330,13 @@ def sync_app_users_to_table(dtable_uuid, app_id, table_name, table_id, username,
 
     rows_name_id_map = {}
     dtable_db_api = DTableDBAPI('dtable-events', dtable_uuid, INNER_DTABLE_DB_URL)
-    query_column_names = ', '.join([f"`{column_name}`" for column_name in ['_id'] + list(APP_USERS_COUMNS_TYPE_MAP.keys())])
-    offset, limit = 0, 1000
-    while True:
-        sql = f"SELECT {query_column_names} FROM `{table['name']}` LIMIT {offset}, {limit}"
-        rows, _ = dtable_db_api.query(sql, convert=True, server_only=True)
-        for row in rows:
-            row_user = row.get('User') and row.get('User')[0] or None
-            if not row_user:
-                continue
-            rows_name_id_map[row_user] = row
-        if len(rows) < limit:
-            break
-        offset += limit
+    query_column_names = ['_id'] + list(APP_USERS_COUMNS_TYPE_MAP.keys())
+    for row in dtable_db_api.iter_rows(table['name'], query_column_names, page_size=1000, convert=True, server_only=True,
+                                       seek=True):
+        row_user = row.get('User') and row.get('User')[0] or None
+        if not row_user:
+            continue
+        rows_name_id_map[row_user] = row
 
     row_data_for_create = []
     row_data_for_update = []
@@ -1514,58 +1391,24 @@ def to_python_boolean(string):
 
 def get_rows_from_dtable_db(dtable_db_api, table_name, limit=50000):
     from dtable_events.utils.dtable_db_api import convert_db_rows
-    offset = 10000
-    start = 0
     dtable_rows = []
-    while True:
-        # exported row number should less than limit
-        if (start + offset) > limit:
-            offset = limit - start
-
-        sql = f"SELECT * FROM `{table_name}` LIMIT {start}, {offset}"
-
-        response_rows, metadata = dtable_db_api.query(sql, convert=False, server_only=True)
-        response_rows = convert_db_rows(metadata, response_rows)
-        dtable_rows.extend(response_rows)
-
-        start += offset
-        if start >= limit or len(response_rows) < offset:
-            break
-
+    # exported row number should less than limit
+    for response_rows, metadata in dtable_db_api.iter_pages(table_name, page_size=10000, limit=limit, convert=False, server_only=True):
+        dtable_rows.extend(convert_db_rows(metadata, response_rows))
     return dtable_rows
 
 
 def get_export_view_rows_from_dtable_db(dtable_db_api, table_name, columns, filter_conditions, query_column_names=None, server_only=True):
-    from dtable_events.utils.sql_generator import filter2sql
+    from dtable_events.utils.sql_generator import BaseSQLGenerator
 
-    rows = []
-    start, limit = 0, 10000
-    while True:
-        filter_conditions['start'] = start
-        filter_conditions['limit'] = limit
-        sql = filter2sql(table_name, columns, filter_conditions, by_group=False)
-        if query_column_names:
-            column_names_str = ', '.join('`%s`' % name for name in query_column_names)
-            sql = sql.replace('*', column_names_str, 1)
-        step_rows, _ = dtable_db_api.query(sql, convert=True, server_only=server_only)
-        rows.extend(step_rows)
-        if len(step_rows) < limit:
-            break
-        start += limit
-    return rows
+    sql_generator = BaseSQLGenerator(table_name, columns, filter_conditions=filter_conditions)
+    return list(dtable_db_api.iter_rows(table_name, query_column_names or None, filter_clause=sql_generator._filter2sql(),
+                                        sort_clause=sql_generator._sort2sql(), page_size=10000, convert=True,
+                                        server_only=server_only))
 
 
 def get_export_table_rows_from_dtable_db(dtable_db_api, table_name):
-    rows = []
-    start, limit = 0, 10000
-    while True:
-        sql = f"SELECT * FROM `{table_name}` LIMIT {start}, {limit}"
-        step_rows = dtable_db_api.query(sql, convert=True, server_only=True)[0]
-        rows.extend(step_rows)
-        if len(step_rows) < limit:
-            break
-        start += limit
-    return rows
+    return list(dtable_db_api.iter_rows(table_name, page_size=10000, convert=True, server_only=True))
 
 
 def update_rows_by_dtable_db(dtable_db_api, update_rows, table_name):
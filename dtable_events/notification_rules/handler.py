@@ -1,52 +1,64 @@
-import json
 import logging
 import time
-from threading import Thread, Event
+from threading import Thread, Lock
 
-from dtable_events.app.event_redis import RedisClient
+from dtable_events.app.config import NOTIFICATION_RULES_BATCH_SIZE, NOTIFICATION_RULES_BATCH_FLUSH_INTERVAL
+from dtable_events.app.event_redis import pubsub_dispatcher
 from dtable_events.db import init_db_session_class
-from dtable_events.notification_rules.notification_rules_utils import scan_triggered_notification_rules
+from dtable_events.notification_rules.notification_rules_utils import scan_triggered_notification_rules_batch
 
 logger = logging.getLogger(__name__)
 
 
-class NotificationRuleHandler(Thread):
+class NotificationRuleHandler(object):
     def __init__(self):
-        Thread.__init__(self)
-        self._finished = Event()
         self._db_session_class = init_db_session_class()
-        self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=5,
-                                         health_check_interval=30, retry_on_timeout=True)
         self._pubsub_channel_name = 'notification-rule-triggered'
-        self._pubsub_no_message_timeout = 5 * 60
 
-    def run(self):
-        logger.info('Starting handle notification rules...')
-        subscriber = self._redis_client.get_subscriber(self._pubsub_channel_name)
-        last_pubsub_message_time = time.time()
-        while not self._finished.is_set():
+        # batch mode, events in a flush interval are grouped by rule, e.g. events of a bulk rows edit
+        self._batch_size = NOTIFICATION_RULES_BATCH_SIZE
+        self._flush_interval = NOTIFICATION_RULES_BATCH_FLUSH_INTERVAL / 1000
+        self._batch = []
+        self._batch_lock = Lock()
+        self._flush_lock = Lock()
+
+    def handle_events(self, events):
+        with self._flush_lock:
+            session = self._db_session_class()
             try:
-                message = subscriber.get_message()
-                if message is not None:
-                    if message.get('type') != 'message':
-                        continue
-                    last_pubsub_message_time = time.time()
-                    event = json.loads(message['data'])
-                    session = self._db_session_class()
-                    try:
-                        scan_triggered_notification_rules(event, db_session=session)
-                    except Exception as e:
-                        logger.error('Handle notification rules failed: %s' % e)
-                    finally:
-                        session.close()
-                else:
-                    if (time.time() - last_pubsub_message_time) >= self._pubsub_no_message_timeout:
-                        subscriber = self._redis_client.refresh_subscriber(
-                            subscriber, self._pubsub_channel_name, 'no message timeout')
-                        last_pubsub_message_time = time.time()
-                        continue
-                    time.sleep(0.5)
+                scan_triggered_notification_rules_batch(events, db_session=session)
             except Exception as e:
-                logger.error('redis pubsub receive error: %s', e)
-                subscriber = self._redis_client.refresh_subscriber(subscriber, self._pubsub_channel_name, str(e))
-                last_pubsub_message_time = time.time()
+                logger.error('Handle notification rules failed: %s' % e)
+            finally:
+                session.close()
+
+    def flush(self):
+        with self._batch_lock:
+            events, self._batch = self._batch, []
+        if events:
+            self.handle_events(events)
+
+    def handle_event(self, event):
+        if self._batch_size <= 1:
+            self.handle_events([event])
+            return
+        with self._batch_lock:
+            self._batch.append(event)
+            if len(self._batch) < self._batch_size:
+                return
+            events, self._batch = self._batch, []
+        self.handle_events(events)
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception('Flush notification rules events error: %s', e)
+
+    def start(self):
+        logger.info('Starting handle notification rules...')
+        if self._batch_size > 1:
+            Thread(target=self.flush_periodically, daemon=True).start()
+        pubsub_dispatcher.register(self._pubsub_channel_name, self.handle_event, name='notification_rules')
@@ -10,7 +10,7 @@ from sqlalchemy import text
 from dtable_events.utils.sql_generator import filter2sql, has_user_filter
 from dtable_events.app.config import INNER_DTABLE_WEB_SERVICE_URL, INNER_DTABLE_DB_URL, INNER_DTABLE_SERVER_URL
 from dtable_events.utils.utils_metadata_cache import get_metadata
-from dtable_events.utils import is_valid_email
+from dtable_events.utils import is_valid_email, uuid_str_to_32_chars
 from dtable_events.utils.constants import ColumnTypes, FormulaResultType
 from dtable_events.utils.dtable_server_api import DTableServerAPI
 from dtable_events.utils.dtable_web_api import DTableWebAPI
@@ -25,6 +25,9 @@ CONDITION_ROWS_ADDED = 'rows_added'
 CONDITION_FILTERS_SATISFY = 'filters_satisfy'
 CONDITION_NEAR_DEADLINE = 'near_deadline'
 
+NOTIFICATION_ROWS_QUERY_LIMIT = 1000
+NOTIFICATION_MESSAGES_SEND_LIMIT = 1000
+
 
 
 def is_trigger_time_satisfy(last_trigger_time):
@@ -41,22 +44,49 @@ def update_rule_last_trigger_time(rule_id, db_session):
 
 
 def scan_triggered_notification_rules(event_data, db_session):
-    row_id = event_data.get('row_id')
-    message_dtable_uuid = event_data.get('dtable_uuid', '')
-    table_id = event_data.get('table_id', '')
-    rule_id = event_data.get('notification_rule_id')
-    op_type = event_data.get('op_type')
-    if not row_id or not message_dtable_uuid or not table_id or not rule_id:
-        logger.error(f'redis event data not valid, event_data = {event_data}')
+    scan_triggered_notification_rules_batch([event_data], db_session)
+
+
+def get_rule_events_key(dtable_uuid, rule_id):
+    """
+    key of events of a rule, rule ids may come as str and dtable uuids with hyphens or in upper case in events
+    """
+    return uuid_str_to_32_chars(dtable_uuid).lower(), int(rule_id)
+
+
+def scan_triggered_notification_rules_batch(events, db_session):
+    """
+    events of the same rule are handled together, rows of them are queried and notified in batches
+    """
+    rule_events_dict = {}  # (dtable_uuid, rule_id) -> [(table_id, row_id, op_type)], keep events order
+    for event_data in events:
+        row_id = event_data.get('row_id')
+        message_dtable_uuid = event_data.get('dtable_uuid', '')
+        table_id = event_data.get('table_id', '')
+        rule_id = event_data.get('notification_rule_id')
+        op_type = event_data.get('op_type')
+        if not row_id or not message_dtable_uuid or not table_id or not rule_id:
+            logger.error(f'redis event data not valid, event_data = {event_data}')
+            continue
+        try:
+            key = get_rule_events_key(message_dtable_uuid, rule_id)
+        except (TypeError, ValueError):
+            logger.error(f'redis event data not valid, event_data = {event_data}')
+            continue
+        rule_events_dict.setdefault(key, []).append((table_id, row_id, op_type))
+    if not rule_events_dict:
         return
 
     sql = "SELECT `id`, `trigger`, `action`, `creator`, `last_trigger_time`, `dtable_uuid` FROM dtable_notification_rules WHERE run_condition='per_update'" \
-          "AND dtable_uuid=:dtable_uuid AND is_valid=1 AND id=:rule_id"
-    rules = db_session.execute(text(sql), {'dtable_uuid': message_dtable_uuid, 'rule_id': rule_id})
+          "AND is_valid=1 AND id IN :rule_ids"
+    rules = db_session.execute(text(sql), {'rule_ids': list({rule_id for _, rule_id in rule_events_dict})})
 
     for rule in rules:
+        row_events = rule_events_dict.get(get_rule_events_key(rule.dtable_uuid, rule.id))
+        if not row_events:
+            continue
         try:
-            trigger_notification_rule(rule, table_id, row_id, db_session, op_type)
+            trigger_notification_rule_batch(rule, row_events, db_session)
         except Exception as e:
             logger.exception(e)
             logger.error(f'check rule failed. {rule}, error: {e}')
@@ -302,6 +332,13 @@ def get_column_by_key(dtable_metadata, table_id, column_key):
 
 
 def trigger_notification_rule(rule, message_table_id, row_id, db_session, op_type):
+    trigger_notification_rule_batch(rule, [(message_table_id, row_id, op_type)], db_session)
+
+
+def trigger_notification_rule_batch(rule, row_events, db_session):
+    """
+    :param row_events: [(table_id, row_id, op_type)] of the rule
+    """
     rule_id = rule[0]
     trigger = rule[1]
     action = rule[2]
@@ -317,10 +354,31 @@ def trigger_notification_rule(rule, message_table_id, row_id, db_session, op_typ
     table_id = trigger['table_id']
     view_id = trigger['view_id']
 
-    if message_table_id != table_id:
+    if trigger['condition'] == CONDITION_ROWS_MODIFIED:
+        condition = CONDITION_ROWS_MODIFIED
+        op_types = ('modify_row', 'modify_rows', 'add_link', 'update_links', 'update_rows_links', 'remove_link')
+    elif trigger['condition'] == CONDITION_FILTERS_SATISFY:
+        condition = CONDITION_FILTERS_SATISFY
+        op_types = ('modify_row', 'modify_rows', 'add_link', 'update_links', 'update_rows_links')
+    elif trigger['condition'] == CONDITION_ROWS_ADDED:
+        condition = CONDITION_FILTERS_SATISFY
+        op_types = ('insert_row', 'append_rows', 'insert_rows')
+    else:
         return
 
-    dtable_server_api = DTableServerAPI('notification-rule', dtable_uuid, INNER_DTABLE_SERVER_URL, access_token_timeout=3600)
+    row_ids = []
+    for message_table_id, row_id, op_type in row_events:
+        if message_table_id == table_id and op_type in op_types and row_id not in row_ids:
+            row_ids.append(row_id)
+    if not row_ids:
+        return
+
+    if condition == CONDITION_ROWS_MODIFIED:
+        if not is_trigger_time_satisfy(last_trigger_time):
+            return
+        # notify once in the trigger interval
+        row_ids = row_ids[:1]
+
     dtable_db_api = DTableDBAPI('notification-rule', dtable_uuid, INNER_DTABLE_DB_URL)
     dtable_web_api = DTableWebAPI(INNER_DTABLE_WEB_SERVICE_URL)
     dtable_metadata = get_metadata(dtable_uuid)
@@ -350,86 +408,54 @@ def trigger_notification_rule(rule, message_table_id, row_id, db_session, op_typ
         if user:
             temp_users.append(user)
     users = temp_users
-    user_msg_list = []
 
     blanks, column_blanks, col_name_dict = set(re.findall(r'\{([^{]*?)\}', msg)), None, None
     if blanks:
         columns = target_table['columns']
         column_blanks, col_name_dict = get_column_blanks(blanks, columns)
 
-    if op_type in ('modify_row', 'modify_rows', 'add_link', 'update_links', 'update_rows_links', 'remove_link') and trigger['condition'] == CONDITION_ROWS_MODIFIED:
-        if not is_trigger_time_satisfy(last_trigger_time):
-            return
-
-        sql = f"SELECT * FROM `{target_table['name']}` WHERE _id='{row_id}'"
+    user_column = None
+    if users_column_key:
+        user_column = get_column_by_key(dtable_metadata, table_id, users_column_key)
+        if not user_column:
+            logger.warning('notification rule: %s notify user column: %s invalid', rule_id, users_column_key)
+
+    sql_rows_dict = {}
+    step = NOTIFICATION_ROWS_QUERY_LIMIT
+    for i in range(0, len(row_ids), step):
+        rows_id_str = ', '.join(["'%s'" % row_id for row_id in row_ids[i: i+step]])
+        sql = f"SELECT * FROM `{target_table['name']}` WHERE _id IN ({rows_id_str}) LIMIT {step}"
         rows, _ = dtable_db_api.query(sql, convert=False)
-        if not rows:
-            return
-        sql_row = rows[0]
-
-        detail = {
-            'table_id': table_id,
-            'view_id': view_id,
-            'condition': CONDITION_ROWS_MODIFIED,
-            'rule_id': rule.id,
-            'rule_name': rule_name,
-            'msg': gen_noti_msg_with_sql_row(msg, sql_row, column_blanks, col_name_dict, db_session),
-            'row_id_list': [row_id],
-        }
-
-        if users_column_key:
-            user_column = get_column_by_key(dtable_metadata, table_id, users_column_key)
-            if user_column:
-                users_from_column = sql_row.get(user_column['key'], [])
-                if not users_from_column:
-                    users_from_column = []
-                if not isinstance(users_from_column, list):
-                    users_from_column = [users_from_column, ]
-                users = list(set(users + [user for user in users_from_column if user in related_users_dict]))
-            else:
-                logger.warning('notification rule: %s notify user column: %s invalid', rule_id, users_column_key)
-
-        for user in users:
-            if not is_valid_email(user):
-                continue
-            user_msg_list.append({
-                'to_user': user,
-                'msg_type': 'notification_rules',
-                'detail': detail,
-                })
-        send_notification(dtable_uuid, user_msg_list, 'notification-rule')
-
-    elif (op_type in ('modify_row', 'modify_rows', 'add_link', 'update_links', 'update_rows_links') and trigger['condition'] == CONDITION_FILTERS_SATISFY) or \
-         (op_type in ('insert_row', 'append_rows', 'insert_rows') and trigger['condition'] == CONDITION_ROWS_ADDED):
+        sql_rows_dict.update({row['_id']: row for row in rows})
+    if not sql_rows_dict:
+        return
 
-        sql = f"SELECT * FROM `{target_table['name']}` WHERE _id='{row_id}'"
-        rows, _ = dtable_db_api.query(sql, convert=False)
-        if not rows:
-            return
-        sql_row = rows[0]
+    user_msg_list = []
+    for row_id in row_ids:
+        sql_row = sql_rows_dict.get(row_id)
+        if not sql_row:
+            continue
 
         detail = {
             'table_id': table_id,
             'view_id': view_id,
-            'condition': CONDITION_FILTERS_SATISFY,
+            'condition': condition,
             'rule_id': rule.id,
             'rule_name': rule_name,
             'msg': gen_noti_msg_with_sql_row(msg, sql_row, column_blanks, col_name_dict, db_session),
             'row_id_list': [row_id],
         }
-        if users_column_key:
-            user_column = get_column_by_key(dtable_metadata, table_id, users_column_key)
-            if user_column:
-                users_from_column = sql_row.get(user_column['key'], [])
-                if not users_from_column:
-                    users_from_column = []
-                if not isinstance(users_from_column, list):
-                    users_from_column = [users_from_column, ]
-                users = list(set(users + [user for user in users_from_column if user in related_users_dict]))
-            else:
-                logger.warning('notification rule: %s notify user column: %s invalid', rule_id, users_column_key)
 
-        for user in users:
+        row_users = users
+        if user_column:
+            users_from_column = sql_row.get(user_column['key'], [])
+            if not users_from_column:
+                users_from_column = []
+            if not isinstance(users_from_column, list):
+                users_from_column = [users_from_column, ]
+            row_users = list(set(users + [user for user in users_from_column if user in related_users_dict]))
+
+        for user in row_users:
             if not is_valid_email(user):
                 continue
             user_msg_list.append({
@@ -437,10 +463,8 @@ def trigger_notification_rule(rule, message_table_id, row_id, db_session, op_typ
                 'msg_type': 'notification_rules',
                 'detail': detail,
                 })
-        send_notification(dtable_uuid, user_msg_list, 'notification-rule')
-
-    else:
-        return
+    for i in range(0, len(user_msg_list), NOTIFICATION_MESSAGES_SEND_LIMIT):
+        send_notification(dtable_uuid, user_msg_list[i: i+NOTIFICATION_MESSAGES_SEND_LIMIT], 'notification-rule')
 
     update_rule_last_trigger_time(rule_id, db_session)
 
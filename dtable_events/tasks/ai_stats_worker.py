@@ -1,6 +1,4 @@
-import json
 import logging
-import time
 from collections import defaultdict
 from copy import deepcopy
 from datetime import datetime
@@ -11,9 +9,9 @@ from dateutil import relativedelta
 from sqlalchemy import text
 
 from dtable_events.app.config import AI_PRICES, AI_STATS_ENABLED
-from dtable_events.app.event_redis import RedisClient
+from dtable_events.app.event_redis import pubsub_dispatcher
 from dtable_events.db import init_db_session_class
-from dtable_events.utils import uuid_str_to_32_chars
+from dtable_events.utils import uuid_str_to_32_chars, get_dtable_owner_info, get_dtable_owner_infos
 
 logger = logging.getLogger(__name__)
 
@@ -22,13 +20,9 @@ class AIStatsWorker(object):
 
     def __init__(self):
         self._db_session_class = init_db_session_class()
-        self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=5,
-                                         health_check_interval=30, retry_on_timeout=True)
         self.stats_lock = Lock()
         self._pubsub_channel_name = 'log_ai_model_usage'
         self.keep_months = 3
-        self.owner_info_cache_timeout = 24 * 60 * 60
-        self._pubsub_no_message_timeout = 5 * 60
         self._parse_config()
         self.reset_stats()
 
@@ -39,28 +33,15 @@ class AIStatsWorker(object):
         self.org_stats = defaultdict(lambda: defaultdict(lambda: {'input_tokens': 0, 'output_tokens': 0}))
         self.owner_stats = defaultdict(lambda: defaultdict(lambda: {'input_tokens': 0, 'output_tokens': 0}))
         self.dtable_stats = defaultdict(lambda: defaultdict(lambda: {'input_tokens': 0, 'output_tokens': 0}))
-        self.dtable_org_cache = {}
-        self.dtable_workspace_owner_cache = {}
 
     def _get_dtable_owner_info(self, dtable_uuid, session, org_id=None):
-        cached_owner = self.dtable_workspace_owner_cache.get(dtable_uuid)
-        cached_org_id = self.dtable_org_cache.get(dtable_uuid)
-        if cached_owner is not None and cached_org_id is not None:
-            return {'owner': cached_owner, 'org_id': cached_org_id}
-
-        sql = "SELECT w.owner, w.org_id FROM dtables d JOIN workspaces w ON d.workspace_id=w.id WHERE d.uuid=:dtable_uuid"
-        result = session.execute(text(sql), {'dtable_uuid': dtable_uuid}).fetchone()
-        if not result:
+        owner_info = get_dtable_owner_info(dtable_uuid, session)
+        if not owner_info:
             return None
-
-        owner = result.owner
-        owner_org_id = result.org_id
+        owner_org_id = owner_info['org_id']
         if org_id is not None:
             owner_org_id = org_id
-
-        self.dtable_workspace_owner_cache[dtable_uuid] = owner
-        self.dtable_org_cache[dtable_uuid] = owner_org_id
-        return {'owner': owner, 'org_id': owner_org_id}
+        return {'owner': owner_info['owner'], 'org_id': owner_org_id}
 
     def save_to_memory(self, usage_info, session):
         if not usage_info.get('model'):
@@ -122,57 +103,24 @@ class AIStatsWorker(object):
         self.dtable_stats[dtable_uuid][key]['input_tokens'] += usage.get('input_tokens') or 0
         self.dtable_stats[dtable_uuid][key]['output_tokens'] += usage.get('output_tokens') or 0
 
-    def receive(self):
-        logger.info('Starts to receive ai calls...')
-        subscriber = self._redis_client.get_subscriber(self._pubsub_channel_name)
-        last_pubsub_message_time = time.time()
-
-        while True:
-            try:
-                message = subscriber.get_message()
-                if message is not None:
-                    if message.get('type') != 'message':
-                        continue
-                    last_pubsub_message_time = time.time()
-                    try:
-                        usage_info = json.loads(message['data'])
-                    except:
-                        logger.warning('log_ai_model_usage message invalid')
-                        continue
-                    session = self._db_session_class()
-                    logger.debug('usage_info %s', usage_info)
-                    try:
-                        with self.stats_lock:
-                            self.save_to_memory(usage_info, session)
-                    except Exception as e:
-                        logger.exception('save usage_info %s to memory error %s', usage_info, e)
-                    finally:
-                        session.close()
-                else:
-                    if (time.time() - last_pubsub_message_time) >= self._pubsub_no_message_timeout:
-                        subscriber = self._redis_client.refresh_subscriber(
-                            subscriber, self._pubsub_channel_name, 'no message timeout')
-                        last_pubsub_message_time = time.time()
-                        continue
-                    time.sleep(0.5)
-            except Exception as e:
-                logger.error('redis pubsub receive error: %s', e)
-                subscriber = self._redis_client.refresh_subscriber(subscriber, self._pubsub_channel_name, str(e))
-                last_pubsub_message_time = time.time()
+    def handle_message(self, usage_info):
+        logger.debug('usage_info %s', usage_info)
+        session = self._db_session_class()
+        try:
+            with self.stats_lock:
+                self.save_to_memory(usage_info, session)
+        except Exception as e:
+            logger.exception('save usage_info %s to memory error %s', usage_info, e)
+        finally:
+            session.close()
 
     def query_dtable_owners(self, dtable_uuids):
         dtable_owners_dict = {}
         if not dtable_uuids:
             return dtable_owners_dict
-        sql = "SELECT d.uuid AS dtable_uuid, w.owner AS `owner`, w.org_id as org_id FROM dtables d JOIN workspaces w ON d.workspace_id=w.id WHERE d.uuid IN :dtable_uuids"
         session = self._db_session_class()
         try:
-            results = session.execute(text(sql), {'dtable_uuids': dtable_uuids})
-            for row in results:
-                dtable_owners_dict[row.dtable_uuid] = {
-                    'owner': row.owner,
-                    'org_id': row.org_id
-                }
+            dtable_owners_dict = get_dtable_owner_infos(dtable_uuids, session)
         except Exception as e:
             logger.exception(e)
         finally:
@@ -355,6 +303,7 @@ class AIStatsWorker(object):
         if not self._enabled:
             logger.warning('Can not stats AI: it is not enabled!')
             return
-        Thread(target=self.receive, daemon=True).start()
+        logger.info('Starts to receive ai calls...')
+        pubsub_dispatcher.register(self._pubsub_channel_name, self.handle_message, name='ai_stats')
         Thread(target=self.stats, daemon=True).start()
         Thread(target=self.clean, daemon=True).start()
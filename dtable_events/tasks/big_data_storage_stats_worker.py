@@ -9,6 +9,7 @@ from sqlalchemy import text
 
 from dtable_events.app.config import INNER_DTABLE_DB_URL
 from dtable_events.db import init_db_session_class
+from dtable_events.utils import get_dtable_owner_infos
 from dtable_events.utils.dtable_db_api import DTableDBAPI
 
 __all__ = [
@@ -17,13 +18,8 @@ __all__ = [
 
 
 def update_big_data_storage_stats(db_session, bases):
-    uuid_org_id_map = dict()
-    get_org_id_sql = """SELECT uuid, org_id FROM dtables d JOIN workspaces w ON d.workspace_id=w.id
-                        WHERE uuid IN :uuid_list"""
-    results = db_session.execute(text(get_org_id_sql),
-                                 {'uuid_list': [uuid.UUID(base.get('id')).hex for base in bases]}).fetchall()
-    for result in results:
-        uuid_org_id_map[result[0]] = result[1]
+    dtable_owner_infos = get_dtable_owner_infos([uuid.UUID(base.get('id')).hex for base in bases], db_session)
+    uuid_org_id_map = {dtable_uuid: owner_info['org_id'] for dtable_uuid, owner_info in dtable_owner_infos.items()}
 
     sql = "REPLACE INTO big_data_storage_stats (dtable_uuid, total_rows, total_storage, org_id) VALUES %s" % ', '.join(
         ["('%s', '%s', '%s', '%s')" % (base.get('id'), base.get('rows'), base.get('storage'),
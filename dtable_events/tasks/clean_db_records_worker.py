@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
+from datetime import datetime
 from threading import Thread
+from typing import Optional
 
 from apscheduler.schedulers.blocking import BlockingScheduler
 from sqlalchemy import text
@@ -12,13 +17,23 @@ from dtable_events.app.config import ENABLE_OPERATION_LOG_DB, CLEAN_DB_ENABLED,
     CLEAN_DB_KEEP_DTABLE_DB_OP_LOG_DAYS, CLEAN_DB_KEEP_NOTIFICATIONS_USERNOTIFICATION_DAYS, \
     CLEAN_DB_KEEP_DTABLE_NOTIFICATIONS_DAYS, CLEAN_DB_KEEP_SESSION_LOG_DAYS, CLEAN_DB_KEEP_AUTO_RULES_TASK_LOG_DAYS, \
     CLEAN_DB_KEEP_USER_ACTIVITY_STATISTICS_DAYS, CLEAN_DB_KEEP_DTABLE_APP_PAGES_OPERATION_LOG_DAYS, \
-    CLEAN_DB_KEEP_EMAIL_SENDING_LOG_DAYS, CLEAN_DB_KEEP_SYSADMIN_EXTRA_USERLOGINLOG_DAYS
+    CLEAN_DB_KEEP_EMAIL_SENDING_LOG_DAYS, CLEAN_DB_KEEP_SYSADMIN_EXTRA_USERLOGINLOG_DAYS, CLEAN_DB_BATCH_SIZE, \
+    CLEAN_DB_MAX_ROWS_PER_SECOND, CLEAN_DB_CONCURRENCY
+from dtable_events.app.event_redis import redis_cache
 from dtable_events.db import init_db_session_class
+from dtable_events.utils.utils_metric import publish_metric, CLEAN_DB_DELETED_COUNT_METRIC_HELP, \
+    CLEAN_DB_DELETE_RATE_METRIC_HELP
 
 __all__ = [
     'CleanDBRecordsWorker',
 ]
 
+CHECKPOINT_KEY_PREFIX = 'clean_db_records:checkpoint'
+# a checkpoint not resumed before next day's clean is discarded, the clean starts over with a new cutoff
+CHECKPOINT_TIMEOUT = 20 * 60 * 60
+# interval (in seconds) of publishing progress metrics of a table being cleaned
+METRICS_INTERVAL = 10
+
 
 class CleanDBRecordsWorker(object):
     def __init__(self):
@@ -86,6 +101,43 @@ class CleanDBRecordsTask(Thread):
         self.db_session_class = db_session_class
         self.retention_config = retention_config
 
+    def get_clean_tables(self):
+        config = self.retention_config
+        clean_tables = [
+            CleanTable('dtable_snapshot', 'ctime', config.dtable_snapshot, ms_timestamp=True),
+            CleanTable('activities', 'op_time', config.activities),
+        ]
+        if not ENABLE_OPERATION_LOG_DB:
+            clean_tables += [
+                CleanTable('operation_log', 'op_time', config.operation_log, ms_timestamp=True),
+                CleanTable('dtable_db_op_log', 'op_time', config.dtable_db_op_log, ms_timestamp=True),
+            ]
+        clean_tables += [
+            CleanTable('delete_operation_log', 'op_time', config.delete_operation_log, ms_timestamp=True),
+            CleanTable('dtable_notifications', 'created_at', config.dtable_notifications),
+            CleanTable('notifications_usernotification', 'timestamp', config.notifications_usernotification),
+            CleanTable('session_log', 'op_time', config.session_log),
+            CleanTable('django_session', 'expire_date', None, primary_key='session_key'),
+            CleanTable('auto_rules_task_log', 'trigger_time', config.auto_rules_task_log),
+            CleanTable('user_activity_statistics', 'timestamp', config.user_activity_statistics),
+            CleanTable('dtable_app_pages_operation_log', 'updated_at', config.dtable_app_pages_operation_log),
+            CleanTable('email_sending_log', 'timestamp', config.email_sending_log),
+            CleanTable('sysadmin_extra_userloginlog', 'login_date', config.sysadmin_extra_userloginlog),
+        ]
+        return clean_tables
+
+    def clean_tables(self, resume_only=False):
+        """clean tables in parallel, if `resume_only`, only continue cleans interrupted by last shutdown"""
+        with ThreadPoolExecutor(max_workers=CLEAN_DB_CONCURRENCY, thread_name_prefix='clean-db') as executor:
+            futures = {executor.submit(clean_table_in_chunks, self.db_session_class, clean_table,
+                                       resume_only=resume_only): clean_table.table
+                       for clean_table in self.get_clean_tables()}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    logging.exception('Could not clean "%s"', futures[future])
+
     def run(self):
         schedule = BlockingScheduler()
 
@@ -93,205 +145,156 @@ class CleanDBRecordsTask(Thread):
         def timed_job():
             logging.info('Start cleaning database...')
 
-            session = self.db_session_class()
+            self.clean_tables()
 
+            session = self.db_session_class()
             try:
-                clean_snapshots(session, self.retention_config.dtable_snapshot)
-                clean_activities(session, self.retention_config.activities)
-                if not ENABLE_OPERATION_LOG_DB:
-                    clean_operation_log(session, self.retention_config.operation_log)
-                    clean_dtable_db_op_log(session, self.retention_config.dtable_db_op_log)
-                clean_delete_operation_log(session, self.retention_config.delete_operation_log)
-                clean_notifications(session, self.retention_config.dtable_notifications)
-                clean_user_notifications(session, self.retention_config.notifications_usernotification)
-                clean_sessions(session, self.retention_config.session_log)
-                clean_django_sessions(session)
-                clean_auto_rules_task_log(session, self.retention_config.auto_rules_task_log)
-                clean_user_activity_statistics(session, self.retention_config.user_activity_statistics)
-                clean_dtable_app_pages_operation_log(session, self.retention_config.dtable_app_pages_operation_log)
-                clean_email_sending_log(session, self.retention_config.email_sending_log)
                 clean_operation_checkpoint(session)
-                clean_sysadmin_extra_userloginlog(session, self.retention_config.sysadmin_extra_userloginlog)
             except:
                 logging.exception('Could not clean database')
             finally:
                 session.close()
 
-        schedule.start()
-
-
-def clean_snapshots(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "dtable_snapshot" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "dtable_snapshot" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `dtable_snapshot` WHERE `ctime` < UNIX_TIMESTAMP(DATE_SUB(NOW(), INTERVAL :days DAY))*1000'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "dtable_snapshot"', result.rowcount)
-
-
-def clean_activities(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "activities" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "activities" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `activities` WHERE `op_time` < DATE_SUB(NOW(), INTERVAL :days DAY)'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "activities"', result.rowcount)
-
-
-def clean_operation_log(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "operation_log" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "operation_log" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `operation_log` WHERE `op_time` < UNIX_TIMESTAMP(DATE_SUB(NOW(), INTERVAL :days DAY))*1000'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "operation_log"', result.rowcount)
-
-
-def clean_delete_operation_log(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "delete_operation_log" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "delete_operation_log" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `delete_operation_log` WHERE `op_time` < UNIX_TIMESTAMP(DATE_SUB(NOW(), INTERVAL :days DAY))*1000'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "delete_operation_log"', result.rowcount)
-
-
-def clean_dtable_db_op_log(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "dtable_db_op_log" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "dtable_db_op_log" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `dtable_db_op_log` WHERE `op_time` < UNIX_TIMESTAMP(DATE_SUB(NOW(), INTERVAL :days DAY))*1000'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "dtable_db_op_log"', result.rowcount)
-
-
-def clean_user_notifications(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "notifications_usernotification" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "notifications_usernotification" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `notifications_usernotification` WHERE `timestamp` < DATE_SUB(NOW(), INTERVAL :days DAY)'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "notifications_usernotification"', result.rowcount)
-
+        def resume_job():
+            self.clean_tables(resume_only=True)
 
-def clean_notifications(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "dtable_notifications" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "dtable_notifications" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `dtable_notifications` WHERE `created_at` < DATE_SUB(NOW(), INTERVAL :days DAY)'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "dtable_notifications"', result.rowcount)
-
-
-def clean_sessions(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "session_log" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "session_log" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `session_log` WHERE `op_time` < DATE_SUB(NOW(), INTERVAL :days DAY)'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "session_log"', result.rowcount)
-
-def clean_django_sessions(session):
-    logging.info('Cleaning expired entries from "django_session" table')
-
-    sql = 'DELETE FROM `django_session` WHERE `expire_date` < CURRENT_TIMESTAMP()'
-    result = session.execute(text(sql))
-    session.commit()
-
-    logging.info('Removed %d entries from "django_session"', result.rowcount)
-
-def clean_auto_rules_task_log(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "auto_rules_task_log" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "auto_rules_task_log" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `auto_rules_task_log` WHERE `trigger_time` < DATE_SUB(NOW(), INTERVAL :days DAY)'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "auto_rules_task_log"', result.rowcount)
-
-def clean_user_activity_statistics(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "user_activity_statistics" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "user_activity_statistics" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `user_activity_statistics` WHERE `timestamp` < DATE_SUB(NOW(), INTERVAL :days DAY)'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "user_activity_statistics"', result.rowcount)
-
-def clean_dtable_app_pages_operation_log(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "dtable_app_pages_operation_log" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "dtable_app_pages_operation_log" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `dtable_app_pages_operation_log` WHERE `updated_at` < DATE_SUB(NOW(), INTERVAL :days DAY)'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "dtable_app_pages_operation_log"', result.rowcount)
-
-
-def clean_email_sending_log(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "email_sending_log" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "email_sending_log" table (older than %d days)', keep_days)
+        schedule.add_job(resume_job, 'date', run_date=datetime.now())
+        schedule.start()
 
-    sql = 'DELETE FROM `email_sending_log` WHERE `timestamp` < DATE_SUB(NOW(), INTERVAL :days DAY)'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
 
-    logging.info('Removed %d entries from "email_sending_log"', result.rowcount)
+@dataclass
+class CleanTable:
+    """
+    A table cleaned by `time_column`, rows older than `keep_days` are removed, or rows whose
+    `time_column` is passed if `keep_days` is None, e.g. expired sessions.
+    """
+    table: str
+    time_column: str
+    keep_days: Optional[int]
+    ms_timestamp: bool = False
+    primary_key: str = 'id'
+
+    def get_cutoff_sql(self):
+        if self.keep_days is None:
+            return 'SELECT CURRENT_TIMESTAMP()'
+        if self.ms_timestamp:
+            return 'SELECT UNIX_TIMESTAMP(DATE_SUB(NOW(), INTERVAL :days DAY))*1000'
+        return 'SELECT DATE_SUB(NOW(), INTERVAL :days DAY)'
+
+
+def get_checkpoint_key(table):
+    return f'{CHECKPOINT_KEY_PREFIX}:{table}'
+
+
+def load_checkpoint(table):
+    try:
+        checkpoint = redis_cache.get(get_checkpoint_key(table))
+        return json.loads(checkpoint) if checkpoint else None
+    except Exception as e:
+        logging.warning('Failed to load clean checkpoint of "%s": %s', table, e)
+        return None
+
+
+def save_checkpoint(table, checkpoint):
+    try:
+        redis_cache.set(get_checkpoint_key(table), json.dumps(checkpoint), timeout=CHECKPOINT_TIMEOUT)
+    except Exception as e:
+        logging.warning('Failed to save clean checkpoint of "%s": %s', table, e)
+
+
+def delete_checkpoint(table):
+    try:
+        redis_cache.delete(get_checkpoint_key(table))
+    except Exception as e:
+        logging.warning('Failed to delete clean checkpoint of "%s": %s', table, e)
+
+
+def publish_clean_metrics(table, deleted_count, rows_per_second):
+    try:
+        publish_metric(deleted_count, f'clean_db_{table}_deleted_count', CLEAN_DB_DELETED_COUNT_METRIC_HELP)
+        publish_metric(round(rows_per_second, 2), f'clean_db_{table}_rows_per_second', CLEAN_DB_DELETE_RATE_METRIC_HELP)
+    except Exception as e:
+        logging.warning('Failed to publish clean metrics of "%s": %s', table, e)
+
+
+def clean_table_in_chunks(db_session_class, clean_table: CleanTable, batch_size=CLEAN_DB_BATCH_SIZE,
+                          max_rows_per_second=CLEAN_DB_MAX_ROWS_PER_SECOND, resume_only=False):
+    """
+    Delete expired rows of a table by chunks of `batch_size` rows walking the primary key, so every
+    DELETE only locks a small range and does not flood the binlog / replicas. Chunks are throttled
+    to `max_rows_per_second`.
+
+    The cutoff time and the last deleted key are checkpointed in redis after every chunk, so a clean
+    interrupted by shutdown continues from the checkpoint.
+    """
+    table, time_column, primary_key = clean_table.table, clean_table.time_column, clean_table.primary_key
+    if clean_table.keep_days is not None and clean_table.keep_days <= 0:
+        logging.info('Skipping "%s" since retention time is set to %d', table, clean_table.keep_days)
+        return 0
+
+    checkpoint = load_checkpoint(table)
+    if resume_only and not checkpoint:
+        return 0
+
+    session = db_session_class()
+    try:
+        if checkpoint:
+            cutoff, last_key, deleted_count = checkpoint['cutoff'], checkpoint['last_key'], checkpoint['deleted_count']
+            logging.info('Resuming cleaning "%s" from %s=%s (%d entries removed)', table, primary_key, last_key, deleted_count)
+        else:
+            params = {'days': clean_table.keep_days} if clean_table.keep_days is not None else {}
+            cutoff = session.execute(text(clean_table.get_cutoff_sql()), params).scalar()
+            cutoff = int(cutoff) if clean_table.ms_timestamp else str(cutoff)
+            last_key, deleted_count = None, 0
+            if clean_table.keep_days is None:
+                logging.info('Cleaning expired entries from "%s" table', table)
+            else:
+                logging.info('Cleaning "%s" table (older than %d days)', table, clean_table.keep_days)
+
+        select_sql = f'SELECT `{primary_key}` FROM `{table}` WHERE `{time_column}` < :cutoff'
+        select_next_sql = select_sql + f' AND `{primary_key}` > :last_key'
+        order_sql = f' ORDER BY `{primary_key}` LIMIT :limit'
+        delete_sql = f'DELETE FROM `{table}` WHERE `{primary_key}` IN :keys AND `{time_column}` < :cutoff'
+
+        start_time = time.time()
+        run_deleted_count = 0
+        last_publish_time = start_time
+        while True:
+            chunk_start_time = time.time()
+            params = {'cutoff': cutoff, 'limit': batch_size}
+            if last_key is None:
+                keys = [row[0] for row in session.execute(text(select_sql + order_sql), params)]
+            else:
+                params['last_key'] = last_key
+                keys = [row[0] for row in session.execute(text(select_next_sql + order_sql), params)]
+            if not keys:
+                session.commit()
+                break
+
+            result = session.execute(text(delete_sql), {'keys': keys, 'cutoff': cutoff})
+            session.commit()
+            last_key = keys[-1]
+            deleted_count += result.rowcount
+            run_deleted_count += result.rowcount
+            save_checkpoint(table, {'cutoff': cutoff, 'last_key': last_key, 'deleted_count': deleted_count})
+
+            now = time.time()
+            if now - last_publish_time >= METRICS_INTERVAL:
+                publish_clean_metrics(table, deleted_count, run_deleted_count / (now - start_time))
+                last_publish_time = now
+
+            if len(keys) < batch_size:
+                break
+            if max_rows_per_second > 0:
+                time.sleep(max(0, len(keys) / max_rows_per_second - (now - chunk_start_time)))
+    finally:
+        session.close()
+
+    delete_checkpoint(table)
+    elapsed = time.time() - start_time
+    publish_clean_metrics(table, deleted_count, run_deleted_count / elapsed if elapsed > 0 else 0)
+    logging.info('Removed %d entries from "%s" in %.1fs', deleted_count, table, elapsed)
+    return deleted_count
 
 
 def clean_operation_checkpoint(session):
@@ -302,17 +305,3 @@ def clean_operation_checkpoint(session):
     session.commit()
 
     logging.info('Removed %d entries from "operation_checkpoint"', result.rowcount)
-
-
-def clean_sysadmin_extra_userloginlog(session, keep_days: int):
-    if keep_days <= 0:
-        logging.info('Skipping "sysadmin_extra_userloginlog" since retention time is set to %d', keep_days)
-        return
-
-    logging.info('Cleaning "sysadmin_extra_userloginlog" table (older than %d days)', keep_days)
-
-    sql = 'DELETE FROM `sysadmin_extra_userloginlog` WHERE `login_date` < DATE_SUB(NOW(), INTERVAL :days DAY)'
-    result = session.execute(text(sql), {'days': keep_days})
-    session.commit()
-
-    logging.info('Removed %d entries from "sysadmin_extra_userloginlog"', result.rowcount)
@@ -1,28 +1,22 @@
 # -*- coding: utf-8 -*-
 import logging
-import time
-import json
 from datetime import datetime
-from threading import Thread, Event
 
 from sqlalchemy import text
 
-from dtable_events.app.event_redis import RedisClient
+from dtable_events.app.event_redis import pubsub_dispatcher
 from dtable_events.db import init_db_session_class
+from dtable_events.utils import get_dtable_owner_infos
 
 logger = logging.getLogger(__name__)
 
 
 def count_rows_by_uuids(session, dtable_uuids):
-    dtable_uuids = [uuid.replace('-', '') for uuid in dtable_uuids]
     # select user and org
-    sql = '''
-    SELECT owner, org_id FROM dtable_rows_count
-    WHERE dtable_uuid IN :dtable_uuids
-    '''
-    results = session.execute(text(sql), {'dtable_uuids': dtable_uuids}).fetchall()
+    dtable_owner_infos = get_dtable_owner_infos(dtable_uuids, session)
     usernames, org_ids = set(), set()
-    for owner, org_id in results:
+    for owner_info in dtable_owner_infos.values():
+        owner, org_id = owner_info['owner'], owner_info['org_id']
         if org_id != -1:
             org_ids.add(org_id)
         else:
@@ -113,44 +107,20 @@ def count_rows_by_uuids(session, dtable_uuids):
                         logger.error('update users rows error: %s', e)
 
 
-class DTableRealTimeRowsCounter(Thread):
+class DTableRealTimeRowsCounter(object):
     def __init__(self):
-        Thread.__init__(self)
-        self._finished = Event()
         self._db_session_class = init_db_session_class()
-        self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=5,
-                                         health_check_interval=30, retry_on_timeout=True)
         self._pubsub_channel_name = 'count-rows'
-        self._pubsub_no_message_timeout = 5 * 60
 
+    def handle_message(self, dtable_uuids):
+        session = self._db_session_class()
+        try:
+            count_rows_by_uuids(session, dtable_uuids)
+        except Exception as e:
+            logger.error('Handle table rows count: %s' % e)
+        finally:
+            session.close()
 
-    def run(self):
+    def start(self):
         logger.info('Starting handle table rows count...')
-        subscriber = self._redis_client.get_subscriber(self._pubsub_channel_name)
-        last_pubsub_message_time = time.time()
-        while not self._finished.is_set():
-            try:
-                message = subscriber.get_message()
-                if message is not None:
-                    if message.get('type') != 'message':
-                        continue
-                    last_pubsub_message_time = time.time()
-                    dtable_uuids = json.loads(message['data'])
-                    session = self._db_session_class()
-                    try:
-                        count_rows_by_uuids(session, dtable_uuids)
-                    except Exception as e:
-                        logger.error('Handle table rows count: %s' % e)
-                    finally:
-                        session.close()
-                else:
-                    if (time.time() - last_pubsub_message_time) >= self._pubsub_no_message_timeout:
-                        subscriber = self._redis_client.refresh_subscriber(
-                            subscriber, self._pubsub_channel_name, 'no message timeout')
-                        last_pubsub_message_time = time.time()
-                        continue
-                    time.sleep(0.5)
-            except Exception as e:
-                logger.error('redis pubsub receive error: %s', e)
-                subscriber = self._redis_client.refresh_subscriber(subscriber, self._pubsub_channel_name, str(e))
-                last_pubsub_message_time = time.time()
+        pubsub_dispatcher.register(self._pubsub_channel_name, self.handle_message, name='real_time_rows_counter')
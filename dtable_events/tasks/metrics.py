@@ -1,66 +1,41 @@
 import datetime
 import logging
-import time
-from threading import Thread, Event
-import json
+from threading import Thread
 from zoneinfo import ZoneInfo
 
 from apscheduler.schedulers.blocking import BlockingScheduler
 
 from dtable_events.app.config import TIME_ZONE
-from dtable_events.app.event_redis import redis_cache, REDIS_METRIC_KEY, RedisClient
+from dtable_events.app.event_redis import redis_cache, REDIS_METRIC_KEY, pubsub_dispatcher
 from dtable_events.utils.utils_metric import METRIC_CHANNEL_NAME
 
 local_metric = {
   'metrics': {}
 }
 
-class MetricReceiver(Thread):
+class MetricReceiver(object):
     """
     collect metrics from redis channel and save to local
     """
     def __init__(self):
-        Thread.__init__(self)
-        self._finished = Event()
-        self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=5,
-                                         health_check_interval=30, retry_on_timeout=True)
         self._pubsub_channel_name = METRIC_CHANNEL_NAME
-        self._pubsub_no_message_timeout = 5 * 60
 
-    def run(self):
-        subscriber = self._redis_client.get_subscriber(self._pubsub_channel_name)
-        last_pubsub_message_time = time.time()
-        while not self._finished.is_set():
-            try:
-                message = subscriber.get_message()
-                if message:
-                    if message.get('type') != 'message':
-                        continue
-                    last_pubsub_message_time = time.time()
-                    metric_data = json.loads(message['data'])
-                    try:
-                        component_name = metric_data.get('component_name')
-                        node_name = metric_data.get('node_name', 'default')
-                        metric_name = metric_data.get('metric_name')
-                        key_name = f"{component_name}:{node_name}:{metric_name}"
-                        metric_details = metric_data.get('details') or {}
-                        metric_details['metric_value'] = metric_data.get('metric_value')
-                        metric_details['metric_type'] = metric_data.get('metric_type')
-                        metric_details['metric_help'] = metric_data.get('metric_help')
-                        local_metric['metrics'][key_name] = metric_details
-                    except Exception as e:
-                        logging.error('Error when handling metric data: %s' % e)
-                else:
-                    if (time.time() - last_pubsub_message_time) >= self._pubsub_no_message_timeout:
-                        subscriber = self._redis_client.refresh_subscriber(
-                            subscriber, self._pubsub_channel_name, 'no message timeout')
-                        last_pubsub_message_time = time.time()
-                        continue
-                    time.sleep(0.5)
-            except Exception as e:
-                logging.error('redis pubsub receive error: %s', e)
-                subscriber = self._redis_client.refresh_subscriber(subscriber, self._pubsub_channel_name, str(e))
-                last_pubsub_message_time = time.time()
+    def handle_message(self, metric_data):
+        try:
+            component_name = metric_data.get('component_name')
+            node_name = metric_data.get('node_name', 'default')
+            metric_name = metric_data.get('metric_name')
+            key_name = f"{component_name}:{node_name}:{metric_name}"
+            metric_details = metric_data.get('details') or {}
+            metric_details['metric_value'] = metric_data.get('metric_value')
+            metric_details['metric_type'] = metric_data.get('metric_type')
+            metric_details['metric_help'] = metric_data.get('metric_help')
+            local_metric['metrics'][key_name] = metric_details
+        except Exception as e:
+            logging.error('Error when handling metric data: %s' % e)
+
+    def start(self):
+        pubsub_dispatcher.register(self._pubsub_channel_name, self.handle_message, name='metric')
 
 
 class MetricSaver(Thread):
@@ -3,11 +3,11 @@ import json
 import os
 import time
 import logging
-from threading import Lock, Thread, Event
+from threading import Lock
 from datetime import datetime, timedelta
 
 from dtable_events.db import init_db_session_class
-from dtable_events.app.event_redis import RedisClient
+from dtable_events.app.event_redis import pubsub_dispatcher
 from dtable_events.utils import uuid_str_to_36_chars
 from dtable_events.app.config import UNIVERSAL_APP_SNAPSHOT_AUTO_SAVE_DAYS
 
@@ -16,16 +16,11 @@ from seaserv import seafile_api
 
 logger = logging.getLogger(__name__)
 
-class UniversalAppAutoBackup(Thread):
+class UniversalAppAutoBackup(object):
     def __init__(self):
-        Thread.__init__(self)
-        self._finished = Event()
         self._db_session_class = init_db_session_class()
-        self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=5,
-                                         health_check_interval=30, retry_on_timeout=True)
         self._lock = Lock()
         self._pubsub_channel_name = 'universal-app-auto-backup'
-        self._pubsub_no_message_timeout = 5 * 60
 
     def create_snapshot(self, session, app_id, app_version, app_config):
         """
@@ -138,44 +133,26 @@ class UniversalAppAutoBackup(Thread):
                 return False
         return True
 
-    def run(self):
+    def handle_message(self, msg):
+        user_name = msg.get('username', '')
+        app_id = msg.get('app_id', '')
+        app_version = msg.get('app_version', '')
+        repo_id = msg.get('repo_id', '')
+        dtable_uuid = msg.get('dtable_uuid', '')
+        app_config = msg.get('app_config', '{}')
+        session = self._db_session_class()
+        try:
+            if not self.should_auto_backup(session, app_id, app_version):
+                return
+            with self._lock:
+                new_snapshot_id = self.create_snapshot(session, app_id, app_version, app_config)
+                self.backup_custom_pages(app_id, app_config, repo_id, dtable_uuid, user_name, new_snapshot_id)
+                self.backup_single_record_pages(app_id, app_config, repo_id, dtable_uuid, user_name, new_snapshot_id)
+        except Exception as e:
+            logger.error(e)
+        finally:
+            session.close()
+
+    def start(self):
         logger.info('Starting universal app auto backup thread')
-        subscriber = self._redis_client.get_subscriber(self._pubsub_channel_name)
-        last_pubsub_message_time = time.time()
-        while not self._finished.is_set():
-            try:
-                message = subscriber.get_message()
-                if message is not None:
-                    if message.get('type') != 'message':
-                        continue
-                    last_pubsub_message_time = time.time()
-                    msg = json.loads(message['data'])
-                    user_name = msg.get('username', '')
-                    app_id = msg.get('app_id', '')
-                    app_version = msg.get('app_version', '')
-                    repo_id = msg.get('repo_id', '')
-                    dtable_uuid = msg.get('dtable_uuid', '')
-                    app_config = msg.get('app_config', '{}')
-                    session = self._db_session_class()
-                    try:
-                        if not self.should_auto_backup(session, app_id, app_version):
-                            continue
-                        with self._lock:
-                            new_snapshot_id = self.create_snapshot(session, app_id, app_version, app_config)
-                            self.backup_custom_pages(app_id, app_config, repo_id, dtable_uuid, user_name, new_snapshot_id)
-                            self.backup_single_record_pages(app_id, app_config, repo_id, dtable_uuid, user_name, new_snapshot_id)
-                    except Exception as e:
-                        logger.error(e)
-                    finally:
-                        session.close()
-                else:
-                    if (time.time() - last_pubsub_message_time) >= self._pubsub_no_message_timeout:
-                        subscriber = self._redis_client.refresh_subscriber(
-                            subscriber, self._pubsub_channel_name, 'no message timeout')
-                        last_pubsub_message_time = time.time()
-                        continue
-                    time.sleep(0.5)
-            except Exception as e:
-                logger.error('redis pubsub receive error: %s', e)
-                subscriber = self._redis_client.refresh_subscriber(subscriber, self._pubsub_channel_name, str(e))
-                last_pubsub_message_time = time.time()
+        pubsub_dispatcher.register(self._pubsub_channel_name, self.handle_message, name='universal_app_auto_backup')
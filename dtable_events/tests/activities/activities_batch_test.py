@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import unittest
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.activities.db import save_activities_batch, save_or_update_or_delete, DETAIL_LIMIT
+from dtable_events.activities.models import Activities
+
+DTABLE_UUID = '1f2e3d4c5b6a47988796a5b4c3d2e1f0'
+OP_TIME = 1700000000
+
+
+def gen_event(op_type, row_id, op_user='a@x.com', seconds=0, table_id='t1', value='v'):
+    return {
+        'dtable_uuid': DTABLE_UUID,
+        'row_id': row_id,
+        'op_user': op_user,
+        'op_type': op_type,
+        'op_time': OP_TIME + seconds,
+        'table_id': table_id,
+        'table_name': 'Table1',
+        'row_name': row_id,
+        'row_data': [
+            {'column_key': '0000', 'column_name': 'Name', 'column_type': 'text', 'column_data': {},
+             'value': value, 'old_value': ''},
+            {'column_key': '_ctime', 'column_name': 'Created', 'column_type': 'ctime', 'column_data': {},
+             'value': '2023-11-14', 'old_value': ''},
+        ],
+    }
+
+
+class SaveActivitiesBatchTest(unittest.TestCase):
+    """Activities saved in batch are the same as saved one by one"""
+
+    def new_session(self):
+        engine = create_engine('sqlite://')
+        Activities.metadata.create_all(engine, tables=[Activities.__table__])
+        return sessionmaker(bind=engine)()
+
+    def get_activities(self, session):
+        return [(activity.row_id, activity.op_user, activity.op_type, activity.op_time, json.loads(activity.detail))
+                for activity in session.scalars(select(Activities).order_by(Activities.id))]
+
+    def assert_same_activities(self, events, saved_events=()):
+        one_by_one_session, batch_session = self.new_session(), self.new_session()
+        for event in saved_events:
+            save_or_update_or_delete(one_by_one_session, event)
+            save_or_update_or_delete(batch_session, event)
+
+        for event in events:
+            save_or_update_or_delete(one_by_one_session, event)
+        save_activities_batch(batch_session, events)
+
+        activities = self.get_activities(one_by_one_session)
+        self.assertEqual(self.get_activities(batch_session), activities)
+        return activities
+
+    def test_modify_merged(self):
+        activities = self.assert_same_activities([
+            gen_event('insert_row', 'r1'),
+            gen_event('modify_row', 'r1', seconds=10, value='v1'),
+            gen_event('modify_row', 'r1', seconds=20, value='v2'),
+            gen_event('modify_row', 'r2', seconds=30, value='v1'),
+            gen_event('modify_row', 'r2', seconds=40, value='v2'),
+        ], saved_events=[gen_event('modify_row', 'r2', seconds=-60, value='v0')])
+        self.assertEqual([(row_id, op_type, detail['row_data'][0]['value'])
+                          for row_id, _, op_type, _, detail in activities],
+                         [('r2', 'modify_row', 'v2'), ('r1', 'insert_row', 'v2')])
+
+    def test_modify_not_merged(self):
+        activities = self.assert_same_activities([
+            gen_event('modify_row', 'r1'),
+            gen_event('modify_row', 'r1', op_user='b@x.com', seconds=10),
+            gen_event('modify_row', 'r1', seconds=10 * 60),
+            gen_event('modify_row', 'r2'),
+            gen_event('modify_row', 'r2', seconds=10, table_id='t2'),
+        ])
+        self.assertEqual(len(activities), 5)
+
+    def test_delete_cancels_insert(self):
+        activities = self.assert_same_activities([
+            gen_event('insert_row', 'r1'),
+            gen_event('modify_row', 'r1', seconds=10),
+            gen_event('delete_row', 'r1', seconds=20),
+            gen_event('delete_row', 'r2', seconds=20),
+            gen_event('delete_row', 'r3', seconds=20),
+            gen_event('insert_row', 'r4'),
+            gen_event('delete_row', 'r4', op_user='b@x.com', seconds=20),
+        ], saved_events=[gen_event('insert_row', 'r2'), gen_event('insert_row', 'r3', seconds=-10 * 60)])
+        self.assertEqual([(row_id, op_type) for row_id, _, op_type, _, _ in activities],
+                         [('r3', 'insert_row'), ('r3', 'delete_row'), ('r4', 'insert_row'), ('r4', 'delete_row')])
+
+    def test_detail_limit(self):
+        large_value = 'x' * DETAIL_LIMIT
+        activities = self.assert_same_activities([
+            gen_event('insert_row', 'r1'),
+            gen_event('modify_row', 'r1', seconds=10, value=large_value),
+            gen_event('modify_row', 'r1', seconds=20, value='v2'),
+            gen_event('insert_row', 'r2', value=large_value),
+            gen_event('modify_row', 'r2', seconds=10, value='v2'),
+        ])
+        self.assertEqual([(row_id, op_type, detail['row_data'][0]['value'])
+                          for row_id, _, op_type, _, detail in activities],
+                         [('r1', 'insert_row', 'v2'), ('r2', 'modify_row', 'v2')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""
+Benchmark overhead of automation rate limiter per `is_allowed` call.
+
+    python rate_limiter_benchmark.py --backend local
+    python rate_limiter_benchmark.py --backend redis --redis-url redis://127.0.0.1:6379/0
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.automations.rate_limiter import LocalRateLimiter, RedisRateLimiter, ApproximateRedisRateLimiter, \
+    RATE_LIMIT_BACKEND_LOCAL, RATE_LIMIT_BACKEND_REDIS, RATE_LIMIT_BACKEND_REDIS_APPROXIMATE
+
+
+def get_limiter(backend, redis_url):
+    if backend == RATE_LIMIT_BACKEND_LOCAL:
+        return LocalRateLimiter()
+    import redis
+    redis_client = redis.Redis.from_url(redis_url, decode_responses=True)
+    if backend == RATE_LIMIT_BACKEND_REDIS:
+        return RedisRateLimiter(redis_client=redis_client)
+    return ApproximateRedisRateLimiter(redis_client=redis_client, sync_interval=1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', default=RATE_LIMIT_BACKEND_LOCAL,
+                        choices=[RATE_LIMIT_BACKEND_LOCAL, RATE_LIMIT_BACKEND_REDIS, RATE_LIMIT_BACKEND_REDIS_APPROXIMATE])
+    parser.add_argument('--redis-url', default='redis://127.0.0.1:6379/0')
+    parser.add_argument('--calls', type=int, default=10000)
+    parser.add_argument('--orgs', type=int, default=100)
+    args = parser.parse_args()
+
+    limiter = get_limiter(args.backend, args.redis_url)
+    limiter.start()
+    org_ids = list(range(1, args.orgs + 1))
+    for org_id in org_ids:
+        limiter.record_time(None, org_id, random.random())
+
+    cost = 0
+    for i in range(args.calls):
+        org_id = org_ids[i % len(org_ids)]
+        start = time.perf_counter()
+        limiter.is_allowed(None, org_id, 5)
+        cost += time.perf_counter() - start
+        limiter.record_time(None, org_id, 0.01)
+    print(f'backend: {args.backend} calls: {args.calls} total: {cost:.3f}s '
+          f'per is_allowed: {cost / args.calls * 1000000:.1f}us')
+
+
+if __name__ == '__main__':
+    main()
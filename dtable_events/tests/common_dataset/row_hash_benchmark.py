@@ -0,0 +1,91 @@
+"""
+Benchmark the update phase of a common dataset sync, comparing every src row with its dst row fetched
+from dtable-db, or skipping rows by row hashes of last sync, dst reads are counted instead of requested.
+
+    python row_hash_benchmark.py --rows 100000 --churn 0.01
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.common_dataset.common_dataset_sync_utils import generate_single_row, generate_synced_rows
+from dtable_events.common_dataset.sync_watermark import get_row_hash
+from dtable_events.utils.constants import ColumnTypes
+
+COLUMNS = [
+    {'key': '0000', 'name': 'Name', 'type': ColumnTypes.TEXT},
+    {'key': 'num1', 'name': 'Amount', 'type': ColumnTypes.NUMBER, 'data': {'format': 'number', 'decimal': 'dot', 'thousands': 'no'}},
+    {'key': 'date', 'name': 'Date', 'type': ColumnTypes.DATE, 'data': {'format': 'YYYY-MM-DD'}},
+    {'key': 'chck', 'name': 'Done', 'type': ColumnTypes.CHECKBOX},
+    {'key': 'note', 'name': 'Note', 'type': ColumnTypes.LONG_TEXT},
+]
+STEP = 10000
+
+
+def gen_row(i, version=0):
+    return {
+        '_id': str(i),
+        '0000': f'name {i} {version}',
+        'num1': i * 1.5,
+        'date': '2024-01-%02d' % (i % 28 + 1),
+        'chck': i % 2 == 0,
+        'note': f'note of row {i}',
+    }
+
+
+def compare_all(src_rows_dict, dst_rows_dict):
+    reads, read_rows, updated = 0, 0, 0
+    rows_id_list = list(src_rows_dict)
+    for i in range(0, len(rows_id_list), STEP):
+        step_rows_id_list = rows_id_list[i: i+STEP]
+        reads += 1
+        read_rows += len(step_rows_id_list)
+        dst_rows = [dst_rows_dict[row_id] for row_id in step_rows_id_list]
+        src_rows = [src_rows_dict[row_id] for row_id in step_rows_id_list]
+        to_be_updated_rows, _ = generate_synced_rows(src_rows, COLUMNS, COLUMNS, [], dst_rows=dst_rows)
+        updated += len(to_be_updated_rows)
+    return reads, read_rows, updated
+
+
+def compare_by_hashes(src_rows_dict, dst_rows_dict, row_hashes):
+    columns_dict = {col['key']: col for col in COLUMNS}
+    changed_rows_id_list = []
+    for row_id, row in src_rows_dict.items():
+        synced_row, _ = generate_single_row(row, COLUMNS, columns_dict)
+        if row_hashes.get(row_id) != get_row_hash(synced_row):
+            changed_rows_id_list.append(row_id)
+    changed_rows_dict = {row_id: src_rows_dict[row_id] for row_id in changed_rows_id_list}
+    return compare_all(changed_rows_dict, dst_rows_dict)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--churn', type=float, default=0.01)
+    args = parser.parse_args()
+
+    columns_dict = {col['key']: col for col in COLUMNS}
+    dst_rows_dict, row_hashes = {}, {}
+    for i in range(args.rows):
+        synced_row, _ = generate_single_row(gen_row(i), COLUMNS, columns_dict)
+        row_hashes[str(i)] = get_row_hash(synced_row)
+        dst_rows_dict[str(i)] = dict(synced_row, _id=str(i))
+    changed = set(random.sample(range(args.rows), int(args.rows * args.churn)))
+    src_rows_dict = {str(i): gen_row(i, version=1 if i in changed else 0) for i in range(args.rows)}
+
+    for name, func, func_args in [
+        ('compare all', compare_all, (src_rows_dict, dst_rows_dict)),
+        ('row hashes', compare_by_hashes, (src_rows_dict, dst_rows_dict, row_hashes))
+    ]:
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        reads, read_rows, updated = func(*func_args)
+        print(f'{name:>12}: dst reads: {reads:>3} dst rows read: {read_rows:>7} updated rows: {updated:>6} '
+              f'wall-clock: {time.perf_counter() - start_wall:.2f}s cpu: {time.process_time() - start_cpu:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark exporting a synthetic big data view to excel, sequentially (fetch, convert and write page by page)
+or by the export pipeline, query latency of dtable-db is simulated by `--latency` per page.
+Run each mode in its own process to compare peak RSS.
+
+    python big_data_export_benchmark.py --mode sequential
+    python big_data_export_benchmark.py --mode pipeline --rows 250000 --latency 0.5
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import openpyxl
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.dtable_io.big_data import run_export_pipeline, EXPORT_PAGE_SIZE
+from dtable_events.dtable_io.excel import write_xls_head, convert_rows_to_cells
+from dtable_events.utils.constants import ColumnTypes
+
+COLUMNS = [
+    {'key': '0000', 'name': 'Name', 'type': ColumnTypes.TEXT},
+    {'key': 'num1', 'name': 'Amount', 'type': ColumnTypes.NUMBER, 'data': {'format': 'number', 'decimal': 'dot', 'thousands': 'no'}},
+    {'key': 'date', 'name': 'Date', 'type': ColumnTypes.DATE, 'data': {'format': 'YYYY-MM-DD'}},
+    {'key': 'chck', 'name': 'Done', 'type': ColumnTypes.CHECKBOX},
+    {'key': 'note', 'name': 'Note', 'type': ColumnTypes.LONG_TEXT},
+]
+
+
+def fetch_pages(rows, latency):
+    for start in range(0, rows, EXPORT_PAGE_SIZE):
+        time.sleep(latency)
+        yield start, [{
+            '_id': str(i),
+            'Name': f'name {i}',
+            'Amount': i * 1.5,
+            'Date': '2024-01-%02d' % (i % 28 + 1),
+            'Done': i % 2 == 0,
+            'Note': f'note of row {i}\n' * 3,
+        } for i in range(start, min(start + EXPORT_PAGE_SIZE, rows))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', default='pipeline', choices=['sequential', 'pipeline'])
+    parser.add_argument('--rows', type=int, default=250000)
+    parser.add_argument('--latency', type=float, default=0.5, help='simulated seconds of querying a page')
+    args = parser.parse_args()
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('benchmark')
+    image_param = {'num': 0, 'is_support': False, 'images_target_dir': ''}
+
+    def convert_page(page):
+        start, rows = page
+        return convert_rows_to_cells(rows, {}, ws, start, '', '', image_param, COLUMNS)
+
+    def write_page(row_list):
+        for row_cells in row_list:
+            ws.append(row_cells)
+
+    start_time = time.time()
+    write_xls_head(ws, COLUMNS)
+    if args.mode == 'sequential':
+        for page in fetch_pages(args.rows, args.latency):
+            write_page(convert_page(page))
+    else:
+        run_export_pipeline(fetch_pages(args.rows, args.latency), convert_page, write_page)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        wb.save(os.path.join(tmp_dir, 'benchmark.xlsx'))
+    cost = time.time() - start_time
+
+    # ru_maxrss is in kilobytes on linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'mode: {args.mode} rows: {args.rows} latency: {args.latency}s wall-clock: {cost:.2f}s peak rss: {peak_rss:.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
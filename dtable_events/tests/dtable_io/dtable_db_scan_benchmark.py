@@ -0,0 +1,55 @@
+"""
+Benchmark latency of scanning a dtable-db table page by page with `LIMIT offset, size` and with
+`_id` seek pagination (`DTableDBAPI.iter_pages`), pages are compared at the same offsets.
+Needs dtable-events config to access dtable-db.
+
+    python dtable_db_scan_benchmark.py --dtable-uuid <uuid> --table Table1 --page-size 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.app.config import INNER_DTABLE_DB_URL
+from dtable_events.utils.dtable_db_api import DTableDBAPI
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dtable-uuid', required=True)
+    parser.add_argument('--table', required=True)
+    parser.add_argument('--username', default='dtable-events')
+    parser.add_argument('--db-url', default=INNER_DTABLE_DB_URL)
+    parser.add_argument('--page-size', type=int, default=10000)
+    parser.add_argument('--max-rows', type=int, default=None)
+    args = parser.parse_args()
+
+    dtable_db_api = DTableDBAPI(args.username, args.dtable_uuid, args.db_url)
+
+    seek_costs = []
+    pages = dtable_db_api.iter_pages(args.table, ['_id'], page_size=args.page_size, limit=args.max_rows,
+                                     convert=False, server_only=True, seek=True)
+    while True:
+        start = time.perf_counter()
+        page = next(pages, None)
+        if page is None:
+            break
+        seek_costs.append(time.perf_counter() - start)
+
+    offset_costs = []
+    for i in range(len(seek_costs)):
+        sql = f"SELECT `_id` FROM `{args.table}` LIMIT {i * args.page_size}, {args.page_size}"
+        start = time.perf_counter()
+        dtable_db_api.query(sql, convert=False, server_only=True)
+        offset_costs.append(time.perf_counter() - start)
+
+    print(f'{"offset":>10} {"limit offset (ms)":>18} {"seek by _id (ms)":>18}')
+    for i, (offset_cost, seek_cost) in enumerate(zip(offset_costs, seek_costs)):
+        print(f'{i * args.page_size:>10} {offset_cost * 1000:>18.1f} {seek_cost * 1000:>18.1f}')
+    print(f'{"total":>10} {sum(offset_costs) * 1000:>18.1f} {sum(seek_costs) * 1000:>18.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.notification_rules import notification_rules_utils
+from dtable_events.notification_rules.notification_rules_utils import scan_triggered_notification_rules_batch
+
+Rule = namedtuple('Rule', ['id', 'trigger', 'action', 'creator', 'last_trigger_time', 'dtable_uuid'])
+
+DTABLE_UUID = '1f2e3d4c5b6a47988796a5b4c3d2e1f0'
+
+
+class FakeSession(object):
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.params = None
+
+    def execute(self, sql, params=None):
+        self.params = params
+        return [rule for rule in self.rules if rule.id in params['rule_ids']]
+
+    def commit(self):
+        pass
+
+
+class ScanTriggeredNotificationRulesTest(unittest.TestCase):
+
+    def scan(self, events, rules):
+        db_session = FakeSession(rules)
+        with mock.patch.object(notification_rules_utils, 'trigger_notification_rule_batch') as trigger:
+            scan_triggered_notification_rules_batch(events, db_session)
+        return db_session, {call.args[0].id: call.args[1] for call in trigger.call_args_list}
+
+    def test_mixed_keys(self):
+        dtable_uuid_36 = '1F2E3D4C-5B6A-4798-8796-A5B4C3D2E1F0'
+        events = [
+            {'dtable_uuid': DTABLE_UUID, 'table_id': 't1', 'row_id': 'r1', 'op_type': 'modify_row', 'notification_rule_id': 1},
+            {'dtable_uuid': dtable_uuid_36, 'table_id': 't1', 'row_id': 'r2', 'op_type': 'modify_row', 'notification_rule_id': '1'},
+            {'dtable_uuid': DTABLE_UUID.upper(), 'table_id': 't1', 'row_id': 'r3', 'op_type': 'insert_row', 'notification_rule_id': '2'},
+        ]
+        rules = [Rule(1, '{}', '{}', 'a@x.com', None, DTABLE_UUID), Rule(2, '{}', '{}', 'a@x.com', None, DTABLE_UUID)]
+        db_session, triggered = self.scan(events, rules)
+        self.assertEqual(sorted(db_session.params['rule_ids']), [1, 2])
+        self.assertEqual(triggered, {
+            1: [('t1', 'r1', 'modify_row'), ('t1', 'r2', 'modify_row')],
+            2: [('t1', 'r3', 'insert_row')],
+        })
+
+    def test_events_of_other_base_or_invalid(self):
+        events = [
+            {'dtable_uuid': 'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa', 'table_id': 't1', 'row_id': 'r1', 'notification_rule_id': 1},
+            {'dtable_uuid': DTABLE_UUID, 'table_id': 't1', 'row_id': 'r2', 'notification_rule_id': 'invalid'},
+        ]
+        _, triggered = self.scan(events, [Rule(1, '{}', '{}', 'a@x.com', None, DTABLE_UUID)])
+        self.assertEqual(triggered, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Benchmark generating sqls of TEST_CONDITIONS by filter2sql, with the sql cache disabled, cold and warm, e.g.
+rules of automations and notifications checked repeatedly with the same filters.
+
+    python sql_cache_benchmark.py --rounds 1000
+"""
+import argparse
+import os
+import sys
+import time
+
+d = os.path.dirname
+sys.path.append(d(d(os.path.abspath(__file__))))
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from sql.column_reference import TEST_COLUMNS
+from sql.test_reference import TEST_CONDITIONS
+from dtable_events.utils import sql_generator
+from dtable_events.utils.sql_generator import filter2sql, _sql_cache
+
+TABLE_NAME = 'Table1'
+
+
+def run(name, rounds, clear_cache=False):
+    conditions = [condition for condition in TEST_CONDITIONS if condition.get('expected_sql')]
+    sqls = []
+    start = time.time()
+    for _ in range(rounds):
+        if clear_cache:
+            _sql_cache.clear()
+        sqls = [filter2sql(TABLE_NAME, TEST_COLUMNS, condition['filter_conditions'], by_group=condition.get('by_group'))
+                for condition in conditions]
+    elapsed = time.time() - start
+    mismatched = sum(1 for sql, condition in zip(sqls, conditions) if sql != condition['expected_sql'])
+    total = rounds * len(conditions)
+    print(f'{name}: {total} sqls {elapsed:.3f}s {total / elapsed:.0f} sqls/s, {mismatched} mismatched')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=1000)
+    args = parser.parse_args()
+
+    cache_size = sql_generator.SQL_GENERATOR_CACHE_SIZE
+    sql_generator.SQL_GENERATOR_CACHE_SIZE = 0
+    run('no cache', args.rounds)
+    sql_generator.SQL_GENERATOR_CACHE_SIZE = cache_size
+    run('cold cache', args.rounds, clear_cache=True)
+    _sql_cache.clear()
+    run('warm cache', args.rounds)
+    print(f'cache: {len(_sql_cache)} entries, {_sql_cache.hits} hits, {_sql_cache.misses} misses')
+
+
+if __name__ == '__main__':
+    main()
@@ -187,6 +187,21 @@ class SqlTest(unittest.TestCase):
             "SELECT * FROM `Table1` WHERE (((`Dept` IN (1, 2, 3, 999)))) LIMIT 0, 100",
         )
 
+    def test_cached_sql(self):
+        # sqls of the cache are the same as generated, sqls are cached from the second time
+        for _ in range(3):
+            self.test_equal()
+
+        # sqls of other filter terms and columns of the same key are not from the cache
+        filter_conditions = {'filters': [{'column_name': 'Colla', 'filter_predicate': 'has_any_of', 'filter_term': ['a@x.com']}]}
+        self.assertEqual(self._toSql(filter_conditions), "SELECT * FROM `Table1` WHERE (`Colla` in ('a@x.com')) LIMIT 0, 100")
+        filter_conditions['filters'][0]['filter_term'].append('b@x.com')
+        self.assertEqual(self._toSql(filter_conditions), "SELECT * FROM `Table1` WHERE (`Colla` in ('a@x.com', 'b@x.com')) LIMIT 0, 100")
+        columns = [dict(column, name='Collaborators') if column.get('name') == 'Colla' else column for column in TEST_COLUMNS]
+        filter_conditions = {'filters': [{'column_key': 'W1lp', 'filter_predicate': 'has_any_of', 'filter_term': ['a@x.com']}]}
+        self.assertNotEqual(filter2sql(self.table_name, TEST_COLUMNS, filter_conditions),
+                            filter2sql(self.table_name, columns, filter_conditions))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -67,6 +67,10 @@ function run_tests() {
     set -e
     # test sql
     python ${EVENTS_TESTDIR}/sql/sql_test.py
+    # test notification rules
+    python ${EVENTS_TESTDIR}/notification_rules/notification_rules_test.py
+    # test activities
+    python ${EVENTS_TESTDIR}/activities/activities_batch_test.py
 }
 
 case $1 in
@@ -0,0 +1,47 @@
+"""
+Benchmark constructing DTableServerAPI and DTableDBAPI objects and requesting with their headers, as an
+automation context or a notification rule does, with the access token cache, or with the cache cleared
+before each construction as tokens were signed for every object.
+
+    python access_token_benchmark.py --count 10000 --bases 10
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.app.config import INNER_DTABLE_SERVER_URL, INNER_DTABLE_DB_URL
+from dtable_events.utils.dtable_server_api import DTableServerAPI
+from dtable_events.utils.dtable_db_api import DTableDBAPI
+from dtable_events.utils.token_cache import clear_cached_tokens
+
+
+def construct(dtable_uuid):
+    dtable_server_api = DTableServerAPI('automation-rule', dtable_uuid, INNER_DTABLE_SERVER_URL, kwargs={'org_id': 1})
+    dtable_db_api = DTableDBAPI('automation-rule', dtable_uuid, INNER_DTABLE_DB_URL, kwargs={'org_id': 1})
+    return dtable_server_api.headers, dtable_db_api.headers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--bases', type=int, default=10)
+    args = parser.parse_args()
+
+    dtable_uuids = [str(uuid.uuid4()) for _ in range(args.bases)]
+    for name, clear in [('no cache', True), ('cached', False)]:
+        clear_cached_tokens()
+        start = time.perf_counter()
+        for i in range(args.count):
+            if clear:
+                clear_cached_tokens()
+            construct(dtable_uuids[i % args.bases])
+        cost = time.perf_counter() - start
+        print(f'{name:>8}: {args.count} constructions {cost:.3f}s, {cost / args.count * 1000000:.1f}us each')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark virus scan backends scanning files of blocks, the clamd backend streaming blocks to a local stand-in
+clamd daemon, or a real one by --clamd-address, and the command backend writing temp files and running a
+command per file.
+
+    python clamd_benchmark.py --files 1000 --blocks 4 --block-size 65536 --threads 4
+    python clamd_benchmark.py --backend command --scan-command /bin/true
+"""
+import argparse
+import os
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.virus_scanner.scanner_backend import ClamdScanner, CommandScanner, SCAN_RESULT_OK, \
+    SCAN_RESULT_VIRUS
+
+# streams containing the signature are reported infected
+VIRUS_SIGNATURE = b'X5O!P%@AP[4\\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*'
+
+
+class FakeClamdHandler(socketserver.BaseRequestHandler):
+    """
+    zINSTREAM command of clamd, a stream of chunks prefixed by 4 bytes length, ended by a zero length chunk
+    """
+
+    def recv_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            packet = self.request.recv(size - len(data))
+            if not packet:
+                raise ConnectionError('connection closed')
+            data += packet
+        return data
+
+    def handle(self):
+        command = b''
+        while not command.endswith(b'\0'):
+            command += self.recv_exactly(1)
+        if command != b'zINSTREAM\0':
+            self.request.sendall(b'UNKNOWN COMMAND\0')
+            return
+        found = False
+        tail = b''
+        while True:
+            size = struct.unpack('!L', self.recv_exactly(4))[0]
+            if size == 0:
+                break
+            data = tail + self.recv_exactly(size)
+            found = found or VIRUS_SIGNATURE in data
+            tail = data[-len(VIRUS_SIGNATURE):]
+        self.request.sendall(b'stream: Eicar-Signature FOUND\0' if found else b'stream: OK\0')
+
+
+class FakeClamd(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class CommandSettings(object):
+
+    def __init__(self, scan_cmd):
+        self.scan_cmd = scan_cmd
+        self.vir_codes = ['1']
+        self.nonvir_codes = ['0']
+
+
+def gen_files(count, blocks, block_size):
+    block = os.urandom(block_size)
+    virus_block = block[:block_size // 2] + VIRUS_SIGNATURE + block[block_size // 2 + len(VIRUS_SIGNATURE):]
+    # every 100th file is infected
+    return [[virus_block if i % 100 == 99 and j == blocks - 1 else block for j in range(blocks)] for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', default='clamd', choices=['clamd', 'command'])
+    parser.add_argument('--clamd-address', default='', help='real clamd address, a stand-in daemon is started if not set')
+    parser.add_argument('--scan-command', default='/bin/true')
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--blocks', type=int, default=4)
+    parser.add_argument('--block-size', type=int, default=64 * 1024)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    server = None
+    if args.backend == 'clamd':
+        address = args.clamd_address
+        if not address:
+            address = os.path.join(tempfile.mkdtemp(), 'clamd.sock')
+            server = FakeClamd(address, FakeClamdHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        scanner = ClamdScanner(address)
+    else:
+        scanner = CommandScanner(CommandSettings(args.scan_command))
+
+    files = gen_files(args.files, args.blocks, args.block_size)
+    start = time.time()
+    with ThreadPoolExecutor(args.threads) as executor:
+        results = list(executor.map(lambda blocks: scanner.scan(iter(blocks)), files))
+    elapsed = time.time() - start
+    if server:
+        server.shutdown()
+
+    total_bytes = args.files * args.blocks * args.block_size
+    print(f'backend: {scanner.name} files: {args.files} ok: {results.count(SCAN_RESULT_OK)} '
+          f'virus: {results.count(SCAN_RESULT_VIRUS)} total: {elapsed:.3f}s '
+          f'{args.files / elapsed:.1f} files/s {total_bytes / elapsed / 1024 / 1024:.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark CommitDiffer on a synthetic tree of 100k entries in memory, a full diff of a new repo, a diff of
+a commit changing some files, and the same diff of a repo sharing the ancestor, with dirs cached.
+
+    python commit_differ_benchmark.py --dirs 1000 --files-per-dir 100 --changed 0.01
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import time
+
+d = os.path.dirname
+sys.path.append(d(d(d(d(os.path.abspath(__file__))))))
+from dtable_events.virus_scanner import commit_differ
+from dtable_events.virus_scanner.commit_differ import CommitDiffer, _seafdirs
+
+DIR_TYPE, FILE_TYPE = 'dir', 'file'
+
+
+class FakeDent(object):
+
+    def __init__(self, name, obj_id, obj_type, size=0):
+        self.name = name
+        self.id = obj_id
+        self.type = obj_type
+        self.size = size
+
+
+class FakeSeafDir(object):
+
+    def __init__(self, dents):
+        self.dents = {dent.name: dent for dent in dents}
+
+    def get_files_list(self):
+        return [dent for dent in self.dents.values() if dent.type == FILE_TYPE]
+
+    def get_subdirs_list(self):
+        return [dent for dent in self.dents.values() if dent.type == DIR_TYPE]
+
+    def lookup_dent(self, name):
+        return self.dents.get(name)
+
+
+class FakeFsMgr(object):
+
+    def __init__(self):
+        self.dirs = {}
+        self.loads = 0
+
+    def add_dir(self, dents):
+        dir_id = hashlib.sha1(repr(sorted((dent.name, dent.id) for dent in dents)).encode()).hexdigest()
+        self.dirs[dir_id] = FakeSeafDir(dents)
+        return dir_id
+
+    def load_seafdir(self, repo_id, version, dir_id):
+        self.loads += 1
+        return self.dirs[dir_id]
+
+
+def gen_file_id():
+    return hashlib.sha1(os.urandom(8)).hexdigest()
+
+
+def gen_tree(fs_mgr, dirs, files_per_dir, changed=0, files=None):
+    """
+    root / d0..dN / f0..fM, returns root id and {(dir, file): file_id}, `changed` part of files changed
+    """
+    files = dict(files or {})
+    for key in random.sample(sorted(files), int(len(files) * changed)):
+        files[key] = gen_file_id()
+    subdir_dents = []
+    for i in range(dirs):
+        dents = []
+        for j in range(files_per_dir):
+            file_id = files.setdefault((i, j), gen_file_id())
+            dents.append(FakeDent(f'f{j}', file_id, FILE_TYPE, 1024))
+        subdir_dents.append(FakeDent(f'd{i}', fs_mgr.add_dir(dents), DIR_TYPE))
+    return fs_mgr.add_dir(subdir_dents), files
+
+
+def run_diff(name, fs_mgr, root1, root2):
+    loads = fs_mgr.loads
+    start = time.time()
+    scan_files = CommitDiffer('repo', 1, root1, root2).diff()
+    print(f'{name}: {len(scan_files)} files changed, {fs_mgr.loads - loads} dirs loaded, {time.time() - start:.3f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dirs', type=int, default=1000)
+    parser.add_argument('--files-per-dir', type=int, default=100)
+    parser.add_argument('--changed', type=float, default=0.01)
+    args = parser.parse_args()
+
+    fs_mgr = FakeFsMgr()
+    commit_differ.fs_mgr = fs_mgr
+    root1, files = gen_tree(fs_mgr, args.dirs, args.files_per_dir)
+    root2, _ = gen_tree(fs_mgr, args.dirs, args.files_per_dir, changed=args.changed, files=files)
+    print(f'tree: {args.dirs} dirs, {len(files)} files')
+
+    _seafdirs.clear()
+    run_diff('new repo', fs_mgr, None, root1)
+    _seafdirs.clear()
+    run_diff('changed commit, cold cache', fs_mgr, root1, root2)
+    run_diff('repo of common ancestor, warm cache', fs_mgr, root1, root2)
+
+
+if __name__ == '__main__':
+    main()
@@ -22,10 +22,20 @@ import mammoth
 
 from dtable_events.app.config import INNER_FILE_SERVER_ROOT
 from dtable_events.app.event_redis import redis_cache
+from dtable_events.utils.lru_cache import LRUCache
 
 logger = logging.getLogger(__name__)
 pyexec = None
 
+# published by dtable-web on base transfer and delete if supported, the redis key of owner info is deleted there too
+DTABLE_OWNER_CHANGED_CHANNEL = 'dtable-owner-changed'
+DTABLE_OWNER_INFO_REDIS_TIMEOUT = 6 * 60 * 60
+DTABLE_OWNER_INFO_KEYS = ('owner', 'org_id', 'workspace_id', 'repo_id')
+
+# dtable_uuid (32 chars) -> {'owner', 'org_id', 'workspace_id', 'repo_id'}
+# ttl is short, entries are not invalidated when only the redis key is deleted by dtable-web
+dtable_owner_cache = LRUCache('dtable_owner', maxsize=20000, ttl=60)
+
 
 EMAIL_RE = re.compile(
         r"(^[-!#$%&*+/=?^_`{}|~0-9A-Z]+(\.[-!#$%&*+/=?^_`{}|~0-9A-Z]+)*"  # dot-atom
@@ -381,24 +391,89 @@ def get_dtable_admins(dtable_uuid, db_session):
         return [member.user_name for member in members if member.is_staff]
 
 
-def get_dtable_owner_org_id(dtable_uuid, db_session):
+def _get_dtable_owner_info_cache_key(dtable_uuid):
+    # key of owner and org_id before, deleted by dtable-web on base transfer
+    return f'dtable:{dtable_uuid}:owner_org_id'
+
+
+def get_dtable_owner_infos(dtable_uuids, db_session):
+    """
+    return a dict of dtable_uuid (32 chars) -> {'owner', 'org_id', 'workspace_id', 'repo_id'}
+    dtables not found are not included
+    """
+    dtable_owner_infos, missing_dtable_uuids = {}, []
+    for dtable_uuid in dtable_uuids:
+        dtable_uuid = uuid_str_to_32_chars(dtable_uuid)
+        owner_info = dtable_owner_cache.get(dtable_uuid)
+        if owner_info is not None:
+            dtable_owner_infos[dtable_uuid] = owner_info
+        else:
+            missing_dtable_uuids.append(dtable_uuid)
+    if not missing_dtable_uuids:
+        return dtable_owner_infos
+    sql = '''
+    SELECT d.uuid, w.owner, w.org_id, w.id AS workspace_id, w.repo_id FROM dtables d
+    JOIN workspaces w ON d.workspace_id=w.id WHERE d.uuid IN :dtable_uuids
+    '''
+    for row in db_session.execute(text(sql), {'dtable_uuids': missing_dtable_uuids}):
+        owner_info = {'owner': row.owner, 'org_id': row.org_id, 'workspace_id': row.workspace_id, 'repo_id': row.repo_id}
+        dtable_owner_cache.set(row.uuid, owner_info)
+        dtable_owner_infos[row.uuid] = owner_info
+    return dtable_owner_infos
+
+
+def get_dtable_owner_info(dtable_uuid, db_session):
+    """
+    return {'owner', 'org_id', 'workspace_id', 'repo_id'} of the dtable or None
+    look up in-process cache, then redis, then database
+    """
     dtable_uuid = uuid_str_to_32_chars(dtable_uuid)
-    key = f'dtable:{dtable_uuid}:owner_org_id'
+    owner_info = dtable_owner_cache.get(dtable_uuid)
+    if owner_info is not None:
+        return owner_info
+    key = _get_dtable_owner_info_cache_key(dtable_uuid)
     value = redis_cache.get(key)
     if value:
         try:
-            value = json.loads(value)
+            owner_info = json.loads(value)
         except:
             pass
         else:
-            return value
-    sql = "SELECT w.owner, w.org_id FROM dtables d JOIN workspaces w ON d.workspace_id=w.id WHERE d.uuid=:dtable_uuid"
-    result = db_session.execute(text(sql), {'dtable_uuid': dtable_uuid}).fetchone()
-    if not result:
+            # values of old versions have owner and org_id only
+            if all(key in owner_info for key in DTABLE_OWNER_INFO_KEYS):
+                dtable_owner_cache.set(dtable_uuid, owner_info)
+                return owner_info
+    owner_info = get_dtable_owner_infos([dtable_uuid], db_session).get(dtable_uuid)
+    if not owner_info:
         return None
-    value = {'owner': result.owner, 'org_id': result.org_id}
-    redis_cache.set(key, json.dumps(value), timeout=6 * 60 * 60)
-    return value
+    redis_cache.set(key, json.dumps(owner_info), timeout=DTABLE_OWNER_INFO_REDIS_TIMEOUT)
+    return owner_info
+
+
+def invalidate_dtable_owner_info(dtable_uuid):
+    dtable_uuid = uuid_str_to_32_chars(dtable_uuid)
+    dtable_owner_cache.delete(dtable_uuid)
+    try:
+        redis_cache.delete(_get_dtable_owner_info_cache_key(dtable_uuid))
+    except Exception as e:
+        logger.warning('delete dtable %s owner info cache error: %s', dtable_uuid, e)
+
+
+def handle_dtable_owner_changed_message(msg):
+    """message of base transfer and delete events published to DTABLE_OWNER_CHANGED_CHANNEL"""
+    dtable_uuid = msg.get('dtable_uuid')
+    if not dtable_uuid:
+        return
+    logger.debug('dtable %s owner changed, op_type: %s', dtable_uuid, msg.get('op_type'))
+    invalidate_dtable_owner_info(dtable_uuid)
+
+
+def get_dtable_owner_org_id(dtable_uuid, db_session):
+    owner_info = get_dtable_owner_info(dtable_uuid, db_session)
+    if not owner_info:
+        return None
+    return {'owner': owner_info['owner'], 'org_id': owner_info['org_id']}
+
 
 def get_user_org_id(username):
     key = f'user:{username}:org_id'
@@ -1,10 +1,10 @@
-import requests
 import time
 from dtable_events.utils import get_file_ext, process_pdf_to_images
 from dtable_events.utils.constants import EXTRACT_TEXT_SUPPORTED_FILES
 import jwt
 
 from dtable_events.app.config import DTABLE_PRIVATE_KEY
+from dtable_events.utils import http_session
 
 class DTableAIAPIError(Exception):
     pass
@@ -35,7 +35,7 @@ class DTableAIAPI:
         
         url = f'{self.seatable_ai_server_url}/api/v1/ai/text-summarize/'
         headers = gen_headers()
-        response = requests.post(url, json=data, headers=headers, timeout=180)
+        response = http_session.post(url, json=data, headers=headers, timeout=180)
         
         if response.status_code == 200:
             result = response.json()
@@ -56,7 +56,7 @@ class DTableAIAPI:
         
         url = f'{self.seatable_ai_server_url}/api/v1/ai/classification/'
         headers = gen_headers()
-        response = requests.post(url, json=data, headers=headers, timeout=180)
+        response = http_session.post(url, json=data, headers=headers, timeout=180)
         
         if response.status_code == 200:
             result = response.json()
@@ -90,7 +90,7 @@ class DTableAIAPI:
         for i, image_data in enumerate(image_pages):
             files.append(('file', (f'page_{i}.jpg', image_data, 'image/jpeg')))
         
-        response = requests.post(url, data=data, files=files, headers=headers, timeout=180)
+        response = http_session.post(url, data=data, files=files, headers=headers, timeout=180)
         
         if response.status_code == 200:
             result = response.json()
@@ -113,7 +113,7 @@ class DTableAIAPI:
         
         url = f'{self.seatable_ai_server_url}/api/v1/ai/extract/'
         headers = gen_headers()
-        response = requests.post(url, json=data, headers=headers, timeout=180)
+        response = http_session.post(url, json=data, headers=headers, timeout=180)
         
         if response.status_code == 200:
             result = response.json()
@@ -134,7 +134,7 @@ class DTableAIAPI:
         
         url = f'{self.seatable_ai_server_url}/api/v1/ai/custom/'
         headers = gen_headers()
-        response = requests.post(url, json=data, headers=headers, timeout=180)
+        response = http_session.post(url, json=data, headers=headers, timeout=180)
         
         if response.status_code == 200:
             result = response.json()
@@ -153,7 +153,7 @@ class DTableAIAPI:
         
         files = {'file': (file_name, file_content, 'application/octet-stream')}
         
-        response = requests.post(url, data=data, files=files, headers=headers, timeout=30)
+        response = http_session.post(url, data=data, files=files, headers=headers, timeout=30)
         
         if response.status_code == 200:
             result = response.json()
@@ -1,15 +1,17 @@
 import json
 import logging
-import requests
 import jwt
 import time
 from datetime import datetime
 from dtable_events.app.config import DTABLE_PRIVATE_KEY
 from dtable_events.utils import uuid_str_to_36_chars
+from dtable_events.utils import http_session
+from dtable_events.utils.token_cache import get_cached_token, get_kwargs_fingerprint
 
 logger = logging.getLogger(__name__)
 
 TIMEOUT = 90
+DTABLE_DB_TOKEN_TIMEOUT = 3600 * 12 * 24
 
 class RowInsertedError(Exception):
     pass
@@ -146,20 +148,28 @@ class DTableDBAPI(object):
     def __init__(self, username, dtable_uuid, dtable_db_url, kwargs=None):
         self.username = username
         self.dtable_uuid = uuid_str_to_36_chars(dtable_uuid) if dtable_uuid else None
-        self.headers = None
         self.dtable_db_url = dtable_db_url.rstrip('/') if dtable_db_url else None
         self.kwargs = kwargs
-        self._init()
+        self._token_key = None
 
-    def _init(self):
-        access_token = self.get_dtable_db_token()
-        self.headers = {'Authorization': 'Token ' + access_token}
-        admin_access_token = self.get_dtable_db_token(is_db_admin=True)
-        self.admin_headers = {'Authorization': 'Token ' + admin_access_token}
+    @property
+    def headers(self):
+        return {'Authorization': 'Token ' + self.get_cached_dtable_db_token()}
 
-    def get_dtable_db_token(self, is_db_admin=None):
+    @property
+    def admin_headers(self):
+        # only signed when an admin api is called
+        return {'Authorization': 'Token ' + self.get_cached_dtable_db_token(is_db_admin=True)}
+
+    def get_cached_dtable_db_token(self, is_db_admin=False):
+        if self._token_key is None:
+            self._token_key = ('dtable_db', self.username, self.dtable_uuid, get_kwargs_fingerprint(self.kwargs))
+        return get_cached_token(self._token_key + (is_db_admin,), DTABLE_DB_TOKEN_TIMEOUT,
+                                lambda exp: self.get_dtable_db_token(is_db_admin=is_db_admin, exp=exp))
+
+    def get_dtable_db_token(self, is_db_admin=None, exp=None):
         payload={
-            'exp': int(time.time()) + 3600 * 12 * 24,
+            'exp': exp or int(time.time()) + DTABLE_DB_TOKEN_TIMEOUT,
             'dtable_uuid': self.dtable_uuid,
             'username': self.username,
             'permission': 'rw',
@@ -193,7 +203,7 @@ class DTableDBAPI(object):
             raise ValueError('sql can not be empty.')
         url = self.dtable_db_url + '/api/v1/query/' + self.dtable_uuid + '/?from=dtable_events'
         json_data = {'sql': sql, 'server_only': server_only, 'convert_keys': convert, 'convert_date': convert}
-        response = requests.post(url, json=json_data, headers=self.headers, timeout=TIMEOUT)
+        response = http_session.post(url, json=json_data, headers=self.headers, timeout=TIMEOUT)
         data = parse_response(response)
         if not data.get('success'):
             if response.status_code == 200:
@@ -203,6 +213,67 @@ class DTableDBAPI(object):
         results = data.get('results')
         return results, metadata
 
+    def iter_pages(self, table_name, columns=None, filter_clause='', sort_clause='', page_size=10000, limit=None,
+                   convert=True, server_only=True, seek=False):
+        """ Scan rows of a table page by page, yield (rows, metadata) of every page
+
+        Pages are queried by `LIMIT offset, size` in the natural order of the table or `sort_clause`.
+        With `seek`, pages are sought by `_id` (`WHERE _id > last ORDER BY _id`) instead, whose cost does not grow
+        with the offset, for callers not caring about the order of rows, nor which rows are in `limit`.
+
+        :param columns: list of column names to query, all columns if None
+        :param filter_clause: str, 'WHERE ...', e.g. generated by BaseSQLGenerator._filter2sql
+        :param sort_clause: str, 'ORDER BY ...', e.g. generated by BaseSQLGenerator._sort2sql, not with `seek`
+        :param limit: int, max number of rows to scan, no limit if None
+        :param seek: bool, scan rows in `_id` order
+        """
+        if seek and sort_clause:
+            raise ValueError('sort_clause can not be used with seek.')
+        remove_id = False
+        if columns is None:
+            columns_str = '*'
+        else:
+            if seek and '_id' not in columns:
+                columns = ['_id'] + list(columns)
+                remove_id = True
+            columns_str = ', '.join(f"`{column}`" for column in columns)
+        condition = filter_clause.strip()
+        if condition.upper().startswith('WHERE '):
+            condition = condition[len('WHERE '):]
+
+        last_id, offset, scanned = None, 0, 0
+        while limit is None or scanned < limit:
+            size = page_size if limit is None else min(page_size, limit - scanned)
+            if seek:
+                conditions = [f"({condition})"] if condition else []
+                if last_id is not None:
+                    conditions.append("_id > '%s'" % last_id.replace("'", "\\'"))
+                where_clause = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+                sql = f"SELECT {columns_str} FROM `{table_name}` {where_clause} ORDER BY _id LIMIT {size}"
+            else:
+                sql = f"SELECT {columns_str} FROM `{table_name}` {filter_clause or ''} {sort_clause} LIMIT {offset}, {size}"
+            rows, metadata = self.query(sql, convert=convert, server_only=server_only)
+            if not rows:
+                break
+            scanned += len(rows)
+            offset += len(rows)
+            last_id = rows[-1]['_id'] if seek else None
+            if remove_id:
+                for row in rows:
+                    row.pop('_id', None)
+            yield rows, metadata
+            if len(rows) < size:
+                break
+
+    def iter_rows(self, table_name, columns=None, filter_clause='', sort_clause='', page_size=10000, limit=None,
+                  convert=True, server_only=True, seek=False):
+        """ Scan rows of a table, see `iter_pages`
+        """
+        for rows, _ in self.iter_pages(table_name, columns=columns, filter_clause=filter_clause, sort_clause=sort_clause,
+                                       page_size=page_size, limit=limit, convert=convert, server_only=server_only,
+                                       seek=seek):
+            yield from rows
+
     def insert_rows(self, table_name, rows):
         api_url = "%s/api/v1/insert-rows/%s/?from=dtable_events" % (
             self.dtable_db_url.rstrip('/'),
@@ -213,7 +284,7 @@ class DTableDBAPI(object):
             "table_name": table_name,
             "rows": rows
         }
-        resp = requests.post(api_url, json=params, headers=self.headers, timeout=TIMEOUT)
+        resp = http_session.post(api_url, json=params, headers=self.headers, timeout=TIMEOUT)
         if not resp.status_code == 200:
             logger.error('error insert rows resp: %s', resp.text)
             raise RowInsertedError
@@ -229,7 +300,7 @@ class DTableDBAPI(object):
             'table_name': table_name,
             'updates': rows_data,
         }
-        resp = requests.put(url, json=json_data, headers=self.headers, timeout=TIMEOUT)
+        resp = http_session.put(url, json=json_data, headers=self.headers, timeout=TIMEOUT)
         if not resp.status_code == 200:
             raise RowUpdatedError
         return resp.json()
@@ -244,7 +315,7 @@ class DTableDBAPI(object):
             'table_name': table_name,
             'row_ids': row_ids
         }
-        resp = requests.delete(url, json=json_data, headers=self.headers, timeout=TIMEOUT)
+        resp = http_session.delete(url, json=json_data, headers=self.headers, timeout=TIMEOUT)
         if not resp.status_code == 200:
             raise RowDeletedError
         return resp.json()
@@ -254,7 +325,7 @@ class DTableDBAPI(object):
             self.dtable_db_url,
             self.dtable_uuid
         )
-        resp = requests.get(url, headers=self.headers, timeout=TIMEOUT)
+        resp = http_session.get(url, headers=self.headers, timeout=TIMEOUT)
         return parse_response(resp)
 
     def list_rows(self, table_name=None, table_id=None, view_name=None, view_id=None, start=None, limit=None,
@@ -280,7 +351,7 @@ class DTableDBAPI(object):
         params['convert_keys'] = 'true' if convert_keys else 'false'
         params['convert_date'] = 'true' if convert_date else 'false'
 
-        resp = requests.get(url, params=params, headers=self.headers, timeout=TIMEOUT)
+        resp = http_session.get(url, params=params, headers=self.headers, timeout=TIMEOUT)
         return parse_response(resp)
 
     def add_index(self, table_id, column_names):
@@ -292,7 +363,7 @@ class DTableDBAPI(object):
             'table_id': table_id,
             'columns': column_names
         }
-        resp = requests.post(url, json=json_data, headers=self.headers, timeout=TIMEOUT)
+        resp = http_session.post(url, json=json_data, headers=self.headers, timeout=TIMEOUT)
         return parse_response(resp)
 
     def list_bases(self, offset=None, limit=None):
@@ -303,32 +374,32 @@ class DTableDBAPI(object):
         if limit is not None:
             params['limit'] = limit
         params['from'] = 'dtable_events'
-        resp = requests.get(url, params=params, headers=self.admin_headers)
+        resp = http_session.get(url, params=params, headers=self.admin_headers)
         return parse_response(resp)
 
     def get_backups(self):
         url = '%s/api/v1/backup/%s/?from=dtable_events' % (self.dtable_db_url, self.dtable_uuid)
-        response = requests.get(url, headers=self.admin_headers)
+        response = http_session.get(url, headers=self.admin_headers)
         return parse_response(response)
 
     def restore_backup(self, version, new_dtable_uuid):
         url = '%s/api/v1/restore/%s/%s?new-dtable-uuid=%s&from=dtable_events' % (self.dtable_db_url, self.dtable_uuid, version, new_dtable_uuid)
-        response = requests.post(url, headers=self.admin_headers)
+        response = http_session.post(url, headers=self.admin_headers)
         return parse_response(response)
 
     def query_restore_task_status(self, task_id):
         url = '%s/api/v1/restore/%s/task/?task_id=%s&from=dtable_events' % (self.dtable_db_url, self.dtable_uuid, task_id)
-        response = requests.get(url, headers=self.admin_headers)
+        response = http_session.get(url, headers=self.admin_headers)
         return parse_response(response)
 
     def create_backup(self):
         url = '%s/api/v1/backup/%s?from=dtable_events' % (self.dtable_db_url, self.dtable_uuid)
-        response = requests.post(url, headers=self.admin_headers)
+        response = http_session.post(url, headers=self.admin_headers)
         return parse_response(response)
 
     def query_backup_task_status(self):
         url = '%s/api/v1/backup/%s/task/?from=dtable_events' % (self.dtable_db_url, self.dtable_uuid)
-        response = requests.get(url, headers=self.admin_headers)
+        response = http_session.get(url, headers=self.admin_headers)
         return parse_response(response)
 
     def import_archive(self, table_name, where):
@@ -337,11 +408,11 @@ class DTableDBAPI(object):
             'table_name': table_name,
             'where': where
         }
-        response = requests.post(url, headers=self.admin_headers, json=data)
+        response = http_session.post(url, headers=self.admin_headers, json=data)
         return parse_response(response)
     
     def query_archive_task(self, task_id):
         url = '%s/api/v1/import/%s/task/?from=dtable_events' % (self.dtable_db_url, self.dtable_uuid)
         params = {'task_id': task_id}
-        response = requests.get(url, headers=self.admin_headers, params=params)
+        response = http_session.get(url, headers=self.admin_headers, params=params)
         return parse_response(response)
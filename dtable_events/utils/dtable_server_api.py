@@ -11,17 +11,18 @@ from uuid import UUID
 from seaserv import seafile_api
 
 import jwt
-import requests
 
 from dtable_events.app.config import INNER_FILE_SERVER_ROOT, DTABLE_PRIVATE_KEY
 from dtable_events.utils import uuid_str_to_36_chars, is_valid_email
+from dtable_events.utils import http_session
+from dtable_events.utils.token_cache import get_cached_token, get_kwargs_fingerprint
 
 logger = logging.getLogger(__name__)
 
 
-def get_dtable_server_token(username, dtable_uuid, timeout=300, permission=None, kwargs=None):
+def gen_dtable_server_payload(username, dtable_uuid, exp, permission=None, kwargs=None):
     payload = {
-        'exp': int(time.time()) + timeout,
+        'exp': exp,
         'dtable_uuid': dtable_uuid,
         'permission': permission if permission else 'rw',
     }
@@ -40,7 +41,11 @@ def get_dtable_server_token(username, dtable_uuid, timeout=300, permission=None,
         payload['owner_id'] = kwargs['owner_id']
     if kwargs.get('signal_name'):
         payload['signal_name'] = kwargs['signal_name']
+    return payload
+
 
+def get_dtable_server_token(username, dtable_uuid, timeout=300, permission=None, kwargs=None):
+    payload = gen_dtable_server_payload(username, dtable_uuid, int(time.time()) + timeout, permission=permission, kwargs=kwargs)
     access_token = jwt.encode(
         payload, DTABLE_PRIVATE_KEY, algorithm='HS256'
     )
@@ -136,45 +141,61 @@ class DTableServerAPI(object):
     def __init__(self, username, dtable_uuid, dtable_server_url, dtable_web_service_url=None, repo_id=None, workspace_id=None, timeout=180, access_token_timeout=3600, permission='rw', kwargs=None):
         self.username = username
         self.dtable_uuid = uuid_str_to_36_chars(dtable_uuid)
-        self.headers = None
-        self.internal_headers = None
         self.dtable_server_url = dtable_server_url.rstrip('/')
         self.dtable_web_service_url = dtable_web_service_url.rstrip('/') if dtable_web_service_url else None
         self.repo_id = repo_id
         self.workspace_id = workspace_id
         self.timeout = timeout
         self.access_token_timeout = access_token_timeout
-        self.access_token = ''
-        self.internal_access_token = ''
         self.permission = permission
         self.kwargs = kwargs
-        self._init()
+        self._token_key = None
+
+    def _get_access_token(self, is_internal=False):
+        # tokens are signed lazily and cached in process
+        if self._token_key is None:
+            self._token_key = ('dtable_server', self.username, self.dtable_uuid, self.permission, get_kwargs_fingerprint(self.kwargs))
+
+        def gen_token(exp):
+            payload = gen_dtable_server_payload(self.username, self.dtable_uuid, exp, permission=self.permission, kwargs=self.kwargs)
+            if is_internal:
+                payload['is_internal'] = True
+            return jwt.encode(payload, DTABLE_PRIVATE_KEY, algorithm='HS256')
+
+        return get_cached_token(self._token_key + (self.access_token_timeout, is_internal), self.access_token_timeout, gen_token)
+
+    @property
+    def access_token(self):
+        return self._get_access_token()
+
+    @property
+    def internal_access_token(self):
+        return self._get_access_token(is_internal=True)
+
+    @property
+    def headers(self):
+        return {'Authorization': 'Token ' + self.access_token}
 
-    def _init(self):
-        info = get_dtable_server_token(self.username, self.dtable_uuid, timeout=self.access_token_timeout, permission=self.permission, kwargs=self.kwargs)
-        self.payload = info['payload']
-        self.access_token = info['access_token']
-        self.headers = {'Authorization': 'Token ' + self.access_token}
-        self.internal_payload = info['internal_payload']
-        self.internal_access_token = info['internal_access_token']
-        self.internal_headers = {'Authorization': 'Token ' + self.internal_access_token}
+    @property
+    def internal_headers(self):
+        return {'Authorization': 'Token ' + self.internal_access_token}
 
     def get_metadata(self):
         url = self.dtable_server_url + '/api/v1/dtables/' + self.dtable_uuid + '/metadata/?from=dtable_events'
-        response = requests.get(url, headers=self.headers, timeout=self.timeout)
+        response = http_session.get(url, headers=self.headers, timeout=self.timeout)
         data = parse_response(response)
         return data.get('metadata')
 
     def get_metadata_plugin(self, plugin_type):
         url = self.dtable_server_url + '/api/v1/dtables/' + self.dtable_uuid + '/metadata/plugin/?from=dtable_events'
         params = {'plugin_type': plugin_type}
-        response = requests.get(url, params=params, headers=self.headers, timeout=self.timeout)
+        response = http_session.get(url, params=params, headers=self.headers, timeout=self.timeout)
         data = parse_response(response)
         return data.get('metadata')
 
     def get_base(self):
         url = self.dtable_server_url + '/dtables/' + self.dtable_uuid + '?from=dtable_events'
-        response = requests.get(url, headers=self.headers, timeout=self.timeout)
+        response = http_session.get(url, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def add_table(self, table_name, lang='cn', columns=None, rows=None, views=None, view_structure=None):
@@ -192,7 +213,7 @@ class DTableServerAPI(object):
             json_data['views'] = views
         if view_structure:
             json_data['view_structure'] = view_structure
-        response = requests.post(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.post(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def delete_table(self, table_id):
@@ -200,7 +221,7 @@ class DTableServerAPI(object):
         json_data = {
             'table_id': table_id
         }
-        response = requests.delete(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.delete(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def rename_table(self, new_table_name, table_id):
@@ -208,7 +229,7 @@ class DTableServerAPI(object):
         json_data = {'new_table_name': new_table_name}
         if table_id:
             json_data['table_id'] = table_id
-        response = requests.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def import_excel(self, json_file, lang='en'):
@@ -216,7 +237,7 @@ class DTableServerAPI(object):
         files = {
             'excel_json': json_file
         }
-        response = requests.post(url, headers=self.headers, files=files, timeout=180)
+        response = http_session.post(url, headers=self.headers, files=files, timeout=180)
         return parse_response(response)
 
     def import_excel_add_table(self, json_file, lang='en'):
@@ -224,7 +245,7 @@ class DTableServerAPI(object):
         files = {
             'excel_json': json_file
         }
-        response = requests.post(url, headers=self.headers, files=files, timeout=180)
+        response = http_session.post(url, headers=self.headers, files=files, timeout=180)
         return parse_response(response)
 
     def list_rows(self, table_name, start=None, limit=None):
@@ -236,7 +257,7 @@ class DTableServerAPI(object):
         if start is not None and limit is not None:
             params['start'] = start
             params['limit'] = limit
-        response = requests.get(url, params=params, headers=self.headers, timeout=self.timeout)
+        response = http_session.get(url, params=params, headers=self.headers, timeout=self.timeout)
         data = parse_response(response)
         return data.get('rows')
 
@@ -252,7 +273,7 @@ class DTableServerAPI(object):
             'table_name': table_name,
             'convert_link_id': convert_link_id
         }
-        response = requests.get(url, params=params, headers=self.headers, timeout=self.timeout)
+        response = http_session.get(url, params=params, headers=self.headers, timeout=self.timeout)
         data = parse_response(response)
         return data
 
@@ -262,7 +283,7 @@ class DTableServerAPI(object):
         params = {'table_name': table_name}
         if view_name:
             params['view_name'] = view_name
-        response = requests.get(url, params=params, headers=self.headers, timeout=self.timeout)
+        response = http_session.get(url, params=params, headers=self.headers, timeout=self.timeout)
         data = parse_response(response)
         return data.get('columns')
 
@@ -274,7 +295,7 @@ class DTableServerAPI(object):
         }
         if convert_link_id is not None:
             params['convert_link_id'] = True
-        response = requests.get(url, params=params, headers=self.internal_headers, timeout=self.timeout)
+        response = http_session.get(url, params=params, headers=self.internal_headers, timeout=self.timeout)
         data = parse_response(response)
         return data.get('rows')
 
@@ -285,7 +306,7 @@ class DTableServerAPI(object):
         }
         if convert_link_id:
             params['convert_link_id'] = 'true'
-        response = requests.get(url, params=params, headers=self.internal_headers, timeout=self.timeout)
+        response = http_session.get(url, params=params, headers=self.internal_headers, timeout=self.timeout)
         data = parse_response(response)
         return data.get('rows')
 
@@ -299,7 +320,7 @@ class DTableServerAPI(object):
         }
         if column_data:
             json_data['column_data'] = column_data
-        response = requests.post(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.post(url, json=json_data, headers=self.headers, timeout=self.timeout)
         data = parse_response(response)
         return data
 
@@ -311,7 +332,7 @@ class DTableServerAPI(object):
             'column': column_key,
             'new_column_name': new_column_name,
         }
-        response = requests.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def batch_append_columns_by_table_id(self, table_id, columns):
@@ -321,7 +342,7 @@ class DTableServerAPI(object):
             'table_id': table_id,
             'columns': columns
         }
-        response = requests.post(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.post(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def batch_update_columns_by_table_id(self, table_id, columns):
@@ -331,7 +352,7 @@ class DTableServerAPI(object):
             'table_id': table_id,
             'columns': columns
         }
-        response = requests.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def batch_append_rows(self, table_name, rows_data, need_convert_back=None):
@@ -343,7 +364,7 @@ class DTableServerAPI(object):
         }
         if need_convert_back is not None:
             json_data['need_convert_back'] = need_convert_back
-        response = requests.post(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.post(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def append_row(self, table_name, row_data, apply_default=None):
@@ -355,7 +376,7 @@ class DTableServerAPI(object):
         }
         if apply_default is not None:
             json_data['apply_default'] = apply_default
-        response = requests.post(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.post(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def update_row(self, table_name, row_id, row_data):
@@ -366,7 +387,7 @@ class DTableServerAPI(object):
             'row_id': row_id,
             'row': row_data
         }
-        response = requests.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def batch_update_rows(self, table_name, rows_data, need_convert_back=None):
@@ -378,7 +399,7 @@ class DTableServerAPI(object):
         }
         if need_convert_back is not None:
             json_data['need_convert_back'] = need_convert_back
-        response = requests.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def add_column_options(self, table_name, column_name, options):
@@ -391,7 +412,7 @@ class DTableServerAPI(object):
             'options': options
         }
 
-        response = requests.post(url, json=data, headers=self.headers, timeout=self.timeout)
+        response = http_session.post(url, json=data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def batch_delete_rows(self, table_name, row_ids):
@@ -401,7 +422,7 @@ class DTableServerAPI(object):
             'table_name': table_name,
             'row_ids': row_ids,
         }
-        response = requests.delete(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.delete(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def lock_rows(self, table_name, row_ids):
@@ -411,7 +432,7 @@ class DTableServerAPI(object):
             'table_name': table_name,
             'row_ids': row_ids
         }
-        response = requests.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def update_link(self, link_id, table_id, other_table_id, row_id, other_rows_ids):
@@ -424,7 +445,7 @@ class DTableServerAPI(object):
             'other_table_id': other_table_id,
             'other_rows_ids': other_rows_ids
         }
-        response = requests.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def get_column_link_id(self, table_name, column_name, view_name=None):
@@ -451,7 +472,7 @@ class DTableServerAPI(object):
             'other_rows_ids_map': other_rows_ids_map,
         }
 
-        response = requests.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
+        response = http_session.put(url, json=json_data, headers=self.headers, timeout=self.timeout)
         return parse_response(response)
 
     def get_file_upload_link(self, attach_path=None):
@@ -495,7 +516,7 @@ class DTableServerAPI(object):
             relative_path = '%ss/%s' % (file_type, str(datetime.today())[:7])
         else:
             relative_path = relative_path.strip('/')
-        response = requests.post(upload_link, data={
+        response = http_session.post(upload_link, data={
             'parent_dir': parent_dir,
             'relative_path': relative_path,
             'replace': 1 if replace else 0
@@ -535,7 +556,7 @@ class DTableServerAPI(object):
             relative_path = '%ss/%s' % (file_type, str(datetime.today())[:7])
         else:
             relative_path = relative_path.strip('/')
-        response = requests.post(upload_link, data={
+        response = http_session.post(upload_link, data={
             'parent_dir': parent_dir,
             'relative_path': relative_path,
             'replace': 1 if replace else 0
@@ -565,7 +586,7 @@ class DTableServerAPI(object):
         parent_dir = upload_link_dict['parent_path']
         upload_link = upload_link_dict['upload_link'] + '?ret-json=1'
 
-        response = requests.post(upload_link, data={
+        response = http_session.post(upload_link, data={
             'parent_dir': parent_dir,
             'replace': 0,
         }, files={
@@ -593,14 +614,14 @@ class DTableServerAPI(object):
         body = {
             'user_messages': user_msg_list,
         }
-        response = requests.post(url, json=body, headers=self.headers)
+        response = http_session.post(url, json=body, headers=self.headers)
         return parse_response(response)
 
     def send_signal(self, signal_name):
         url = self.dtable_server_url + f'/api/v1/internal/dtables/{self.dtable_uuid}/signals/?from=dtable_web'
         access_token = get_dtable_server_token('dtable-events', self.dtable_uuid, kwargs={'is_internal': True, 'signal_name': signal_name})['internal_access_token']
         signal_headers = {'Authorization': f"Token {access_token}"}
-        response = requests.post(url, headers=signal_headers)
+        response = http_session.post(url, headers=signal_headers)
         return parse_response(response)
 
     def update_enable_archive(self, enable_archive):
@@ -608,7 +629,7 @@ class DTableServerAPI(object):
         json_data = {
             'enable_archive': enable_archive,
         }
-        response = requests.put(url, json=json_data, headers=self.internal_headers, timeout=self.timeout)
+        response = http_session.put(url, json=json_data, headers=self.internal_headers, timeout=self.timeout)
         data = parse_response(response)
 
         return data
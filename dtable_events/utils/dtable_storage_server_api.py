@@ -1,8 +1,8 @@
 import os
 import uuid
-import requests
 
 from dtable_events.app.config import DTABLE_STORAGE_SERVER_URL
+from dtable_events.utils import http_session
 
 
 TIMEOUT = 90
@@ -45,7 +45,7 @@ class DTableStorageServerAPI(object):
     def get_dtable(self, dtable_uuid):
         dtable_uuid = uuid_str_to_36_chars(dtable_uuid)
         url = self.server_url + '/dtables/' + dtable_uuid
-        response = requests.get(url, timeout=TIMEOUT)
+        response = http_session.get(url, timeout=TIMEOUT)
         try:
             data = parse_response(response)
         except StorageAPIError as e:
@@ -56,21 +56,21 @@ class DTableStorageServerAPI(object):
     def create_empty_dtable(self, dtable_uuid):
         dtable_uuid = uuid_str_to_36_chars(dtable_uuid)
         url = self.server_url + '/dtables/' + dtable_uuid
-        response = requests.put(url, timeout=TIMEOUT)
+        response = http_session.put(url, timeout=TIMEOUT)
         data = parse_response(response)
         return data
 
     def save_dtable(self, dtable_uuid, json_string):
         dtable_uuid = uuid_str_to_36_chars(dtable_uuid)
         url = self.server_url + '/dtables/' + dtable_uuid
-        response = requests.put(url, data=json_string, timeout=TIMEOUT)
+        response = http_session.put(url, data=json_string, timeout=TIMEOUT)
         data = parse_response(response)
         return data
 
     def delete_dtable(self, dtable_uuid):
         dtable_uuid = uuid_str_to_36_chars(dtable_uuid)
         url = self.server_url + '/dtables/' + dtable_uuid
-        response = requests.delete(url, timeout=TIMEOUT)
+        response = http_session.delete(url, timeout=TIMEOUT)
         try:
             data = parse_response(response)
         except StorageAPIError as e:
@@ -81,22 +81,25 @@ class DTableStorageServerAPI(object):
     def get_backup(self, dtable_uuid, version):
         """Return backup content"""
         url = self.server_url + f'/backups/{dtable_uuid}/{version}'
-        response = requests.get(url, timeout=TIMEOUT)
+        response = http_session.get(url, timeout=TIMEOUT)
         if not response.ok:
             raise ConnectionError(response.status_code, 'get backup failed')
         return response.content
 
-    def get_backup_chunked(self, dtable_uuid, version, file_path):
-        temp_path = f'{file_path}.part'
+    def iter_backup_chunks(self, dtable_uuid, version, chunk_size=64 * 1024):
         url = self.server_url + f'/backups/{dtable_uuid}/{version}'
-        try:
-            resp = requests.get(url, stream=True, timeout=TIMEOUT)
+        with http_session.get(url, stream=True, timeout=TIMEOUT) as resp:
             resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    yield chunk
 
+    def get_backup_chunked(self, dtable_uuid, version, file_path):
+        temp_path = f'{file_path}.part'
+        try:
             with open(temp_path, 'wb') as f:
-                for chunk in resp.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+                for chunk in self.iter_backup_chunks(dtable_uuid, version):
+                    f.write(chunk)
             os.rename(temp_path, file_path)
 
         except Exception as e:
@@ -108,12 +111,12 @@ class DTableStorageServerAPI(object):
         file: bytes or a file-like obj
         """
         url = self.server_url + f'/backups/{dtable_uuid}/{version}'
-        resp = requests.put(url, data=file)
+        resp = http_session.put(url, data=file)
         return resp
 
     def delete_dtable_all_backups(self, dtable_uuid):
         url = self.server_url + f'/backups/{dtable_uuid}'
-        response = requests.delete(url)
+        response = http_session.delete(url)
         return parse_response(response)
 
 
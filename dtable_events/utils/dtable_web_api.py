@@ -3,10 +3,10 @@ import logging
 import time
 
 import jwt
-import requests
 
 from dtable_events.app.config import SEATABLE_FAAS_URL, SEATABLE_FAAS_AUTH_TOKEN, DTABLE_PRIVATE_KEY
 from dtable_events.utils import uuid_str_to_36_chars
+from dtable_events.utils import http_session
 
 
 logger = logging.getLogger(__name__)
@@ -53,7 +53,7 @@ class DTableWebAPI:
         }
         access_token = get_access_token(username, dtable_uuid)
         headers = {'Authorization': 'Token ' + access_token}
-        response = requests.get(url, headers=headers)
+        response = http_session.get(url, headers=headers)
         return parse_response(response)
 
     def can_user_run_python(self, user):
@@ -69,7 +69,7 @@ class DTableWebAPI:
         #   'org_script_permissions': {org1: {'can_run_python_script': True/False}}
         # }
         try:
-            resp = requests.get(url, headers=headers, json=json_data)
+            resp = http_session.get(url, headers=headers, json=json_data)
             if resp.status_code != 200:
                 logger.error('check run script permission error response: %s', resp.status_code)
                 return False
@@ -87,7 +87,7 @@ class DTableWebAPI:
         headers = {'Authorization': 'Token ' + SEATABLE_FAAS_AUTH_TOKEN}
         json_data = {'org_ids': [org_id]}
         try:
-            resp = requests.get(url, headers=headers, json=json_data)
+            resp = http_session.get(url, headers=headers, json=json_data)
             if resp.status_code != 200:
                 logger.error('check run script permission error response: %s', resp.status_code)
                 return False
@@ -105,7 +105,7 @@ class DTableWebAPI:
         headers = {'Authorization': 'Token ' + SEATABLE_FAAS_AUTH_TOKEN}
         params = {'username': user}
         try:
-            resp = requests.get(url, headers=headers, params=params)
+            resp = http_session.get(url, headers=headers, params=params)
             if resp.status_code != 200:
                 logger.error('get scripts running limit error response: %s', resp.status_code)
                 return 0
@@ -123,7 +123,7 @@ class DTableWebAPI:
         headers = {'Authorization': 'Token ' + SEATABLE_FAAS_AUTH_TOKEN}
         params = {'org_id': org_id}
         try:
-            resp = requests.get(url, headers=headers, params=params)
+            resp = http_session.get(url, headers=headers, params=params)
             if resp.status_code != 200:
                 logger.error('get scripts running limit error response: %s', resp.status_code)
                 return 0
@@ -148,7 +148,7 @@ class DTableWebAPI:
     def run_script(self, dtable_uuid, script_name, context_data, owner, org_id, scripts_running_limit, operate_from, operator):
         headers = {'Authorization': 'Token ' + SEATABLE_FAAS_AUTH_TOKEN}
         url = SEATABLE_FAAS_URL.strip('/') + '/run-script/'
-        response = requests.post(url, json={
+        response = http_session.post(url, json={
             'dtable_uuid': uuid_str_to_36_chars(dtable_uuid),
             'script_name': script_name,
             'context_data': context_data,
@@ -171,7 +171,7 @@ class DTableWebAPI:
         }
         access_token = jwt.encode(payload, DTABLE_PRIVATE_KEY, algorithm='HS256')
         headers = {'Authorization': 'Token ' + access_token}
-        res = requests.post(url, headers=headers, json=json_data)
+        res = http_session.post(url, headers=headers, json=json_data)
         return parse_response(res)
 
     def internal_add_notification(self, to_users, msg_type, detail):
@@ -185,7 +185,7 @@ class DTableWebAPI:
         }
         token = jwt.encode(payload, DTABLE_PRIVATE_KEY, algorithm='HS256')
         headers = {'Authorization': 'Token ' + token}
-        resp = requests.post(url, json={
+        resp = http_session.post(url, json={
             'detail': detail,
             'to_users': to_users,
             'type': msg_type
@@ -211,7 +211,7 @@ class DTableWebAPI:
             'is_internal': True
         }
         header_token = 'Token ' + jwt.encode(payload, DTABLE_PRIVATE_KEY, 'HS256')
-        resp = requests.post(url, data=data, headers={'Authorization': header_token}, timeout=30)
+        resp = http_session.post(url, data=data, headers={'Authorization': header_token}, timeout=30)
         return parse_response(resp)
 
     def internal_update_exceed_api_quota(self, month, org_ids, owner_ids):
@@ -229,7 +229,7 @@ class DTableWebAPI:
             'is_internal': True
         }
         header_token = 'Token ' + jwt.encode(payload, DTABLE_PRIVATE_KEY, 'HS256')
-        resp = requests.post(url, json=data, headers={'Authorization': header_token}, timeout=30)
+        resp = http_session.post(url, json=data, headers={'Authorization': header_token}, timeout=30)
         return parse_response(resp)
 
     def ai_permission_check(self, dtable_uuid):
@@ -243,7 +243,7 @@ class DTableWebAPI:
             'is_internal': True
         }
         header_token = 'Token ' + jwt.encode(payload, DTABLE_PRIVATE_KEY, 'HS256')
-        resp = requests.get(url, params=params, headers={'Authorization': header_token}, timeout=30)
+        resp = http_session.get(url, params=params, headers={'Authorization': header_token}, timeout=30)
         return parse_response(resp)
 
     def internal_roles(self):
@@ -253,7 +253,7 @@ class DTableWebAPI:
         }
         token = jwt.encode({'is_internal': True}, DTABLE_PRIVATE_KEY, algorithm='HS256')
         headers = {'Authorization': 'Token ' + token}
-        resp = requests.get(url, headers=headers, timeout=30)
+        resp = http_session.get(url, headers=headers, timeout=30)
         return parse_response(resp).get('roles', [])
 
     def internal_storage_quota(self, org_id=None, username=None):
@@ -269,7 +269,7 @@ class DTableWebAPI:
             params['org_id'] = org_id
         if username:
             params['username'] = username
-        resp = requests.get(url, headers=headers, params=params)
+        resp = http_session.get(url, headers=headers, params=params)
         return parse_response(resp)
 
     def internal_dtable_permission(self, dtable_uuid, permission):
@@ -280,5 +280,5 @@ class DTableWebAPI:
         token = jwt.encode({'is_internal': True}, DTABLE_PRIVATE_KEY, algorithm='HS256')
         headers = {'Authorization': 'Token ' + token}
         params = {'dtable_uuid': dtable_uuid, 'permission': permission}
-        resp = requests.get(url, headers=headers, params=params)
+        resp = http_session.get(url, headers=headers, params=params)
         return parse_response(resp)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Pooled keep-alive http sessions for inner services, dtable-server, dtable-db, dtable-web and so on.
+
+Use `http_session.get/post/put/delete(url, ...)` in place of `requests.get/post/put/delete`, requests to
+the same upstream (scheme, host and port) share a connection pool, and requests rejected by 429/503
+are retried with backoff.
+"""
+import logging
+import re
+import time
+from collections import defaultdict
+from http.cookiejar import DefaultCookiePolicy
+from threading import Lock
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from dtable_events.app.config import HTTP_POOL_MAXSIZE, HTTP_RETRY_TOTAL, HTTP_RETRY_BACKOFF_FACTOR
+from dtable_events.utils.utils_metric import publish_metric, HTTP_REQUESTS_COUNT_METRIC_HELP, \
+    HTTP_ERRORS_COUNT_METRIC_HELP, HTTP_LATENCY_METRIC_HELP, HTTP_MAX_LATENCY_METRIC_HELP
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (429, 503)
+
+# path segments of ids, uuids, numbers, emails..., replaced to group requests by endpoint
+ID_SEGMENT_RE = re.compile(r'^([0-9a-fA-F-]{16,}|\d+|.*@.*|[0-9a-zA-Z_-]{22})$')
+ENDPOINT_PATH_DEPTH = 5
+
+_sessions = {}
+_sessions_lock = Lock()
+
+
+class EndpointStats(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+
+_stats = defaultdict(EndpointStats)
+_stats_lock = Lock()
+
+
+def get_endpoint(method, url):
+    parts = urlsplit(url)
+    segments = [':id' if ID_SEGMENT_RE.match(segment) else segment for segment in parts.path.split('/') if segment]
+    return f'{method.upper()} {parts.hostname}:{parts.port or ""}/{"/".join(segments[:ENDPOINT_PATH_DEPTH])}'
+
+
+def record_request(endpoint, latency, is_error):
+    with _stats_lock:
+        stats = _stats[endpoint]
+        stats.requests += 1
+        stats.total_latency += latency
+        stats.max_latency = max(stats.max_latency, latency)
+        if is_error:
+            stats.errors += 1
+
+
+class PooledSession(requests.Session):
+    """
+    A session not keeping cookies, since it's shared by requests of all users, recording latency
+    and errors of each endpoint
+    """
+
+    def __init__(self):
+        super(PooledSession, self).__init__()
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        # only connect errors and 429/503 are retried, requests may have been handled in other errors
+        retry = Retry(total=HTTP_RETRY_TOTAL, connect=HTTP_RETRY_TOTAL, read=0, status=HTTP_RETRY_TOTAL,
+                      backoff_factor=HTTP_RETRY_BACKOFF_FACTOR, status_forcelist=RETRY_STATUS_CODES,
+                      allowed_methods=None, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        endpoint = get_endpoint(method, url)
+        start = time.monotonic()
+        try:
+            response = super(PooledSession, self).request(method, url, *args, **kwargs)
+        except Exception:
+            record_request(endpoint, time.monotonic() - start, True)
+            raise
+        record_request(endpoint, time.monotonic() - start, response.status_code >= 500 or response.status_code == 429)
+        return response
+
+
+def get_session(url):
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    session = _sessions.get(key)
+    if session:
+        return session
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = PooledSession()
+        return _sessions[key]
+
+
+def request(method, url, **kwargs):
+    return get_session(url).request(method, url, **kwargs)
+
+
+def get(url, params=None, **kwargs):
+    return request('GET', url, params=params, **kwargs)
+
+
+def post(url, data=None, json=None, **kwargs):
+    return request('POST', url, data=data, json=json, **kwargs)
+
+
+def put(url, data=None, **kwargs):
+    return request('PUT', url, data=data, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
+
+
+def get_metric_name(endpoint):
+    return 'http_' + re.sub(r'[^0-9a-zA-Z]+', '_', endpoint.replace(':id', 'id')).strip('_').lower()
+
+
+def publish_http_metrics(interval=60):
+    """
+    publish requests / errors counts since start up, average and max latency since last publish, of each endpoint
+    """
+    last_requests, last_total_latency = defaultdict(int), defaultdict(float)
+    while True:
+        time.sleep(interval)
+        with _stats_lock:
+            stats_list = [(endpoint, stats.requests, stats.errors, stats.total_latency, stats.max_latency)
+                          for endpoint, stats in _stats.items()]
+            for stats in _stats.values():
+                stats.max_latency = 0
+        for endpoint, requests_count, errors_count, total_latency, max_latency in stats_list:
+            metric_name = get_metric_name(endpoint)
+            interval_requests = requests_count - last_requests[endpoint]
+            interval_latency = total_latency - last_total_latency[endpoint]
+            last_requests[endpoint], last_total_latency[endpoint] = requests_count, total_latency
+            try:
+                publish_metric(requests_count, f'{metric_name}_requests', HTTP_REQUESTS_COUNT_METRIC_HELP)
+                publish_metric(errors_count, f'{metric_name}_errors', HTTP_ERRORS_COUNT_METRIC_HELP)
+                if interval_requests:
+                    publish_metric(round(interval_latency / interval_requests, 4), f'{metric_name}_latency', HTTP_LATENCY_METRIC_HELP)
+                    publish_metric(round(max_latency, 4), f'{metric_name}_max_latency', HTTP_MAX_LATENCY_METRIC_HELP)
+            except Exception as e:
+                logger.warning('publish http endpoint %s metrics error: %s', endpoint, e)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from dtable_events.utils.utils_metric import publish_metric, CACHE_HITS_METRIC_HELP, CACHE_MISSES_METRIC_HELP, \
+    CACHE_EVICTIONS_METRIC_HELP, CACHE_SIZE_METRIC_HELP
+
+logger = logging.getLogger(__name__)
+
+# all caches created in this process, to publish their metrics
+_caches = []
+_caches_lock = Lock()
+
+
+class LRUCache(object):
+    """
+    A thread-safe in-process cache, bounded by `maxsize` with LRU eviction.
+    Entries expire after `ttl` seconds, no expiration if `ttl` is None.
+    """
+
+    def __init__(self, name, maxsize=10000, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expire_at, value)
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        with _caches_lock:
+            _caches.append(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expire_at, value = item
+            if expire_at is not None and expire_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expire_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def publish_metrics(self):
+        publish_metric(self.hits, f'{self.name}_cache_hits', CACHE_HITS_METRIC_HELP)
+        publish_metric(self.misses, f'{self.name}_cache_misses', CACHE_MISSES_METRIC_HELP)
+        publish_metric(self.evictions, f'{self.name}_cache_evictions', CACHE_EVICTIONS_METRIC_HELP)
+        publish_metric(len(self), f'{self.name}_cache_size', CACHE_SIZE_METRIC_HELP)
+
+
+def publish_caches_metrics(interval=60):
+    while True:
+        time.sleep(interval)
+        with _caches_lock:
+            caches = list(_caches)
+        for cache in caches:
+            try:
+                cache.publish_metrics()
+            except Exception as e:
+                logger.warning('publish cache %s metrics error: %s', cache.name, e)
@@ -1,13 +1,18 @@
+import json
 import logging
 import re
+import time
 import pytz
 from datetime import datetime, timedelta, timezone
+from threading import Lock
 
 from dateutil.relativedelta import relativedelta
 
 from dtable_events.utils.constants import FilterPredicateTypes, FormulaResultType, FilterTermModifier, ColumnTypes, \
     DurationFormatsType, StatisticType, MapLevel, GeolocationGranularity, MUNICIPALITIES
 from dtable_events.utils.dtable_column_utils import is_numeric_column, is_date_column
+from dtable_events.utils.lru_cache import LRUCache
+from dtable_events.app.config import SQL_GENERATOR_CACHE_SIZE
 
 logger = logging.getLogger(__name__)
 
@@ -2672,6 +2677,79 @@ class StatisticSQLGenerator(object):
 
 
 
+# sqls of the same table columns, conditions and user are the same in a day, relative dates of filters
+# like `today` and `this_week` are resolved to dates of the day, so the cache is cleared when the date changes
+_sql_cache = LRUCache('sql_generator', maxsize=SQL_GENERATOR_CACHE_SIZE)
+_sql_cache_date = None
+_sql_cache_date_expire_at = 0
+_sql_cache_date_lock = Lock()
+
+# sqls cached of a key, inputs of different filter terms of the same columns and predicates
+SQL_CACHE_ENTRIES_PER_KEY = 8
+
+
+def _get_sql_cache_date():
+    # local date for filters of dates, utc date for trend periods of statistics, checked once a second
+    global _sql_cache_date, _sql_cache_date_expire_at
+    if time.time() < _sql_cache_date_expire_at:
+        return _sql_cache_date
+    with _sql_cache_date_lock:
+        cache_date = (datetime.today().date(), datetime.now(timezone.utc).date())
+        if cache_date != _sql_cache_date:
+            _sql_cache.clear()
+            _sql_cache_date = cache_date
+        _sql_cache_date_expire_at = time.time() + 1
+    return cache_date
+
+
+def _get_or_generate_sql(key, inputs, generate):
+    """
+    Serializing filters and columns to hash them costs as much as generating sql, so sqls are cached by a cheap key,
+    and other inputs are compared with inputs of sqls cached of the key. Copying inputs costs as much too, so sqls
+    are cached from the second time their key is seen.
+
+    :param key: hashable, e.g. table name, columns and predicates of filters
+    :param inputs: list of all other inputs the sql depends on, e.g. filters and columns
+    :param generate: function generating the sql, errors raised are not cached
+    """
+    if not SQL_GENERATOR_CACHE_SIZE:
+        return generate()
+    key = (_get_sql_cache_date(), key)
+    try:
+        entries = _sql_cache.get(key)
+    except TypeError:  # unhashable values of invalid filters
+        return generate()
+    if entries is None:
+        # keys seen once, e.g. views exported once, are not worth copying inputs
+        _sql_cache.set(key, [])
+        return generate()
+    for cached_inputs, sql in entries:
+        if cached_inputs == inputs:
+            return sql
+    # inputs may be changed in place by generating and by callers, copied by json much faster than deepcopy
+    try:
+        cached_inputs = json.loads(json.dumps(inputs))
+    except (TypeError, ValueError):
+        return generate()
+    sql = generate()
+    _sql_cache.set(key, entries[-SQL_CACHE_ENTRIES_PER_KEY + 1:] + [(cached_inputs, sql)])
+    return sql
+
+
+def _get_filters_refs(filters, refs):
+    for filter_item in filters or []:
+        if not isinstance(filter_item, dict):
+            continue
+        # filter groups and filters of inner filters
+        inner_filters = filter_item.get('filters')
+        if inner_filters and isinstance(inner_filters, list):
+            _get_filters_refs(inner_filters, refs)
+            continue
+        refs.append((filter_item.get('column_key'), filter_item.get('column_name'),
+                     filter_item.get('filter_predicate'), filter_item.get('filter_term_modifier')))
+    return refs
+
+
 class BaseSQLGenerator(object):
 
     def __init__(self, table_name, columns, filter_conditions=None, filter_condition_groups=None):
@@ -2692,6 +2770,18 @@ class BaseSQLGenerator(object):
                 return col
         return None
 
+    def _get_sql_cache_key(self, by_group=False):
+        filter_conditions = self.filter_condition_groups if by_group else self.filter_conditions
+        refs = []
+        if isinstance(filter_conditions, dict):
+            _get_filters_refs(filter_conditions.get('filters'), refs)
+            _get_filters_refs(filter_conditions.get('filter_groups'), refs)
+            _get_filters_refs(filter_conditions.get('sorts'), refs)
+        # only columns of filters and sorts, found as generating sql
+        columns = [(column_key and self._get_column_by_key(column_key)) or (column_name and self._get_column_by_name(column_name)) or None
+                   for column_key, column_name, _, _ in refs]
+        return (by_group, self.table_name, tuple(refs)), [columns, filter_conditions]
+
     def _sort2sql(self, by_group=False):
         if by_group:
             filter_conditions = self.filter_condition_groups
@@ -2919,12 +3009,20 @@ def filter2sql(table_name, columns, filter_conditions, by_group=False):
         sql_generator = BaseSQLGenerator(table_name, columns, filter_condition_groups=filter_conditions)
     else:
         sql_generator = BaseSQLGenerator(table_name, columns, filter_conditions=filter_conditions)
-    return sql_generator.to_sql(by_group=by_group)
+    if not SQL_GENERATOR_CACHE_SIZE:
+        return sql_generator.to_sql(by_group=by_group)
+    key, inputs = sql_generator._get_sql_cache_key(by_group=by_group)
+    return _get_or_generate_sql(key, inputs, lambda: sql_generator.to_sql(by_group=by_group))
 
 
 def statistic2sql(table, statistic_type, statistic, username='', id_in_org='', current_user_department_ids=[], current_user_department_and_sub_ids=[], detail_filter_conditions=None, start_of_week='sunday'):
-    sql_generator = StatisticSQLGenerator(table, statistic_type, statistic, username, id_in_org, current_user_department_ids, current_user_department_and_sub_ids, detail_filter_conditions=detail_filter_conditions, start_of_week=start_of_week)
-    return sql_generator.to_sql()
+    def generate():
+        sql_generator = StatisticSQLGenerator(table, statistic_type, statistic, username, id_in_org, current_user_department_ids, current_user_department_and_sub_ids, detail_filter_conditions=detail_filter_conditions, start_of_week=start_of_week)
+        return sql_generator.to_sql()
+
+    key = ('statistic2sql', table.get('name'), statistic_type, username, id_in_org, start_of_week)
+    inputs = [table.get('columns'), statistic, current_user_department_ids, current_user_department_and_sub_ids, detail_filter_conditions]
+    return _get_or_generate_sql(key, inputs, generate)
 
 def linkRecords2sql(current_table, link_column, link_record_ids, tables):
     sql_generator = LinkRecordsSQLGenerator(current_table, link_column, link_record_ids, tables)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of signed access tokens of dtable-server / dtable-db, shared by all api objects in this process,
+a token is reused until a margin before its `exp`.
+"""
+import json
+import time
+
+from dtable_events.utils.lru_cache import LRUCache
+
+# a cached token is valid for at least this margin, or 1/10 of its lifetime if larger
+TOKEN_EXPIRE_MARGIN = 60
+
+_tokens = LRUCache('access_tokens', maxsize=10000)
+
+
+def get_kwargs_fingerprint(kwargs):
+    if not kwargs or not isinstance(kwargs, dict):
+        return ''
+    return json.dumps(kwargs, sort_keys=True, default=str)
+
+
+def get_cached_token(key, timeout, gen_token):
+    """
+    :param key: tuple identifying the payload of the token, except `exp`
+    :param timeout: lifetime of the token in seconds
+    :param gen_token: function(exp) -> token
+    """
+    token = _tokens.get(key)
+    if token:
+        return token
+    token = gen_token(int(time.time()) + timeout)
+    ttl = timeout - max(TOKEN_EXPIRE_MARGIN, timeout // 10)
+    if ttl > 0:
+        _tokens.set(key, token, ttl=ttl)
+    return token
+
+
+def clear_cached_tokens():
+    _tokens.clear()
@@ -3,9 +3,9 @@ import logging
 import time
 
 import jwt
-import requests
 
 from dtable_events.app.config import DTABLE_PRIVATE_KEY
+from dtable_events.utils import http_session
 
 logger = logging.getLogger(__name__)
 
@@ -71,5 +71,5 @@ class UniversalAppAPI(object):
         body = {
             'user_messages': user_msg_list,
         }
-        response = requests.post(url, json=body, headers=self.headers)
+        response = http_session.post(url, json=body, headers=self.headers)
         return parse_response(response)
\ No newline at end of file
@@ -1,33 +1,131 @@
 import json
 import logging
+import time
+from collections import defaultdict
+from threading import Lock
 
-from dtable_events.app.config import INNER_DTABLE_SERVER_URL
-from dtable_events.app.event_redis import redis_cache
+from dtable_events.app.config import INNER_DTABLE_SERVER_URL, METADATA_CACHE_SIZE, METADATA_CACHE_TTL
+from dtable_events.app.event_redis import redis_cache, pubsub_dispatcher
 from dtable_events.utils import uuid_str_to_36_chars
 from dtable_events.utils.dtable_server_api import DTableServerAPI
+from dtable_events.utils.lru_cache import LRUCache
+from dtable_events.utils.utils_metric import publish_metric, METADATA_CACHE_BYTES_SAVED_METRIC_HELP, \
+    METADATA_CACHE_PARSE_TIME_METRIC_HELP
 
 logger = logging.getLogger(__name__)
 
+# metadata is cached in two tiers, parsed objects in process and json in redis, both for METADATA_CACHE_TTL
+# both are invalidated by schema changes in `table-events` channel if dtable-server publishes them, METADATA_CACHE_TTL
+# longer than 60s is opt-in for that case, without the channel subscribed, e.g. in a process of foreground tasks,
+# metadata is never cached longer than 60s
+TABLE_EVENTS_CHANNEL = 'table-events'
+NOT_SUBSCRIBED_TTL = 60
+
+# op types not changing metadata, all others invalidate metadata of the base
+ROWS_OP_TYPES = {
+    'insert_row',
+    'insert_rows',
+    'append_rows',
+    'delete_row',
+    'delete_rows',
+    'modify_row',
+    'modify_rows',
+    'add_link',
+    'remove_link',
+    'update_links',
+    'update_rows_links',
+}
+
+_local_cache = LRUCache('metadata', maxsize=METADATA_CACHE_SIZE)  # dtable_uuid -> (metadata, json size)
+# increased by each invalidation, metadata fetched before an invalidation is not cached
+_generations = defaultdict(int)
+_generations_lock = Lock()
+_subscribed = False
+
+_bytes_saved = 0
+_parse_seconds = 0
+
 
 def get_key(dtable_uuid):
     dtable_uuid = uuid_str_to_36_chars(dtable_uuid)
     return f'dtable:{dtable_uuid}:metadata'
 
+
+def get_ttl():
+    return METADATA_CACHE_TTL if _subscribed else min(METADATA_CACHE_TTL, NOT_SUBSCRIBED_TTL)
+
+
+def _cache_metadata(dtable_uuid, generation, metadata, size, metadata_str=None):
+    with _generations_lock:
+        if _generations[dtable_uuid] != generation:
+            return
+        _local_cache.set(dtable_uuid, (metadata, size), ttl=get_ttl())
+    if metadata_str:
+        redis_cache.set(get_key(dtable_uuid), metadata_str, timeout=get_ttl())
+
+
 def get_metadata(dtable_uuid):
-    key = get_key(dtable_uuid)
-    metadata_str = redis_cache.get(key)
+    """
+    :return: metadata shared by all callers in process, must not be modified
+    """
+    global _bytes_saved, _parse_seconds
+    dtable_uuid = uuid_str_to_36_chars(dtable_uuid)
+    item = _local_cache.get(dtable_uuid)
+    if item:
+        metadata, size = item
+        _bytes_saved += size
+        return metadata
+
+    generation = _generations[dtable_uuid]
+    metadata_str = redis_cache.get(get_key(dtable_uuid))
     logger.debug('instant metadata dtable_uuid: %s metadata: %s', dtable_uuid, bool(metadata_str))
     if metadata_str:
         try:
+            start = time.monotonic()
             metadata = json.loads(metadata_str)
+            _parse_seconds += time.monotonic() - start
+            _cache_metadata(dtable_uuid, generation, metadata, len(metadata_str))
             return metadata
         except:
             pass
     dtable_server_api = DTableServerAPI('dtable-events', dtable_uuid, INNER_DTABLE_SERVER_URL)
     metadata = dtable_server_api.get_metadata()
-    redis_cache.set(key, json.dumps(metadata), timeout=60)
+    metadata_str = json.dumps(metadata)
+    _cache_metadata(dtable_uuid, generation, metadata, len(metadata_str), metadata_str=metadata_str)
     return metadata
 
+
 def clean_metadata(dtable_uuid):
-    key = get_key(uuid_str_to_36_chars(dtable_uuid))
-    redis_cache.delete(key)
+    dtable_uuid = uuid_str_to_36_chars(dtable_uuid)
+    with _generations_lock:
+        _generations[dtable_uuid] += 1
+        _local_cache.delete(dtable_uuid)
+    redis_cache.delete(get_key(dtable_uuid))
+
+
+def handle_table_event(event):
+    if event.get('op_type') in ROWS_OP_TYPES or not event.get('dtable_uuid'):
+        return
+    try:
+        clean_metadata(event['dtable_uuid'])
+    except Exception as e:
+        logger.warning('clean dtable: %s metadata cache error: %s', event.get('dtable_uuid'), e)
+
+
+def subscribe_metadata_changes():
+    global _subscribed
+    pubsub_dispatcher.register(TABLE_EVENTS_CHANNEL, handle_table_event, name='metadata_cache')
+    _subscribed = True
+
+
+def publish_metadata_cache_metrics(interval=60):
+    """
+    hits / misses are published by the LRU cache `metadata`
+    """
+    while True:
+        time.sleep(interval)
+        try:
+            publish_metric(_bytes_saved, 'metadata_cache_bytes_saved', METADATA_CACHE_BYTES_SAVED_METRIC_HELP)
+            publish_metric(round(_parse_seconds, 3), 'metadata_cache_parse_seconds', METADATA_CACHE_PARSE_TIME_METRIC_HELP)
+        except Exception as e:
+            logger.warning('publish metadata cache metrics error: %s', e)
@@ -11,12 +11,40 @@ MESSAGE_TASK_MANAGER_METRIC_HELP = "The number of notification message tasks in
 COMMON_DATASET_TOTAL_ROW_COUNT_METRIC_HELP = "Total rows processed in common-dataset syncs"
 COMMON_DATASET_OPERATIONS_COUNT_METRIC_HELP = "Common-dataset syncs count"
 COMMON_DATASET_ELAPSED_TIME_METRIC_HELP = "Time taken (in seconds) to complete common-dataset syncs job"
+COMMON_DATASET_ROWS_RATE_METRIC_HELP = "Rows processed per second in common-dataset syncs job"
 REALTIME_AUTOMATION_RULES_TRIGGERED_COUNT_HELP = "The number of triggered realtime automations since start up"
 REALTIME_AUTOMATION_RULES_HEARTBEAT_HELP = "Heartbeat timestamp of realtime automations"
 SCHEDULED_AUTOMATION_RULES_TRIGGERED_COUNT_HELP = "The number of triggered scheduled automations since start up"
 AUTOMATION_QUEUE_10_METRIC_HELP = "The number of automations in the queue 10"
 AUTOMATION_QUEUE_20_METRIC_HELP = "The number of automations in the queue 20"
 AUTOMATION_QUEUE_30_METRIC_HELP = "The number of automations in the queue 30"
+ACTIVITIES_EVENTS_RATE_METRIC_HELP = "The number of table events saved as activities per second"
+ACTIVITIES_DB_ROUND_TRIPS_METRIC_HELP = "The number of database statements per table event saved as activities"
+CACHE_HITS_METRIC_HELP = "The number of in-process cache hits since start up"
+CACHE_MISSES_METRIC_HELP = "The number of in-process cache misses since start up"
+CACHE_EVICTIONS_METRIC_HELP = "The number of in-process cache entries evicted since start up"
+CACHE_SIZE_METRIC_HELP = "The number of entries in the in-process cache"
+PUBSUB_QUEUE_SIZE_METRIC_HELP = "The number of redis pubsub messages waiting in the handler queue"
+PUBSUB_DROPPED_COUNT_METRIC_HELP = "The number of redis pubsub messages dropped because the handler queue is full"
+PUBSUB_LAG_METRIC_HELP = "Max time (in seconds) a redis pubsub message waited in the handler queue"
+AUTOMATION_RATE_LIMIT_MAX_USAGE_METRIC_HELP = "Max usage percent of automation run time of orgs/owners checked since last publish"
+AUTOMATION_RATE_LIMIT_OVER_LIMIT_COUNT_METRIC_HELP = "The number of orgs/owners over automation run time limit checked since last publish"
+HTTP_REQUESTS_COUNT_METRIC_HELP = "The number of requests to an inner service endpoint since start up"
+HTTP_ERRORS_COUNT_METRIC_HELP = "The number of failed requests (connection errors, 429 and 5xx) to an inner service endpoint since start up"
+HTTP_LATENCY_METRIC_HELP = "Average latency (in seconds) of requests to an inner service endpoint since last publish"
+HTTP_MAX_LATENCY_METRIC_HELP = "Max latency (in seconds) of requests to an inner service endpoint since last publish"
+METADATA_CACHE_BYTES_SAVED_METRIC_HELP = "Bytes of metadata json not parsed again thanks to the in-process metadata cache since start up"
+METADATA_CACHE_PARSE_TIME_METRIC_HELP = "Time (in seconds) spent parsing metadata json from redis since start up"
+AUTOMATION_RATE_LIMIT_LIMITED_COUNT_METRIC_HELP = "The number of automations skipped by rate limit since start up"
+WEBHOOK_QUEUE_SIZE_METRIC_HELP = "The number of webhook jobs waiting for delivery"
+WEBHOOK_DROPPED_COUNT_METRIC_HELP = "The number of webhook jobs dropped because the queue is full since start up"
+WEBHOOK_SPILLED_SIZE_METRIC_HELP = "The number of webhook jobs spilled to redis because the queue is full"
+WEBHOOK_DELIVERY_LATENCY_METRIC_HELP = "Webhook deliveries latency histogram since start up, deliveries count of each bucket or latency sum in seconds"
+WEBHOOK_DELIVERY_COUNT_METRIC_HELP = "The number of webhook deliveries since start up"
+CLEAN_DB_DELETED_COUNT_METRIC_HELP = "The number of expired rows deleted from the table by the current or last db clean"
+CLEAN_DB_DELETE_RATE_METRIC_HELP = "Rows deleted per second from the table by the current or last db clean"
+VIRUS_SCAN_FILES_RATE_METRIC_HELP = "Files scanned per second by the last virus scan run"
+VIRUS_SCAN_BYTES_RATE_METRIC_HELP = "Bytes scanned per second by the last virus scan run"
 
 
 def publish_metric(value, metric_name, metric_help):
@@ -42,6 +70,7 @@ def publish_common_dataset_metric_decorator(func):
         publish_metric(sync_count, 'common_dataset_sync_count', COMMON_DATASET_OPERATIONS_COUNT_METRIC_HELP)
         publish_metric(total_row_count, 'common_dataset_sync_total_row_count', COMMON_DATASET_TOTAL_ROW_COUNT_METRIC_HELP)
         publish_metric(elapsed, 'common_dataset_sync_time_cost', COMMON_DATASET_ELAPSED_TIME_METRIC_HELP)
+        publish_metric(round(total_row_count / elapsed, 2) if elapsed else 0, 'common_dataset_sync_rows_per_second', COMMON_DATASET_ROWS_RATE_METRIC_HELP)
         
         return result
     return wrapper
@@ -1,9 +1,18 @@
 #coding: UTF-8
+from collections import deque
 
 from seafobj import fs_mgr
 
+from dtable_events.app.config import VIRUS_SCAN_SEAFDIR_CACHE_SIZE
+from dtable_events.utils.lru_cache import LRUCache
+
 ZERO_OBJ_ID = '0000000000000000000000000000000000000000'
 
+# dirs are content addressed, shared by differs of all repos, e.g. repos of common ancestors and scans of next runs
+# cached dirs must not be modified
+_seafdirs = LRUCache('virus_scan_seafdirs', maxsize=VIRUS_SCAN_SEAFDIR_CACHE_SIZE)
+
+
 class CommitDiffer(object):
     def __init__(self, repo_id, version, root1, root2):
         self.repo_id = repo_id
@@ -11,10 +20,18 @@ class CommitDiffer(object):
         self.root1 = root1
         self.root2 = root2
 
+    def load_seafdir(self, dir_id):
+        key = (self.version, dir_id)
+        seafdir = _seafdirs.get(key)
+        if seafdir is None:
+            seafdir = fs_mgr.load_seafdir(self.repo_id, self.version, dir_id)
+            _seafdirs.set(key, seafdir)
+        return seafdir
+
     def diff(self):
         scan_files = []
-        new_dirs = [] # (path, dir_id)
-        queued_dirs = [] # (path, dir_id1, dir_id2)
+        new_dirs = deque() # (path, dir_id)
+        queued_dirs = deque() # (path, dir_id1, dir_id2)
 
         if ZERO_OBJ_ID == self.root1:
             self.root1 = None
@@ -28,46 +45,40 @@ class CommitDiffer(object):
         elif self.root2:
             queued_dirs.append(('/', self.root1, self.root2))
 
-        while True:
-            path = old_id = new_id = None
-            try:
-                path, old_id, new_id = queued_dirs.pop(0)
-            except IndexError:
-                break
+        while queued_dirs:
+            path, old_id, new_id = queued_dirs.popleft()
 
-            dir1 = fs_mgr.load_seafdir(self.repo_id, self.version, old_id)
-            dir2 = fs_mgr.load_seafdir(self.repo_id, self.version, new_id)
+            dir1 = self.load_seafdir(old_id)
+            dir2 = self.load_seafdir(new_id)
+            # names of dir2 entries in dir1 too, others are added
+            matched_names = set()
 
             for dent in dir1.get_files_list():
                 new_dent = dir2.lookup_dent(dent.name)
                 if new_dent and new_dent.type == dent.type:
-                    dir2.remove_entry(dent.name)
+                    matched_names.add(dent.name)
                     if new_dent.id != dent.id:
                         scan_files.append((make_path(path, dent.name), new_dent.id,
                                            new_dent.size))
 
             scan_files.extend([(make_path(path, dent.name), dent.id, dent.size)
-                               for dent in dir2.get_files_list()])
+                               for dent in dir2.get_files_list() if dent.name not in matched_names])
 
             for dent in dir1.get_subdirs_list():
                 new_dent = dir2.lookup_dent(dent.name)
                 if new_dent and new_dent.type == dent.type:
-                    dir2.remove_entry(dent.name)
+                    matched_names.add(dent.name)
                     if new_dent.id != dent.id:
                         queued_dirs.append((make_path(path, dent.name), dent.id, new_dent.id))
 
             new_dirs.extend([(make_path(path, dent.name), dent.id)
-                             for dent in dir2.get_subdirs_list()])
+                             for dent in dir2.get_subdirs_list() if dent.name not in matched_names])
 
-        while True:
+        while new_dirs:
             # Process newly added dirs and its sub-dirs, all files under
             # these dirs should be marked as added.
-            path = obj_id = None
-            try:
-                path, obj_id = new_dirs.pop(0)
-            except IndexError:
-                break
-            d = fs_mgr.load_seafdir(self.repo_id, self.version, obj_id)
+            path, obj_id = new_dirs.popleft()
+            d = self.load_seafdir(obj_id)
             scan_files.extend([(make_path(path, dent.name), dent.id, dent.size)
                                for dent in d.get_files_list()])
 
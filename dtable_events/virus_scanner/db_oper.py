@@ -27,9 +27,10 @@ class DBOper(object):
                 repo.repo_id.not_in(select(virtual_repo.repo_id)))
 
             rows = session.execute(stmt).unique().all()
+            scan_commit_ids = self.get_scan_commit_ids()
             for row in rows:
                 repo_id, commit_id = row
-                scan_commit_id = self.get_scan_commit_id(repo_id)
+                scan_commit_id = scan_commit_ids.get(repo_id)
                 repo_list.append((repo_id, commit_id, scan_commit_id))
         except Exception as e:
             logger.error('Failed to fetch repo list from db: %s.', e)
@@ -51,6 +52,42 @@ class DBOper(object):
         finally:
             session.close()
 
+    def get_scan_commit_ids(self):
+        session = self.edb_session()
+        try:
+            stmt = select(VirusScanRecord.repo_id, VirusScanRecord.scan_commit_id)
+            return {repo_id: scan_commit_id for repo_id, scan_commit_id in session.execute(stmt)}
+        finally:
+            session.close()
+
+    def save_scan_results(self, records, scanned_repos):
+        """
+        add virus records and update scan records of repos in one transaction
+
+        :param records: [(repo_id, commit_id, file_path)]
+        :param scanned_repos: [(repo_id, scan_commit_id)]
+        """
+        session = self.edb_session()
+        try:
+            session.add_all(VirusFile(repo_id, commit_id, file_path, 0, 0)
+                            for repo_id, commit_id, file_path in records)
+            repo_ids = [repo_id for repo_id, _ in scanned_repos]
+            stmt = select(VirusScanRecord.repo_id).where(VirusScanRecord.repo_id.in_(repo_ids))
+            existing_repo_ids = set(session.scalars(stmt).all())
+            updates = [{'repo_id': repo_id, 'scan_commit_id': scan_commit_id}
+                       for repo_id, scan_commit_id in scanned_repos if repo_id in existing_repo_ids]
+            if updates:
+                session.execute(update(VirusScanRecord), updates)
+            session.add_all(VirusScanRecord(repo_id, scan_commit_id)
+                            for repo_id, scan_commit_id in scanned_repos if repo_id not in existing_repo_ids)
+            session.commit()
+            return 0
+        except Exception as e:
+            logger.warning('Failed to save virus scan results to db: %s.', e)
+            return -1
+        finally:
+            session.close()
+
     def update_vscan_record(self, repo_id, scan_commit_id):
         session = self.edb_session()
         try:
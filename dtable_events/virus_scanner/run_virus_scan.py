@@ -3,6 +3,7 @@
 import sys
 import logging
 
+from dtable_events.app.event_redis import redis_cache
 from dtable_events.db import prepare_seafile_tables
 from dtable_events.virus_scanner.scan_settings import Settings
 from dtable_events.virus_scanner.virus_scan import VirusScan
@@ -24,6 +25,7 @@ if __name__ == "__main__":
     setting = Settings()
     if setting.is_enabled():
         prepare_seafile_tables()
+        redis_cache.init_redis()  # init redis instance for scan checkpoints
         VirusScan(setting).start()
     else:
         logger.info('Virus scan is disabled.')
@@ -0,0 +1,56 @@
+# coding: utf-8
+"""
+Checkpoints of repos being scanned, stored in redis, an interrupted scan of a repo resumes from its checkpoint
+instead of scanning all files changed since `scan_commit_id` again.
+
+A checkpoint records results of file ids scanned, valid while `scan_commit_id` of the repo is not updated.
+"""
+import base64
+import json
+import zlib
+
+from dtable_events.app.event_redis import redis_cache
+from .scan_settings import logger
+
+CHECKPOINT_KEY_PREFIX = 'virus_scan_checkpoint'
+CHECKPOINT_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def get_checkpoint_key(repo_id):
+    return f'{CHECKPOINT_KEY_PREFIX}:{repo_id}'
+
+
+def load_scan_checkpoint(repo_id, scan_commit_id):
+    """
+    :return: {file_id: scan result} of files scanned since `scan_commit_id`, or None
+    """
+    try:
+        checkpoint = redis_cache.get(get_checkpoint_key(repo_id))
+        if not checkpoint:
+            return None
+        checkpoint = json.loads(zlib.decompress(base64.b64decode(checkpoint)).decode())
+        if checkpoint['scan_commit_id'] != scan_commit_id:
+            return None
+        return checkpoint['results']
+    except Exception as e:
+        logger.warning('Failed to load virus scan checkpoint of repo %.8s: %s.', repo_id, e)
+        return None
+
+
+def save_scan_checkpoint(repo_id, scan_commit_id, results):
+    checkpoint = {
+        'scan_commit_id': scan_commit_id,
+        'results': results,
+    }
+    try:
+        checkpoint = base64.b64encode(zlib.compress(json.dumps(checkpoint).encode())).decode()
+        redis_cache.set(get_checkpoint_key(repo_id), checkpoint, timeout=CHECKPOINT_TIMEOUT)
+    except Exception as e:
+        logger.warning('Failed to save virus scan checkpoint of repo %.8s: %s.', repo_id, e)
+
+
+def delete_scan_checkpoint(repo_id):
+    try:
+        redis_cache.delete(get_checkpoint_key(repo_id))
+    except Exception as e:
+        logger.warning('Failed to delete virus scan checkpoint of repo %.8s: %s.', repo_id, e)
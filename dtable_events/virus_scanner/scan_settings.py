@@ -4,7 +4,8 @@ import logging
 
 from dtable_events.app.config import VIRUS_SCAN_ENABLED, VIRUS_SCAN_SCAN_COMMAND, VIRUS_SCAN_VIRUS_CODE, \
     VIRUS_SCAN_NONVIRUS_CODE, VIRUS_SCAN_SCAN_INTERVAL, VIRUS_SCAN_SCAN_SIZE_LIMIT, VIRUS_SCAN_SCAN_SKIP_EXT, \
-    VIRUS_SCAN_THREADS, EMAIL_SENDER_ENABLED
+    VIRUS_SCAN_THREADS, VIRUS_SCAN_CLAMD_ADDRESS, VIRUS_SCAN_CLAMD_TIMEOUT, VIRUS_SCAN_DB_BATCH_SIZE, \
+    EMAIL_SENDER_ENABLED
 from dtable_events.utils import get_opt_from_conf_or_env, parse_bool
 from dtable_events.db import init_db_session_class, init_seafile_db_session_class
 
@@ -16,6 +17,8 @@ class Settings(object):
     def __init__(self):
         self.enable_scan = False
         self.scan_cmd = None
+        self.clamd_address = None
+        self.clamd_timeout = 60
         self.vir_codes = None
         self.nonvir_codes = None
         self.scan_interval = 60
@@ -25,6 +28,7 @@ class Settings(object):
                               '.mp3', '.mp4', '.wav', '.avi', '.rmvb',
                               '.mkv']
         self.threads = 4
+        self.db_batch_size = 100
         self.enable_send_mail = False
 
         self.session_cls = None
@@ -48,6 +52,32 @@ class Settings(object):
         self.parse_send_mail_config()
 
     def parse_scan_config(self):
+        if VIRUS_SCAN_CLAMD_ADDRESS:
+            self.clamd_address = VIRUS_SCAN_CLAMD_ADDRESS
+            self.clamd_timeout = VIRUS_SCAN_CLAMD_TIMEOUT
+        elif not self.parse_scan_command_config():
+            return False
+
+        self.scan_interval = VIRUS_SCAN_SCAN_INTERVAL
+
+        self.scan_size_limit = VIRUS_SCAN_SCAN_SIZE_LIMIT
+
+        if VIRUS_SCAN_SCAN_SKIP_EXT:
+            exts = VIRUS_SCAN_SCAN_SKIP_EXT.split(',')
+            # .jpg, .mp3, .mp4 format
+            exts = [ext.strip() for ext in exts if ext]
+            self.scan_skip_ext = [ext.lower() for ext in exts
+                                  if len(ext) > 1 and ext[0] == '.']
+
+        if VIRUS_SCAN_THREADS:
+            self.threads = VIRUS_SCAN_THREADS
+
+        if VIRUS_SCAN_DB_BATCH_SIZE:
+            self.db_batch_size = VIRUS_SCAN_DB_BATCH_SIZE
+
+        return True
+
+    def parse_scan_command_config(self):
         self.scan_cmd = VIRUS_SCAN_SCAN_COMMAND
         if not self.scan_cmd:
             logger.info(f'scan_command option is not found in seafile.conf, disable virus scan.')
@@ -75,20 +105,6 @@ class Settings(object):
             logger.info('invalid nonvirus_code format, disable virus scan.')
             return False
 
-        self.scan_interval = VIRUS_SCAN_SCAN_INTERVAL
-
-        self.scan_size_limit = VIRUS_SCAN_SCAN_SIZE_LIMIT
-
-        if VIRUS_SCAN_SCAN_SKIP_EXT:
-            exts = VIRUS_SCAN_SCAN_SKIP_EXT.split(',')
-            # .jpg, .mp3, .mp4 format
-            exts = [ext.strip() for ext in exts if ext]
-            self.scan_skip_ext = [ext.lower() for ext in exts
-                                  if len(ext) > 1 and ext[0] == '.']
-
-        if VIRUS_SCAN_THREADS:
-            self.threads = VIRUS_SCAN_THREADS
-
         return True
 
     def parse_send_mail_config(self):
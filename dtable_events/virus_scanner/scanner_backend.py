@@ -0,0 +1,113 @@
+# coding: utf-8
+import os
+import socket
+import struct
+import subprocess
+import tempfile
+
+from .scan_settings import logger
+
+# results of scanners
+SCAN_RESULT_OK = 0
+SCAN_RESULT_VIRUS = 1
+SCAN_RESULT_FAILED = -1
+
+CLAMD_CHUNK_SIZE = 1024 * 1024
+
+
+class CommandScanner(object):
+    """
+    Run `scan_cmd <file>` for each file, the file is written to a temp file first, result is parsed from
+    the return code by `virus_code` and `nonvirus_code`.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.name = settings.scan_cmd
+
+    def scan(self, chunks):
+        tfd, tpath = tempfile.mkstemp()
+        try:
+            for chunk in chunks:
+                os.write(tfd, chunk)
+
+            log_dir = os.path.join(os.environ.get('LOG_DIR', ''))
+            logfile = os.path.join(log_dir, 'virus_scan.log')
+            with open(logfile, 'a') as fp:
+                ret_code = subprocess.call([self.settings.scan_cmd, tpath], stdout=fp, stderr=fp)
+
+            return self.parse_scan_result(ret_code)
+        finally:
+            os.close(tfd)
+            os.unlink(tpath)
+
+    def parse_scan_result(self, ret_code):
+        rcode_str = str(ret_code)
+
+        for code in self.settings.nonvir_codes:
+            if rcode_str == code:
+                return SCAN_RESULT_OK
+
+        for code in self.settings.vir_codes:
+            if rcode_str == code:
+                return SCAN_RESULT_VIRUS
+
+        return ret_code
+
+
+class ClamdScanner(object):
+    """
+    Stream files to a clamd daemon by the INSTREAM command, no temp file and no process per file.
+
+    address is a unix socket path, e.g. /var/run/clamav/clamd.ctl, or host:port, e.g. 127.0.0.1:3310
+    """
+
+    def __init__(self, address, timeout=60):
+        self.address = address
+        self.timeout = timeout
+        self.name = f'clamd {address}'
+
+    def connect(self):
+        if ':' in self.address and not self.address.startswith('/'):
+            host, port = self.address.rsplit(':', 1)
+            return socket.create_connection((host, int(port)), timeout=self.timeout)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.address)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def scan(self, chunks):
+        with self.connect() as sock:
+            sock.sendall(b'zINSTREAM\0')
+            for chunk in chunks:
+                # clamd limits size of a chunk by `StreamMaxLength`, blocks are split to chunks of 1M
+                for i in range(0, len(chunk), CLAMD_CHUNK_SIZE):
+                    data = chunk[i:i + CLAMD_CHUNK_SIZE]
+                    sock.sendall(struct.pack('!L', len(data)) + data)
+            sock.sendall(struct.pack('!L', 0))
+            reply = b''
+            while not reply.endswith(b'\0'):
+                data = sock.recv(4096)
+                if not data:
+                    break
+                reply += data
+        return self.parse_reply(reply.rstrip(b'\0').decode('utf-8', 'replace'))
+
+    def parse_reply(self, reply):
+        # stream: OK / stream: Eicar-Signature FOUND / INSTREAM size limit exceeded. ERROR
+        if reply.endswith('FOUND'):
+            return SCAN_RESULT_VIRUS
+        if reply.endswith('OK'):
+            return SCAN_RESULT_OK
+        logger.warning('clamd %s scan error: %s', self.address, reply)
+        return SCAN_RESULT_FAILED
+
+
+def get_scanner(settings):
+    if settings.clamd_address:
+        return ClamdScanner(settings.clamd_address, timeout=settings.clamd_timeout)
+    return CommandScanner(settings)
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 import os
-import tempfile
 import subprocess
+import time
+from threading import Lock
 
 from seafobj import commit_mgr, fs_mgr, block_mgr
 
@@ -9,8 +10,12 @@ from .db_oper import DBOper
 from .commit_differ import CommitDiffer
 from .thread_pool import ThreadPool
 from .scan_settings import logger
+from .scanner_backend import get_scanner, SCAN_RESULT_OK, SCAN_RESULT_VIRUS, SCAN_RESULT_FAILED
+from .scan_checkpoint import load_scan_checkpoint, save_scan_checkpoint, delete_scan_checkpoint
 from dtable_events.utils import get_python_executable
-from dtable_events.app.config import dtable_web_dir
+from dtable_events.utils.utils_metric import publish_metric, VIRUS_SCAN_FILES_RATE_METRIC_HELP, \
+    VIRUS_SCAN_BYTES_RATE_METRIC_HELP
+from dtable_events.app.config import dtable_web_dir, VIRUS_SCAN_CHECKPOINT_INTERVAL
 from dtable_events.virus_scanner.scan_settings import Settings
 
 
@@ -21,10 +26,66 @@ class ScanTask(object):
         self.scan_commit_id = scan_commit_id
 
 
+class RepoScan(object):
+    """
+    results of files of a repo, files are scanned in parallel
+    """
+
+    def __init__(self, scan_task, nfiles, results=None):
+        self.scan_task = scan_task
+        self.pending = nfiles
+        self.vnum = 0
+        self.nvnum = 0
+        self.nfailed = 0
+        self.vrecords = []
+        self.lock = Lock()
+
+        # file_id -> result of files scanned, checkpointed periodically
+        self.results = results or {}
+        self.checkpointed = bool(results)
+        self.checkpoint_time = time.time()
+
+    def add_result(self, fpath, fid, ret):
+        if ret == SCAN_RESULT_OK:
+            self.nvnum += 1
+        elif ret == SCAN_RESULT_VIRUS:
+            self.vnum += 1
+            self.vrecords.append((self.scan_task.repo_id, self.scan_task.head_commit_id, fpath))
+        else:
+            self.nfailed += 1
+            return
+        self.results[fid] = ret
+
+
+class FileScanTask(object):
+    def __init__(self, repo_scan, fpath, fid, fsize):
+        self.repo_scan = repo_scan
+        self.fpath = fpath
+        self.fid = fid
+        self.fsize = fsize
+
+
 class VirusScan(object):
+    """
+    Repos are diffed in a thread pool and changed files of them are scanned in another, results of repos
+    are saved to db in batches.
+    """
+
     def __init__(self, settings: Settings):
         self.settings = settings
         self.db_oper = DBOper(settings)
+        self.scanner = get_scanner(settings)
+
+        self.file_pool = None
+        self._results_lock = Lock()
+        self._flush_lock = Lock()
+        self._vrecords = []
+        self._scanned_repos = []
+        self._checkpointed_repo_ids = []
+
+        self._stats_lock = Lock()
+        self.files_scanned = 0
+        self.bytes_scanned = 0
 
     def start(self):
         repo_list = self.db_oper.get_repo_list()
@@ -32,6 +93,9 @@ class VirusScan(object):
             logger.debug("No repo, skip virus scan.")
             return
 
+        start_time = time.time()
+        self.file_pool = ThreadPool(self.scan_file, self.settings.threads)
+        self.file_pool.start()
         thread_pool = ThreadPool(self.scan_virus, self.settings.threads)
         thread_pool.start()
 
@@ -44,7 +108,11 @@ class VirusScan(object):
 
             thread_pool.put_task(ScanTask(repo_id, head_commit_id, scan_commit_id))
 
+        # files of all repos are queued after repos diffed
         thread_pool.join()
+        self.file_pool.join()
+        self.flush_results()
+        self.report_stats(time.time() - start_time)
 
     def scan_virus(self, scan_task):
         try:
@@ -63,70 +131,132 @@ class VirusScan(object):
 
             if len(scan_files) == 0:
                 logger.debug('No change occur for repo %.8s, skip virus scan.', scan_task.repo_id)
-                self.db_oper.update_vscan_record(scan_task.repo_id, scan_task.head_commit_id)
+                self.add_results(scan_task, [])
+                return
+
+            scan_files = [scan_file for scan_file in scan_files if self.should_scan_file(scan_file[0], scan_file[2])]
+            if len(scan_files) == 0:
+                logger.info('Virus scan for repo %.8s finished: no file to scan.', scan_task.repo_id)
+                self.add_results(scan_task, [])
                 return
+
+            results = load_scan_checkpoint(scan_task.repo_id, scan_task.scan_commit_id)
+            if results:
+                logger.info('Resume virus scan for repo %.8s, %d files scanned.', scan_task.repo_id, len(results))
+                # files scanned before interrupted are not scanned again
+                repo_scan = RepoScan(scan_task, 0, results=results)
+                for fpath, fid, _ in scan_files:
+                    if fid in results:
+                        repo_scan.add_result(fpath, fid, results[fid])
+                scan_files = [scan_file for scan_file in scan_files if scan_file[1] not in results]
+                repo_scan.pending = len(scan_files)
+                if len(scan_files) == 0:
+                    self.finish_repo_scan(repo_scan)
+                    return
             else:
                 logger.info('Start to scan virus for repo %.8s.', scan_task.repo_id)
+                repo_scan = RepoScan(scan_task, len(scan_files))
 
-            vnum = 0
-            nvnum = 0
-            nfailed = 0
-            vrecords = []
-
-            for scan_file in scan_files:
-                fpath, fid, fsize = scan_file
-                if not self.should_scan_file(fpath, fsize):
-                    continue
-
-                ret = self.scan_file_virus(scan_task.repo_id, fid, fpath)
-
-                if ret == 0:
-                    logger.debug('File %s virus scan by %s: OK.', fpath, self.settings.scan_cmd)
-                    nvnum += 1
-                elif ret == 1:
-                    logger.info('File %s virus scan by %s: Found virus.', fpath, self.settings.scan_cmd)
-                    vnum += 1
-                    vrecords.append((scan_task.repo_id, scan_task.head_commit_id, fpath))
-                else:
-                    logger.debug('File %s virus scan by %s: Failed.', fpath, self.settings.scan_cmd)
-                    nfailed += 1
-
-            if nfailed == 0:
-                ret = 0
-                if len(vrecords) > 0:
-                    ret = self.db_oper.add_virus_record(vrecords)
-                    if ret == 0 and self.settings.enable_send_mail:
-                        self.send_email(vrecords)
-                if ret == 0:
-                    self.db_oper.update_vscan_record(scan_task.repo_id, scan_task.head_commit_id)
-
-            logger.info('Virus scan for repo %.8s finished: %d virus, %d non virus, %d failed.',
-                        scan_task.repo_id, vnum, nvnum, nfailed)
+            for fpath, fid, fsize in scan_files:
+                self.file_pool.put_task(FileScanTask(repo_scan, fpath, fid, fsize))
 
         except Exception as e:
             logger.warning('Failed to scan virus for repo %.8s: %s.', scan_task.repo_id, e)
 
+    def scan_file(self, file_task):
+        repo_scan = file_task.repo_scan
+        scan_task = repo_scan.scan_task
+        try:
+            ret = self.scan_file_virus(scan_task.repo_id, file_task.fid, file_task.fpath)
+        except Exception as e:
+            logger.warning('Virus scan for file %s encounter error: %s.', file_task.fpath, e)
+            ret = SCAN_RESULT_FAILED
+
+        if ret == SCAN_RESULT_OK:
+            logger.debug('File %s virus scan by %s: OK.', file_task.fpath, self.scanner.name)
+        elif ret == SCAN_RESULT_VIRUS:
+            logger.info('File %s virus scan by %s: Found virus.', file_task.fpath, self.scanner.name)
+        else:
+            logger.debug('File %s virus scan by %s: Failed.', file_task.fpath, self.scanner.name)
+
+        checkpoint_results = None
+        with repo_scan.lock:
+            repo_scan.add_result(file_task.fpath, file_task.fid, ret)
+            repo_scan.pending -= 1
+            finished = repo_scan.pending == 0
+            if not finished and VIRUS_SCAN_CHECKPOINT_INTERVAL and \
+                    time.time() - repo_scan.checkpoint_time >= VIRUS_SCAN_CHECKPOINT_INTERVAL:
+                repo_scan.checkpoint_time = time.time()
+                repo_scan.checkpointed = True
+                checkpoint_results = dict(repo_scan.results)
+        if checkpoint_results:
+            save_scan_checkpoint(scan_task.repo_id, scan_task.scan_commit_id, checkpoint_results)
+
+        if ret in (SCAN_RESULT_OK, SCAN_RESULT_VIRUS):
+            with self._stats_lock:
+                self.files_scanned += 1
+                self.bytes_scanned += file_task.fsize
+
+        if finished:
+            self.finish_repo_scan(repo_scan)
+
+    def finish_repo_scan(self, repo_scan):
+        scan_task = repo_scan.scan_task
+        logger.info('Virus scan for repo %.8s finished: %d virus, %d non virus, %d failed.',
+                    scan_task.repo_id, repo_scan.vnum, repo_scan.nvnum, repo_scan.nfailed)
+        if repo_scan.nfailed == 0:
+            self.add_results(scan_task, repo_scan.vrecords, checkpointed=repo_scan.checkpointed)
+        elif repo_scan.results:
+            # failed files are scanned again in next run, with others resumed
+            save_scan_checkpoint(scan_task.repo_id, scan_task.scan_commit_id, repo_scan.results)
+
     def scan_file_virus(self, repo_id, file_id, file_path):
-        tfd, tpath = tempfile.mkstemp()
         try:
             seafile = fs_mgr.load_seafile(repo_id, 1, file_id)
-            for blk_id in seafile.blocks:
-                os.write(tfd, block_mgr.load_block(repo_id, 1, blk_id))
-
-            log_dir = os.path.join(os.environ.get('LOG_DIR', ''))
-            logfile = os.path.join(log_dir, 'virus_scan.log')
-            with open(logfile, 'a') as fp:
-                ret_code = subprocess.call([self.settings.scan_cmd, tpath], stdout=fp, stderr=fp)
-
-            return self.parse_scan_result(ret_code)
-
+            # blocks are streamed to scanner one by one
+            chunks = (block_mgr.load_block(repo_id, 1, blk_id) for blk_id in seafile.blocks)
+            return self.scanner.scan(chunks)
         except Exception as e:
             logger.warning('Virus scan for file %s encounter error: %s.', file_path, e)
-            return -1
-        finally:
-            if tfd > 0:
-                os.close(tfd)
-                os.unlink(tpath)
+            return SCAN_RESULT_FAILED
+
+    def add_results(self, scan_task, vrecords, checkpointed=False):
+        with self._results_lock:
+            self._scanned_repos.append((scan_task.repo_id, scan_task.head_commit_id))
+            self._vrecords.extend(vrecords)
+            if checkpointed:
+                self._checkpointed_repo_ids.append(scan_task.repo_id)
+            if len(self._scanned_repos) < self.settings.db_batch_size:
+                return
+        self.flush_results()
+
+    def flush_results(self):
+        with self._flush_lock:
+            with self._results_lock:
+                vrecords, self._vrecords = self._vrecords, []
+                scanned_repos, self._scanned_repos = self._scanned_repos, []
+                checkpointed_repo_ids, self._checkpointed_repo_ids = self._checkpointed_repo_ids, []
+            if not scanned_repos:
+                return
+            # repos not saved are scanned again in next run, resumed from checkpoints
+            ret = self.db_oper.save_scan_results(vrecords, scanned_repos)
+            if ret != 0:
+                return
+            for repo_id in checkpointed_repo_ids:
+                delete_scan_checkpoint(repo_id)
+            if vrecords and self.settings.enable_send_mail:
+                self.send_email(vrecords)
+
+    def report_stats(self, elapsed):
+        files_rate = round(self.files_scanned / elapsed, 2) if elapsed else 0
+        bytes_rate = int(self.bytes_scanned / elapsed) if elapsed else 0
+        logger.info('Virus scan by %s finished: %d files, %d bytes in %.1fs, %s files/s, %s bytes/s.',
+                    self.scanner.name, self.files_scanned, self.bytes_scanned, elapsed, files_rate, bytes_rate)
+        try:
+            publish_metric(files_rate, 'virus_scan_files_per_second', VIRUS_SCAN_FILES_RATE_METRIC_HELP)
+            publish_metric(bytes_rate, 'virus_scan_bytes_per_second', VIRUS_SCAN_BYTES_RATE_METRIC_HELP)
+        except Exception as e:
+            logger.debug('Failed to publish virus scan metrics: %s.', e)
 
     def send_email(self, vrecords):
         args = ["%s:%s" % (e[0], e[2]) for e in vrecords]
@@ -137,19 +267,6 @@ class VirusScan(object):
         ]
         subprocess.Popen(cmd, cwd=dtable_web_dir)
 
-    def parse_scan_result(self, ret_code):
-        rcode_str = str(ret_code)
-
-        for code in self.settings.nonvir_codes:
-            if rcode_str == code:
-                return 0
-
-        for code in self.settings.vir_codes:
-            if rcode_str == code:
-                return 1
-
-        return ret_code
-
     def should_scan_file(self, fpath, fsize):
         if fsize >= self.settings.scan_size_limit << 20:
             logger.debug('File %s size exceed %sM, skip virus scan.' % (fpath, self.settings.scan_size_limit))
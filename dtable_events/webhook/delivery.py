@@ -0,0 +1,343 @@
+import heapq
+import json
+import logging
+import time
+from collections import deque, defaultdict
+from datetime import datetime
+from itertools import count
+from threading import Thread, Condition, Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ReadTimeout
+from sqlalchemy import insert, text
+
+from dtable_events.app.config import WEBHOOK_WORKERS, WEBHOOK_CONCURRENCY_PER_WEBHOOK, WEBHOOK_QUEUE_SIZE, \
+    WEBHOOK_QUEUE_FULL_POLICY, WEBHOOK_REQUEST_TIMEOUT, WEBHOOK_RETRY_TIMES, WEBHOOK_RETRY_BACKOFF
+from dtable_events.app.event_redis import RedisClient
+from dtable_events.db import init_db_session_class
+from dtable_events.utils.utils_metric import publish_metric, WEBHOOK_QUEUE_SIZE_METRIC_HELP, \
+    WEBHOOK_DROPPED_COUNT_METRIC_HELP, WEBHOOK_SPILLED_SIZE_METRIC_HELP, WEBHOOK_DELIVERY_LATENCY_METRIC_HELP, \
+    WEBHOOK_DELIVERY_COUNT_METRIC_HELP
+from dtable_events.webhook.models import WebhookJobs, FAILURE
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_ERROR_CACHE_PREFIX = 'webhook_error_'
+WEBHOOK_ERROR_TIMES_CACHE_TIMEOUT = 24 * 60 * 60
+WEBHOOK_ALLOW_ERROR_TIMES = 5
+
+WEBHOOK_SPILL_QUEUE_KEY = 'webhook_jobs_spill'
+
+QUEUE_FULL_POLICY_DROP = 'drop'
+QUEUE_FULL_POLICY_SPILL = 'spill'
+
+# upper bounds (in seconds) of delivery latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 10, 30)
+
+
+class WebhookJobQueue(object):
+    """
+    A bounded queue of webhook jobs.
+
+    Jobs of one webhook are handed out to at most `concurrency_per_webhook` workers at the same time
+    and webhooks with pending jobs take turns, so a slow endpoint can't occupy all workers.
+    """
+
+    def __init__(self, maxsize=10000, concurrency_per_webhook=2):
+        self.maxsize = maxsize
+        self.concurrency_per_webhook = concurrency_per_webhook
+        self._pending = {}  # webhook_id -> deque of jobs
+        self._running = defaultdict(int)  # webhook_id -> number of jobs being delivered
+        self._ready = deque()  # webhook ids whose jobs can be handed out
+        self._ready_set = set()
+        self._size = 0
+        self._cond = Condition()
+
+    def qsize(self):
+        return self._size
+
+    def _mark_ready(self, webhook_id):
+        if webhook_id in self._ready_set:
+            return
+        if not self._pending.get(webhook_id) or self._running[webhook_id] >= self.concurrency_per_webhook:
+            return
+        self._ready.append(webhook_id)
+        self._ready_set.add(webhook_id)
+        self._cond.notify()
+
+    def put(self, job, force=False):
+        """return False if the queue is full, `force` to put anyway, e.g. jobs to retry"""
+        with self._cond:
+            if not force and self._size >= self.maxsize:
+                return False
+            webhook_id = job['webhook_id']
+            self._pending.setdefault(webhook_id, deque()).append(job)
+            self._size += 1
+            self._mark_ready(webhook_id)
+            return True
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._ready and not self._cond.wait_for(lambda: self._ready, timeout=timeout):
+                return None
+            webhook_id = self._ready.popleft()
+            self._ready_set.discard(webhook_id)
+            jobs = self._pending[webhook_id]
+            job = jobs.popleft()
+            if not jobs:
+                del self._pending[webhook_id]
+            self._size -= 1
+            self._running[webhook_id] += 1
+            self._mark_ready(webhook_id)
+            return job
+
+    def task_done(self, job):
+        webhook_id = job['webhook_id']
+        with self._cond:
+            self._running[webhook_id] -= 1
+            if self._running[webhook_id] <= 0:
+                del self._running[webhook_id]
+            self._mark_ready(webhook_id)
+
+
+class WebhookDeliverer(object):
+    """
+    Deliver webhook jobs by a pool of workers sharing one http session, which keeps a connection pool per host.
+
+    Requests timed out, failed to connect or responded with 429 / 5xx are retried with exponential backoff
+    before counted as an error of the webhook, webhooks with too many errors are invalidated.
+    Failed jobs are saved to webhook_jobs in batches.
+    """
+
+    def __init__(self, workers=WEBHOOK_WORKERS, concurrency_per_webhook=WEBHOOK_CONCURRENCY_PER_WEBHOOK,
+                 queue_size=WEBHOOK_QUEUE_SIZE, queue_full_policy=WEBHOOK_QUEUE_FULL_POLICY,
+                 timeout=WEBHOOK_REQUEST_TIMEOUT, retry_times=WEBHOOK_RETRY_TIMES, retry_backoff=WEBHOOK_RETRY_BACKOFF,
+                 on_invalidate=None):
+        self._db_session_class = init_db_session_class()
+        self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=5,
+                                         health_check_interval=30, retry_on_timeout=True)
+        self.workers = workers
+        self.queue = WebhookJobQueue(maxsize=queue_size, concurrency_per_webhook=concurrency_per_webhook)
+        self.queue_full_policy = queue_full_policy
+        self.timeout = timeout
+        self.retry_times = retry_times
+        self.retry_backoff = retry_backoff
+        self.on_invalidate = on_invalidate
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=100, pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        self._retry_jobs = []  # heap of (retry_at, seq, job)
+        self._retry_seq = count()
+        self._retry_cond = Condition()
+
+        self._failed_jobs = []
+        self._failed_jobs_lock = Lock()
+
+        # metrics
+        self.dropped_count = 0
+        self.delivery_count = 0
+        self._latency_lock = Lock()
+        self._latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._latency_sum = 0
+
+    def start(self):
+        for i in range(self.workers):
+            Thread(target=self.deliver_jobs, name='webhook_deliver_%s' % i, daemon=True).start()
+        Thread(target=self.schedule_retries, name='webhook_retry', daemon=True).start()
+        Thread(target=self.flush_failed_jobs, name='webhook_failed_jobs', daemon=True).start()
+        Thread(target=self.publish_metrics, name='webhook_metrics', daemon=True).start()
+        if self.queue_full_policy == QUEUE_FULL_POLICY_SPILL:
+            Thread(target=self.load_spilled_jobs, name='webhook_spill', daemon=True).start()
+
+    def put(self, job):
+        job.setdefault('attempts', 0)
+        if self.queue.put(job):
+            return
+        if self.queue_full_policy == QUEUE_FULL_POLICY_SPILL:
+            try:
+                self._redis_client.lpush(WEBHOOK_SPILL_QUEUE_KEY, json.dumps(job, default=str))
+                return
+            except Exception as e:
+                logger.warning('spill webhook job error: %s', e)
+        self.dropped_count += 1
+        logger.warning('webhook job queue is full, drop job of webhook %s', job['webhook_id'])
+
+    def load_spilled_jobs(self):
+        """move spilled jobs back to the queue when it has space"""
+        while True:
+            try:
+                space = self.queue.maxsize // 2 - self.queue.qsize()
+                if space <= 0:
+                    time.sleep(1)
+                    continue
+                job_str = self._redis_client.rpop(WEBHOOK_SPILL_QUEUE_KEY)
+                if not job_str:
+                    time.sleep(1)
+                    continue
+                job = json.loads(job_str)
+                job['created_at'] = datetime.fromisoformat(job['created_at'])
+                self.queue.put(job, force=True)
+            except Exception as e:
+                logger.error('load spilled webhook jobs error: %s', e)
+                time.sleep(1)
+
+    def retry_later(self, job):
+        job['attempts'] += 1
+        retry_at = time.time() + self.retry_backoff * 2 ** (job['attempts'] - 1)
+        with self._retry_cond:
+            heapq.heappush(self._retry_jobs, (retry_at, next(self._retry_seq), job))
+            self._retry_cond.notify()
+
+    def schedule_retries(self):
+        while True:
+            with self._retry_cond:
+                while not self._retry_jobs or self._retry_jobs[0][0] > time.time():
+                    timeout = self._retry_jobs[0][0] - time.time() if self._retry_jobs else None
+                    self._retry_cond.wait(timeout)
+                _, _, job = heapq.heappop(self._retry_jobs)
+            self.queue.put(job, force=True)
+
+    def record_latency(self, latency):
+        with self._latency_lock:
+            self.delivery_count += 1
+            self._latency_sum += latency
+            for i, bucket in enumerate(LATENCY_BUCKETS):
+                if latency <= bucket:
+                    self._latency_buckets[i] += 1
+                    break
+            else:
+                self._latency_buckets[-1] += 1
+
+    def add_failed_job(self, job, response_status=None, response_body=None):
+        webhook_job = {
+            'webhook_id': job['webhook_id'],
+            'created_at': job['created_at'],
+            'trigger_at': datetime.now(),
+            'status': FAILURE,
+            'url': job['url'],
+            'request_headers': json.dumps(job['request_headers']),
+            'request_body': json.dumps(job['request_body']),
+            'response_status': response_status,
+            'response_body': response_body
+        }
+        with self._failed_jobs_lock:
+            self._failed_jobs.append(webhook_job)
+
+    def flush_failed_jobs(self, interval=1):
+        while True:
+            time.sleep(interval)
+            with self._failed_jobs_lock:
+                failed_jobs, self._failed_jobs = self._failed_jobs, []
+            if not failed_jobs:
+                continue
+            session = self._db_session_class()
+            try:
+                session.execute(insert(WebhookJobs), failed_jobs)
+                session.commit()
+            except Exception as e:
+                logger.error('save %s failed webhook jobs error: %s', len(failed_jobs), e)
+            finally:
+                session.close()
+
+    def invalidate_webhook(self, webhook_id):
+        sql = "UPDATE webhooks SET is_valid=0 WHERE id=:webhook_id"
+        session = self._db_session_class()
+        try:
+            session.execute(text(sql), {'webhook_id': webhook_id})
+            session.commit()
+        except Exception as e:
+            logger.error('invalidate webhook: %s error: %s', webhook_id, e)
+        finally:
+            session.close()
+        if self.on_invalidate:
+            self.on_invalidate(webhook_id)
+
+    def get_webhook_error_times(self, cache_key):
+        webhook_error_times = self._redis_client.get(cache_key)
+        if not webhook_error_times:
+            webhook_error_times = 0
+
+        return int(webhook_error_times)
+
+    def count_error(self, webhook_id):
+        """return whether the webhook has too many errors"""
+        webhook_error_cache_key = WEBHOOK_ERROR_CACHE_PREFIX + str(webhook_id)
+        webhook_error_times = self.get_webhook_error_times(webhook_error_cache_key) + 1
+        self._redis_client.set(webhook_error_cache_key,
+                               webhook_error_times,
+                               timeout=WEBHOOK_ERROR_TIMES_CACHE_TIMEOUT
+                               )
+        return webhook_error_times >= WEBHOOK_ALLOW_ERROR_TIMES
+
+    def deliver(self, job):
+        webhook_error_cache_key = WEBHOOK_ERROR_CACHE_PREFIX + str(job['webhook_id'])
+        can_retry = job['attempts'] < self.retry_times
+        need_invalidate = False
+        start = time.monotonic()
+        try:
+            response = self._session.post(job['url'], json=job.get('request_body'),
+                                          headers=job.get('request_headers'), timeout=self.timeout)
+        except ReadTimeout:
+            self.record_latency(time.monotonic() - start)
+            logger.warning('request webhook url: %s timeout', job['url'])
+            if can_retry:
+                self.retry_later(job)
+                return
+            self.add_failed_job(job)
+            need_invalidate = self.count_error(job['webhook_id'])
+        except Exception as e:
+            logger.warning('request webhook url: %s error: %s', job['url'], e)
+            if can_retry and isinstance(e, requests.ConnectionError):
+                self.retry_later(job)
+                return
+            self.add_failed_job(job)
+            need_invalidate = True
+        else:
+            self.record_latency(time.monotonic() - start)
+            if 200 <= response.status_code < 300:
+                self._redis_client.delete(webhook_error_cache_key)
+                return
+            if can_retry and (response.status_code == 429 or response.status_code >= 500):
+                self.retry_later(job)
+                return
+            self.add_failed_job(job, response.status_code, response.text)
+            need_invalidate = self.count_error(job['webhook_id'])
+        if need_invalidate:
+            self.invalidate_webhook(job['webhook_id'])
+            self._redis_client.delete(webhook_error_cache_key)
+
+    def deliver_jobs(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self.deliver(job)
+            except Exception as e:
+                logger.error('trigger job error: %s' % e)
+            finally:
+                self.queue.task_done(job)
+
+    def publish_metrics(self, interval=30):
+        while True:
+            time.sleep(interval)
+            try:
+                publish_metric(self.queue.qsize(), 'webhook_queue_size', WEBHOOK_QUEUE_SIZE_METRIC_HELP)
+                publish_metric(self.dropped_count, 'webhook_dropped_count', WEBHOOK_DROPPED_COUNT_METRIC_HELP)
+                if self.queue_full_policy == QUEUE_FULL_POLICY_SPILL:
+                    publish_metric(self._redis_client.llen(WEBHOOK_SPILL_QUEUE_KEY), 'webhook_spilled_size', WEBHOOK_SPILLED_SIZE_METRIC_HELP)
+                with self._latency_lock:
+                    latency_buckets = list(self._latency_buckets)
+                    latency_sum, delivery_count = self._latency_sum, self.delivery_count
+                # cumulative buckets, like a prometheus histogram
+                cumulative = 0
+                for bucket, bucket_count in zip(LATENCY_BUCKETS + ('inf',), latency_buckets):
+                    cumulative += bucket_count
+                    bucket_name = 'inf' if bucket == 'inf' else '%sms' % int(bucket * 1000)
+                    publish_metric(cumulative, f'webhook_delivery_latency_le_{bucket_name}', WEBHOOK_DELIVERY_LATENCY_METRIC_HELP)
+                publish_metric(round(latency_sum, 3), 'webhook_delivery_latency_sum', WEBHOOK_DELIVERY_LATENCY_METRIC_HELP)
+                publish_metric(delivery_count, 'webhook_delivery_count', WEBHOOK_DELIVERY_COUNT_METRIC_HELP)
+            except Exception as e:
+                logger.warning('publish webhook metrics error: %s', e)
@@ -44,6 +44,13 @@ class Webhooks(Base):
         if event in events:
             return True
 
+    def is_op_type_subscribed(self, op_type):
+        """hooks without `op_types` in settings subscribe all op types"""
+        op_types = self.hook_settings.get('op_types')
+        if not op_types:
+            return True
+        return op_type in op_types
+
     def gen_request_body(self, event):
         """
         must return dict
@@ -1,162 +1,149 @@
-import json
 import logging
 import time
 from datetime import datetime
-from threading import Thread
-from queue import Queue
+from threading import Thread, Lock
 
-import requests
-from requests.exceptions import ReadTimeout
-from sqlalchemy import select, text
+from sqlalchemy import select
 
-from dtable_events.app.event_redis import RedisClient
+from dtable_events.app.config import WEBHOOK_INDEX_REFRESH_INTERVAL
+from dtable_events.app.event_redis import pubsub_dispatcher
 from dtable_events.db import init_db_session_class
-from dtable_events.webhook.models import Webhooks, WebhookJobs, PENDING, FAILURE
+from dtable_events.webhook.delivery import WebhookDeliverer
+from dtable_events.webhook.models import Webhooks, PENDING
 
 logger = logging.getLogger(__name__)
 
-WEBHOOK_ERROR_CACHE_PREFIX = 'webhook_error_'
-WEBHOOK_ERROR_TIMES_CACHE_TIMEOUT = 24 * 60 * 60
-WEBHOOK_ALLOW_ERROR_TIMES = 5
+# {'dtable_uuid'} of webhooks changed, to be published by dtable-web when webhooks are created, edited or deleted,
+# nothing publishes it yet, so the periodic refresh bounds how late changes are picked up
+WEBHOOK_CHANGED_CHANNEL = 'webhook-changed'
 
 
-class Webhooker(object):
+class WebhookIndex(object):
     """
-    There are a few steps in this program:
-    1. subscribe events from redis.
-    2. query webhooks and generate jobs, then put them to queue.
-    3. trigger jobs one by one.
+    In-memory index of dtable_uuid -> valid webhooks.
+
+    All valid webhooks are reloaded every `refresh_interval` seconds, which bounds how late changes of
+    webhooks are picked up. Webhooks of a base are reloaded at once when a message of it comes on
+    WEBHOOK_CHANGED_CHANNEL, and webhooks invalidated by the deliverer are removed at once.
     """
-    def __init__(self):
-        self._db_session_class = init_db_session_class()
-        self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=5,
-                                         health_check_interval=30, retry_on_timeout=True)
-        self.job_queue = Queue()
-        self._pubsub_channel_name = 'table-events'
-        self._pubsub_no_message_timeout = 5 * 60
 
-    def start(self):
-        logger.info('Starting handle webhook jobs...')
-        tds = [Thread(target=self.add_jobs)]
-        tds.extend([Thread(target=self.trigger_jobs, name='trigger_%s' % i) for i in range(2)])
-        [td.start() for td in tds]
+    def __init__(self, db_session_class, refresh_interval=WEBHOOK_INDEX_REFRESH_INTERVAL):
+        self._db_session_class = db_session_class
+        self.refresh_interval = refresh_interval
+        self._hooks_map = {}  # dtable_uuid -> [Webhooks], detached from session
+        self._lock = Lock()
+        self.loaded = False
 
-    def add_jobs(self):
-        """all events from redis are kind of update so far"""
-        subscriber = self._redis_client.get_subscriber(self._pubsub_channel_name)
-        last_pubsub_message_time = time.time()
+    def _load(self, dtable_uuid=None):
+        session = self._db_session_class()
+        try:
+            stmt = select(Webhooks).where(Webhooks.is_valid == 1)
+            if dtable_uuid:
+                stmt = stmt.where(Webhooks.dtable_uuid == dtable_uuid)
+            hooks = session.scalars(stmt).all()
+            session.expunge_all()
+        finally:
+            session.close()
+        hooks_map = {}
+        for hook in hooks:
+            hooks_map.setdefault(hook.dtable_uuid, []).append(hook)
+        return hooks_map
+
+    def refresh(self):
+        hooks_map = self._load()
+        with self._lock:
+            self._hooks_map = hooks_map
+            self.loaded = True
+
+    def refresh_dtable(self, dtable_uuid):
+        hooks = self._load(dtable_uuid).get(dtable_uuid)
+        with self._lock:
+            if hooks:
+                self._hooks_map[dtable_uuid] = hooks
+            else:
+                self._hooks_map.pop(dtable_uuid, None)
+
+    def remove_webhook(self, webhook_id):
+        with self._lock:
+            for dtable_uuid, hooks in list(self._hooks_map.items()):
+                hooks = [hook for hook in hooks if hook.id != webhook_id]
+                if hooks:
+                    self._hooks_map[dtable_uuid] = hooks
+                else:
+                    del self._hooks_map[dtable_uuid]
+
+    def get_hooks(self, dtable_uuid):
+        return self._hooks_map.get(dtable_uuid) or []
+
+    def handle_webhook_changed_message(self, msg):
+        dtable_uuid = msg.get('dtable_uuid')
+        if not dtable_uuid:
+            logger.warning('invalid webhook changed message: %s', msg)
+            return
+        self.refresh_dtable(dtable_uuid.replace('-', ''))
+
+    def refresh_periodically(self):
         while True:
+            time.sleep(self.refresh_interval)
             try:
-                message = subscriber.get_message()
-                if message is not None:
-                    if message['type'] != 'message':
-                        continue
-                    last_pubsub_message_time = time.time()
-                    try:
-                        data = json.loads(message['data'])
-                    except Exception as e:
-                        logger.error('parse message error: %s' % e)
-                        continue
-                    session = self._db_session_class()
-                    try:
-                        event = {'data': data, 'event': 'update'}
-                        dtable_uuid = data.get('dtable_uuid')
-                        stmt = select(Webhooks).where(Webhooks.dtable_uuid == dtable_uuid, Webhooks.is_valid == 1)
-                        hooks = session.scalars(stmt).all()
-                        for hook in hooks:
-                            request_body = hook.gen_request_body(event)
-                            request_headers = hook.gen_request_headers(request_body)
-                            job = {'webhook_id': hook.id, 'created_at': datetime.now(), 'status': PENDING,
-                                   'url': hook.url, 'request_headers': request_headers, 'request_body': request_body}
-                            self.job_queue.put(job)
-                    except Exception as e:
-                        logger.error('add jobs error: %s' % e)
-                    finally:
-                        session.close()
-                else:
-                    if (time.time() - last_pubsub_message_time) >= self._pubsub_no_message_timeout:
-                        subscriber = self._redis_client.refresh_subscriber(
-                            subscriber, self._pubsub_channel_name, 'no message timeout')
-                        last_pubsub_message_time = time.time()
-                        continue
-                    time.sleep(0.5)
+                self.refresh()
             except Exception as e:
-                logger.error('redis pubsub receive error: %s', e)
-                subscriber = self._redis_client.refresh_subscriber(subscriber, self._pubsub_channel_name, str(e))
-                last_pubsub_message_time = time.time()
+                logger.error('refresh webhook index error: %s', e)
 
-    def invalidate_webhook(self, webhook_id, db_session):
-        sql = "UPDATE webhooks SET is_valid=0 WHERE id=:webhook_id"
+    def start(self):
         try:
-            db_session.execute(text(sql), {'webhook_id': webhook_id})
-            db_session.commit()
+            self.refresh()
         except Exception as e:
-            logger.error('invalidate webhook: %s error: %s', webhook_id, e)
+            logger.error('load webhook index error: %s', e)
+        Thread(target=self.refresh_periodically, name='webhook_index', daemon=True).start()
 
-    def get_webhook_error_times(self, cache_key):
-        webhook_error_times = self._redis_client.get(cache_key)
-        if not webhook_error_times:
-            webhook_error_times = 0
 
-        return int(webhook_error_times)
+class Webhooker(object):
+    """
+    There are a few steps in this program:
+    1. receive events from redis pubsub dispatcher.
+    2. look up webhooks of the base in the index and generate jobs, then put them to the deliverer's queue.
+    3. deliverer's workers trigger jobs, see WebhookDeliverer.
+    """
+    def __init__(self):
+        self._db_session_class = init_db_session_class()
+        self.index = WebhookIndex(self._db_session_class)
+        self.deliverer = WebhookDeliverer(on_invalidate=self.index.remove_webhook)
+        self._pubsub_channel_name = 'table-events'
 
-    def save_webhook_job(self, session, job_params):
-        webhook_job = WebhookJobs(*job_params)
-        session.add(webhook_job)
-        session.commit()
+    def start(self):
+        logger.info('Starting handle webhook jobs...')
+        self.index.start()
+        self.deliverer.start()
+        pubsub_dispatcher.register(WEBHOOK_CHANGED_CHANNEL, self.index.handle_webhook_changed_message, name='webhook_index')
+        pubsub_dispatcher.register(self._pubsub_channel_name, self.add_jobs, name='webhook')
+
+    def get_hooks(self, dtable_uuid):
+        if self.index.loaded:
+            return self.index.get_hooks(dtable_uuid)
+        # index failed to load, query db
+        session = self._db_session_class()
+        try:
+            stmt = select(Webhooks).where(Webhooks.dtable_uuid == dtable_uuid, Webhooks.is_valid == 1)
+            return session.scalars(stmt).all()
+        finally:
+            session.close()
 
-    def trigger_jobs(self):
-        while True:
-            try:
-                job = self.job_queue.get()
-                session = self._db_session_class()
-                need_invalidate = False
-                webhook_error_cache_key = WEBHOOK_ERROR_CACHE_PREFIX + str(job['webhook_id'])
-                try:
-                    body = job.get('request_body')
-                    headers = job.get('request_headers')
-                    response = requests.post(job['url'], json=body, headers=headers, timeout=30)
-                except ReadTimeout:
-                    logger.warning('request webhook url: %s timeout', job['url'])
-
-                    job_params = (job['webhook_id'], job['created_at'], datetime.now(), FAILURE,
-                                  job['url'], job['request_headers'], job['request_body'], None, None)
-                    self.save_webhook_job(session, job_params)
-
-                    webhook_error_times = self.get_webhook_error_times(webhook_error_cache_key) + 1
-                    if webhook_error_times >= WEBHOOK_ALLOW_ERROR_TIMES:
-                        need_invalidate = True
-                    self._redis_client.set(webhook_error_cache_key,
-                                           webhook_error_times,
-                                           timeout=WEBHOOK_ERROR_TIMES_CACHE_TIMEOUT
-                                           )
-                except Exception as e:
-                    logger.warning('request webhook url: %s error: %s', job['url'], e)
-                    need_invalidate = True
-
-                    job_params = (job['webhook_id'], job['created_at'], datetime.now(), FAILURE,
-                                  job['url'], job['request_headers'], job['request_body'], None, None)
-                    self.save_webhook_job(session, job_params)
-                else:
-                    if 200 <= response.status_code < 300:
-                        self._redis_client.delete(webhook_error_cache_key)
-                        continue
-                    else:
-                        job_params = (job['webhook_id'], job['created_at'], datetime.now(), FAILURE, job['url'],
-                                      job['request_headers'], job['request_body'], response.status_code, response.text)
-                        self.save_webhook_job(session, job_params)
-
-                        webhook_error_times = self.get_webhook_error_times(webhook_error_cache_key) + 1
-                        if webhook_error_times >= WEBHOOK_ALLOW_ERROR_TIMES:
-                            need_invalidate = True
-                        self._redis_client.set(webhook_error_cache_key,
-                                               webhook_error_times,
-                                               timeout=WEBHOOK_ERROR_TIMES_CACHE_TIMEOUT
-                                               )
-                finally:
-                    if need_invalidate:
-                        self.invalidate_webhook(job['webhook_id'], session)
-                        self._redis_client.delete(webhook_error_cache_key)
-                    session.close()
-            except Exception as e:
-                logger.error('trigger job error: %s' % e)
+    def add_jobs(self, data):
+        """all events from redis are kind of update so far"""
+        try:
+            hooks = self.get_hooks(data.get('dtable_uuid'))
+            if not hooks:
+                return
+            event = {'data': data, 'event': 'update'}
+            op_type = data.get('op_type')
+            for hook in hooks:
+                if not hook.is_op_type_subscribed(op_type):
+                    continue
+                request_body = hook.gen_request_body(event)
+                request_headers = hook.gen_request_headers(request_body)
+                job = {'webhook_id': hook.id, 'created_at': datetime.now(), 'status': PENDING,
+                       'url': hook.url, 'request_headers': request_headers, 'request_body': request_body}
+                self.deliverer.put(job)
+        except Exception as e:
+            logger.error('add jobs error: %s' % e)
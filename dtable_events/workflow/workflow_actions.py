@@ -1,11 +1,9 @@
 import json
 import logging
-import time
-from threading import Thread, Event
 
 from sqlalchemy import text
 
-from dtable_events.app.event_redis import RedisClient
+from dtable_events.app.event_redis import pubsub_dispatcher
 from dtable_events.automations.general_actions import ActionInvalid, AddRecordToOtherTableAction, BaseContext, NotifyAction, SendEmailAction, \
     SendWechatAction, SendDingtalkAction, UpdateAction, AddRowAction, LockRecordAction, LinkRecordsAction, \
     RunPythonScriptAction
@@ -162,47 +160,23 @@ def do_workflow_actions(task_id, node_id, db_session):
             logger.error('workflow: %s, task: %s node: %s do action: %s error: %s', workflow_token, task_id, node_id, action_info, e)
 
 
-class WorkflowActionsHandler(Thread):
+class WorkflowActionsHandler(object):
     def __init__(self):
-        Thread.__init__(self)
-        self._finished = Event()
         self._db_session_class = init_db_session_class()
-        self._redis_client = RedisClient(socket_connect_timeout=5, socket_timeout=5,
-                                         health_check_interval=30, retry_on_timeout=True)
         self._pubsub_channel_name = 'workflow-actions'
-        self._pubsub_no_message_timeout = 5 * 60
-    
-    def run(self):
-        logger.info('Starting handle workflow actions...')
-        subscriber = self._redis_client.get_subscriber(self._pubsub_channel_name)
-        last_pubsub_message_time = time.time()
 
-        while not self._finished.is_set():
-            try:
-                message = subscriber.get_message()
-                if message is not None:
-                    if message.get('type') != 'message':
-                        continue
-                    last_pubsub_message_time = time.time()
-                    sub_data = json.loads(message['data'])
-                    session = self._db_session_class()
-                    task_id = sub_data['task_id']
-                    node_id = sub_data['node_id']
-                    try:
-                        do_workflow_actions(task_id, node_id, session)
-                    except Exception as e:
-                        logger.exception(e)
-                        logger.error('task: %s node: %s do actions error: %s', task_id, node_id, e)
-                    finally:
-                        session.close()
-                else:
-                    if (time.time() - last_pubsub_message_time) >= self._pubsub_no_message_timeout:
-                        subscriber = self._redis_client.refresh_subscriber(
-                            subscriber, self._pubsub_channel_name, 'no message timeout')
-                        last_pubsub_message_time = time.time()
-                        continue
-                    time.sleep(0.5)
-            except Exception as e:
-                logger.error('redis pubsub receive error: %s', e)
-                subscriber = self._redis_client.refresh_subscriber(subscriber, self._pubsub_channel_name, str(e))
-                last_pubsub_message_time = time.time()
+    def handle_message(self, sub_data):
+        session = self._db_session_class()
+        task_id = sub_data['task_id']
+        node_id = sub_data['node_id']
+        try:
+            do_workflow_actions(task_id, node_id, session)
+        except Exception as e:
+            logger.exception(e)
+            logger.error('task: %s node: %s do actions error: %s', task_id, node_id, e)
+        finally:
+            session.close()
+
+    def start(self):
+        logger.info('Starting handle workflow actions...')
+        pubsub_dispatcher.register(self._pubsub_channel_name, self.handle_message, name='workflow_actions')